@@ -343,7 +343,7 @@ class listener_node_one:
                         # find the voxels that collide with the robot
                         self.dont_voxelize = True
                         pyb_u.toggle_rendering(False)
-                        for tup in pyb_u.collisions:
+                        for tup in pyb_u.get_collision_pairs():
                             if self.virtual_robot.object_id in tup and not self.probe_voxel.object_id in tup:
                                 voxel_id = tup[0] if tup[0]!=self.virtual_robot.object_id else tup[1]
                                 pyb.changeVisualShape(pyb_u.to_pb(voxel_id), -1, rgbaColor=[1, 0, 0, 1])
@@ -425,7 +425,7 @@ class listener_node_one:
                         self.env.episode += 1
                         # find the voxels that collide with the robot
                         pyb_u.toggle_rendering(False)
-                        for tup in pyb_u.collisions:
+                        for tup in pyb_u.get_collision_pairs():
                             if self.virtual_robot.object_id in tup and not self.probe_voxel.object_id in tup:
                                 voxel_id = tup[0] if tup[0]!=self.virtual_robot.object_id else tup[1]
                                 pyb.changeVisualShape(pyb_u.to_pb(voxel_id), -1, rgbaColor=[1, 0, 0, 1])
@@ -518,7 +518,7 @@ class listener_node_one:
                         self.env.episode += 1
                         # find the voxels that collide with the robot
                         pyb_u.toggle_rendering(False)
-                        for tup in pyb_u.collisions:
+                        for tup in pyb_u.get_collision_pairs():
                             if self.virtual_robot.object_id in tup and not self.probe_voxel.object_id in tup:
                                 voxel_id = tup[0] if tup[0] != self.virtual_robot.object_id else tup[1]
                                 pyb.changeVisualShape(pyb_u.to_pb(voxel_id), -1, rgbaColor=[1, 0, 0, 1])
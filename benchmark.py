@@ -0,0 +1,204 @@
+# parse command line args
+from argparse import ArgumentParser
+import os
+
+# parse the arguments
+parser = ArgumentParser(prog = "Modular DRL Robot Gym Env Benchmark",
+                        description = "Measures the simulation speed of the env for one or more config files without any DRL agent and writes a json report.")
+parser.add_argument("configfiles", nargs="*", help="Paths to the config yamls you want to benchmark. Defaults to all configs in the configs folder.")
+parser.add_argument("--steps", type=int, default=2000, help="Number of env steps to run per config and mode.")
+parser.add_argument("--resets", type=int, default=20, help="Number of additional resets to time per config.")
+parser.add_argument("--num_envs", type=int, default=4, help="Number of envs for the vectorized modes.")
+parser.add_argument("--modes", nargs="+", default=["single", "subproc"], choices=["single", "subproc", "modular_vec"], help="single: one env in this process, subproc: SB3's SubprocVecEnv, modular_vec: our ModularDRLVecEnv.")
+parser.add_argument("--policy", default="random", choices=["random", "zero"], help="random samples the action space, zero always sends a zero action.")
+parser.add_argument("--seed", type=int, default=0, help="Seed for numpy's rng.")
+parser.add_argument("--output", default="./models/benchmarks/benchmark.json", help="Path of the json report.")
+
+def _benchmark_single(env_config: dict, args) -> dict:
+    """
+    Runs a single env in this process.
+    """
+    import numpy as np
+    from time import perf_counter
+    from modular_drl_env.gym_env.environment import ModularDRLEnv
+
+    # same as the single env in run.py
+    env_config["env_id"] = 0
+    start = perf_counter()
+    env = ModularDRLEnv(env_config)
+    build_time = perf_counter() - start
+
+    # resets on their own
+    reset_times = []
+    for _ in range(args.resets):
+        start = perf_counter()
+        env.reset()
+        reset_times.append(perf_counter() - start)
+
+    # steps, episodes that end get reset right away, that time is counted separately
+    step_times = []
+    env.reset()
+    for _ in range(args.steps):
+        action = env.action_space.sample() if args.policy == "random" else np.zeros(env.action_space.shape, dtype=np.float32)
+        start = perf_counter()
+        _, _, done, _ = env.step(action)
+        step_times.append(perf_counter() - start)
+        if done:
+            start = perf_counter()
+            env.reset()
+            reset_times.append(perf_counter() - start)
+    env.close()
+
+    step_times = np.array(step_times)
+    reset_times = np.array(reset_times)
+    return {
+        "build_time_s": build_time,
+        "steps": len(step_times),
+        "resets": len(reset_times),
+        "steps_per_s": len(step_times) / np.sum(step_times),
+        "steps_per_s_with_resets": len(step_times) / (np.sum(step_times) + np.sum(reset_times)),
+        "resets_per_s": len(reset_times) / np.sum(reset_times),
+        "step_latency_p50_ms": np.percentile(step_times, 50) * 1000,
+        "step_latency_p99_ms": np.percentile(step_times, 99) * 1000,
+        "reset_latency_p50_ms": np.percentile(reset_times, 50) * 1000,
+        "reset_latency_p99_ms": np.percentile(reset_times, 99) * 1000,
+    }
+
+def _benchmark_vec(env_config: dict, args, mode: str) -> dict:
+    """
+    Runs num_envs envs in a vectorized env, resets happen automatically within the vec env.
+    """
+    import numpy as np
+    from time import perf_counter
+    from modular_drl_env.gym_env.environment import ModularDRLEnv
+
+    def return_env_outer(i):
+        def return_env_inner():
+            config = env_config.copy()
+            config["env_id"] = i
+            return ModularDRLEnv(config)
+        return return_env_inner
+
+    start = perf_counter()
+    if mode == "subproc":
+        from stable_baselines3.common.vec_env import SubprocVecEnv
+        envs = SubprocVecEnv([return_env_outer(i) for i in range(args.num_envs)])
+    else:
+        from modular_drl_env.gym_env.vec_env import ModularDRLVecEnv
+        envs = ModularDRLVecEnv([return_env_outer(i) for i in range(args.num_envs)], num_processes=1)
+    build_time = perf_counter() - start
+
+    start = perf_counter()
+    envs.reset()
+    reset_time = perf_counter() - start
+
+    step_times = []
+    # one vec env step steps all envs, so the number of steps is divided among them
+    for _ in range(max(1, args.steps // args.num_envs)):
+        if args.policy == "random":
+            actions = np.array([envs.action_space.sample() for _ in range(args.num_envs)])
+        else:
+            actions = np.zeros((args.num_envs,) + envs.action_space.shape, dtype=np.float32)
+        start = perf_counter()
+        envs.step(actions)
+        step_times.append(perf_counter() - start)
+    envs.close()
+
+    step_times = np.array(step_times)
+    return {
+        "build_time_s": build_time,
+        "num_envs": args.num_envs,
+        "steps": len(step_times) * args.num_envs,
+        "steps_per_s": len(step_times) * args.num_envs / np.sum(step_times),
+        "first_reset_s": reset_time,
+        "vec_step_latency_p50_ms": np.percentile(step_times, 50) * 1000,
+        "vec_step_latency_p99_ms": np.percentile(step_times, 99) * 1000,
+    }
+
+def _run_benchmark(config_path: str, mode: str, args, remote) -> None:
+    """
+    Entry point of the process that benchmarks one config in one mode, sends back a dict with the results.
+    """
+    try:
+        import resource
+        import numpy as np
+        from modular_drl_env.util.configparser import parse_config
+
+        np.random.seed(args.seed)
+        _, env_config = parse_config(config_path, True)
+        # no console and csv output, that would only measure the terminal and the disk
+        env_config["logging"] = 0
+        env_config["display"] = False
+
+        if mode == "single":
+            result = _benchmark_single(env_config, args)
+        else:
+            result = _benchmark_vec(env_config, args, mode)
+
+        # peak memory, on linux ru_maxrss is given in kilobytes
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        result["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        # json can't deal with numpy types
+        result = {key: value.item() if hasattr(value, "item") else value for key, value in result.items()}
+    except BaseException as e:
+        # SystemExit included, the env calls exit() in some cases
+        result = {"error": type(e).__name__ + ": " + str(e)}
+    remote.send(result)
+    remote.close()
+
+def _get_commit() -> str:
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+if __name__ == "__main__":
+    import json
+    import platform
+    import multiprocessing as mp
+    from datetime import datetime
+
+    args = parser.parse_args()
+
+    configfiles = args.configfiles
+    if not configfiles:
+        config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs")
+        configfiles = sorted(os.path.join(config_dir, name) for name in os.listdir(config_dir) if name.endswith(".yaml") and name != "explanations.yaml")
+
+    report = {
+        "commit": _get_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "arguments": vars(args),
+        "results": dict()
+    }
+
+    # every config and mode runs in a fresh process, that keeps the pybullet util's state and the peak memory measurements separate
+    ctx = mp.get_context("spawn")
+    for config_path in configfiles:
+        config_name = os.path.splitext(os.path.basename(config_path))[0]
+        report["results"][config_name] = dict()
+        for mode in args.modes:
+            print("[BENCHMARK] " + config_name + ", " + mode)
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_run_benchmark, args=(config_path, mode, args, work_remote))
+            process.start()
+            work_remote.close()
+            try:
+                result = remote.recv()
+            except EOFError:
+                result = {"error": "benchmark process died with exit code " + str(process.exitcode)}
+            process.join()
+            report["results"][config_name][mode] = result
+            if "error" in result:
+                print("[WARNING] " + result["error"])
+            else:
+                print("    " + str(round(result["steps_per_s"], 1)) + " steps/s, peak rss " + str(round(result["peak_rss_mb"], 1)) + " MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    print("[BENCHMARK] report written to " + args.output)
@@ -0,0 +1,126 @@
+# parse command line args
+from argparse import ArgumentParser
+import os
+
+# parse the arguments
+parser = ArgumentParser(prog = "Modular DRL Robot Gym Env Scenario Generator",
+                        description = "Generates a fixed, reproducible set of scenarios (obstacles, robot starting points and targets) for a config's world and writes them into one file that envs can replay, see scenario_dataset in the explanations config.")
+parser.add_argument("configfile", help="Path to the config yaml whose world and robots you want to generate scenarios for.")
+parser.add_argument("--num", type=int, default=1000, help="Number of scenarios.")
+parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes generating scenarios in parallel, the result doesn't depend on it.")
+parser.add_argument("--seed", type=int, default=0, help="Seed for the world's set up and the scenarios, the same seed and config always lead to the same scenarios.")
+parser.add_argument("--success_rate", type=float, default=None, help="Success rate handed to the world's reset, worlds with a curriculum use it to scale the difficulty. Random per scenario if not given.")
+parser.add_argument("--levels", type=int, default=5, help="Number of success rate intervals the scenarios are sorted into, only matters if the file is used as a scenario cache.")
+parser.add_argument("--output", default=None, help="Path of the scenario file, defaults to ./scenarios/<config name>_<seed>.npz.")
+
+def _build_env(config_path: str, args, env_id: int):
+    """
+    Builds an env from the config whose world has the obstacles of the given seed.
+    """
+    from modular_drl_env.util.configparser import parse_config
+    from modular_drl_env.gym_env.environment import ModularDRLEnv
+
+    _, env_config = parse_config(config_path, False)
+    env_config["logging"] = 0
+    env_config["display"] = False
+    env_config["env_id"] = env_id
+    # the obstacles have to be the same in all workers and in the envs replaying the file
+    env_config["world"]["set_up_seed"] = args.seed
+    env_config["world"].pop("scenario_cache", None)
+    env_config["world"].pop("scenario_dataset", None)
+    # only the world's reset is used, planning ahead would be wasted
+    for robo_entry in env_config["robots"]:
+        if "goal" in robo_entry and "planning_workers" in robo_entry["goal"]["config"]:
+            robo_entry["goal"]["config"]["planning_workers"] = 0
+    return ModularDRLEnv(env_config)
+
+def _generate(config_path: str, indices: list, args, worker_id: int, remote) -> None:
+    """
+    Entry point of the processes that generate the scenarios with the given indices, sends back one (index, success rate, scenario) tuple per scenario and None at the end.
+    """
+    try:
+        import random
+        import numpy as np
+
+        env = _build_env(config_path, args, worker_id)
+        world = env.world
+
+        # nothing is active right after the set up
+        empty_scenario = world.get_scenario()
+        for idx in indices:
+            # every scenario starts from the same state and gets its own seeds, such that it only depends on its index and not on the scenarios generated before it
+            world.set_scenario(empty_scenario)
+            for robot in world.robots:
+                robot.moveto_joints(np.array(robot.resting_pose_angles, dtype=np.float64), False)
+            np.random.seed([args.seed, idx])
+            random.seed(str(args.seed) + "_" + str(idx))
+            success_rate = args.success_rate if args.success_rate is not None else np.random.random()
+            world.reset(success_rate)
+            remote.send((idx, success_rate, world.get_scenario()))
+        env.close()
+        remote.send(None)
+    except BaseException as e:
+        # SystemExit included, the env calls exit() in some cases
+        remote.send(type(e).__name__ + ": " + str(e))
+    remote.close()
+
+if __name__ == "__main__":
+    import multiprocessing as mp
+    from multiprocessing.connection import wait
+    import numpy as np
+    from time import perf_counter
+
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        output = os.path.join("./scenarios", os.path.splitext(os.path.basename(args.configfile))[0] + "_" + str(args.seed) + ".npz")
+    num_workers = max(1, min(args.workers, args.num))
+
+    # every worker builds its own env in a fresh process, the scenarios are dealt out round robin
+    start = perf_counter()
+    ctx = mp.get_context("spawn")
+    remotes, processes = [], []
+    for worker_id in range(num_workers):
+        remote, work_remote = ctx.Pipe()
+        process = ctx.Process(target=_generate, args=(args.configfile, list(range(worker_id, args.num, num_workers)), args, worker_id, work_remote))
+        process.start()
+        work_remote.close()
+        remotes.append(remote)
+        processes.append(process)
+
+    scenarios = None
+    success_rates = np.zeros(args.num)
+    done = 0
+    open_remotes = list(remotes)
+    while open_remotes:
+        for remote in wait(open_remotes):
+            try:
+                message = remote.recv()
+            except EOFError:
+                message = "worker process died"
+            if message is None or type(message) == str:
+                open_remotes.remove(remote)
+                if type(message) == str:
+                    for process in processes:
+                        process.terminate()
+                    raise Exception("Scenario generation failed: " + message)
+                continue
+            idx, success_rate, scenario = message
+            if scenarios is None:
+                scenarios = {key: np.zeros((args.num,) + value.shape, dtype=value.dtype) for key, value in scenario.items()}
+            for key, value in scenario.items():
+                scenarios[key][idx] = value
+            success_rates[idx] = success_rate
+            done += 1
+            if done % 100 == 0:
+                print("[GENERATOR] " + str(done) + "/" + str(args.num) + " scenarios")
+    for process in processes:
+        process.join()
+
+    # the file is written with a world of the same config, which also provides the obstacle descriptions that get checked when replaying
+    from modular_drl_env.world.scenario_cache import write_scenario_file
+    env = _build_env(args.configfile, args, num_workers)
+    scenario_levels = np.minimum((success_rates * args.levels).astype(int), args.levels - 1)
+    write_scenario_file(output, env.world, args.seed, args.levels, scenario_levels, scenarios, _success_rates=success_rates)
+    env.close()
+    print("[GENERATOR] " + str(args.num) + " scenarios written to " + output + " in " + str(round(perf_counter() - start, 1)) + " s")
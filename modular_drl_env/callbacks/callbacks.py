@@ -1,5 +1,6 @@
 from stable_baselines3.common.callbacks import CallbackList, CheckpointCallback, EvalCallback, StopTrainingOnMaxEpisodes, BaseCallback, EveryNTimesteps
 import numpy as np
+import torch as th
 
 class MoreLoggingCustomCallback(BaseCallback):
     def __init__(self, verbose=0):
@@ -65,6 +66,19 @@ class MoreLoggingCustomCallback(BaseCallback):
         # reward
         rewards_cumulative = np.average([(np.average(ar) if len(ar) != 0 else 0) for ar in self.training_env.get_attr("cumulated_rewards_stat")])
         self.logger.record("train/rewards", rewards_cumulative)
+
+        # step timings, only there if profiling is enabled in the envs
+        timings = dict()
+        for env_timings in self.training_env.env_method("pop_step_timings"):
+            for name, values in env_timings.items():
+                if name not in timings:
+                    timings[name] = []
+                timings[name].append(values)
+        for name in timings:
+            values_ms = np.concatenate(timings[name]) * 1000
+            self.logger.record("profiling/" + name + "_ms", np.average(values_ms))
+            # histograms only work with tensorboard and only if given as a torch tensor
+            self.logger.record("profiling/" + name + "_hist_ms", th.as_tensor(values_ms), exclude=("stdout", "log", "json", "csv"))
         
         return True
 
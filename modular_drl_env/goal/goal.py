@@ -12,6 +12,7 @@ class Goal(ABC):
     def __init__(self, robot:Robot, normalize_rewards:bool, normalize_observations:bool, train:bool, add_to_observation_space: bool, add_to_logging:bool, max_steps:int, continue_after_success:bool=False):
 
         # each goal needs to have a robot assigned for which it is valid
+        # its joints and end effector data for the current step are in self.robot.state, see robot_state.py
         self.robot = robot
 
         # bool for training or evaluation, useful for when the goal has to change if it's in training
@@ -69,6 +70,14 @@ class Goal(ABC):
         """
         pass
 
+    def write_observation(self, views: dict):
+        """
+        Writes the observation of this goal into the pre-allocated arrays of the env's observation buffer, keys are the same as in get_observation().
+        Per default this copies the output of get_observation(), overwrite this to write into the arrays directly.
+        """
+        for key, value in self.get_observation().items():
+            views[key][...] = value
+
     @abstractmethod
     def reward(self, step, action) -> Tuple[float, bool, bool, bool, bool]:
         """
@@ -99,6 +108,14 @@ class Goal(ABC):
         """
         pass
 
+    def on_world_reset(self):
+        """
+        This method will be called right after the world has set up a new episode, before the sensors are reset and before on_env_reset.
+        Goals can start work here that on_env_reset needs later on, e.g. asynchronous trajectory planning, such that it runs alongside the sensor resets.
+        Does nothing by default.
+        """
+        pass
+
     def build_visual_aux(self):
         """
         This method should add objects that are helpful to visualize the goal. In most cases this will be something 
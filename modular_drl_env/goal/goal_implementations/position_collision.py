@@ -5,6 +5,8 @@ from gym.spaces import Box
 from modular_drl_env.util.quaternion_util import quaternion_similarity
 from modular_drl_env.sensor.sensor_implementations.positional.obstacle_sensor import ObstacleSensor, ObstacleAbsoluteSensor
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.util.ring_buffer import RingBuffer
+from modular_drl_env.goal.goal_implementations.reward_kernels import *
 
 __all__ = [
     'PositionCollisionGoal',
@@ -16,6 +18,54 @@ __all__ = [
     'PositionCollisionGoalNoShakingProximityV3'
 ]
 
+def _outcome_flags(outcome: int, done_on_oob: bool=True):
+    """
+    Translates the outcome of a step (see reward_kernels.terminal_reward) into the success, done and timeout flags of the goals.
+    """
+    if outcome == OUT_OF_BOUNDS:
+        return False, done_on_oob, False
+    return outcome == SUCCESS, outcome != RUNNING, outcome == TIMEOUT
+
+class _DistanceHistory(RingBuffer):
+    """
+    History of the last distances to the target for the shaking penalty.
+    Also keeps count of how often the distance switched between rising (or staying the same) and falling within the history,
+    which gets updated with every new distance instead of going over the whole history each step.
+    """
+
+    __slots__ = ("_flips", "_flips_mask", "_last", "_rising")
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        # bit i is set if the direction flipped i distances ago, only the flips within the history are kept
+        self._flips = 0
+        self._flips_mask = (1 << (capacity - 2)) - 1
+        self._last = None
+        self._rising = None
+
+    def append(self, value) -> None:
+        # plain floats, numpy scalars are a lot slower for this
+        value = float(value)
+        if self._last is not None:
+            rising = value - self._last >= 0
+            if self._rising is not None:
+                self._flips = ((self._flips << 1) | (rising != self._rising)) & self._flips_mask
+            self._rising = rising
+        self._last = value
+        super().append(value)
+
+    def clear(self) -> None:
+        super().clear()
+        self._flips = 0
+        self._last = None
+        self._rising = None
+
+    def count_direction_changes(self) -> int:
+        """
+        Number of times the distances currently in the history switch direction.
+        """
+        return bin(self._flips).count("1")
+
 class PositionCollisionGoal(Goal):
     """
     This class implements a goal of reaching a certain position while avoiding collisions.
@@ -85,7 +135,7 @@ class PositionCollisionGoal(Goal):
 
         # placeholders so that we have access in other methods without doing double work
         self.distance = None
-        self.position = None
+        self.position = np.zeros(3)
         self.reward_value = 0
         self.shaking = 0
         self.collided = False
@@ -93,7 +143,9 @@ class PositionCollisionGoal(Goal):
         self.out_of_bounds = False
         self.is_success = False
         self.done = False
-        self.past_distances = []
+        self.past_distances = _DistanceHistory(10)
+        # difference vector and distance, normalized if needed, see _update_distance
+        self._observation = np.zeros(4)
 
         # option to turn off episode end on oob, needed for the planner function elsewhere
         self.done_on_oob = done_on_oob
@@ -124,62 +176,44 @@ class PositionCollisionGoal(Goal):
         else:
             return {}
 
-    def get_observation(self) -> dict:
-        # get the data
-        self.position = self.robot.position_rotation_sensor.position
+    def _update_distance(self):
+        # get the data, the position is copied because reward uses it one step later, after the robot's state has changed
+        self.position[:] = self.robot.state.ee_position
         self.target = self.robot.world.position_targets[self.robot.mgt_id]
-        dif = self.target - self.position
-        self.distance = np.linalg.norm(dif)
+        np.subtract(self.target, self.position, out=self._observation[:3])
+        self.distance = np.linalg.norm(self._observation[:3])
+        self._observation[3] = self.distance
 
         self.past_distances.append(self.distance)
-        if len(self.past_distances) > 10:
-            self.past_distances.pop(0)
 
-        ret = np.zeros(4)
-        ret[:3] = dif
-        ret[3] = self.distance
-        
         if self.normalize_observations:
-            return {self.output_name: np.multiply(self.normalizing_constant_a_obs, ret) + self.normalizing_constant_b_obs} 
-        else:
-            return {self.output_name: ret}
+            np.multiply(self.normalizing_constant_a_obs, self._observation, out=self._observation)
+            self._observation += self.normalizing_constant_b_obs
 
-    def reward(self, step, action):
+    def get_observation(self) -> dict:
+        self._update_distance()
+        return {self.output_name: self._observation.copy()}
 
-        reward = 0
+    def write_observation(self, views: dict):
+        self._update_distance()
+        views[self.output_name][:] = self._observation
+
+    def reward(self, step, action):
 
         self.out_of_bounds = self.robot.world.out_of_bounds(self.position)
-        self.collided = pyb_u.collision
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
 
         shaking = 0
-        if len(self.past_distances) >= 10:
-            arrow = []
-            for i in range(0,9):
-                arrow.append(0) if self.past_distances[i + 1] - self.past_distances[i] >= 0 else arrow.append(1)
-            for j in range(0,8):
-                if arrow[j] != arrow[j+1]:
-                    shaking += 1
+        if self.past_distances.full():
+            shaking = self.past_distances.count_direction_changes()
         self.shaking = shaking
-        reward -= shaking * 0.005
 
-        self.is_success = False
-        if self.out_of_bounds:
-            self.done = True if self.done_on_oob else False
-            reward += self.reward_collision
-        elif self.collided:
-            self.done = True
-            reward += self.reward_collision
-        elif self.distance < self.distance_threshold:
-            self.done = True
-            self.is_success = True
-            reward += self.reward_success
-        elif step > self.max_steps:
-            self.done = True
+        reward, outcome = terminal_reward(self.out_of_bounds, self.collided, self.distance < self.distance_threshold, step > self.max_steps,
+                                          self.reward_collision, self.reward_collision, self.reward_success, self.reward_collision / 10, self.reward_distance_mult * self.distance)
+        reward = -shaking * 0.005 + reward
+        self.is_success, self.done, timeout = _outcome_flags(outcome, self.done_on_oob)
+        if timeout:
             self.timeout = True
-            reward += self.reward_collision / 10
-        else:
-            self.done = False
-            reward += self.reward_distance_mult * self.distance
         
         self.reward_value = reward
         if self.normalize_rewards:
@@ -241,48 +275,25 @@ class PositionCollisionBetterSmoothingGoal(PositionCollisionGoal):
     def __init__(self, robot: Robot, normalize_rewards: bool, normalize_observations: bool, train: bool, add_to_logging: bool, max_steps: int, continue_after_success: bool, reward_success=10, reward_collision=-10, reward_distance_mult=-0.01, reward_smoothness_mult=-0.001, dist_threshold_start=0.3, dist_threshold_end=0.01, dist_threshold_increment_start=0.01, dist_threshold_increment_end=0.001, dist_threshold_overwrite: float = None, dist_threshold_change: float = 0.8):
         super().__init__(robot, normalize_rewards, normalize_observations, train, add_to_logging, max_steps, continue_after_success, reward_success, reward_collision, reward_distance_mult, dist_threshold_start, dist_threshold_end, dist_threshold_increment_start, dist_threshold_increment_end, dist_threshold_overwrite, dist_threshold_change)
         self.reward_smoothness_mult = reward_smoothness_mult
-        self.last_velocities = []
+        self.last_velocities = RingBuffer(1, (len(self.robot.controlled_joints_ids),))
+        self._last_velocities_ordered = np.zeros_like(self.last_velocities.data)
         self.velocity_smoothness_importance_decay = 0.9
 
     def reward(self, step, action):
 
-        reward = 0
-
         self.out_of_bounds = self.robot.world.out_of_bounds(self.position)
-        self.collided = pyb_u.collision
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
 
-        shaking = 0
-        current_velocity = self.robot.joints_sensor.joints_velocities
-        it_velocity = current_velocity
-        for idx, vel in reversed(list(enumerate(self.last_velocities))):
-            diff_norm = np.linalg.norm(it_velocity - vel)
-            shaking += (self.velocity_smoothness_importance_decay ** idx) * diff_norm
-            it_velocity = vel
-        self.shaking = shaking
-        reward += shaking * self.reward_smoothness_mult
-        
+        current_velocity = self.robot.state.joints_velocities
+        self.shaking = velocity_shaking(current_velocity, self.last_velocities.ordered(out=self._last_velocities_ordered), self.velocity_smoothness_importance_decay)
         self.last_velocities.append(current_velocity)
-        if len(self.last_velocities) > 1:
-            self.last_velocities.pop(0)
 
-        self.is_success = False
-        if self.out_of_bounds:
-            self.done = True
-            reward += self.reward_collision / 2
-        elif self.collided:
-            self.done = True
-            reward += self.reward_collision
-        elif self.distance < self.distance_threshold:
-            self.done = True
-            self.is_success = True
-            reward += self.reward_success
-        elif step > self.max_steps:
-            self.done = True
+        reward, outcome = terminal_reward(self.out_of_bounds, self.collided, self.distance < self.distance_threshold, step > self.max_steps,
+                                          self.reward_collision / 2, self.reward_collision, self.reward_success, self.reward_collision / 2, self.reward_distance_mult * self.distance)
+        reward = self.shaking * self.reward_smoothness_mult + reward
+        self.is_success, self.done, timeout = _outcome_flags(outcome)
+        if timeout:
             self.timeout = True
-            reward += self.reward_collision / 2
-        else:
-            self.done = False
-            reward += self.reward_distance_mult * self.distance
         
         self.reward_value = reward
         if self.normalize_rewards:
@@ -381,8 +392,8 @@ class PositionRotationCollisionGoal(Goal):
         # placeholders so that we have access in other methods without doing double work
         self.position_distance = None
         self.rotation_distance = None
-        self.position = None
-        self.rotation = None
+        self.position = np.zeros(3)
+        self.rotation = np.zeros(4)
         self.reward_value = 0
         self.shaking = 0
         self.collided = False
@@ -390,8 +401,11 @@ class PositionRotationCollisionGoal(Goal):
         self.out_of_bounds = False
         self.is_success = False
         self.done = False
-        self.past_position_distances = []
-        self.past_rotation_distances = []
+        self.past_position_distances = _DistanceHistory(10)
+        self.past_rotation_distances = RingBuffer(10)
+        # see _update_distances
+        self._observation_position = np.zeros(4)
+        self._observation_rotation = np.zeros(5)
 
         # performance metric name
         self.metric_names = ["distance_threshold", "rotation_threshold"]
@@ -411,77 +425,59 @@ class PositionRotationCollisionGoal(Goal):
         else:
             return {}
 
-    def get_observation(self) -> dict:
-        # get the data
-        self.position = self.robot.position_rotation_sensor.position
-        self.rotation = self.robot.position_rotation_sensor.rotation
+    def _update_distances(self):
+        # get the data, copied for the same reason as in the position goal
+        self.position[:] = self.robot.state.ee_position
+        self.rotation[:] = self.robot.state.ee_rotation
         self.target_position = self.robot.world.position_targets[self.robot.mgt_id]
         self.target_rotation = self.robot.world.rotation_targets[self.robot.mgt_id]
-        dif = self.target_position - self.position
-        self.position_distance = np.linalg.norm(dif)
+        np.subtract(self.target_position, self.position, out=self._observation_position[:3])
+        self.position_distance = np.linalg.norm(self._observation_position[:3])
         #print(self.rotation, self.target_rotation)
         self.rotation_distance = 1 - quaternion_similarity(self.rotation, self.target_rotation)
 
         self.past_position_distances.append(self.position_distance)
-        if len(self.past_position_distances) > 10:
-            self.past_position_distances.pop(0)
         self.past_rotation_distances.append(self.rotation_distance)
-        if len(self.past_rotation_distances) > 10:
-            self.past_position_distances.pop(0)
-
-        ret_pos = np.zeros(4)
-        ret_pos[:3] = dif
-        ret_pos[3] = self.position_distance
-        ret_rot = np.zeros(5)
-        ret_rot[:4] = self.target_rotation
-        ret_rot[4] = self.rotation_distance 
-        
+
+        self._observation_position[3] = self.position_distance
+        self._observation_rotation[:4] = self.target_rotation
+        self._observation_rotation[4] = self.rotation_distance
+
         if self.normalize_observations:
-            return {self.output_name_position: np.multiply(self.normalizing_constant_a_obs, ret_pos) + self.normalizing_constant_b_obs,
-                    self.output_name_rotation: ret_rot} 
-        else:
-            return {self.output_name_position: ret_pos,
-                    self.output_name_rotation: ret_rot}
+            np.multiply(self.normalizing_constant_a_obs, self._observation_position, out=self._observation_position)
+            self._observation_position += self.normalizing_constant_b_obs
 
-    def reward(self, step, action):
+    def get_observation(self) -> dict:
+        self._update_distances()
+        return {self.output_name_position: self._observation_position.copy(),
+                self.output_name_rotation: self._observation_rotation.copy()}
 
-        reward = 0
+    def write_observation(self, views: dict):
+        self._update_distances()
+        views[self.output_name_position][:] = self._observation_position
+        views[self.output_name_rotation][:] = self._observation_rotation
+
+    def reward(self, step, action):
 
         self.out_of_bounds = self.robot.world.out_of_bounds(self.position)
-        self.collided = pyb_u.collision
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
 
         shaking = 0
-        if len(self.past_position_distances) >= 10:
-            arrow = []
-            for i in range(0,9):
-                arrow.append(0) if self.past_position_distances[i + 1] - self.past_position_distances[i] >= 0 else arrow.append(1)
-            for j in range(0,8):
-                if arrow[j] != arrow[j+1]:
-                    shaking += 1
+        if self.past_position_distances.full():
+            shaking = self.past_position_distances.count_direction_changes()
         self.shaking = shaking
-        reward -= shaking * 0.005
 
-        self.is_success = False
-        if self.out_of_bounds:
-            self.done = True
-            reward += self.reward_collision / 2
-        elif self.collided:
-            self.done = True
-            reward += self.reward_collision
-        elif self.position_distance < self.distance_threshold and self.rotation_distance < self.rotation_threshold:
-            self.done = True
-            self.is_success = True
-            reward += self.reward_success
-        elif step > self.max_steps:
-            self.done = True
-            self.timeout = True
-            reward += self.reward_collision / 2
-        else:
-            self.done = False
-            reward += self.reward_distance_mult * self.position_distance
+        reached = self.position_distance < self.distance_threshold and self.rotation_distance < self.rotation_threshold
+        reward, outcome = terminal_reward(self.out_of_bounds, self.collided, reached, step > self.max_steps,
+                                          self.reward_collision / 2, self.reward_collision, self.reward_success, self.reward_collision / 2, self.reward_distance_mult * self.position_distance)
+        reward = -shaking * 0.005 + reward
+        if outcome == RUNNING:
             rot_score_threshold = max(10 * self.distance_threshold_end, 1.2 * self.distance_threshold)  # threshold for when to start scoring on rotation
             if self.position_distance < rot_score_threshold:
                 reward += self.reward_rotation_mult * self.rotation_distance
+        self.is_success, self.done, timeout = _outcome_flags(outcome)
+        if timeout:
+            self.timeout = True
         
         self.reward_value = reward
         if self.normalize_rewards:
@@ -551,29 +547,15 @@ class PositionCollisionGoalNoShaking(PositionCollisionGoal):
 
     def reward(self, step, action):
 
-        reward = 0
-
         self.out_of_bounds = self.robot.world.out_of_bounds(self.position)
-        self.collided = pyb_u.collision
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
 
-        self.is_success = False
-        if self.out_of_bounds:
-            self.done = True
-            reward += self.reward_collision
-        elif self.collided:
-            self.done = True
-            reward += self.reward_collision
-        elif self.distance < self.distance_threshold:
-            self.done = True
-            self.is_success = True
-            reward += self.reward_success
-        elif step > self.max_steps:
-            self.done = True
+        distance_reward = self.reward_distance_mult * self.distance
+        reward, outcome = terminal_reward(self.out_of_bounds, self.collided, self.distance < self.distance_threshold, step > self.max_steps,
+                                          self.reward_collision, self.reward_collision, self.reward_success, distance_reward, distance_reward)
+        self.is_success, self.done, timeout = _outcome_flags(outcome)
+        if timeout:
             self.timeout = True
-            reward += self.reward_distance_mult * self.distance
-        else:
-            self.done = False
-            reward += self.reward_distance_mult * self.distance
         
         self.reward_value = reward
         if self.normalize_rewards:
@@ -654,25 +636,20 @@ class PositionCollisionGoalNoShakingProximity(PositionCollisionGoalNoShaking):
         self.d_min = d_min
         if self.obst_sensor is None:
             raise Exception("This goal type needs an obstacle sensor to be present for its robot!")
-        a = ((self.reward_collision) - (0)) / (np.exp(self.d_min) - 1)
-        b = (0) - a
-        self.proximity_reward = lambda x: a * np.exp(-(x - self.d_min)) + b
-        a = ((self.reward_collision) - (0)) / (np.exp(0.05) - 1)
-        b = (0) - a
-        self.joint_limit_reward = lambda x: a * np.exp(-(x - 0.05)) + b
+        # constants of the exponential penalties for obstacles within d_min and joints within 0.05 of their limits
+        self.proximity_a = ((self.reward_collision) - (0)) / (np.exp(self.d_min) - 1)
+        self.proximity_b = (0) - self.proximity_a
+        self.joint_limit_a = ((self.reward_collision) - (0)) / (np.exp(0.05) - 1)
+        self.joint_limit_b = (0) - self.joint_limit_a
 
     def reward(self, step, action):
         reward, is_success, done, timeout, oob = super().reward(step, action)
         # penalty for being close to obstacles
-        if self.obst_sensor.min_dist <= self.d_min:
-            reward += self.proximity_reward(self.obst_sensor.min_dist)
+        reward += exponential_penalty(self.obst_sensor.min_dist, self.d_min, self.proximity_a, self.proximity_b)
         self.reward_value = reward
         # penalty for being very close to joint limits
-        dist_to_max = abs(self.robot.joints_limits_upper - self.robot.joints_sensor.joints_angles)
-        dist_to_min = abs(self.robot.joints_sensor.joints_angles - self.robot.joints_limits_lower)
-        dist_both = min(min(dist_to_max), min(dist_to_min))
-        if dist_both <= 0.05:
-            reward += self.joint_limit_reward(dist_both)
+        dist_both = joint_limit_distance(self.robot.state.joints_angles, self.robot.joints_limits_lower, self.robot.joints_limits_upper)
+        reward += exponential_penalty(dist_both, 0.05, self.joint_limit_a, self.joint_limit_b)
         if step > self.max_steps:
             reward += self.reward_collision
         return reward, is_success, done, timeout, oob
@@ -712,12 +689,11 @@ class PositionCollisionGoalNoShakingProximityV2(PositionCollisionGoalNoShaking):
         if self.obst_sensor is None:
             raise Exception("This goal type needs an obstacle sensor to be present for its robot!")
         
-        # create the partial reward functions as small anonymous functions
-        self.dist_reward = lambda x: (0.5 * (x**2)) if x < dirac else (dirac * (x - 0.5 * dirac))
-        self.obst_reward = lambda x: (d_min / (x + d_min)) ** k
-        a = ((self.reward_collision) - (0)) / (np.exp(0.05) - 1)
-        b = (0) - a
-        self.joint_limit_reward = lambda x: (a * np.exp(-(x - 0.05)) + b) if x <= 0.05 else 0
+        # parameters of the partial rewards, see reward_kernels.proximity_v2_reward
+        self.k = k
+        self.dirac = dirac
+        self.joint_limit_a = ((self.reward_collision) - (0)) / (np.exp(0.05) - 1)
+        self.joint_limit_b = (0) - self.joint_limit_a
 
         # reward weights
         self.lambda_1 = lambda_1
@@ -726,39 +702,16 @@ class PositionCollisionGoalNoShakingProximityV2(PositionCollisionGoalNoShaking):
         self.lambda_4 = 0.0
 
     def reward(self, step, action):
-        reward = 0
-
-        dist_reward = -self.dist_reward(self.distance)
-        obst_reward = -self.obst_reward(self.obst_sensor.min_dist)
-        action_reward = -np.sum(np.square(action))
-        # penalty for being very close to joint limits
-        dist_to_max = abs(self.robot.joints_limits_upper - self.robot.joints_sensor.joints_angles)
-        dist_to_min = abs(self.robot.joints_sensor.joints_angles - self.robot.joints_limits_lower)
-        dist_both = min(min(dist_to_max), min(dist_to_min))
-        joint_limit_reward = self.joint_limit_reward(dist_both)
-
-        self.is_success = False
-        self.collided = pyb_u.collision
-        self.done = False
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
         self.out_of_bounds = False
-        self.timeout = False
 
-        if self.collided:
-            self.done = True
-            reward += self.reward_collision
-        elif self.distance < self.distance_threshold:
-            self.done = True
-            self.is_success = True
-            reward += self.reward_success
-        elif step > self.max_steps:
-            self.done = True
-            self.timeout = True
-            reward += self.reward_collision/2
-        else:
-            if self.normalize_rewards:
-                reward = (self.lambda_1 * dist_reward + self.lambda_2 * obst_reward + self.lambda_3 * action_reward + self.lambda_4 * joint_limit_reward) / self.lambda_1
-            else:
-                reward = self.lambda_1 * dist_reward + self.lambda_2 * obst_reward + self.lambda_3 * action_reward + self.lambda_4 * joint_limit_reward
+        # penalty for being very close to joint limits is part of the running reward
+        dist_both = joint_limit_distance(self.robot.state.joints_angles, self.robot.joints_limits_lower, self.robot.joints_limits_upper)
+        running_reward = proximity_v2_reward(self.distance, self.obst_sensor.min_dist, action, dist_both, self.dirac, self.d_min, self.k, self.joint_limit_a, self.joint_limit_b,
+                                             self.lambda_1, self.lambda_2, self.lambda_3, self.lambda_4, self.normalize_rewards)
+        reward, outcome = terminal_reward(False, self.collided, self.distance < self.distance_threshold, step > self.max_steps,
+                                          0., self.reward_collision, self.reward_success, self.reward_collision/2, running_reward)
+        self.is_success, self.done, self.timeout = _outcome_flags(outcome)
 
         self.reward_value = reward
         return self.reward_value, self.is_success, self.done, self.timeout, self.out_of_bounds 
@@ -771,11 +724,19 @@ class PositionCollisionGoalNoShakingProximityV3(PositionCollisionGoalNoShakingPr
         ret[self.output_name + "_ee_position"] = Box(low=-50, high=50, shape=(3,), dtype=np.float32)
         return ret
     
-    def get_observation(self) -> dict:
-        self.position = self.robot.position_rotation_sensor.position
+    def _update_distance(self):
+        self.position[:] = self.robot.state.ee_position
         self.target = self.robot.world.position_targets[self.robot.mgt_id]
         self.distance = np.linalg.norm(self.target - self.position)
+
+    def get_observation(self) -> dict:
+        self._update_distance()
         ret = dict()
         ret[self.output_name + "_target"] = self.target
-        ret[self.output_name + "_ee_position"] = self.position
-        return ret
\ No newline at end of file
+        ret[self.output_name + "_ee_position"] = self.position.copy()
+        return ret
+
+    def write_observation(self, views: dict):
+        self._update_distance()
+        views[self.output_name + "_target"][:] = self.target
+        views[self.output_name + "_ee_position"][:] = self.position
\ No newline at end of file
@@ -5,7 +5,8 @@ from gym.spaces import Box, MultiBinary
 from modular_drl_env.util.quaternion_util import quaternion_similarity
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 from modular_drl_env.sensor.sensor_implementations.positional.obstacle_sensor import ObstacleSensor, ObstacleAbsoluteSensor
-from modular_drl_env.planner.planner_implementations.rrt import BiRRT, RRT
+from modular_drl_env.planner.planner_implementations import BiRRT, RRT, RRTConnect, PRM
+from modular_drl_env.planner.planning_service import PlanningService, capture_scene, get_scene_key
 
 #TODO: 
 # 1. Implement Distance Sensor
@@ -40,7 +41,9 @@ class PositionCollisionTrajectoryGoal(Goal):
                 w_a_dot: float=-0.0004,
                 w_waypoint: float=0.05,
                 w_collision: float=-0.3,
-                joints_position_buffer_size: int=10):
+                joints_position_buffer_size: int=10,
+                planner: str="BiRRT",
+                planning_workers: int=0):
 
         super().__init__(robot, normalize_rewards, normalize_observations, train, True, add_to_logging, max_steps, continue_after_success)
 
@@ -90,9 +93,20 @@ class PositionCollisionTrajectoryGoal(Goal):
         self.normalizing_constant_a_obs = 2 / self.robot.joints_range
         self.normalizing_constant_b_obs = np.ones(len(self.robot.joints_range)) - np.multiply(self.normalizing_constant_a_obs, self.robot.joints_limits_upper)
 
-        # init planner # TODO
-        #self.planner = RRT(self.robot)
-        self.planner = BiRRT(robot)
+        # init planner
+        planners = {"RRT": RRT, "BiRRT": BiRRT, "RRTConnect": RRTConnect, "PRM": PRM}
+        if planner not in planners:
+            raise Exception("Unknown planner " + planner + " for the trajectory goal, available are: " + ", ".join(planners))
+        # with planning workers, the trajectories are planned in other processes while the env does something else (see on_world_reset)
+        if planning_workers > 0:
+            self.planner = None
+            self.planning_service = PlanningService(planner, num_workers=planning_workers, assets_path=self.robot.world.assets_path)
+        else:
+            self.planner = planners[planner](robot)
+            self.planning_service = None
+        # (scene key, future) of the query for the current and the next episode
+        self.planning_request = None
+        self.prefetch_request = None
         self.trajectory = np.zeros((1, len(self.robot.controlled_joints_ids)))
         self.trajectory_idx = 0
 
@@ -103,9 +117,10 @@ class PositionCollisionTrajectoryGoal(Goal):
         self.out_of_bounds = False
         self.is_success = False
         self.done = False
-        self.current_joints = None
-        self.current_position = None
-        self.previous_position = None
+        # own copies of the robot's state at the last observation, reward runs one step later
+        self.current_joints = np.zeros(len(self.robot.controlled_joints_ids))
+        self.current_position = np.zeros(3)
+        self.previous_position = np.zeros(3)
         self.min_distance_to_trajectory = 0
         self.target_joints = None
         self.final = False
@@ -141,9 +156,9 @@ class PositionCollisionTrajectoryGoal(Goal):
             return {}
         
     def get_observation(self) -> dict:
-        self.previous_position = self.current_position
-        self.current_position = self.robot.position_rotation_sensor.position
-        self.current_joints = self.robot.joints_sensor.joints_angles
+        self.previous_position[:] = self.current_position
+        self.current_position[:] = self.robot.state.ee_position
+        self.current_joints[:] = self.robot.state.joints_angles
         if self.trajectory is not None:
             self.waypoint_joints = self.trajectory[self.trajectory_idx]
             if self.robot.control_mode == 3:
@@ -176,7 +191,7 @@ class PositionCollisionTrajectoryGoal(Goal):
             self.previous_action = action
 
         # check collision status
-        self.collided = pyb_u.collision
+        self.collided = pyb_u.robot_in_collision(self.robot.object_id)
 
         # reward for collision
         if self.collided:
@@ -252,7 +267,7 @@ class PositionCollisionTrajectoryGoal(Goal):
         # method: in a sphere around the robot's end effector, pick the one waypoint that is both
         # a) the most far away from the end effector while stile in the sphere and
         # b) the closest to the end waypoint along the trajectory
-        ee_position = self.robot.position_rotation_sensor.position
+        ee_position = self.robot.state.ee_position
         distances_to_ee = np.linalg.norm(self.trajectory_xyz -  ee_position, axis=1)
         self.min_distance_to_trajectory = min(distances_to_ee)
         sphere_mask = distances_to_ee < self.sample_radius
@@ -270,6 +285,30 @@ class PositionCollisionTrajectoryGoal(Goal):
 
         return self.reward_value, self.is_success, self.done, self.timeout, False  # out of bounds always false, doesn't make sense for preplanned trajectory
             
+    def on_world_reset(self):
+        if self.planning_service is None:
+            return
+        # the trajectory gets planned while the env resets the sensors, unless it was planned ahead during the last episode already
+        scene = capture_scene(self.robot, self.robot.world.joints_targets[self.robot.mgt_id], self.robot.world.active_objects)
+        scene_key = get_scene_key(scene)
+        if self.prefetch_request is not None and self.prefetch_request[0] == scene_key:
+            self.planning_request = self.prefetch_request
+        else:
+            if self.prefetch_request is not None:
+                self.prefetch_request[1].cancel()
+            self.planning_request = (scene_key, self.planning_service.submit(scene))
+        self.prefetch_request = None
+
+    def _prefetch(self):
+        # plan the next episode's trajectory in the background if the world already knows what it will look like
+        scenario = self.robot.world.peek_next_scenario()
+        if scenario is None:
+            return
+        scene = capture_scene(self.robot, scenario["joints_targets"][self.robot.mgt_id], scenario["active_objects"],
+                              q_start=scenario["robots_joints"][self.robot], obstacle_poses=scenario["obstacle_poses"],
+                              robots_joints=scenario["robots_joints"], active_objects=scenario["active_objects"])
+        self.prefetch_request = (get_scene_key(scene), self.planning_service.submit(scene))
+
     def on_env_reset(self, success_rate):
         self.n = 0
         # reset attributes
@@ -279,15 +318,23 @@ class PositionCollisionTrajectoryGoal(Goal):
         self.collided = False
         self.joints_position_buffer = []
         self.final = False
-        self.current_joints = self.robot.joints_sensor.joints_angles
-        self.current_position = self.robot.position_rotation_sensor.position
-        self.previous_position = self.current_position
+        self.current_joints[:] = self.robot.state.joints_angles
+        self.current_position[:] = self.robot.state.ee_position
+        self.previous_position[:] = self.current_position
         self.target_joints = self.robot.world.joints_targets[self.robot.mgt_id]
         self.trajectory_idx = 0
         self.trajectory_idx_prev = 0
 
-        # plan new trajectory      
-        self.trajectory = self.planner.plan(self.target_joints, self.robot.world.active_objects)
+        # plan new trajectory
+        if self.planning_service is not None:
+            if self.planning_request is None:
+                self.on_world_reset()
+            self.trajectory, planning_time = self.planning_request[1].result()
+            pyb_u.log_planner_time(self.robot.object_id, planning_time)
+            self.planning_request = None
+            self._prefetch()
+        else:
+            self.trajectory = self.planner.plan(self.target_joints, self.robot.world.active_objects)
         
         # calculate cartesian positions of trajectory waypoints
         self.trajectory_xyz = []
@@ -0,0 +1,103 @@
+import numpy as np
+
+# numeric kernels for the rewards of the PositionCollision goals, see position_collision.py
+# the goals only gather their inputs and keep track of their state, all the math happens in here on plain floats and arrays
+# if numba is installed, the kernels get compiled on first use, otherwise they run as regular python with the exact same results as before
+try:
+    from numba import njit
+    _jit = njit(cache=True)
+    _NUMBA = True
+except ImportError:
+    def _jit(func):
+        return func
+    _NUMBA = False
+
+__all__ = [
+    "RUNNING",
+    "OUT_OF_BOUNDS",
+    "COLLISION",
+    "SUCCESS",
+    "TIMEOUT",
+    "terminal_reward",
+    "velocity_shaking",
+    "exponential_penalty",
+    "joint_limit_distance",
+    "proximity_v2_reward"
+]
+
+# outcomes of a step as returned by terminal_reward
+RUNNING = 0
+OUT_OF_BOUNDS = 1
+COLLISION = 2
+SUCCESS = 3
+TIMEOUT = 4
+
+if _NUMBA:
+    @_jit
+    def _norm(vec: np.ndarray) -> float:
+        # np.linalg.norm would need scipy's BLAS within numba
+        return np.sqrt(np.sum(vec * vec))
+else:
+    _norm = np.linalg.norm
+
+@_jit
+def terminal_reward(out_of_bounds: bool, collided: bool, reached: bool, timed_out: bool,
+                    reward_out_of_bounds: float, reward_collision: float, reward_success: float, reward_timeout: float, reward_running: float):
+    """
+    Picks the reward for the outcome of a step, the conditions are checked in the order out of bounds, collision, target reached and timeout.
+    Returns the reward and the outcome as one of the constants above.
+    """
+    if out_of_bounds:
+        return reward_out_of_bounds, OUT_OF_BOUNDS
+    elif collided:
+        return reward_collision, COLLISION
+    elif reached:
+        return reward_success, SUCCESS
+    elif timed_out:
+        return reward_timeout, TIMEOUT
+    return reward_running, RUNNING
+
+@_jit
+def velocity_shaking(velocities: np.ndarray, past_velocities: np.ndarray, decay: float) -> float:
+    """
+    Sums up the norms of the changes between consecutive joint velocities, going from the current ones back in time.
+    past_velocities is ordered from oldest to newest, the change to the entry at index idx is weighted with decay ** idx.
+    """
+    shaking = 0.
+    current = velocities
+    for idx in range(len(past_velocities) - 1, -1, -1):
+        shaking += (decay ** idx) * _norm(current - past_velocities[idx])
+        current = past_velocities[idx]
+    return shaking
+
+@_jit
+def exponential_penalty(x: float, x_max: float, a: float, b: float) -> float:
+    """
+    a * exp(-(x - x_max)) + b for x up to x_max and 0 above, for punishing closeness to obstacles or joint limits.
+    """
+    if x <= x_max:
+        return a * np.exp(-(x - x_max)) + b
+    return 0.
+
+@_jit
+def joint_limit_distance(joints: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> float:
+    """
+    Distance of the joint closest to one of its limits.
+    """
+    return min(np.min(np.abs(upper - joints)), np.min(np.abs(joints - lower)))
+
+@_jit
+def proximity_v2_reward(distance: float, min_dist: float, action: np.ndarray, dist_to_limits: float,
+                        dirac: float, d_min: float, k: int, joint_limit_a: float, joint_limit_b: float,
+                        lambda_1: float, lambda_2: float, lambda_3: float, lambda_4: float, normalize: bool) -> float:
+    """
+    Weighted sum of a huber like distance penalty, a penalty for the closest obstacle, the squared action and a penalty for closeness to the joint limits.
+    """
+    dist_reward = -((0.5 * (distance**2)) if distance < dirac else (dirac * (distance - 0.5 * dirac)))
+    obst_reward = -((d_min / (min_dist + d_min)) ** k)
+    action_reward = -np.sum(np.square(action))
+    joint_limit_reward = exponential_penalty(dist_to_limits, 0.05, joint_limit_a, joint_limit_b)
+    reward = lambda_1 * dist_reward + lambda_2 * obst_reward + lambda_3 * action_reward + lambda_4 * joint_limit_reward
+    if normalize:
+        return reward / lambda_1
+    return reward
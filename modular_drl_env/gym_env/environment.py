@@ -1,8 +1,8 @@
 import gym
 import numpy as np
-import pybullet as pyb
+import random
+from modular_drl_env.util.pybullet_util import pyb
 from time import process_time
-import pandas as pd
 import os
 import platform
 
@@ -11,6 +11,14 @@ from modular_drl_env.robot.robot import Robot
 from modular_drl_env.sensor.sensor import Sensor
 from modular_drl_env.goal.goal import Goal
 from modular_drl_env.world.world import World
+from modular_drl_env.world.scenario_cache import ScenarioCache, ScenarioDataset
+
+# import observation assembly
+from modular_drl_env.gym_env.observation_buffer import ObservationBuffer
+
+# import log writer and profiler
+from modular_drl_env.util.log_writer import EpisodeLogWriter
+from modular_drl_env.util.profiler import StepProfiler
 
 # import pybullet wrapper
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
@@ -19,9 +27,10 @@ from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 #   worlds
 from modular_drl_env.world import WorldRegistry
 #   robots
-from modular_drl_env.robot import RobotRegistry
+from modular_drl_env.robot import RobotRegistry, IKSolverRegistry
 #   sensors
 from modular_drl_env.sensor import SensorRegistry
+from modular_drl_env.sensor.sensor_implementations.camera import CameraBase, CameraRenderScheduler
 #   goals
 from modular_drl_env.goal import GoalRegistry
 
@@ -34,6 +43,8 @@ class ModularDRLEnv(gym.Env):
         self.train = env_config["train"]
         # flag for normalizing observations
         self.normalize_observations = env_config["normalize_observations"]
+        # flag for returning observations as one flat vector instead of a dict, optional
+        self.flatten_observations = env_config["flatten_observations"] if "flatten_observations" in env_config else False
         # flag for normalizing rewards
         self.normalize_rewards = env_config["normalize_rewards"]
         # flag for rendering auxillary geometry spawned by the scenario
@@ -72,6 +83,10 @@ class ModularDRLEnv(gym.Env):
         self.inference_time = 0
         self.inference_epoch = 0
         self.log = []
+        # writes the log to csv in the background, see step
+        self.log_writer = EpisodeLogWriter() if self.logging == 2 or self.logging == 3 else None
+        # timings of the single parts of each step, optional, can be sent to tensorboard via the MoreLoggingCustomCallback
+        self.profiler = StepProfiler(enabled=env_config["profiling"] if "profiling" in env_config else False)
         # init and fill the stats with a few entries to make early iterations a bit more robust
         self.success_stat = [False, False]
         self.out_of_bounds_stat = [False, False]
@@ -97,7 +112,7 @@ class ModularDRLEnv(gym.Env):
         else:
             self.assets_path = os.path.join(os.sep, *assets_path[:-1])  
         
-        # init pybullet from config
+        # init pybullet from config, this gives the env its own physics client
         pyb_u.init(self.assets_path, env_config["display"], env_config["sim_step"], env_config["gravity"])
 
         pyb_u.toggle_rendering(False)
@@ -111,6 +126,10 @@ class ModularDRLEnv(gym.Env):
         self._robot_setup(env_config)
         pyb_u.toggle_rendering(True)
 
+        # all cameras get rendered in one go before the other sensors are updated
+        cameras = [sensor for sensor in self.sensors if isinstance(sensor, CameraBase)]
+        self.camera_scheduler = CameraRenderScheduler(cameras) if cameras else None
+
         # construct observation space from sensors and goals
         # each sensor and goal will add elements to the observation space with fitting names
         observation_space_dict = dict()
@@ -122,6 +141,10 @@ class ModularDRLEnv(gym.Env):
                 observation_space_dict = {**observation_space_dict, **goal.get_observation_space_element()}
 
         self.observation_space = gym.spaces.Dict(observation_space_dict)
+        # pre-allocated memory the sensors and goals write their observations into
+        self.observation_buffer = ObservationBuffer(self.observation_space)
+        if self.flatten_observations:
+            self.observation_space = self.observation_buffer.get_flat_space()
 
         # construct action space from robots
         # the action space will be a vector with the length of all robot's control dimensions added up
@@ -137,10 +160,52 @@ class ModularDRLEnv(gym.Env):
         
         self.action_space = gym.spaces.Box(low=-1, high=1, shape=(sum(self.action_space_dims),), dtype=np.float32)
 
+        # names under which the step profiler records the sensors
+        self.sensor_profile_names = ["sensor_" + str(idx) + "_" + type(sensor).__name__ for idx, sensor in enumerate(self.sensors)]
+
+        # resets draw from pre-sampled scenarios if configured, see world/scenario_cache.py
+        if self.scenario_dataset_config is not None:
+            self.world.scenario_cache = ScenarioDataset(self.world, self.scenario_dataset_config["path"],
+                                                        loop=self.scenario_dataset_config["loop"] if "loop" in self.scenario_dataset_config else True)
+        elif self.scenario_cache_config is not None:
+            self.world.scenario_cache = ScenarioCache(self.world,
+                                                      size=self.scenario_cache_config["size"] if "size" in self.scenario_cache_config else 1000,
+                                                      levels=self.scenario_cache_config["levels"] if "levels" in self.scenario_cache_config else 5,
+                                                      path=self.scenario_cache_config["path"] if "path" in self.scenario_cache_config else None,
+                                                      seed=self.scenario_cache_seed,
+                                                      background_workers=self.scenario_cache_config["background_workers"] if "background_workers" in self.scenario_cache_config else 0)
+            # the workers are forks of this process, which doesn't work with the pybullet GUI
+            if env_config["display"] and self.world.scenario_cache.num_background_workers > 0:
+                print("[WARNING] scenario cache background workers don't work with the display turned on, continuing without them")
+            else:
+                self.world.scenario_cache.start_workers()
+
+        # state of the pybullet util belonging to this env, gets activated whenever this env is used
+        # this allows multiple envs to run in the same process, see the vec env
+        self.pyb_context = pyb_u.get_context()
+
     def reset(self):
+        with pyb_u.activate(self.pyb_context):
+            return self._reset()
+
+    def step(self, action):
+        with pyb_u.activate(self.pyb_context):
+            return self._step(action)
+
+    def close(self):
+        if self.log_writer is not None:
+            self.log_writer.close()
+        if self.world.scenario_cache is not None:
+            self.world.scenario_cache.close()
+        with pyb_u.activate(self.pyb_context):
+            pyb_u.close()
+
+    def _reset(self):
         pyb_u.toggle_rendering(False)
         # end execution if max episodes is reached
         if self.max_episodes != -1 and self.episode >= self.max_episodes:
+            if self.log_writer is not None:
+                self.log_writer.close()
             exit(0)
 
         # reset the tracking variables
@@ -157,7 +222,16 @@ class ModularDRLEnv(gym.Env):
 
         # toggle pybullet rendering off
         
-        self.world.reset(np.average(self.success_stat))
+        success_rate = np.average(self.success_stat)
+        scenario = self.world.scenario_cache.draw(success_rate) if self.world.scenario_cache is not None else None
+        if scenario is not None:
+            self.world.set_scenario(scenario)
+        else:
+            self.world.reset(success_rate)
+            if self.world.scenario_cache is not None:
+                self.world.scenario_cache.add(self.world.get_scenario(), success_rate)
+        for goal in self.goals:
+            goal.on_world_reset()
 
         # set all robots to active
         self.active_robots = [True for robot in self.robots]
@@ -165,6 +239,10 @@ class ModularDRLEnv(gym.Env):
         # reset the sensors to start settings
         for sensor in self.sensors:
             sensor.reset()
+        for robot in self.robots:
+            robot.state.reset()
+        if self.camera_scheduler is not None:
+            self.camera_scheduler.render()
 
         # call the goals' update routine and get their metrics, if they exist
         self.goal_metrics = []
@@ -191,14 +269,15 @@ class ModularDRLEnv(gym.Env):
         return self._get_obs()
 
     def _get_obs(self):
-        obs_dict = dict()
-        # get the sensor data
+        profile_epoch = self.profiler.now()
+        # let the sensors and goals write their data into the buffer
+        views = self.observation_buffer.views
         for sensor in self.sensors:
             if sensor.add_to_observation_space:
-                obs_dict = {**obs_dict, **sensor.get_observation()}
+                sensor.write_observation(views)
         for goal in self.goals:
             if goal.add_to_observation_space:
-                obs_dict = {**obs_dict, **goal.get_observation()}
+                goal.write_observation(views)
 
         # no normalizing here, that should be handled by the sensors and goals
 
@@ -206,9 +285,15 @@ class ModularDRLEnv(gym.Env):
         # inference time here and in step
         self.inference_epoch = process_time()
 
-        return obs_dict
+        # copy, the buffer gets overwritten on the next step (or reset, which matters for vec envs keeping the terminal observation)
+        if self.flatten_observations:
+            obs = self.observation_buffer.get_flat()
+        else:
+            obs = self.observation_buffer.get_dict()
+        self.profiler.record("observation", profile_epoch)
+        return obs
 
-    def step(self, action):
+    def _step(self, action):
 
         # measure inference time via the epoch, see above
         self.inference_time += process_time() - self.inference_epoch
@@ -218,9 +303,13 @@ class ModularDRLEnv(gym.Env):
 
         # convert to numpy
         action = np.array(action)
+
+        # timestamps for the step profiler
+        profile_step_epoch = self.profiler.now()
         
         # update world
         self.world.update()
+        profile_epoch = self.profiler.record("world_update", profile_step_epoch)
 
         # apply the action to all robots that have to be moved
         action_offset = 0  # the offset at which the ith robot sits in the action array
@@ -234,21 +323,32 @@ class ModularDRLEnv(gym.Env):
             current_robot_action = action[action_offset : self.action_space_dims[idx] + action_offset]
             action_offset += self.action_space_dims[idx]
             exec_time = robot.process_action(current_robot_action)
+            profile_epoch = self.profiler.record("action", profile_epoch)
             # let simulated physical time pass
             for i in range(self.sim_steps_per_env_step):
-                pyb.stepSimulation()
+                pyb_u.physics_step()
                 self.sim_time += self.sim_step
+            profile_epoch = self.profiler.record("physics", profile_epoch)
             exec_times_cpu.append(exec_time)
 
         # update the sensor data
-        for sensor in self.sensors:
+        if self.camera_scheduler is not None:
+            self.camera_scheduler.render(self.steps_current_episode)
+            profile_epoch = self.profiler.record("camera_render", profile_epoch)
+        for idx, sensor in enumerate(self.sensors):
             sensor.update(self.steps_current_episode)
+            profile_epoch = self.profiler.record(self.sensor_profile_names[idx], profile_epoch)
+        # fill the robots' state snapshots from the fresh sensor data, goals read from these
+        for robot in self.robots:
+            robot.state.update()
+        profile_epoch = self.profiler.record("robot_state", profile_epoch)
 
         # update the collision model if necessary
         if not self.use_physics_sim:
             pyb_u.perform_collision_check()
         # run our collision handling
         pyb_u.get_collisions()
+        profile_epoch = self.profiler.record("collision_check", profile_epoch)
 
         # calculate reward and get termination conditions
         rewards = []
@@ -291,6 +391,7 @@ class ModularDRLEnv(gym.Env):
         else:
             self.reward = np.sum(rewards)
         self.reward_cumulative += self.reward
+        profile_epoch = self.profiler.record("reward", profile_epoch)
 
         # visual help, if enabled
         if self.show_auxillary_geometry_sensors:
@@ -368,17 +469,25 @@ class ModularDRLEnv(gym.Env):
 
             self.log.append(info)
 
+            # write to textfile, one file per episode if max_episodes is -1, otherwise one for all episodes
+            # the rows are streamed to disk in the background, a copy is needed as the info dict might get changed by the caller (e.g. vec envs)
+            if self.log_writer is not None:
+                log_path = "./models/env_logs/episode_" + str(self.episode if self.max_episodes == -1 else self.max_episodes) + ".csv"
+                self.log_writer.append(log_path, dict(info))
+                if done:
+                    self.log_writer.flush(log_path)
+
             # on episode end:
             if done:
                 # write to console
                 info_string = self._get_info_string(info)
                 print(info_string)
-                # write to textfile, in this case the entire log so far
-                if self.logging == 2 or self.logging == 3:
-                    if self.max_episodes == -1 or self.episode == self.max_episodes:
-                        pd.DataFrame(self.log).to_csv("./models/env_logs/episode_" + str(self.episode) + ".csv")
 
-        return self._get_obs(), self.reward, done, info
+        profile_epoch = self.profiler.record("logging", profile_epoch)
+        obs = self._get_obs()
+        self.profiler.record("step_total", profile_step_epoch)
+
+        return obs, self.reward, done, info
 
     ###################
     # utility methods #
@@ -455,7 +564,7 @@ class ModularDRLEnv(gym.Env):
                 self.robots[0].moveto_xyzquat(np.array([x,y,z]),np.array(command_quat), self.use_physics_sim)
                 if self.use_physics_sim:
                     for i in range(self.sim_steps_per_env_step):
-                        pyb.stepSimulation()
+                        pyb_u.physics_step()
 
                 self.robots[0].position_rotation_sensor.reset()
                 self.robots[0].joints_sensor.reset()
@@ -487,7 +596,7 @@ class ModularDRLEnv(gym.Env):
                 self.robots[0].moveto_joints(command_quat, self.use_physics_sim, self.robots[0].all_joints_ids)
                 if self.use_physics_sim:
                     for i in range(self.sim_steps_per_env_step):
-                        pyb.stepSimulation()
+                        pyb_u.physics_step()
 
                 self.robots[0].joints_sensor.reset()
                 self.robots[0].position_rotation_sensor.reset()
@@ -500,6 +609,13 @@ class ModularDRLEnv(gym.Env):
     # callback methods #
     ####################
 
+    def pop_step_timings(self) -> dict:
+        """
+        This method is only called from the outside by the custom logging callback (see callbacks/callbacks.py).
+        Returns the timings collected by the step profiler since the last call as a dict of component name -> numpy array of seconds.
+        """
+        return self.profiler.pop_timings()
+
     def set_goal_metric(self, name, value):
         """
         This method is only called from the outside by the custom logging callback (see callbacks/callbacks.py).
@@ -524,7 +640,25 @@ class ModularDRLEnv(gym.Env):
         world_config["sim_steps_per_env_step"] = self.sim_steps_per_env_step
         
         self.world:World = WorldRegistry.get(world_type)(**world_config)
-        self.world.set_up()
+        self.scenario_cache_config = env_config["world"]["scenario_cache"] if "scenario_cache" in env_config["world"] else None
+        self.scenario_cache_seed = self.scenario_cache_config["seed"] if self.scenario_cache_config is not None and "seed" in self.scenario_cache_config else 0
+        self.scenario_dataset_config = env_config["world"]["scenario_dataset"] if "scenario_dataset" in env_config["world"] else None
+        # scenario files only fit the exact same obstacles, so the random parts of the set up are seeded in that case, everything after stays random
+        if self.scenario_dataset_config is not None:
+            set_up_seed = ScenarioDataset.read_seed(self.scenario_dataset_config["path"])
+        elif self.scenario_cache_config is not None and "path" in self.scenario_cache_config:
+            set_up_seed = self.scenario_cache_seed
+        else:
+            set_up_seed = env_config["world"]["set_up_seed"] if "set_up_seed" in env_config["world"] else None
+        if set_up_seed is not None:
+            np_state, py_state = np.random.get_state(), random.getstate()
+            np.random.seed(set_up_seed)
+            random.seed(set_up_seed)
+            self.world.set_up()
+            np.random.set_state(np_state)
+            random.setstate(py_state)
+        else:
+            self.world.set_up()
         if not self.train and self.show_auxillary_geometry_world:
             self.world.build_visual_aux()
 
@@ -543,6 +677,11 @@ class ModularDRLEnv(gym.Env):
             self.robots.append(robot)
             robot.build()
 
+            # replace pybullet's inverse kinematics if the config asks for it
+            if "ik_solver" in robo_entry:
+                ik_config = robo_entry["ik_solver"]["config"] if "config" in robo_entry["ik_solver"] else {}
+                robot.set_ik_solver(IKSolverRegistry.get(robo_entry["ik_solver"]["type"])(robot=robot, **ik_config))
+
             # create the two mandatory sensors
             if "report_joint_velocities" in robo_entry:
                 jv = robo_entry["report_joint_velocities"]
@@ -0,0 +1,77 @@
+import gym
+import numpy as np
+
+__all__ = [
+    "ObservationBuffer"
+]
+
+class ObservationBuffer:
+    """
+    Pre-allocated memory for the observations of an env.
+    The layout is computed once from the observation space: all float32 elements are placed one after another in a single contiguous float32 buffer
+    and every element gets a view into it with the shape of its gym space. Elements with other dtypes (e.g. camera images) get an array of their own.
+    Sensors and goals write their data directly into these views (see write_observation in their base classes),
+    such that assembling an observation neither has to merge dicts nor to allocate new arrays.
+    """
+
+    def __init__(self, observation_space: gym.spaces.Dict):
+        self.observation_space = observation_space
+        # same order as in the observation space, gym sorts the keys
+        self.keys = list(observation_space.spaces.keys())
+
+        # key -> slice of the flat buffer, only for float32 elements
+        self.slices = dict()
+        size = 0
+        for key, space in observation_space.spaces.items():
+            if np.dtype(space.dtype) == np.float32:
+                element_size = int(np.prod(space.shape))
+                self.slices[key] = slice(size, size + element_size)
+                size += element_size
+        self.flat = np.zeros(size, dtype=np.float32)
+
+        # key -> array the sensors and goals write into
+        self.views = dict()
+        for key, space in observation_space.spaces.items():
+            if key in self.slices:
+                self.views[key] = self.flat[self.slices[key]].reshape(space.shape)
+            else:
+                self.views[key] = np.zeros(space.shape, dtype=space.dtype)
+
+        # whether the flat buffer holds the complete observation
+        self.all_flat = len(self.slices) == len(self.keys)
+
+    def get_dict(self, copy: bool=True) -> dict:
+        """
+        Returns the observation as a dict like the observation space.
+        Without copying, the arrays are views into the buffer and will change on the next write.
+        """
+        if not copy:
+            return dict(self.views)
+        # one copy of the flat buffer instead of one per element
+        flat = self.flat.copy()
+        ret = dict()
+        for key in self.keys:
+            if key in self.slices:
+                ret[key] = flat[self.slices[key]].reshape(self.views[key].shape)
+            else:
+                ret[key] = self.views[key].copy()
+        return ret
+
+    def get_flat(self, copy: bool=True) -> np.ndarray:
+        """
+        Returns the observation as one float32 vector, elements ordered as in the observation space.
+        Without copying (and if all elements are float32), this is the buffer itself and will change on the next write.
+        """
+        if self.all_flat:
+            return self.flat.copy() if copy else self.flat
+        # elements with other dtypes have to be converted anyway
+        return np.concatenate([self.views[key].ravel() for key in self.keys], dtype=np.float32)
+
+    def get_flat_space(self) -> gym.spaces.Box:
+        """
+        Returns the gym space matching the output of get_flat.
+        """
+        spaces = [self.observation_space.spaces[key] for key in self.keys]
+        low = np.concatenate([np.broadcast_to(space.low, space.shape).ravel() for space in spaces], dtype=np.float32)
+        high = np.concatenate([np.broadcast_to(space.high, space.shape).ravel() for space in spaces], dtype=np.float32)
+        return gym.spaces.Box(low=low, high=high, dtype=np.float32)
@@ -0,0 +1,268 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, List, Optional, Union
+import numpy as np
+import gym
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv, CloudpickleWrapper
+
+from modular_drl_env.gym_env.environment import ModularDRLEnv
+
+__all__ = [
+    "ModularDRLVecEnv"
+]
+
+class ModularDRLVecEnv(VecEnv):
+    """
+    Vectorized env that steps many ModularDRLEnvs within one process instead of one process per env (like SB3's SubprocVecEnv does).
+    Every env has its own pybullet physics client, the pybullet util switches between them when an env is stepped.
+    Observations are written into pre-allocated numpy buffers, one per observation key (or a single one for flattened observations) with the envs stacked along the first axis.
+
+    If num_processes is larger than 1, the envs are split into that many shards that each run in their own worker process.
+    In that case the observation and action buffers live in shared memory, such that only rewards, dones and infos
+    have to be sent through the pipes between the processes.
+    """
+
+    def __init__(self, env_fns: List[Callable[[], ModularDRLEnv]], num_processes: int=1, start_method: str=None):
+        self.num_processes = min(num_processes, len(env_fns))
+        self.envs = []
+        self.remotes = []
+        self.processes = []
+        self._shared_memory = []
+        self.waiting = False
+        self.closed = False
+
+        if self.num_processes <= 1:
+            # everything runs right here
+            self.envs = [env_fn() for env_fn in env_fns]
+            observation_space, action_space = self.envs[0].observation_space, self.envs[0].action_space
+            super().__init__(len(env_fns), observation_space, action_space)
+            self.buf_obs = {key: np.zeros((self.num_envs,) + space.shape, dtype=space.dtype) for key, space in self._obs_spaces().items()}
+            self.actions = np.zeros((self.num_envs,) + self.action_space.shape, dtype=self.action_space.dtype)
+        else:
+            # split the envs into shards of (almost) equal size
+            shards = np.array_split(np.arange(len(env_fns)), self.num_processes)
+            self.shard_slices = [slice(shard[0], shard[-1] + 1) for shard in shards]
+            if start_method is None:
+                # forkserver is faster than spawn and safer than fork, same default as SB3 uses
+                start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+            ctx = mp.get_context(start_method)
+            for shard_slice in self.shard_slices:
+                remote, work_remote = ctx.Pipe()
+                process = ctx.Process(target=_shard_worker, args=(work_remote, remote, CloudpickleWrapper(env_fns[shard_slice])), daemon=True)
+                process.start()
+                work_remote.close()
+                self.remotes.append(remote)
+                self.processes.append(process)
+            # the workers tell us the spaces once their envs are built
+            observation_space, action_space = self.remotes[0].recv()
+            for remote in self.remotes[1:]:
+                remote.recv()
+            super().__init__(len(env_fns), observation_space, action_space)
+            # allocate the shared buffers and let the workers attach to them
+            self.buf_obs = {key: self._create_shared_array((self.num_envs,) + space.shape, space.dtype) for key, space in self._obs_spaces().items()}
+            self.actions = self._create_shared_array((self.num_envs,) + self.action_space.shape, self.action_space.dtype)
+            buffer_specs = {key: (self._shared_memory[idx].name, array.shape, array.dtype) for idx, (key, array) in enumerate(self.buf_obs.items())}
+            action_spec = (self._shared_memory[-1].name, self.actions.shape, self.actions.dtype)
+            for remote, shard_slice in zip(self.remotes, self.shard_slices):
+                remote.send(("attach", (buffer_specs, action_spec, shard_slice)))
+            for remote in self.remotes:
+                remote.recv()
+
+    ###############
+    # VecEnv API  #
+    ###############
+
+    def reset(self):
+        if self.envs:
+            self._reset_envs()
+        else:
+            for remote in self.remotes:
+                remote.send(("reset", None))
+            for remote in self.remotes:
+                remote.recv()
+        return self._obs_from_buf()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.actions[:] = actions
+        if self.remotes:
+            for remote in self.remotes:
+                remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self):
+        if self.envs:
+            rewards, dones, infos = self._step_envs()
+        else:
+            results = [remote.recv() for remote in self.remotes]
+            rewards = np.concatenate([result[0] for result in results])
+            dones = np.concatenate([result[1] for result in results])
+            infos = [info for result in results for info in result[2]]
+        self.waiting = False
+        return self._obs_from_buf(), rewards, dones, infos
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.envs:
+            for env in self.envs:
+                env.close()
+        else:
+            if self.waiting:
+                for remote in self.remotes:
+                    remote.recv()
+            for remote in self.remotes:
+                remote.send(("close", None))
+            for process in self.processes:
+                process.join()
+            for shared_memory in self._shared_memory:
+                shared_memory.close()
+                shared_memory.unlink()
+        self.closed = True
+
+    def get_attr(self, attr_name: str, indices=None) -> List[Any]:
+        return self._call("get_attr", indices, attr_name)
+
+    def set_attr(self, attr_name: str, value: Any, indices=None) -> None:
+        self._call("set_attr", indices, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices=None, **method_kwargs) -> List[Any]:
+        return self._call("env_method", indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None) -> List[bool]:
+        # our envs are never wrapped
+        return [False for _ in self._get_indices(indices)]
+
+    def seed(self, seed: Optional[int]=None) -> List[Union[None, int]]:
+        # the envs use numpy's global rng, so the best we can do is seeding that in every process
+        if seed is None:
+            return [None for _ in range(self.num_envs)]
+        if self.envs:
+            np.random.seed(seed)
+        else:
+            for idx, remote in enumerate(self.remotes):
+                remote.send(("seed", seed + idx))
+            for remote in self.remotes:
+                remote.recv()
+        return [seed + idx for idx in range(self.num_envs)]
+
+    ###########
+    # helpers #
+    ###########
+
+    def _reset_envs(self) -> None:
+        for idx, env in enumerate(self.envs):
+            self._save_obs(idx, env.reset())
+
+    def _step_envs(self):
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for idx, env in enumerate(self.envs):
+            obs, rewards[idx], dones[idx], info = env.step(self.actions[idx])
+            if dones[idx]:
+                # same convention as SB3's vec envs: keep the last observation and start the next episode right away
+                info["terminal_observation"] = obs
+                obs = env.reset()
+            self._save_obs(idx, obs)
+            infos.append(info)
+        return rewards, dones, infos
+
+    def _obs_spaces(self) -> dict:
+        # envs with flattened observations have a single Box space, it gets the key None
+        if isinstance(self.observation_space, gym.spaces.Dict):
+            return dict(self.observation_space.spaces)
+        return {None: self.observation_space}
+
+    def _save_obs(self, env_idx: int, obs) -> None:
+        for key, buffer in self.buf_obs.items():
+            buffer[env_idx] = obs if key is None else obs[key]
+
+    def _obs_from_buf(self):
+        # copies, the buffers get overwritten on the next step
+        if None in self.buf_obs:
+            return self.buf_obs[None].copy()
+        return {key: buffer.copy() for key, buffer in self.buf_obs.items()}
+
+    def _create_shared_array(self, shape: tuple, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        shared_memory = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self._shared_memory.append(shared_memory)
+        return np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf)
+
+    def _get_indices(self, indices) -> List[int]:
+        if indices is None:
+            return list(range(self.num_envs))
+        if isinstance(indices, int):
+            return [indices]
+        return list(indices)
+
+    def _call(self, command: str, indices, *args) -> List[Any]:
+        indices = self._get_indices(indices)
+        if self.envs:
+            return [_run_env_command(self.envs[idx], command, *args) for idx in indices]
+        # ask every worker only for the envs it owns
+        requests = []
+        for remote, shard_slice in zip(self.remotes, self.shard_slices):
+            local_indices = [idx - shard_slice.start for idx in indices if shard_slice.start <= idx < shard_slice.stop]
+            if local_indices:
+                remote.send((command, (local_indices, args)))
+                requests.append(remote)
+        return [result for remote in requests for result in remote.recv()]
+
+def _run_env_command(env: ModularDRLEnv, command: str, *args) -> Any:
+    if command == "get_attr":
+        return getattr(env, args[0])
+    elif command == "set_attr":
+        return setattr(env, args[0], args[1])
+    elif command == "env_method":
+        method_name, method_args, method_kwargs = args
+        return getattr(env, method_name)(*method_args, **method_kwargs)
+    raise Exception("Unknown command " + command + " for the vec env!")
+
+def _attach_shared_array(spec: tuple):
+    name, shape, dtype = spec
+    shared_memory = SharedMemory(name=name)
+    return shared_memory, np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf)
+
+def _shard_worker(remote, parent_remote, env_fns_wrapper: CloudpickleWrapper) -> None:
+    """
+    Runs one shard of envs in its own process.
+    """
+    parent_remote.close()
+    # all envs of the shard are handled by a single process vec env whose buffers get replaced by views into the shared memory
+    vec_env = ModularDRLVecEnv(env_fns_wrapper.var)
+    remote.send((vec_env.observation_space, vec_env.action_space))
+    shared_memories = []
+    try:
+        while True:
+            command, data = remote.recv()
+            if command == "attach":
+                buffer_specs, action_spec, shard_slice = data
+                for key, spec in buffer_specs.items():
+                    shared_memory, array = _attach_shared_array(spec)
+                    shared_memories.append(shared_memory)
+                    vec_env.buf_obs[key] = array[shard_slice]
+                shared_memory, array = _attach_shared_array(action_spec)
+                shared_memories.append(shared_memory)
+                vec_env.actions = array[shard_slice]
+                remote.send(None)
+            elif command == "step":
+                remote.send(vec_env._step_envs())
+            elif command == "reset":
+                vec_env._reset_envs()
+                remote.send(None)
+            elif command == "seed":
+                np.random.seed(data)
+                remote.send(None)
+            elif command == "close":
+                vec_env.close()
+                break
+            else:
+                local_indices, args = data
+                remote.send(vec_env._call(command, local_indices, *args))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for shared_memory in shared_memories:
+            shared_memory.close()
+        remote.close()
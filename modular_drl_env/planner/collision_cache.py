@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import numpy as np
+from modular_drl_env.robot.robot import Robot
+
+__all__ = [
+    "CollisionCache"
+]
+
+class CollisionCache:
+    """
+    Memoizes the collision checks of a planner for one robot.
+    Configurations are discretized with the given resolution (in radians), configurations that end up in the same cell share one result.
+    The results are kept in an LRU cache and are valid for as long as the scene stays the same: they get dropped once any of the world's
+    active objects moves, the active objects or other robots change, bodies get spawned or removed or the planner's context changes (see sync).
+    Next to single configurations the cache also keeps the interpolated configurations of extend segments, such that a segment that is
+    extended again doesn't need to be interpolated anew and stops right at its first known collision.
+    """
+
+    def __init__(self, robot: Robot, resolution: float=1e-4, max_size: int=100000, max_edges: int=20000):
+        self.robot = robot
+        self.resolution = resolution
+        self.max_size = max_size
+        self.max_edges = max_edges
+
+        # discretized configuration -> bool collision
+        self.configurations = OrderedDict()
+        # (discretized start, discretized end) -> list of interpolated configurations
+        self.edges = OrderedDict()
+
+        # state of the scene and context the cached results belong to
+        self.scene_key = None
+        self.context = None
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, q) -> bytes:
+        return np.round(np.asarray(q, dtype=np.float64) / self.resolution).astype(np.int64).tobytes()
+
+    def clear(self):
+        self.configurations.clear()
+        self.edges.clear()
+
+    def sync(self, context=None):
+        """
+        Drops all cached results if the scene changed since the last call or if the context differs.
+        The context should be something hashable that contains everything else the collision check depends on, e.g. the obstacles and the safety margin.
+        Should be called at the start of each planning query.
+        """
+        scene_key = self._get_scene_key()
+        if scene_key != self.scene_key or context != self.context:
+            self.clear()
+            self.scene_key = scene_key
+            self.context = context
+
+    def in_collision(self, q, collision_fn) -> bool:
+        """
+        Returns the cached result for q or runs the collision function and stores its result.
+        """
+        key = self.key(q)
+        result = self._lookup(key)
+        if result is None:
+            result = bool(collision_fn(q))
+            self._store(key, result)
+        return result
+
+    def lookup(self, q):
+        """
+        Returns the cached result for q or None if there is none yet.
+        """
+        return self._lookup(self.key(q))
+
+    def store(self, q, result: bool):
+        """
+        Stores the result of a collision check done outside of the cache, e.g. via collision_checker.check_configurations.
+        """
+        self._store(self.key(q), bool(result))
+
+    def wrap_collision_fn(self, collision_fn):
+        """
+        Returns a collision function with the same signature as the pybullet planning ones that goes through the cache.
+        """
+        def cached_collision_fn(q, diagnosis=False) -> bool:
+            return self.in_collision(q, collision_fn)
+        return cached_collision_fn
+
+    def wrap_extend_fn(self, extend_fn):
+        """
+        Returns an extend function that caches the interpolated configurations of every segment.
+        The configurations are handed out until (and including) the first one that is already known to collide, the caller will then stop there anyway.
+        """
+        def cached_extend_fn(q1, q2):
+            key = (self.key(q1), self.key(q2))
+            configurations = self.edges.get(key)
+            if configurations is None:
+                configurations = [tuple(q) for q in extend_fn(q1, q2)]
+                self.edges[key] = configurations
+                if len(self.edges) > self.max_edges:
+                    self.edges.popitem(last=False)
+            else:
+                self.edges.move_to_end(key)
+            for q in configurations:
+                yield q
+                if self.configurations.get(self.key(q)):
+                    return
+        return cached_extend_fn
+
+    def edge_in_collision(self, q1, q2, extend_fn, collision_fn) -> bool:
+        """
+        Returns whether any configuration on the segment between q1 and q2 collides, goes through the cache for every one of them.
+        """
+        for q in self.wrap_extend_fn(extend_fn)(q1, q2):
+            if self.in_collision(q, collision_fn):
+                return True
+        return False
+
+    def _lookup(self, key: bytes):
+        result = self.configurations.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.configurations.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def _store(self, key: bytes, result: bool):
+        self.configurations[key] = result
+        if len(self.configurations) > self.max_size:
+            self.configurations.popitem(last=False)
+
+    def _get_scene_key(self) -> tuple:
+        # the other robots are obstacles as well
+        return self.robot.world.get_scene_key(self.robot)
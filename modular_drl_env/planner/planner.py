@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from modular_drl_env.robot.robot import Robot
 from typing import List
+import numpy as np
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 
 class Planner(ABC):
@@ -18,4 +19,46 @@ class Planner(ABC):
         The result has to be a list of joint positions which for a valid, collision-free trajectory between the start and q_goal.
         """
         pass
-    
\ No newline at end of file
+
+    def _edge_steps(self, q_a: np.ndarray, q_b: np.ndarray) -> int:
+        """
+        Number of steps the edge between two configurations is divided into, such that no joint moves more than self.epsilon per step.
+        This is the resolution edges are checked for collisions at.
+        """
+        return max(1, int(np.ceil(np.max(np.abs(q_b - q_a)) / self.epsilon)))
+
+    def _interpolate_path(self, path: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Pads the path with waypoints at most self.epsilon apart in every joint, which is the spacing a trajectory follower expects.
+        The waypoints are the same configurations the edges were checked at, so none of them is left unchecked.
+        """
+        ret = [np.array(path[0])]
+        for q_a, q_b in zip(path[:-1], path[1:]):
+            q_a, q_b = np.array(q_a), np.array(q_b)
+            num_steps = self._edge_steps(q_a, q_b)
+            ret += list(q_a + np.outer(np.arange(1, num_steps + 1) / num_steps, q_b - q_a))
+        return ret
+
+    # num of steps -> steps in bisection order
+    _bisection_orders = dict()
+
+    @classmethod
+    def _bisection_order(cls, num_steps: int) -> np.ndarray:
+        """
+        Returns the steps 1 to num_steps in bisection order: the last one first, then the middle, then the middles of the halves etc.
+        Collisions along an edge are mostly found after a few checks this way.
+        """
+        order = cls._bisection_orders.get(num_steps)
+        if order is None:
+            order = [num_steps]
+            intervals = [(0, num_steps)]
+            while intervals:
+                next_intervals = []
+                for low, high in intervals:
+                    if high - low > 1:
+                        mid = (low + high) // 2
+                        order.append(mid)
+                        next_intervals += [(low, mid), (mid, high)]
+                intervals = next_intervals
+            order = cls._bisection_orders[num_steps] = np.array(order)
+        return order
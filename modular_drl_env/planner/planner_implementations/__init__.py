@@ -1,2 +1,3 @@
 from .rrt import *
-from .prm import *
\ No newline at end of file
+from .prm import *
+from .rrt_connect import *
\ No newline at end of file
@@ -1,53 +1,345 @@
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from modular_drl_env.planner.planner import Planner
+from modular_drl_env.planner.collision_cache import CollisionCache
 from modular_drl_env.robot.robot import Robot
-from typing import List, Tuple
+from typing import List
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
-import pybullet_planning as pyb_p
-from time import process_time
+from time import time
+import hashlib
+import heapq
+import os
+import tempfile
 
 __all__ = [
     "PRM"
 ]
+
+class Roadmap:
+    """
+    Roadmap of a PRM in compact numpy form: the nodes as one configuration per row and the undirected edges as pairs of node indices.
+    For the graph search the edges are additionally kept in CSR form (per node a slice of neighbours and edge indices).
+    Everything in here is free of self collisions and collisions with static bodies, the active objects aren't part of it.
+    """
+
+    def __init__(self, nodes: np.ndarray, edges: np.ndarray):
+        self.nodes = nodes
+        self.edges = edges
+        self.lengths = np.linalg.norm(nodes[edges[:, 0]] - nodes[edges[:, 1]], axis=1) if len(edges) else np.zeros(0)
+        # CSR adjacency, both directions of every edge
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        targets = np.concatenate([edges[:, 1], edges[:, 0]])
+        edge_ids = np.concatenate([np.arange(len(edges)), np.arange(len(edges))])
+        order = np.argsort(sources, kind="stable")
+        self.neighbours = targets[order]
+        self.neighbour_edges = edge_ids[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(nodes)))])
+
+    def save(self, path: str):
+        # float32 and int32 are plenty for joint angles and node indices and halve the size on disk
+        # several envs might build the same roadmap at once, so it gets written to a temporary file first and then moved into place in one go
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, nodes=self.nodes.astype(np.float32), edges=self.edges.astype(np.int32))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path: str):
+        with np.load(path) as data:
+            return Roadmap(data["nodes"].astype(np.float64), data["edges"].astype(np.int64))
+
 class PRM(Planner):
-    
-    def __init__(self, robot: Robot) -> None:
+    """
+    Probabilistic roadmap planner with a roadmap that persists across episodes.
+    The roadmap only depends on the robot (its URDF, base pose and joint limits) and the static scene (bodies that are not part of the world's active objects),
+    so it gets built once, validated against self collisions and the static bodies and then stored on disk as a compressed npz file in roadmap_dir.
+    Every later run with the same robot and static scene just loads it.
+    Queries connect start and goal to their nearest roadmap nodes and search the graph with A*. The nodes and edges of the path found are checked
+    against the active objects only then (lazy PRM), colliding ones get removed for the rest of the query and the search is repeated.
+    """
+
+    def __init__(self, robot: Robot, epsilon: float=0.0416, num_samples: int=1000, num_neighbours: int=10, max_time: float=5.0, padding: bool=True, roadmap_dir: str="./models/roadmaps", collision_cache: bool=True) -> None:
         super().__init__(robot)
-        self.joint_ids = [pyb_u.pybullet_joints_ids[self.robot.object_id, joint_id] for joint_id in self.robot.controlled_joints_ids]
+        self.joint_ids_u = self.robot.controlled_joints_group
+
+        # resolution in joint space for collision checks along edges and for the padding of the result
+        self.epsilon = epsilon
+        # number of collision free nodes of the roadmap
+        self.num_samples = num_samples
+        # number of nearest nodes every node (as well as start and goal) gets connected to
+        self.num_neighbours = num_neighbours
+        # wall clock budget for a query in seconds, building or loading the roadmap doesn't count towards it
+        self.max_time = max_time
+        self.padding = padding
+        # folder for the roadmaps, None keeps them in memory only
+        self.roadmap_dir = roadmap_dir
+        # memoizes the collision checks against the active objects for as long as the scene stays the same
+        self.collision_cache = CollisionCache(self.robot) if collision_cache else None
+
+        self.roadmap = None
+        self.roadmap_key = None
 
     def plan(self, q_goal, obstacles) -> List:
-        obstacles = [pyb_u.to_pb(obstacle.object_id) for obstacle in obstacles]
-        q_start = self.robot.joints_sensor.joints_angles
-        ret = None
-        tries = 0
-        sample_fn = pyb_p.get_sample_fn(pyb_u.to_pb(self.robot.object_id), self.joint_ids)
-        distance_fn = pyb_p.get_distance_fn(pyb_u.to_pb(self.robot.object_id), self.joint_ids)
-        extend_fn = pyb_p.get_extend_fn(pyb_u.to_pb(self.robot.object_id), self.joint_ids)
-
-        def collision_fn(q, diagnosis=False) -> bool:
-            q = np.array(q)
-            self.robot.moveto_joints(q, False)
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            return pyb_u.collision
-
-        if not pyb_p.check_initial_end(q_start, q_goal, collision_fn):
+        obstacles_set = set(obstacles)
+        q_start, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
+        q_goal = np.array(q_goal, dtype=np.float64)
+
+        t_start = time()
+        self._update_roadmap()
+        deadline = time() + self.max_time
+
+        def dynamic_collision_fn(q) -> bool:
+            # the active objects, other robots and the world's obstacles that aren't active, everything else has been checked when building the roadmap
+            self.robot.moveto_joints(np.array(q), False, self.joint_ids_u)
+            low, high = pyb_u.get_aabb(self.robot.object_id)
+            for obst in self.robot.world.get_active_objects_near(low - 0.03, high + 0.03):
+                if obst in obstacles_set and obst.seen_by_obstacle_sensor:
+                    if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obst.object_id), 0.03):
+                        return True
+            if self.robot.world.collision_checker.in_pooled_collision(self.robot):
+                return True
+            return self.robot.world.collision_checker.in_collision(self.robot, obstacles=self.robot.world.active_objects, check_self=False)
+
+        if self.collision_cache is not None:
+            self.collision_cache.sync((frozenset(obstacles_set), 0.03))
+            self._in_collision = lambda q: self.collision_cache.in_collision(q, dynamic_collision_fn)
+        else:
+            self._in_collision = dynamic_collision_fn
+
+        if self._in_full_collision(q_start) or self._in_full_collision(q_goal):
+            self.robot.moveto_joints(q_start, False, self.joint_ids_u)
             return [q_start]
-        
-        while ret is None and tries < 50:
-            t_start = process_time()
-            ret = pyb_p.prm(q_start, q_goal, distance_fn, sample_fn, extend_fn, collision_fn)
-            
-            pyb_u.log_planner_time(self.robot.object_id, process_time() - t_start)
-            tries += 1
-            if tries >= 50:
-                break
+
+        # the lazy results stay valid as long as the scene (including the obstacles outside of the active objects) and the obstacles stay the same
+        states_key = (self.robot.world.get_scene_key(self.robot), frozenset(obstacles_set))
+        ret = self._query(q_start, q_goal, deadline, states_key)
+        pyb_u.log_planner_time(self.robot.object_id, time() - t_start)
         if ret is None:
-            ret = [q_start, q_goal]
-        ret = pyb_p.refine_path(pyb_u.to_pb(self.robot.object_id), self.joint_ids, ret, 200)
+            # no path within the time budget, stay where we are like for invalid start or goal configurations
+            self.robot.moveto_joints(q_start, False, self.joint_ids_u)
+            return [q_start]
+        if self.padding:
+            ret = self._interpolate_path(ret)
         pyb_u.perform_collision_check()
         pyb_u.get_collisions()
-        #print(pyb_u.collisions)
-        self.robot.moveto_joints(q_start, False)
-        return np.array(ret)
\ No newline at end of file
+        self.robot.moveto_joints(q_start, False, self.joint_ids_u)
+        return np.array(ret)
+
+    ###########
+    # roadmap #
+    ###########
+
+    def _get_roadmap_key(self) -> str:
+        # everything the roadmap depends on
+        key = hashlib.sha1()
+        key.update(str(self.robot.urdf_path).encode())
+        key.update(np.round(np.concatenate([self.robot.base_position, self.robot.base_orientation]), 4).tobytes())
+        key.update(np.array(self.joint_ids_u.pyb_joint_ids).tobytes())
+        key.update(np.round(np.concatenate([self.robot.joints_limits_lower, self.robot.joints_limits_upper]), 4).tobytes())
+        key.update(np.array([self.epsilon, self.num_samples, self.num_neighbours]).tobytes())
+        key.update(self.robot.world.collision_checker.get_static_bodies_key())
+        return key.hexdigest()
+
+    def _update_roadmap(self):
+        """
+        Makes sure the roadmap fits the current robot and static scene, loads or builds it if not.
+        """
+        roadmap_key = self._get_roadmap_key()
+        if roadmap_key == self.roadmap_key:
+            return
+        path = None
+        if self.roadmap_dir is not None:
+            path = os.path.join(self.roadmap_dir, "prm_" + self.robot.name + "_" + roadmap_key[:16] + ".npz")
+        if path is not None and os.path.exists(path):
+            self.roadmap = Roadmap.load(path)
+        else:
+            self.roadmap = self._build_roadmap()
+            if path is not None:
+                os.makedirs(self.roadmap_dir, exist_ok=True)
+                self.roadmap.save(path)
+        self.roadmap_key = roadmap_key
+        # per edge and node: 0 unknown, 1 free, -1 colliding with the active objects
+        self.edge_states = np.zeros(len(self.roadmap.edges), dtype=np.int8)
+        self.node_states = np.zeros(len(self.roadmap.nodes), dtype=np.int8)
+        self.states_key = None
+
+    def _build_roadmap(self) -> Roadmap:
+        print("[PRM] Building roadmap for robot " + self.robot.name + " with " + str(self.num_samples) + " nodes")
+        q_orig, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
+        lower, upper = self.robot.joints_limits_lower, self.robot.joints_limits_upper
+
+        def static_collision_fn(q) -> bool:
+            self.robot.moveto_joints(q, False, self.joint_ids_u)
+            return self.robot.world.collision_checker.in_static_collision(self.robot)
+
+        # nodes, with a cap on the attempts for robots that are in collision almost everywhere
+        nodes = []
+        max_attempts = 100 * self.num_samples
+        attempts = 0
+        while len(nodes) < self.num_samples and attempts < max_attempts:
+            attempts += 1
+            q = np.random.uniform(lower, upper)
+            if not static_collision_fn(q):
+                nodes.append(q)
+        if len(nodes) < self.num_samples:
+            print("[WARNING] PRM found only " + str(len(nodes)) + " collision free nodes in " + str(max_attempts) + " attempts")
+        nodes = np.array(nodes).reshape(-1, len(lower))
+
+        # edges to the nearest neighbours, each undirected edge only once
+        num_neighbours = min(self.num_neighbours, len(nodes) - 1)
+        candidates = set()
+        for idx, q in enumerate(nodes if num_neighbours > 0 else []):
+            diff = nodes - q
+            dists = np.einsum("ij,ij->i", diff, diff)
+            dists[idx] = np.inf
+            for other in np.argpartition(dists, num_neighbours - 1)[:num_neighbours]:
+                candidates.add((min(idx, other), max(idx, other)))
+        edges = [edge for edge in sorted(candidates) if not self._edge_in_collision(nodes[edge[0]], nodes[edge[1]], static_collision_fn)]
+
+        self.robot.moveto_joints(q_orig, False, self.joint_ids_u)
+        return Roadmap(nodes, np.array(edges, dtype=np.int64).reshape(-1, 2))
+
+    #########
+    # query #
+    #########
+
+    def _query(self, q_start: np.ndarray, q_goal: np.ndarray, deadline: float, states_key: tuple):
+        if not self._edge_in_collision(q_start, q_goal, self._in_full_collision):
+            return [q_start, q_goal]
+        roadmap = self.roadmap
+
+        if states_key != self.states_key:
+            self.edge_states[:] = 0
+            self.node_states[:] = 0
+            self.states_key = states_key
+
+        # start and goal get the indices num nodes and num nodes + 1, their edges to the roadmap are appended after the roadmap's edges
+        num_nodes, num_edges = len(roadmap.nodes), len(roadmap.edges)
+        start, goal = num_nodes, num_nodes + 1
+        nodes = np.vstack([roadmap.nodes, q_start, q_goal])
+        extra_neighbours = {start: [], goal: []}
+        extra_edges = []
+        extra_edge_states = []
+        # roadmap nodes by distance to start and goal, they get connected to the nearest ones first and to more if that isn't enough
+        orders = {idx: np.argsort(np.linalg.norm(roadmap.nodes - q, axis=1)) for idx, q in ((start, q_start), (goal, q_goal))}
+        num_connected = 0
+        node_states = np.concatenate([self.node_states, [1, 1]]).astype(np.int8)
+
+        while time() < deadline:
+            if num_connected == 0:
+                path_nodes = None
+            else:
+                path_nodes, path_edges = self._search(nodes, start, goal, extra_neighbours, extra_edges, extra_edge_states, node_states)
+            if path_nodes is None:
+                if num_connected == num_nodes:
+                    return None
+                num_connect = min(num_nodes, max(self.num_neighbours, 2 * num_connected))
+                for idx in (start, goal):
+                    for other in orders[idx][num_connected:num_connect]:
+                        extra_neighbours[idx].append((other, num_edges + len(extra_edges)))
+                        extra_edges.append((idx, other))
+                        extra_edge_states.append(0)
+                num_connected = num_connect
+                continue
+            valid = True
+            # nodes first, a single configuration is cheaper than an edge
+            for node in path_nodes:
+                if node_states[node] == 0:
+                    node_states[node] = self.node_states[node] = -1 if self._in_collision(nodes[node]) else 1
+                    if node_states[node] == -1:
+                        valid = False
+                        break
+            if valid:
+                for edge in path_edges:
+                    if edge < num_edges:
+                        if self.edge_states[edge] == 0:
+                            q_a, q_b = nodes[roadmap.edges[edge, 0]], nodes[roadmap.edges[edge, 1]]
+                            self.edge_states[edge] = -1 if self._edge_in_collision(q_a, q_b, self._in_collision) else 1
+                        state = self.edge_states[edge]
+                    else:
+                        # edges to start and goal haven't been checked against the static scene
+                        if extra_edge_states[edge - num_edges] == 0:
+                            q_a, q_b = nodes[extra_edges[edge - num_edges][0]], nodes[extra_edges[edge - num_edges][1]]
+                            extra_edge_states[edge - num_edges] = -1 if self._edge_in_collision(q_a, q_b, self._in_full_collision) else 1
+                        state = extra_edge_states[edge - num_edges]
+                    if state == -1:
+                        valid = False
+                        break
+            if valid:
+                return [nodes[node].copy() for node in path_nodes]
+        return None
+
+    def _search(self, nodes: np.ndarray, start: int, goal: int, extra_neighbours: dict, extra_edges: list, extra_edge_states: list, node_states: np.ndarray):
+        """
+        A* from start to goal over all nodes and edges not known to collide. Returns the nodes and edges of the path or None, None.
+        """
+        roadmap = self.roadmap
+        num_edges = len(roadmap.edges)
+        # edges from the roadmap to the goal, the other way round is in extra_neighbours already
+        to_goal = {other: edge for other, edge in extra_neighbours[goal]}
+        heuristic = np.linalg.norm(nodes - nodes[goal], axis=1)
+        costs = {start: 0.0}
+        parents = {start: (-1, -1)}
+        closed = set()
+        queue = [(heuristic[start], start)]
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node in closed:
+                continue
+            if node == goal:
+                path_nodes, path_edges = [], []
+                while node != -1:
+                    path_nodes.append(node)
+                    node, edge = parents[node]
+                    if edge != -1:
+                        path_edges.append(edge)
+                return path_nodes[::-1], path_edges[::-1]
+            closed.add(node)
+            if node in extra_neighbours:
+                neighbours = extra_neighbours[node]
+            else:
+                neighbours = list(zip(roadmap.neighbours[roadmap.indptr[node]:roadmap.indptr[node + 1]], roadmap.neighbour_edges[roadmap.indptr[node]:roadmap.indptr[node + 1]]))
+                if node in to_goal:
+                    neighbours.append((goal, to_goal[node]))
+            for other, edge in neighbours:
+                if other in closed or node_states[other] == -1:
+                    continue
+                if edge < num_edges:
+                    if self.edge_states[edge] == -1:
+                        continue
+                    length = roadmap.lengths[edge]
+                else:
+                    if extra_edge_states[edge - num_edges] == -1:
+                        continue
+                    length = np.linalg.norm(nodes[extra_edges[edge - num_edges][0]] - nodes[extra_edges[edge - num_edges][1]])
+                cost = costs[node] + length
+                if cost < costs.get(other, np.inf):
+                    costs[other] = cost
+                    parents[other] = (node, edge)
+                    heapq.heappush(queue, (cost + heuristic[other], other))
+        return None, None
+
+    ###########
+    # helpers #
+    ###########
+
+    def _in_full_collision(self, q) -> bool:
+        # configurations that are not part of the roadmap need the static checks as well
+        if self._in_collision(q):
+            return True
+        self.robot.moveto_joints(np.array(q), False, self.joint_ids_u)
+        return self.robot.world.collision_checker.in_static_collision(self.robot)
+
+    def _edge_in_collision(self, q_a: np.ndarray, q_b: np.ndarray, collision_fn) -> bool:
+        # all configurations along the edge at epsilon resolution, the ends are assumed to be checked already
+        num_steps = self._edge_steps(q_a, q_b)
+        configurations = q_a + np.outer(self._bisection_order(num_steps)[1:] / num_steps, q_b - q_a)
+        for q in configurations:
+            if collision_fn(q):
+                return True
+        return False
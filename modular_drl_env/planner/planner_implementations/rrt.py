@@ -1,6 +1,7 @@
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from modular_drl_env.planner.planner import Planner
+from modular_drl_env.planner.collision_cache import CollisionCache
 from modular_drl_env.robot.robot import Robot
 from typing import List, Tuple
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
@@ -14,18 +15,21 @@ __all__ = [
 ]
 class RRT(Planner):
     
-    def __init__(self, robot: Robot, epsilon: float=0.0416, max_iterations: int=10000, goal_bias: float=0.35, padding: bool=True) -> None:
+    def __init__(self, robot: Robot, epsilon: float=0.0416, max_iterations: int=10000, goal_bias: float=0.35, padding: bool=True, collision_cache: bool=True) -> None:
         super().__init__(robot)
-        self.joint_ids = [pyb_u.pybullet_joints_ids[self.robot.object_id, joint_id] for joint_id in self.robot.controlled_joints_ids]
-        self.joint_ids_u = self.robot.controlled_joints_ids
+        self.joint_ids = self.robot.controlled_joints_group.pyb_joint_ids
+        self.joint_ids_u = self.robot.controlled_joints_group
 
         self.epsilon = epsilon
         self.max_iterations = max_iterations
         self.goal_bias = goal_bias
         self.padding = padding
+        # memoizes collision checks, such that configurations that come up again (even across several plan calls) don't need to be checked again
+        self.collision_cache = CollisionCache(self.robot) if collision_cache else None
 
     def plan(self, q_goal, obstacles) -> List:
         obstacles_pyb = [pyb_u.to_pb(obstacle.object_id) for obstacle in obstacles]
+        obstacles_set = set(obstacles)
         q_start, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
         ret = None
         tries = 0
@@ -36,13 +40,19 @@ class RRT(Planner):
         def collision_fn(q, diagnosis=False) -> bool:
             q = np.array(q)
             self.robot.moveto_joints(q, False, self.joint_ids_u)
-            for obst in obstacles:
-                if obst.seen_by_obstacle_sensor:
+            # broad phase: only obstacles close to the robot's bounding box can be within the safety distance
+            low, high = pyb_u.get_aabb(self.robot.object_id)
+            for obst in self.robot.world.get_active_objects_near(low - 0.03, high + 0.03):
+                if obst in obstacles_set and obst.seen_by_obstacle_sensor:
                     if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obst.object_id), 0.03):
                         return True
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            return pyb_u.collision
+            return self.robot.world.collision_checker.in_collision(self.robot)
+
+        if self.collision_cache is not None:
+            # the results depend on the obstacles and the safety margin next to the scene itself
+            self.collision_cache.sync((frozenset(obstacles_set), 0.03))
+            collision_fn = self.collision_cache.wrap_collision_fn(collision_fn)
+            extend_fn = self.collision_cache.wrap_extend_fn(extend_fn)
 
         if not pyb_p.check_initial_end(q_start, q_goal, collision_fn):
             return [q_start]
@@ -61,23 +71,26 @@ class RRT(Planner):
             ret = pyb_p.refine_path(pyb_u.to_pb(self.robot.object_id), self.joint_ids, ret, 200)
         pyb_u.perform_collision_check()
         pyb_u.get_collisions()
-        #print(pyb_u.collisions)
+        #print(pyb_u.get_collision_pairs())
         self.robot.moveto_joints(q_start, False, self.joint_ids_u)
         return np.array(ret)
 
 class BiRRT(Planner):
 
-    def __init__(self, robot: Robot, epsilon: float=0.0416, max_iterations: int=1000, padding: bool=True) -> None:
+    def __init__(self, robot: Robot, epsilon: float=0.0416, max_iterations: int=1000, padding: bool=True, collision_cache: bool=True) -> None:
         super().__init__(robot)
-        self.joint_ids = [pyb_u.pybullet_joints_ids[self.robot.object_id, joint_id] for joint_id in self.robot.controlled_joints_ids]
-        self.joint_ids_u = self.robot.controlled_joints_ids
+        self.joint_ids = self.robot.controlled_joints_group.pyb_joint_ids
+        self.joint_ids_u = self.robot.controlled_joints_group
 
         self.epsilon = epsilon
         self.max_iterations = max_iterations
         self.padding = padding
+        # memoizes collision checks, such that configurations that come up again (even across several plan calls) don't need to be checked again
+        self.collision_cache = CollisionCache(self.robot) if collision_cache else None
 
     def plan(self, q_goal, obstacles) -> List:
         obstacles_pyb = [pyb_u.to_pb(obstacle.object_id) for obstacle in obstacles]
+        obstacles_set = set(obstacles)
         q_start, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
         ret = None
         tries = 0
@@ -88,13 +101,19 @@ class BiRRT(Planner):
         def collision_fn(q, diagnosis=False) -> bool:
             q = np.array(q)
             self.robot.moveto_joints(q, False, self.joint_ids_u)
-            for obst in obstacles:
-                if obst.seen_by_obstacle_sensor:
+            # broad phase: only obstacles close to the robot's bounding box can be within the safety distance
+            low, high = pyb_u.get_aabb(self.robot.object_id)
+            for obst in self.robot.world.get_active_objects_near(low - 0.03, high + 0.03):
+                if obst in obstacles_set and obst.seen_by_obstacle_sensor:
                     if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obst.object_id), 0.03):
                         return True
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            return pyb_u.collision
+            return self.robot.world.collision_checker.in_collision(self.robot)
+
+        if self.collision_cache is not None:
+            # the results depend on the obstacles and the safety margin next to the scene itself
+            self.collision_cache.sync((frozenset(obstacles_set), 0.03))
+            collision_fn = self.collision_cache.wrap_collision_fn(collision_fn)
+            extend_fn = self.collision_cache.wrap_extend_fn(extend_fn)
 
         if not pyb_p.check_initial_end(q_start, q_goal, collision_fn):
             return [q_start]
@@ -114,23 +133,25 @@ class BiRRT(Planner):
             ret = pyb_p.refine_path(pyb_u.to_pb(self.robot.object_id), self.joint_ids, ret, 200)
         pyb_u.perform_collision_check()
         pyb_u.get_collisions()
-        #print(pyb_u.collisions)
+        #print(pyb_u.get_collision_pairs())
         self.robot.moveto_joints(q_start, False, self.joint_ids_u)
         return np.array(ret)
     
 class RRTStar(Planner):
 
-    def __init__(self, robot: Robot, epsilon: float=5e-2, max_iterations: int=1000, padding: bool=True) -> None:
+    def __init__(self, robot: Robot, epsilon: float=5e-2, max_iterations: int=1000, padding: bool=True, collision_cache: bool=True) -> None:
         super().__init__(robot)
-        self.joint_ids = [pyb_u.pybullet_joints_ids[self.robot.object_id, joint_id] for joint_id in self.robot.controlled_joints_ids]
-        self.joint_ids_u = self.robot.controlled_joints_ids
+        self.joint_ids = self.robot.controlled_joints_group.pyb_joint_ids
+        self.joint_ids_u = self.robot.controlled_joints_group
 
         self.epsilon = epsilon
         self.max_iterations = max_iterations
         self.padding = padding
+        # memoizes collision checks, such that configurations that come up again (even across several plan calls) don't need to be checked again
+        self.collision_cache = CollisionCache(self.robot) if collision_cache else None
 
     def plan(self, q_goal, obstacles) -> List:
-        obstacles = [pyb_u.to_pb(obstacle.object_id) for obstacle in obstacles]
+        obstacles_set = set(obstacles)
         q_start, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
         ret = None
         tries = 0
@@ -141,12 +162,19 @@ class RRTStar(Planner):
         def collision_fn(q, diagnosis=False) -> bool:
             q = np.array(q)
             self.robot.moveto_joints(q, False, self.joint_ids_u)
-            for obst in obstacles:
-                if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), obst, 0.01):
-                    return True
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            return pyb_u.collision
+            # broad phase: only obstacles close to the robot's bounding box can be within the safety distance
+            low, high = pyb_u.get_aabb(self.robot.object_id)
+            for obst in self.robot.world.get_active_objects_near(low - 0.01, high + 0.01):
+                if obst in obstacles_set:
+                    if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obst.object_id), 0.01):
+                        return True
+            return self.robot.world.collision_checker.in_collision(self.robot)
+
+        if self.collision_cache is not None:
+            # the results depend on the obstacles and the safety margin next to the scene itself
+            self.collision_cache.sync((frozenset(obstacles_set), 0.01))
+            collision_fn = self.collision_cache.wrap_collision_fn(collision_fn)
+            extend_fn = self.collision_cache.wrap_extend_fn(extend_fn)
 
         if not pyb_p.check_initial_end(q_start, q_goal, collision_fn):
             return [q_start]
@@ -166,7 +194,7 @@ class RRTStar(Planner):
             ret = pyb_p.refine_path(pyb_u.to_pb(self.robot.object_id), self.joint_ids, ret, 200)
         pyb_u.perform_collision_check()
         pyb_u.get_collisions()
-        #print(pyb_u.collisions)
+        #print(pyb_u.get_collision_pairs())
         self.robot.moveto_joints(q_start, False, self.joint_ids_u)
         return np.array(ret)  
     
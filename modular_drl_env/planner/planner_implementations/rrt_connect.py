@@ -0,0 +1,196 @@
+import numpy as np
+from modular_drl_env.util.pybullet_util import pyb
+from modular_drl_env.planner.planner import Planner
+from modular_drl_env.planner.collision_cache import CollisionCache
+from modular_drl_env.robot.robot import Robot
+from typing import List
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from time import time
+
+__all__ = [
+    "RRTConnect"
+]
+
+class ConfigurationTree:
+    """
+    Tree of robot configurations stored in numpy arrays, one row per node.
+    Nearest neighbour queries are a single vectorized scan over all nodes, which for the tree sizes a planning query produces
+    (up to some ten thousand nodes) is faster than walking a tree structure in Python.
+    """
+
+    def __init__(self, root: np.ndarray, capacity: int=1024):
+        self.nodes = np.zeros((capacity, len(root)))
+        self.parents = np.zeros(capacity, dtype=int)
+        self.nodes[0] = root
+        self.parents[0] = -1
+        self.size = 1
+
+    def add(self, q: np.ndarray, parent: int) -> int:
+        if self.size == len(self.nodes):
+            # double the capacity
+            self.nodes = np.concatenate([self.nodes, np.zeros_like(self.nodes)])
+            self.parents = np.concatenate([self.parents, np.zeros_like(self.parents)])
+        self.nodes[self.size] = q
+        self.parents[self.size] = parent
+        self.size += 1
+        return self.size - 1
+
+    def nearest(self, q: np.ndarray) -> int:
+        diff = self.nodes[:self.size] - q
+        return int(np.argmin(np.einsum("ij,ij->i", diff, diff)))
+
+    def path_to_root(self, idx: int) -> List[np.ndarray]:
+        path = []
+        while idx != -1:
+            path.append(self.nodes[idx].copy())
+            idx = self.parents[idx]
+        return path
+
+class RRTConnect(Planner):
+    """
+    Bidirectional RRT (RRT-Connect) that doesn't rely on pybullet planning.
+    Both trees are kept in numpy arrays, edges are validated by interpolating them in one go and checking the configurations
+    in bisection order (the middle first), such that collisions are usually found after few checks.
+    Instead of a number of tries the planner gets a wall clock budget, which also bounds the shortcutting of the path once one is found.
+    """
+
+    def __init__(self, robot: Robot, epsilon: float=0.0416, max_step: float=0.5, max_time: float=5.0, smoothing_iterations: int=100, padding: bool=True, collision_cache: bool=True) -> None:
+        super().__init__(robot)
+        self.joint_ids_u = self.robot.controlled_joints_group
+
+        # resolution in joint space for collision checks along edges and for the padding of the result
+        self.epsilon = epsilon
+        # maximum length of a single tree edge
+        self.max_step = max_step
+        # wall clock budget for finding a path in seconds
+        self.max_time = max_time
+        # number of shortcuts tried once a path is found
+        self.smoothing_iterations = smoothing_iterations
+        self.padding = padding
+        # memoizes collision checks, such that configurations that come up again (even across several plan calls) don't need to be checked again
+        self.collision_cache = CollisionCache(self.robot) if collision_cache else None
+
+    def plan(self, q_goal, obstacles) -> List:
+        obstacles_set = set(obstacles)
+        q_start, _ = pyb_u.get_joint_states(self.robot.object_id, self.joint_ids_u)
+        q_goal = np.array(q_goal, dtype=np.float64)
+        self.lower, self.upper = self.robot.joints_limits_lower, self.robot.joints_limits_upper
+
+        def check() -> bool:
+            # checks the configuration the robot is in right now
+            # broad phase: only obstacles close to the robot's bounding box can be within the safety distance
+            low, high = pyb_u.get_aabb(self.robot.object_id)
+            for obst in self.robot.world.get_active_objects_near(low - 0.03, high + 0.03):
+                if obst in obstacles_set and obst.seen_by_obstacle_sensor:
+                    if pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obst.object_id), 0.03):
+                        return True
+            return self.robot.world.collision_checker.in_collision(self.robot)
+        self._check = check
+
+        def collision_fn(q) -> bool:
+            self.robot.moveto_joints(np.array(q), False, self.joint_ids_u)
+            return check()
+
+        if self.collision_cache is not None:
+            # the results depend on the obstacles and the safety margin next to the scene itself
+            self.collision_cache.sync((frozenset(obstacles_set), 0.03))
+            self._in_collision = lambda q: self.collision_cache.in_collision(q, collision_fn)
+        else:
+            self._in_collision = collision_fn
+
+        if self._in_collision(q_start) or self._in_collision(q_goal):
+            self.robot.moveto_joints(q_start, False, self.joint_ids_u)
+            return [q_start]
+
+        t_start = time()
+        ret = self._connect_trees(q_start, q_goal, t_start + self.max_time)
+        if ret is not None:
+            ret = self._shortcut(ret, t_start + self.max_time)
+        pyb_u.log_planner_time(self.robot.object_id, time() - t_start)
+        if ret is None:
+            ret = [q_start, q_goal]
+        if self.padding:
+            ret = self._interpolate_path(ret)
+        pyb_u.perform_collision_check()
+        pyb_u.get_collisions()
+        self.robot.moveto_joints(q_start, False, self.joint_ids_u)
+        return np.array(ret)
+
+    def _connect_trees(self, q_start: np.ndarray, q_goal: np.ndarray, deadline: float):
+        if not self._edge_in_collision(q_start, q_goal):
+            return [q_start, q_goal]
+        tree_a, tree_b = ConfigurationTree(q_start), ConfigurationTree(q_goal)
+        # whether tree_a is the one rooted at the start
+        a_is_start = True
+        while time() < deadline:
+            q_rand = np.random.uniform(self.lower, self.upper)
+            idx_a = self._extend(tree_a, q_rand)
+            if idx_a is not None:
+                # try to connect the other tree to the new node
+                q_new = tree_a.nodes[idx_a]
+                idx_b = tree_b.nearest(q_new)
+                while True:
+                    idx_b_new = self._extend(tree_b, q_new, idx_b)
+                    if idx_b_new is None:
+                        break
+                    idx_b = idx_b_new
+                    if np.array_equal(tree_b.nodes[idx_b], q_new):
+                        path_a, path_b = tree_a.path_to_root(idx_a), tree_b.path_to_root(idx_b)
+                        # the connecting node is part of both paths
+                        path = path_a[::-1] + path_b[1:]
+                        return path if a_is_start else path[::-1]
+            tree_a, tree_b = tree_b, tree_a
+            a_is_start = not a_is_start
+        return None
+
+    def _extend(self, tree: ConfigurationTree, q_target: np.ndarray, idx_near: int=None):
+        """
+        Grows the tree by at most max_step from its node nearest to the target (or the given node) towards the target.
+        Returns the index of the new node or None if the edge collides.
+        """
+        if idx_near is None:
+            idx_near = tree.nearest(q_target)
+        q_near = tree.nodes[idx_near]
+        diff = q_target - q_near
+        dist = np.linalg.norm(diff)
+        if dist == 0:
+            return None
+        q_new = q_target if dist <= self.max_step else q_near + diff * (self.max_step / dist)
+        if self._edge_in_collision(q_near, q_new):
+            return None
+        return tree.add(q_new, idx_near)
+
+    def _edge_in_collision(self, q_a: np.ndarray, q_b: np.ndarray) -> bool:
+        # all configurations along the edge at epsilon resolution, the end is included, the start is assumed to be checked already
+        num_steps = self._edge_steps(q_a, q_b)
+        configurations = q_a + np.outer(self._bisection_order(num_steps) / num_steps, q_b - q_a)
+        if self.collision_cache is not None:
+            known = [self.collision_cache.lookup(q) for q in configurations]
+            if any(known):
+                return True
+            # only the configurations without a cached result need to be checked
+            configurations = configurations[[result is None for result in known]]
+            if not len(configurations):
+                return False
+        collisions = self.robot.world.collision_checker.check_configurations(self.robot, configurations, self.joint_ids_u, collision_fn=self._check, first_only=True)
+        if self.collision_cache is not None:
+            # the configurations after the first collision haven't been checked
+            num_checked = np.argmax(collisions) + 1 if collisions.any() else len(collisions)
+            for q, result in zip(configurations[:num_checked], collisions[:num_checked]):
+                self.collision_cache.store(q, result)
+        return bool(collisions.any())
+
+    def _shortcut(self, path: List[np.ndarray], deadline: float) -> List[np.ndarray]:
+        """
+        Randomly replaces parts of the path by direct edges, stops early at the deadline.
+        """
+        path = list(path)
+        for _ in range(self.smoothing_iterations):
+            if len(path) <= 2 or time() >= deadline:
+                break
+            i, j = np.sort(np.random.choice(len(path), 2, replace=False))
+            if j - i < 2:
+                continue
+            if not self._edge_in_collision(path[i], path[j]):
+                path = path[:i + 1] + path[j:]
+        return path
@@ -0,0 +1,336 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, Future
+import hashlib
+import numpy as np
+from modular_drl_env.util.pybullet_util import pyb
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.world.world import World
+from modular_drl_env.world.obstacles.obstacle import Obstacle
+
+__all__ = [
+    "PlanningService",
+    "capture_scene",
+    "get_scene_key"
+]
+
+class PlanningService:
+    """
+    Runs planning queries in a pool of worker processes, such that an env doesn't have to wait for its planner.
+    Every worker has its own DIRECT pybullet client in which it mirrors the scene of a query: robots are loaded from their URDFs,
+    obstacles from their URDFs or from their collision shapes (see capture_scene). Bodies are kept between queries and only moved around
+    if the next query has bodies of the same kind, the planners are kept as well, so their caches and roadmaps carry over.
+    Queries return futures whose result is a tuple of the trajectory and the time the planner took.
+    """
+
+    def __init__(self, planner: str="RRTConnect", planner_kwargs: dict=None, num_workers: int=1, assets_path: str="", start_method: str=None):
+        self.planner = planner
+        self.planner_kwargs = planner_kwargs if planner_kwargs is not None else dict()
+        if start_method is None:
+            # same default as the vec env
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self.executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context(start_method), initializer=_init_worker, initargs=(assets_path,))
+
+    def submit(self, scene: dict) -> Future:
+        """
+        Queues a planning query for a scene made by capture_scene.
+        """
+        return self.executor.submit(_plan, scene, self.planner, self.planner_kwargs)
+
+    def plan(self, scene: dict):
+        """
+        Same as submit, but waits for the result.
+        """
+        return self.submit(scene).result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+# (physics client id, object id) -> collision shapes of single link bodies, their geometry never changes
+_shapes_cache = dict()
+
+def capture_scene(robot, q_goal, obstacles: list, q_start: np.ndarray=None, obstacle_poses: dict=None, robots_joints: dict=None, active_objects: list=None) -> dict:
+    """
+    Describes the scene a robot plans in, such that a planning worker can mirror it: all robots of the world with their joint states,
+    the world's active objects (flagged if they are among the obstacles handed to the planner) and all other bodies with collision geometry.
+    By default everything is taken from the simulation as it is right now. A scene that isn't set up yet (e.g. the next episode's) can be described via
+    active_objects, obstacle_poses (obstacle -> (position, orientation)), robots_joints (robot -> controlled joints angles) and q_start.
+    """
+    world = robot.world
+    obstacles_set = set(obstacles)
+    robots = []
+    for other in world.robots:
+        joints, _ = pyb_u.get_joint_states(other.object_id, other.all_joints_group)
+        controlled_joints, _ = pyb_u.get_joint_states(other.object_id, other.controlled_joints_group)
+        if robots_joints is not None and other in robots_joints:
+            controlled_joints = np.array(robots_joints[other], dtype=np.float64)
+            all_joint_ids = list(other.all_joints_group.joint_ids)
+            joints[[all_joint_ids.index(joint_id) for joint_id in other.controlled_joints_group.joint_ids]] = controlled_joints
+        robots.append({
+            "name": other.name,
+            "urdf_path": other.urdf_path,
+            "base_position": np.array(other.base_position, dtype=np.float64),
+            "base_orientation": np.array(other.base_orientation, dtype=np.float64),
+            "self_collision": other.self_collision,
+            "joint_ids": list(other.all_joints_group.joint_ids),
+            "joints": joints,
+            "controlled_joint_ids": list(other.controlled_joints_group.joint_ids),
+            "controlled_joints": controlled_joints,
+            "joints_limits_lower": np.array(other.joints_limits_lower),
+            "joints_limits_upper": np.array(other.joints_limits_upper)
+        })
+
+    bodies = []
+    for obstacle in (active_objects if active_objects is not None else world.active_objects):
+        pose = obstacle_poses.get(obstacle) if obstacle_poses is not None else None
+        body = _capture_body(obstacle.object_id, getattr(obstacle, "urdf_path", None), getattr(obstacle, "scale", 1), pose)
+        body.update({"active": True, "obstacle": obstacle in obstacles_set, "seen_by_obstacle_sensor": obstacle.seen_by_obstacle_sensor})
+        bodies.append(body)
+    # bodies outside of the active objects, the collision checker keeps track of them anyway
+    active_pyb_ids = set(pyb_u.to_pb(obstacle.object_id) for obstacle in world.active_objects)
+    if active_objects is not None:
+        active_pyb_ids.update(pyb_u.to_pb(obstacle.object_id) for obstacle in active_objects)
+    static_pyb_ids, _, _ = world.collision_checker._get_static_bodies()
+    for pyb_id in static_pyb_ids:
+        if pyb_id in active_pyb_ids:
+            continue
+        body = _capture_body(pyb_u.gym_env_str_names[pyb_id])
+        body.update({"active": False, "obstacle": False, "seen_by_obstacle_sensor": False})
+        bodies.append(body)
+
+    robot_idx = world.robots.index(robot)
+    if q_start is None:
+        q_start = robots[robot_idx]["controlled_joints"]
+    return {"robot": robot_idx, "robots": robots, "bodies": bodies, "q_start": np.array(q_start, dtype=np.float64), "q_goal": np.array(q_goal, dtype=np.float64)}
+
+def get_scene_key(scene: dict) -> str:
+    """
+    Returns a hash of the poses, joint states and the query of a scene, two scenes with the same key lead to the same planning problem.
+    """
+    key = hashlib.sha1()
+    for robot in scene["robots"]:
+        key.update(np.round(np.concatenate([robot["joints"], robot["controlled_joints"]]), 4).tobytes())
+    for body in scene["bodies"]:
+        key.update(body["object_id"].encode())
+        key.update(np.round(np.concatenate([body["position"], body["orientation"], body.get("joints", [])]), 4).tobytes())
+        key.update(bytes([body["active"], body["obstacle"]]))
+    key.update(np.round(np.concatenate([scene["q_start"], scene["q_goal"]]), 4).tobytes())
+    return key.hexdigest()
+
+def _capture_body(object_id: str, urdf_path: str=None, scale: float=1, pose: tuple=None) -> dict:
+    pyb_id = pyb_u.to_pb(object_id)
+    position, orientation = pose if pose is not None else pyb.getBasePositionAndOrientation(pyb_id)
+    num_joints = pyb.getNumJoints(pyb_id)
+    body = {"object_id": object_id, "position": np.array(position, dtype=np.float64), "orientation": np.array(orientation, dtype=np.float64)}
+    if urdf_path is not None:
+        # URDFs can have concave meshes, which can't be rebuilt from the collision shape data, so these get loaded again
+        body["urdf_path"] = urdf_path
+        body["scale"] = scale
+        body["joints"] = np.array([state[0] for state in pyb.getJointStates(pyb_id, list(range(num_joints)))]) if num_joints else np.zeros(0)
+    else:
+        body["shapes"] = _get_shapes(object_id, pyb_id, num_joints)
+    return body
+
+def _get_shapes(object_id: str, pyb_id: int, num_joints: int) -> tuple:
+    """
+    Returns the collision shapes of all links of a body with their frames relative to the body's base.
+    """
+    cache_key = (pyb_u.physics_client_id, object_id)
+    if num_joints == 0 and cache_key in _shapes_cache:
+        return _shapes_cache[cache_key]
+    base_position, base_orientation = pyb.getBasePositionAndOrientation(pyb_id)
+    inv_position, inv_orientation = pyb.invertTransform(base_position, base_orientation)
+    shapes = []
+    for link in range(-1, num_joints):
+        if link == -1:
+            link_position, link_orientation = (0, 0, 0), (0, 0, 0, 1)
+        else:
+            link_state = pyb.getLinkState(pyb_id, link)
+            link_position, link_orientation = pyb.multiplyTransforms(inv_position, inv_orientation, link_state[0], link_state[1])
+        for shape in pyb.getCollisionShapeData(pyb_id, link):
+            geometry, dimensions, mesh, local_position, local_orientation = shape[2:7]
+            frame_position, frame_orientation = pyb.multiplyTransforms(link_position, link_orientation, local_position, local_orientation)
+            mesh = mesh.decode("UTF-8") if isinstance(mesh, bytes) else mesh
+            shapes.append((geometry, tuple(np.round(dimensions, 6)), mesh, tuple(np.round(frame_position, 6)), tuple(np.round(frame_orientation, 6))))
+    shapes = tuple(shapes)
+    if num_joints == 0:
+        _shapes_cache[cache_key] = shapes
+    return shapes
+
+##########
+# worker #
+##########
+
+class _MirrorWorld(World):
+    """
+    World of a planning worker, it only holds the mirrored robots and bodies.
+    """
+
+    def __init__(self):
+        super().__init__([0, 0, 0, 0, 0, 0], 1 / 240, 1, -1, "")
+
+    def set_up(self):
+        pass
+
+    def reset(self, success_rate: float):
+        pass
+
+    def update(self):
+        pass
+
+class _MirrorObstacle(Obstacle):
+    """
+    Stand-in for an active object of the original scene, the body itself is spawned by the worker.
+    """
+
+    def __init__(self, object_id: str, seen_by_obstacle_sensor: bool):
+        position, orientation = pyb_u.get_base_pos_and_ori(object_id)
+        super().__init__(position, orientation, [], 0, 0, 0, seen_by_obstacle_sensor)
+        self.object_id = object_id
+
+    def build(self) -> int:
+        return self.object_id
+
+class _MirrorRobot:
+    """
+    Stand-in for a robot of the original scene with the attributes the planners and the collision checker use.
+    """
+
+    def __init__(self, spec: dict, world: World):
+        self.name = spec["name"]
+        self.urdf_path = spec["urdf_path"]
+        self.base_position = spec["base_position"]
+        self.base_orientation = spec["base_orientation"]
+        self.self_collision = spec["self_collision"]
+        self.world = world
+        self.object_id = pyb_u.load_urdf(urdf_path=self.urdf_path, position=self.base_position, orientation=self.base_orientation, is_robot=True, self_collisions=self.self_collision)
+        self.all_joints_group = pyb_u.get_joint_group(self.object_id, spec["joint_ids"])
+        self.controlled_joints_group = pyb_u.get_joint_group(self.object_id, spec["controlled_joint_ids"])
+        self.joints_limits_lower = spec["joints_limits_lower"]
+        self.joints_limits_upper = spec["joints_limits_upper"]
+
+    def moveto_joints(self, desired_joints_angles: np.ndarray, use_physics_sim: bool, joints_ids=None):
+        if joints_ids is None or joints_ids is self.controlled_joints_group:
+            joints_ids = self.controlled_joints_group
+            np.clip(desired_joints_angles, self.joints_limits_lower, self.joints_limits_upper, out=desired_joints_angles)
+        pyb_u.set_joint_states(self.object_id, joints_ids, desired_joints_angles)
+
+class _PlanningWorker:
+
+    def __init__(self):
+        self.world = _MirrorWorld()
+        # robot key -> mirror robot
+        self.robots = dict()
+        # (robot key, planner, planner kwargs) -> planner
+        self.planners = dict()
+        # shapes -> pybullet collision shape
+        self.collision_shapes = dict()
+        # body kind -> object ids of the bodies of that kind currently spawned
+        self.bodies = dict()
+        # object id -> mirror obstacle
+        self.mirror_obstacles = dict()
+
+    def plan(self, scene: dict, planner: str, planner_kwargs: dict):
+        robot, obstacles = self._sync(scene)
+        key = (self._robot_key(scene["robots"][scene["robot"]]), planner, repr(sorted(planner_kwargs.items())))
+        if key not in self.planners:
+            self.planners[key] = _get_planner_class(planner)(robot, **planner_kwargs)
+        robot.moveto_joints(scene["q_start"].copy(), False)
+        # planners that give up early don't log a time
+        pyb_u.log_planner_time(robot.object_id, 0)
+        trajectory = self.planners[key].plan(scene["q_goal"], obstacles)
+        return np.array(trajectory), pyb_u.get_planner_time(robot.object_id)
+
+    def _robot_key(self, spec: dict) -> tuple:
+        return (spec["urdf_path"], spec["base_position"].tobytes(), spec["base_orientation"].tobytes(), spec["self_collision"], tuple(spec["controlled_joint_ids"]))
+
+    def _sync(self, scene: dict):
+        """
+        Sets up the mirror of the scene, returns the planning robot and the obstacles it should avoid.
+        """
+        # robots
+        self.world.robots = []
+        for spec in scene["robots"]:
+            key = self._robot_key(spec)
+            if key not in self.robots:
+                self.robots[key] = _MirrorRobot(spec, self.world)
+            robot = self.robots[key]
+            robot.mgt_id = len(self.world.robots)
+            self.world.robots.append(robot)
+            pyb_u.set_joint_states(robot.object_id, robot.all_joints_group, spec["joints"])
+            pyb_u.set_joint_states(robot.object_id, robot.controlled_joints_group, spec["controlled_joints"])
+
+        # bodies, reuse the ones of the same kind from the last query
+        unused = {kind: list(object_ids) for kind, object_ids in self.bodies.items()}
+        self.bodies = dict()
+        active_objects, obstacles = [], []
+        for body in scene["bodies"]:
+            kind = ("urdf", body["urdf_path"], body["scale"]) if "urdf_path" in body else ("shapes", body["shapes"])
+            if unused.get(kind):
+                object_id = unused[kind].pop()
+            elif kind[0] == "urdf":
+                object_id = pyb_u.load_urdf(urdf_path=body["urdf_path"], position=body["position"], orientation=body["orientation"], scale=body["scale"])
+            else:
+                object_id = pyb_u.create_collision_body(body["position"], body["orientation"], self._get_collision_shape(body["shapes"]))
+            self.bodies.setdefault(kind, []).append(object_id)
+            pyb_id = pyb_u.to_pb(object_id)
+            for joint, angle in enumerate(body.get("joints", [])):
+                pyb.resetJointState(pyb_id, joint, angle)
+            if len(body.get("joints", ())):
+                pyb_u.invalidate_states()
+                pyb_u.move_counter += 1
+            if body["active"]:
+                obstacle = self.mirror_obstacles.get(object_id)
+                if obstacle is None:
+                    obstacle = self.mirror_obstacles[object_id] = _MirrorObstacle(object_id, body["seen_by_obstacle_sensor"])
+                obstacle.seen_by_obstacle_sensor = body["seen_by_obstacle_sensor"]
+                obstacle.move_base(body["position"], body["orientation"])
+                active_objects.append(obstacle)
+                if body["obstacle"]:
+                    obstacles.append(obstacle)
+            else:
+                self.mirror_obstacles.pop(object_id, None)
+                pyb_u.set_base_pos_and_ori(object_id, body["position"], body["orientation"])
+        for object_ids in unused.values():
+            for object_id in object_ids:
+                self.mirror_obstacles.pop(object_id, None)
+                pyb_u.remove_object(object_id)
+        self.world.active_objects = active_objects
+        return self.world.robots[scene["robot"]], obstacles
+
+    def _get_collision_shape(self, shapes: tuple) -> int:
+        collision_shape = self.collision_shapes.get(shapes)
+        if collision_shape is None:
+            geometries, radii, half_extents, lengths, file_names, mesh_scales, plane_normals, positions, orientations = [], [], [], [], [], [], [], [], []
+            for geometry, dimensions, mesh, position, orientation in shapes:
+                geometries.append(geometry)
+                radii.append(dimensions[1] if geometry in (pyb.GEOM_CYLINDER, pyb.GEOM_CAPSULE) else dimensions[0])
+                half_extents.append([dimension / 2 for dimension in dimensions])
+                lengths.append(dimensions[0])
+                file_names.append(mesh)
+                mesh_scales.append(list(dimensions))
+                plane_normals.append([0, 0, 1])
+                positions.append(list(position))
+                orientations.append(list(orientation))
+            collision_shape = pyb.createCollisionShapeArray(shapeTypes=geometries, radii=radii, halfExtents=half_extents, lengths=lengths, fileNames=file_names,
+                                                            meshScales=mesh_scales, planeNormals=plane_normals, collisionFramePositions=positions, collisionFrameOrientations=orientations)
+            self.collision_shapes[shapes] = collision_shape
+        return collision_shape
+
+def _get_planner_class(planner: str):
+    # imported here, the planners import this module's dependencies themselves
+    from modular_drl_env.planner.planner_implementations import RRT, BiRRT, RRTStar, RRTConnect, PRM
+    planners = {"RRT": RRT, "BiRRT": BiRRT, "RRTStar": RRTStar, "RRTConnect": RRTConnect, "PRM": PRM}
+    if planner not in planners:
+        raise Exception("Unknown planner " + planner + " for the planning service, available are: " + ", ".join(planners))
+    return planners[planner]
+
+# planning worker of this process, see _init_worker
+_worker = None
+
+def _init_worker(assets_path: str):
+    global _worker
+    pyb_u.init(assets_path, False, 1 / 240, [0, 0, -9.8])
+    _worker = _PlanningWorker()
+
+def _plan(scene: dict, planner: str, planner_kwargs: dict):
+    return _worker.plan(scene, planner, planner_kwargs)
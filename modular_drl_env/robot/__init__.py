@@ -1,5 +1,7 @@
 from .robot_implementations import *
 from .robot import Robot
+from .robot_state import RobotState
+from .inverse_kinematics import *
 
 
 class RobotRegistry:
@@ -26,3 +28,25 @@ RobotRegistry.register('KR16')(KR16)
 RobotRegistry.register('Kukaiiwa')(Kukaiiwa)
 RobotRegistry.register('KukaKr3')(KukaKr3)
 RobotRegistry.register('KR120')(KR120)
+
+
+class IKSolverRegistry:
+    _ik_solver_classes = {}
+
+    @classmethod
+    def get(cls, ik_solver_type:str) -> IKSolver:
+        try:
+            return cls._ik_solver_classes[ik_solver_type]
+        except KeyError:
+            raise ValueError(f"unknown ik solver type: {ik_solver_type}")
+
+    @classmethod
+    def register(cls, ik_solver_type:str):
+        def inner_wrapper(wrapped_class):
+            cls._ik_solver_classes[ik_solver_type] = wrapped_class
+            return wrapped_class
+        return inner_wrapper
+
+IKSolverRegistry.register('Pybullet')(PybulletIK)
+IKSolverRegistry.register('DampedLeastSquares')(DampedLeastSquaresIK)
+IKSolverRegistry.register('Analytic')(AnalyticIK)
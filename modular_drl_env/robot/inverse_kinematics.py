@@ -0,0 +1,810 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import Union, Tuple
+from math import pi, sqrt, sin, cos, atan2, acos, hypot
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.util.quaternion_util import quaternions_to_matrices, matrices_to_quaternions
+
+__all__ = [
+    "IKSolver",
+    "PybulletIK",
+    "DampedLeastSquaresIK",
+    "AnalyticIK"
+]
+
+# sin(angle * scale + phase) gives 1, sin(angle) and cos(angle) in one call
+_TRIGONOMETRY_SCALES = np.array([0., 1., 1.])
+_TRIGONOMETRY_PHASES = np.array([pi / 2, 0., pi / 2])
+# outer product of two vectors (flattened) times this is their cross product
+_LEVI_CIVITA = np.array([[0, 0, 0], [0, 0, 1], [0, -1, 0], [0, 0, -1], [0, 0, 0], [1, 0, 0], [0, 1, 0], [-1, 0, 0], [0, 0, 0]], dtype=np.float64)
+
+def _cross_matrix(axis: np.ndarray) -> np.ndarray:
+    return np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+
+# plain float versions of the vector math and the subproblems below for the single target paths of the solvers,
+# vectors are 3-tuples and matrices row major 9-tuples, for single targets this beats numpy's overhead per call by far
+
+def _dot(a: tuple, b: tuple) -> float:
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def _add(a: tuple, b: tuple) -> tuple:
+    return (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+
+def _sub(a: tuple, b: tuple) -> tuple:
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+def _cross(a: tuple, b: tuple) -> tuple:
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def _mat_vec(m: tuple, v: tuple) -> tuple:
+    return (m[0] * v[0] + m[1] * v[1] + m[2] * v[2], m[3] * v[0] + m[4] * v[1] + m[5] * v[2], m[6] * v[0] + m[7] * v[1] + m[8] * v[2])
+
+def _mat_t_vec(m: tuple, v: tuple) -> tuple:
+    # m^T v
+    return (m[0] * v[0] + m[3] * v[1] + m[6] * v[2], m[1] * v[0] + m[4] * v[1] + m[7] * v[2], m[2] * v[0] + m[5] * v[1] + m[8] * v[2])
+
+def _mat_mul(a: tuple, b: tuple) -> tuple:
+    return (a[0] * b[0] + a[1] * b[3] + a[2] * b[6], a[0] * b[1] + a[1] * b[4] + a[2] * b[7], a[0] * b[2] + a[1] * b[5] + a[2] * b[8],
+            a[3] * b[0] + a[4] * b[3] + a[5] * b[6], a[3] * b[1] + a[4] * b[4] + a[5] * b[7], a[3] * b[2] + a[4] * b[5] + a[5] * b[8],
+            a[6] * b[0] + a[7] * b[3] + a[8] * b[6], a[6] * b[1] + a[7] * b[4] + a[8] * b[7], a[6] * b[2] + a[7] * b[5] + a[8] * b[8])
+
+def _mat_t_mul(a: tuple, b: tuple) -> tuple:
+    # a^T b
+    return (a[0] * b[0] + a[3] * b[3] + a[6] * b[6], a[0] * b[1] + a[3] * b[4] + a[6] * b[7], a[0] * b[2] + a[3] * b[5] + a[6] * b[8],
+            a[1] * b[0] + a[4] * b[3] + a[7] * b[6], a[1] * b[1] + a[4] * b[4] + a[7] * b[7], a[1] * b[2] + a[4] * b[5] + a[7] * b[8],
+            a[2] * b[0] + a[5] * b[3] + a[8] * b[6], a[2] * b[1] + a[5] * b[4] + a[8] * b[7], a[2] * b[2] + a[5] * b[5] + a[8] * b[8])
+
+def _mat_mul_t(a: tuple, b: tuple) -> tuple:
+    # a b^T
+    return (a[0] * b[0] + a[1] * b[1] + a[2] * b[2], a[0] * b[3] + a[1] * b[4] + a[2] * b[5], a[0] * b[6] + a[1] * b[7] + a[2] * b[8],
+            a[3] * b[0] + a[4] * b[1] + a[5] * b[2], a[3] * b[3] + a[4] * b[4] + a[5] * b[5], a[3] * b[6] + a[4] * b[7] + a[5] * b[8],
+            a[6] * b[0] + a[7] * b[1] + a[8] * b[2], a[6] * b[3] + a[7] * b[4] + a[8] * b[5], a[6] * b[6] + a[7] * b[7] + a[8] * b[8])
+
+def _rodrigues(cross: tuple, cross_squared: tuple, angle: float) -> tuple:
+    # rotation around a unit axis given by its cross product matrix and that matrix squared
+    s, c = sin(angle), 1 - cos(angle)
+    return (1 + s * cross[0] + c * cross_squared[0], s * cross[1] + c * cross_squared[1], s * cross[2] + c * cross_squared[2],
+            s * cross[3] + c * cross_squared[3], 1 + s * cross[4] + c * cross_squared[4], s * cross[5] + c * cross_squared[5],
+            s * cross[6] + c * cross_squared[6], s * cross[7] + c * cross_squared[7], 1 + s * cross[8] + c * cross_squared[8])
+
+def _quaternion_matrix(quaternion) -> tuple:
+    # rotation matrix of a quaternion that doesn't need to be normalized
+    x, y, z, w = quaternion.tolist() if type(quaternion) is np.ndarray else [float(value) for value in quaternion]
+    norm = sqrt(x * x + y * y + z * z + w * w)
+    x, y, z, w = x / norm, y / norm, z / norm, w / norm
+    return (1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+            2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+            2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y))
+
+def _rotation_vector(m: tuple) -> list:
+    # axis times angle of a rotation matrix, see DampedLeastSquaresIK._rotation_vectors
+    x, y, z = (m[7] - m[5]) / 2, (m[2] - m[6]) / 2, (m[3] - m[1]) / 2
+    sin_angle = sqrt(x * x + y * y + z * z)
+    cos_angle = (m[0] + m[4] + m[8] - 1) / 2
+    if sin_angle < 1e-6 and cos_angle < 0:
+        return DampedLeastSquaresIK._rotation_vectors(np.array(m).reshape(1, 3, 3))[0].tolist()
+    factor = atan2(sin_angle, cos_angle) / max(sin_angle, 1e-12)
+    return [x * factor, y * factor, z * factor]
+
+def _towards(angle: float, seed: float, lower: float, upper: float) -> float:
+    # the angle modulo full turns that is as close to the seed as the limits allow, clipped to the limits if there is none within
+    angle = seed + (angle - seed + pi) % (2 * pi) - pi
+    if angle > upper:
+        angle -= 2 * pi
+    if angle < lower:
+        angle += 2 * pi
+    return min(max(angle, lower), upper)
+
+def _closest(angles: list, seed: float, lower: float, upper: float) -> float:
+    # the one of two angles that ends up closer to the seed, see _towards
+    first, second = angles
+    return first if abs(_towards(first, seed, lower, upper) - seed) <= abs(_towards(second, seed, lower, upper) - seed) else second
+
+def _subproblem_1_float(axis: tuple, p: tuple, q: tuple) -> float:
+    p_axial, q_axial = _dot(p, axis), _dot(q, axis)
+    p = (p[0] - p_axial * axis[0], p[1] - p_axial * axis[1], p[2] - p_axial * axis[2])
+    q = (q[0] - q_axial * axis[0], q[1] - q_axial * axis[1], q[2] - q_axial * axis[2])
+    return atan2(_dot(_cross(p, q), axis), _dot(p, q))
+
+def _subproblem_3_float(axis: tuple, p: tuple, c: tuple, distance: float) -> Tuple[list, bool]:
+    # also tells whether the distance can be reached at all, the angles are the closest ones otherwise
+    axial = _dot(_sub(p, c), axis)
+    p_axial, c_axial = _dot(p, axis), _dot(c, axis)
+    p_plane = (p[0] - p_axial * axis[0], p[1] - p_axial * axis[1], p[2] - p_axial * axis[2])
+    c_plane = (c[0] - c_axial * axis[0], c[1] - c_axial * axis[1], c[2] - c_axial * axis[2])
+    base_angle = atan2(_dot(_cross(p_plane, c_plane), axis), _dot(p_plane, c_plane))
+    p_norm, c_norm = sqrt(_dot(p_plane, p_plane)), sqrt(_dot(c_plane, c_plane))
+    cos_offset = (p_norm ** 2 + c_norm ** 2 - (distance ** 2 - axial ** 2)) / max(2 * p_norm * c_norm, 1e-12)
+    offset = acos(min(max(cos_offset, -1.), 1.))
+    return [base_angle - offset, base_angle + offset], abs(cos_offset) <= 1
+
+def _subproblem_4_float(axis: tuple, p: tuple, h: tuple, d: float) -> Tuple[list, bool]:
+    # also tells whether there is an exact solution, see _subproblem_3_float
+    p_axial = _dot(p, axis)
+    a = _dot((p[0] - p_axial * axis[0], p[1] - p_axial * axis[1], p[2] - p_axial * axis[2]), h)
+    b = _dot(_cross(axis, p), h)
+    c = d - p_axial * _dot(axis, h)
+    base_angle = atan2(b, a)
+    cos_offset = c / max(hypot(a, b), 1e-12)
+    offset = acos(min(max(cos_offset, -1.), 1.))
+    return [base_angle - offset, base_angle + offset], abs(cos_offset) <= 1
+
+class IKSolver(ABC):
+    """
+    Abstract base class for inverse kinematics solvers, a robot uses one of these to turn end effector poses into joint angles, see Robot.set_ik_solver.
+    Solvers work on the robot's controlled joints and accept batches of targets.
+    """
+
+    def __init__(self, robot):
+        self.robot = robot
+
+    @abstractmethod
+    def solve(self, positions: np.ndarray, quaternions: np.ndarray=None, seeds: np.ndarray=None) -> np.ndarray:
+        """
+        Returns the angles of the controlled joints that bring the end effector to the given positions (N, 3) and orientations (N, 4), if quaternions is None only the position counts.
+        Seeds (N, number of controlled joints) are the configurations the solver starts from or looks for the closest solution to, defaults to the current joint angles for all targets.
+        Returns an (N, number of controlled joints) array, single targets of shape (3,) give a single configuration.
+        """
+        pass
+
+    def _prepare(self, positions: np.ndarray, quaternions: np.ndarray, seeds: np.ndarray) -> Tuple[np.ndarray, Union[np.ndarray, None], np.ndarray, bool]:
+        # brings the inputs of solve into batch form
+        positions = np.asarray(positions, dtype=np.float64)
+        single = positions.ndim == 1
+        positions = np.atleast_2d(positions)
+        if quaternions is not None:
+            quaternions = np.atleast_2d(np.asarray(quaternions, dtype=np.float64))
+            quaternions = quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)
+        if seeds is None:
+            seeds = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_group)[0]
+        seeds = np.broadcast_to(np.asarray(seeds, dtype=np.float64), (len(positions), len(self.robot.controlled_joints_ids))).copy()
+        return positions, quaternions, seeds, single
+
+class PybulletIK(IKSolver):
+    """
+    Pybullet's own iterative solver, solves one target at a time and always starts from the current state of the robot in the simulation, i.e. seeds are ignored.
+    """
+
+    def __init__(self, robot, max_iterations: int=100, threshold: float=1e-2):
+        super().__init__(robot)
+        self.max_iterations = max_iterations
+        self.threshold = threshold
+
+    def solve(self, positions: np.ndarray, quaternions: np.ndarray=None, seeds: np.ndarray=None) -> np.ndarray:
+        positions, quaternions, seeds, single = self._prepare(positions, quaternions, seeds)
+        joints = np.empty_like(seeds)
+        for idx, position in enumerate(positions):
+            # pybullet returns all movable joints
+            joints[idx] = pyb_u.solve_inverse_kinematics(
+                robot_id=self.robot.object_id,
+                link_id=self.robot.end_effector_link_id,
+                target_position=position,
+                target_orientation=quaternions[idx] if quaternions is not None else None,
+                max_iterations=self.max_iterations,
+                threshold=self.threshold
+            )[self.robot.indices_controlled]
+        return joints[0] if single else joints
+
+class _KinematicChain:
+    """
+    The controlled joints between the base and the end effector of a robot as screw motions in the world frame (product of exponentials):
+    end effector frame = exp(S_1 q_1) ... exp(S_m q_m) * end effector frame in the zero configuration.
+    Gives end effector frames and everything the Jacobian needs for batches of configurations with a handful of numpy calls,
+    where ForwardKinematics.link_frames goes through all links of the URDF one by one. Only valid for the base pose it was built with, see is_current.
+    """
+
+    def __init__(self, robot):
+        forward_kinematics = robot.get_forward_kinematics()
+        ee_idx = forward_kinematics.link_ids[robot.end_effector_link_id]
+        # controlled joints on the way from the base to the end effector, all others don't move it
+        chain = []
+        idx = ee_idx
+        while idx != -1:
+            if forward_kinematics.columns[idx] != -1:
+                chain.append(idx)
+            idx = forward_kinematics.parents[idx]
+        chain = chain[::-1]
+        assert len(chain), "[IKSolver] none of the controlled joints of robot " + robot.name + " moves its end effector"
+        frames = forward_kinematics.link_frames(np.zeros(len(forward_kinematics.joint_names)))
+        self.base = forward_kinematics.base
+        # per joint of the chain: input column, type, world axis and a point on it, all in the zero configuration
+        self.columns = np.array([forward_kinematics.columns[idx] for idx in chain], dtype=int)
+        self.types = [forward_kinematics.joint_types[idx] for idx in chain]
+        self.prismatic = np.array([joint_type == "prismatic" for joint_type in self.types])
+        self.axes = np.array([frames[idx, :3, :3] @ forward_kinematics.axes[idx] for idx in chain])
+        self.points = frames[chain, :3, 3]
+        self.ee_zero = frames[ee_idx]
+        self.any_prismatic = bool(self.prismatic.any())
+        # Rodrigues' formula for the rotations around the axes through the points, as 4x4 motions that are a linear combination of 1, sin and cos of the angle:
+        # (I + K^2) + sin * K - cos * K^2 with the translations p - R p, translations along the axes for prismatic joints
+        crosses = np.array([_cross_matrix(axis) for axis in self.axes]) * ~self.prismatic[:, None, None]
+        crosses_squared = crosses @ crosses
+        basis = np.zeros((len(chain), 3, 4, 4))
+        basis[:, 0] = np.eye(4)
+        basis[:, 0, :3, :3] += crosses_squared
+        basis[:, 0, :3, 3] = -np.einsum("mij,mj->mi", crosses_squared, self.points)
+        basis[:, 1, :3, :3] = crosses
+        basis[:, 1, :3, 3] = -np.einsum("mij,mj->mi", crosses, self.points)
+        basis[:, 2, :3] = -basis[:, 0, :3] + np.eye(4)[:3]
+        self.motion_basis = basis.reshape(len(chain), 3, 16)
+        self.translations = self.axes * self.prismatic[:, None]
+        # axes and points in homogeneous coordinates, a frame times this gives both of them moved
+        self.screws = np.zeros((len(chain), 4, 2))
+        self.screws[:, :3, 0] = self.axes
+        self.screws[:, :3, 1] = self.points
+        self.screws[:, 3, 1] = 1
+
+    def is_current(self, robot) -> bool:
+        # the forward kinematics get a new base frame whenever the robot is moved
+        return self.base is robot.get_forward_kinematics().base
+
+    def frames(self, angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For a batch of angles of the chain's joints (N, m), returns the motions accumulated up to and including each joint (N, m, 4, 4) and the end effector frames (N, 4, 4).
+        The accumulated motion of a joint takes its axis and point from the zero configuration to where they are in the given configuration.
+        """
+        num, length = angles.shape
+        trigonometry = np.sin(angles[..., None] * _TRIGONOMETRY_SCALES + _TRIGONOMETRY_PHASES)
+        motions = (trigonometry[..., None, :] @ self.motion_basis).reshape(num, length, 4, 4)
+        if self.any_prismatic:
+            motions[..., :3, 3] += angles[..., None] * self.translations
+        accumulated = np.empty_like(motions)
+        accumulated[:, 0] = motions[:, 0]
+        for idx in range(1, length):
+            np.matmul(accumulated[:, idx - 1], motions[:, idx], out=accumulated[:, idx])
+        return accumulated, accumulated[:, -1] @ self.ee_zero
+
+    def jacobians(self, frames: np.ndarray, ee_positions: np.ndarray, rotation: bool=True) -> np.ndarray:
+        """
+        Geometric Jacobians (..., 6 or 3, m) from the accumulated motions (..., m, 4, 4) and end effector positions (..., 3) given by frames.
+        """
+        screws = frames @ self.screws
+        axes = screws[..., :3, 0]
+        arms = ee_positions[..., None, :] - screws[..., :3, 1]
+        linear = (axes[..., :, None] * arms[..., None, :]).reshape(axes.shape[:-1] + (9,)) @ _LEVI_CIVITA
+        if self.any_prismatic:
+            linear[..., self.prismatic, :] = axes[..., self.prismatic, :]
+            axes = axes * ~self.prismatic[:, None]
+        return np.swapaxes(np.concatenate((linear, axes), axis=-1) if rotation else linear, -1, -2)
+
+class DampedLeastSquaresIK(IKSolver):
+    """
+    Iterative solver based on the robot's kinematic chain, works for any robot and solves whole batches of targets at once without touching the simulation.
+    Every iteration steps along the damped least squares solution of the Jacobian. The damping grows with the remaining error (Levenberg-Marquardt style),
+    which keeps the steps sane far from the target and near singularities while still converging fast close to the target.
+    Starting from the current joint angles (or the seeds), targets close to the current pose like the ones in control mode 0 only need a few iterations.
+    Unreachable targets result in the configuration that got closest, the iterations stop once they barely get any closer.
+    """
+
+    def __init__(self, robot, max_iterations: int=100, damping: float=1, max_step: float=0.5, position_threshold: float=1e-4, rotation_threshold: float=1e-3, min_improvement: float=1e-2):
+        super().__init__(robot)
+        self.max_iterations = max_iterations
+        # multiplier for the squared error that makes up the damping
+        self.damping = damping
+        # maximum change of a joint angle per iteration
+        self.max_step = max_step
+        self.position_threshold = position_threshold
+        self.rotation_threshold = rotation_threshold
+        # targets whose squared error shrinks by less than this fraction in an iteration are given up on, this is what happens with unreachable targets
+        self.min_improvement = min_improvement
+        # the joints that move the end effector, built on the first solve and whenever the robot's base moved
+        self._chain = None
+
+    def _get_chain(self) -> _KinematicChain:
+        if self._chain is None or not self._chain.is_current(self.robot):
+            self._chain = _KinematicChain(self.robot)
+        return self._chain
+
+    def solve(self, positions: np.ndarray, quaternions: np.ndarray=None, seeds: np.ndarray=None) -> np.ndarray:
+        if np.ndim(positions) == 1:
+            return self._solve_single(positions, quaternions, seeds)
+        positions, quaternions, seeds, single = self._prepare(positions, quaternions, seeds)
+        chain = self._get_chain()
+        lower, upper = self.robot.joints_limits_lower[chain.columns], self.robot.joints_limits_upper[chain.columns]
+        target_rotations = quaternions_to_matrices(quaternions) if quaternions is not None else None
+        dims = 6 if quaternions is not None else 3
+        identity = np.eye(dims)
+        position_threshold, rotation_threshold = self.position_threshold ** 2, self.rotation_threshold ** 2
+        max_improvement = 1 - self.min_improvement
+
+        joints = np.clip(seeds, self.robot.joints_limits_lower, self.robot.joints_limits_upper)
+        # only the joints of the chain change, the others can't move the end effector
+        angles = joints[:, chain.columns]
+        # only the targets that haven't converged or stalled yet are iterated on
+        active = np.arange(len(angles))
+        previous_errors = np.full(len(angles), np.inf)
+        previous_angles = angles.copy()
+        previous_frames, previous_ee_frames, previous_step_errors = None, None, None
+        scales = np.ones(len(angles))
+        for iteration in range(self.max_iterations + 1):
+            frames, ee_frames = chain.frames(angles[active])
+            errors = np.empty((len(active), dims))
+            errors[:, :3] = positions[active] - ee_frames[:, :3, 3]
+            if quaternions is not None:
+                errors[:, 3:] = self._rotation_vectors(target_rotations[active] @ np.swapaxes(ee_frames[:, :3, :3], -1, -2))
+            squared_errors = np.einsum("ij,ij->i", errors, errors)
+            # a step that made things worse is taken back and tried again with ten times the damping, i.e. a shorter step closer to the gradient
+            worse = squared_errors > previous_errors[active]
+            if worse.any():
+                angles[active[worse]] = previous_angles[active[worse]]
+                frames[worse], ee_frames[worse], errors[worse], squared_errors[worse] = previous_frames[worse], previous_ee_frames[worse], previous_step_errors[worse], previous_errors[active[worse]]
+                scales[active[worse]] *= 10
+            done = np.einsum("ij,ij->i", errors[:, :3], errors[:, :3]) < position_threshold
+            if quaternions is not None:
+                done &= np.einsum("ij,ij->i", errors[:, 3:], errors[:, 3:]) < rotation_threshold
+            done |= (squared_errors > max_improvement * previous_errors[active]) & ~worse
+            done |= scales[active] > 1e6
+            if done.any():
+                keep = ~done
+                active, frames, ee_frames, errors, squared_errors = active[keep], frames[keep], ee_frames[keep], errors[keep], squared_errors[keep]
+            if not len(active) or iteration == self.max_iterations:
+                break
+            previous_errors[active] = squared_errors
+            previous_angles[active] = angles[active]
+            previous_frames, previous_ee_frames, previous_step_errors = frames, ee_frames, errors
+
+            jacobian = chain.jacobians(frames, ee_frames[:, :3, 3], quaternions is not None)
+
+            # dq = J^T (J J^T + lambda^2 I)^-1 e, with a small constant part in lambda^2 that keeps the system solvable at singularities
+            jacobian_t = np.swapaxes(jacobian, -1, -2)
+            damping = (self.damping * scales[active] * squared_errors + 1e-6)[:, None, None] * identity
+            steps = (jacobian_t @ np.linalg.solve(jacobian @ jacobian_t + damping, errors[..., None]))[..., 0]
+            largest = np.max(np.abs(steps), axis=1, keepdims=True)
+            steps *= np.minimum(1, self.max_step / np.maximum(largest, 1e-12))
+            angles[active] = np.clip(angles[active] + steps, lower, upper)
+        joints[:, chain.columns] = angles
+        return joints[0] if single else joints
+
+    def _solve_single(self, position: np.ndarray, quaternion: np.ndarray, seed: np.ndarray) -> np.ndarray:
+        """
+        Same iterations as solve for a single target, without the bookkeeping for batches and with the checks on floats,
+        which makes up most of the time for one target.
+        """
+        chain = self._get_chain()
+        if seed is None:
+            seed = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_group)[0]
+        px, py, pz = position.tolist() if type(position) is np.ndarray else [float(value) for value in position]
+        lower, upper = self.robot.joints_limits_lower[chain.columns], self.robot.joints_limits_upper[chain.columns]
+        if quaternion is not None:
+            target_rotation = _quaternion_matrix(quaternion)
+        dims = 6 if quaternion is not None else 3
+        position_threshold, rotation_threshold = self.position_threshold ** 2, self.rotation_threshold ** 2
+        max_improvement = 1 - self.min_improvement
+
+        joints = np.clip(np.asarray(seed, dtype=np.float64), self.robot.joints_limits_lower, self.robot.joints_limits_upper)
+        angles = joints[chain.columns]
+        previous_error, previous_angles, previous = np.inf, angles, None
+        scale = 1.
+        for iteration in range(self.max_iterations + 1):
+            frames, ee_frame = chain.frames(angles[None])
+            frames, ee_frame = frames[0], ee_frame[0]
+            x, y, z = ee_frame[:3, 3].tolist()
+            error = [px - x, py - y, pz - z]
+            position_error = error[0] ** 2 + error[1] ** 2 + error[2] ** 2
+            rotation_error = 0.
+            if quaternion is not None:
+                error += _rotation_vector(_mat_mul_t(target_rotation, ee_frame[:3, :3].ravel().tolist()))
+                rotation_error = error[3] ** 2 + error[4] ** 2 + error[5] ** 2
+            squared_error = position_error + rotation_error
+            worse = squared_error > previous_error
+            if worse:
+                angles, (frames, ee_frame, error, position_error, rotation_error), squared_error = previous_angles, previous, previous_error
+                scale *= 10
+            if (position_error < position_threshold and rotation_error < rotation_threshold) or (squared_error > max_improvement * previous_error and not worse) or scale > 1e6:
+                break
+            if iteration == self.max_iterations:
+                break
+            previous_error, previous_angles, previous = squared_error, angles, (frames, ee_frame, error, position_error, rotation_error)
+
+            jacobian = chain.jacobians(frames, ee_frame[:3, 3], quaternion is not None)
+            system = jacobian @ jacobian.T
+            system.flat[::dims + 1] += self.damping * scale * squared_error + 1e-6
+            step = jacobian.T @ np.linalg.solve(system, error)
+            largest = np.abs(step).max()
+            if largest > self.max_step:
+                step *= self.max_step / largest
+            angles = np.minimum(np.maximum(angles + step, lower), upper)
+        joints[chain.columns] = angles
+        return joints
+
+    @staticmethod
+    def _rotation_vectors(matrices: np.ndarray) -> np.ndarray:
+        # axis times angle of a batch of rotation matrices
+        skew = np.stack([matrices[:, 2, 1] - matrices[:, 1, 2], matrices[:, 0, 2] - matrices[:, 2, 0], matrices[:, 1, 0] - matrices[:, 0, 1]], axis=1) / 2
+        sin = np.linalg.norm(skew, axis=1)
+        cos = (np.trace(matrices, axis1=1, axis2=2) - 1) / 2
+        angles = np.arctan2(sin, cos)
+        vectors = skew * (angles / np.maximum(sin, 1e-12))[:, None]
+        # close to 180 degrees the skew part says nothing about the axis, the quaternion does
+        flipped = (sin < 1e-6) & (cos < 0)
+        if np.any(flipped):
+            quats = matrices_to_quaternions(matrices[flipped])
+            vectors[flipped] = quats[:, :3] / np.linalg.norm(quats[:, :3], axis=1, keepdims=True) * angles[flipped, None]
+        return vectors
+
+class AnalyticIK(IKSolver):
+    """
+    Closed form solver for 6 DoF arms with a spherical wrist (last three axes meet in one point, e.g. KR16, KR120, KR3)
+    or with three parallel axes in the middle followed by two intersecting ones (e.g. UR5).
+    Computes all (up to 8) solutions per target from the robot's geometry and returns the valid one closest to the seed, so the robot doesn't jump between configurations.
+    Single targets, like the ones of control mode 0, first try only the branch the seed is on with plain float math, which is a lot cheaper than numpy for one target.
+    Targets without orientation and targets that no solution reaches within the thresholds are left to a damped least squares solver.
+    """
+
+    def __init__(self, robot, position_threshold: float=1e-4, rotation_threshold: float=1e-3, fallback_config: dict={}):
+        super().__init__(robot)
+        self.position_threshold = position_threshold
+        self.rotation_threshold = rotation_threshold
+        self.fallback = DampedLeastSquaresIK(robot, **fallback_config)
+        # robot geometry, depends on the base pose, see below
+        self._geometry = None
+        self._geometry_chain = None
+
+    def _get_geometry(self) -> dict:
+        """
+        Joint axes and points on them in the zero configuration, the end effector frame in the zero configuration and which kind of arm this is.
+        Comes from the kinematic chain of the fallback solver and gets rebuilt along with it whenever the base of the robot moved.
+        """
+        chain = self.fallback._get_chain()
+        if self._geometry_chain is chain:
+            return self._geometry
+        assert len(self.robot.controlled_joints_ids) == 6, "[AnalyticIK] robot " + self.robot.name + " needs exactly 6 controlled joints"
+        # the controlled joints must be exactly the movable joints between base and end effector, in that order
+        assert list(chain.columns) == list(range(6)), "[AnalyticIK] the controlled joints of robot " + self.robot.name + " must form its arm"
+        assert all(joint_type in ["revolute", "continuous"] for joint_type in chain.types), "[AnalyticIK] robot " + self.robot.name + " has prismatic joints"
+        axes, points = chain.axes, chain.points
+
+        geometry = {"axes": axes, "points": points, "ee": chain.ee_zero, "ee_inv": np.linalg.inv(chain.ee_zero)}
+        wrist_center = self._intersection(axes[3], points[3], axes[4], points[4])
+        if self._parallel(axes[1], axes[2]) and wrist_center is not None and self._on_axis(wrist_center, axes[5], points[5]):
+            geometry["type"] = "spherical_wrist"
+            geometry["wrist_center"] = wrist_center
+        elif self._parallel(axes[1], axes[2]) and self._parallel(axes[1], axes[3]) and self._intersection(axes[4], points[4], axes[5], points[5]) is not None:
+            geometry["type"] = "parallel"
+            geometry["wrist_point"] = self._intersection(axes[4], points[4], axes[5], points[5])
+        else:
+            raise Exception("[AnalyticIK] robot " + self.robot.name + " has neither a spherical wrist nor three parallel axes, use the DampedLeastSquares solver instead")
+        assert not self._parallel(axes[0], axes[1]), "[AnalyticIK] the first two axes of robot " + self.robot.name + " must not be parallel"
+        # everything the single target solver needs as plain floats, matrices as row major 9-tuples
+        geometry["floats"] = {
+            "axes": [tuple(axis.tolist()) for axis in axes],
+            "points": [tuple(point.tolist()) for point in points],
+            "crosses": [tuple(_cross_matrix(axis).ravel().tolist()) for axis in axes],
+            "crosses_squared": [tuple((_cross_matrix(axis) @ _cross_matrix(axis)).ravel().tolist()) for axis in axes],
+            "ee_rotation": tuple(chain.ee_zero[:3, :3].ravel().tolist()),
+            "ee_position": tuple(chain.ee_zero[:3, 3].tolist()),
+            "wrist": tuple((geometry["wrist_center"] if geometry["type"] == "spherical_wrist" else geometry["wrist_point"]).tolist()),
+            "reference": tuple(self._perpendicular(axes[1] if geometry["type"] == "parallel" else axes[5]).tolist()),
+            "signs": tuple(np.sign(axes[1:4] @ axes[1]).tolist()),
+            "lower": self.robot.joints_limits_lower.tolist(),
+            "upper": self.robot.joints_limits_upper.tolist()
+        }
+        self._geometry = geometry
+        self._geometry_chain = chain
+        return geometry
+
+    def solve(self, positions: np.ndarray, quaternions: np.ndarray=None, seeds: np.ndarray=None) -> np.ndarray:
+        if quaternions is not None and np.ndim(positions) == 1:
+            joints = self._solve_single(positions, quaternions, seeds)
+            if joints is not None:
+                return joints
+        positions, quaternions, seeds, single = self._prepare(positions, quaternions, seeds)
+        if quaternions is None:
+            joints = self.fallback.solve(positions, None, seeds)
+            return joints[0] if single else joints
+        geometry = self._get_geometry()
+        num = len(positions)
+
+        targets = np.broadcast_to(np.eye(4), (num, 4, 4)).copy()
+        targets[:, :3, :3] = quaternions_to_matrices(quaternions)
+        targets[:, :3, 3] = positions
+        # the transform of the joints: target = e^(S1 t1) ... e^(S6 t6) ee_zero
+        motions = targets @ geometry["ee_inv"]
+        if geometry["type"] == "spherical_wrist":
+            candidates = self._solve_spherical_wrist(geometry, motions)
+        else:
+            candidates = self._solve_parallel(geometry, motions)
+
+        # bring the angles as close to the seeds as the limits allow, then keep the solutions that actually reach the target
+        lower, upper = self.robot.joints_limits_lower, self.robot.joints_limits_upper
+        candidates = candidates.reshape(num, -1, 6)
+        candidates = seeds[:, None] + (candidates - seeds[:, None] + np.pi) % (2 * np.pi) - np.pi
+        candidates = np.where(candidates > upper, candidates - 2 * np.pi, candidates)
+        candidates = np.where(candidates < lower, candidates + 2 * np.pi, candidates)
+        candidates = np.clip(candidates, lower, upper)
+        frames = self.fallback._get_chain().frames(candidates.reshape(-1, 6))[1].reshape(num, -1, 4, 4)
+        position_errors = np.linalg.norm(frames[..., :3, 3] - positions[:, None], axis=-1)
+        rotation_errors = np.linalg.norm(DampedLeastSquaresIK._rotation_vectors((targets[:, None, :3, :3] @ np.swapaxes(frames[..., :3, :3], -1, -2)).reshape(-1, 3, 3)), axis=-1).reshape(num, -1)
+        valid = (position_errors < self.position_threshold) & (rotation_errors < self.rotation_threshold)
+        seed_distances = np.linalg.norm(candidates - seeds[:, None], axis=-1)
+        distances = np.where(valid, seed_distances, np.inf)
+        joints = candidates[np.arange(num), np.argmin(distances, axis=1)]
+
+        unsolved = ~np.any(valid, axis=1)
+        if np.any(unsolved):
+            # the fallback starts from the candidate closest to the seed, which usually has most of the way behind it already
+            closest = candidates[np.arange(num), np.argmin(seed_distances, axis=1)]
+            joints[unsolved] = self.fallback.solve(positions[unsolved], quaternions[unsolved], closest[unsolved])
+        return joints[0] if single else joints
+
+    def _solve_single(self, position: np.ndarray, quaternion: np.ndarray, seed: np.ndarray) -> Union[np.ndarray, None]:
+        """
+        Solves a single target on the branch of the seed only: wherever a subproblem has two solutions, the one closer to the seed's angle is taken.
+        All math is done on floats, for one target this is several times faster than going through numpy.
+        Returns None if the result doesn't reach the target within the thresholds or moves a joint by more than 90 degrees,
+        in which case the batch solver should have a look at all branches.
+        """
+        geometry = self._get_geometry()
+        floats = geometry["floats"]
+        if seed is None:
+            seed = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_group)[0]
+        seed = seed.tolist() if type(seed) is np.ndarray else [float(angle) for angle in seed]
+        px, py, pz = position.tolist() if type(position) is np.ndarray else [float(value) for value in position]
+        target_rotation = _quaternion_matrix(quaternion)
+        # the transform of the joints: target = e^(S1 t1) ... e^(S6 t6) ee_zero
+        motion_rotation = _mat_mul_t(target_rotation, floats["ee_rotation"])
+        motion_translation = _sub((px, py, pz), _mat_vec(motion_rotation, floats["ee_position"]))
+        if geometry["type"] == "spherical_wrist":
+            angles, exact = self._solve_single_spherical_wrist(floats, motion_rotation, motion_translation, seed)
+        else:
+            angles, exact = self._solve_single_parallel(floats, motion_rotation, motion_translation, seed)
+
+        # same as for the batches: as close to the seed as the limits allow
+        for idx in range(6):
+            angle = _towards(angles[idx], seed[idx], floats["lower"][idx], floats["upper"][idx])
+            if abs(angle - seed[idx]) > pi / 2:
+                return None
+            # anything but full turns means the angle got clipped to the limits
+            exact = exact and abs((angle - angles[idx] + pi) % (2 * pi) - pi) < 1e-9
+            angles[idx] = angle
+        # exact solutions of all subproblems within the limits reach the target by construction, only everything else needs a look
+        if exact:
+            return np.array(angles)
+
+        # end effector pose of the result: R = R1 ... R6 R_ee, p = e^(S1 t1) ... e^(S6 t6) p_ee
+        rotations = [_rodrigues(floats["crosses"][idx], floats["crosses_squared"][idx], angles[idx]) for idx in range(6)]
+        rotation = floats["ee_rotation"]
+        ee_position = floats["ee_position"]
+        for idx in range(5, -1, -1):
+            rotation = _mat_mul(rotations[idx], rotation)
+            point = floats["points"][idx]
+            ee_position = _add(_mat_vec(rotations[idx], _sub(ee_position, point)), point)
+        error = _sub(ee_position, (px, py, pz))
+        if error[0] * error[0] + error[1] * error[1] + error[2] * error[2] >= self.position_threshold ** 2:
+            return None
+        # angle of target * R^T
+        difference = _mat_mul_t(target_rotation, rotation)
+        sin_angle = sqrt((difference[7] - difference[5]) ** 2 + (difference[2] - difference[6]) ** 2 + (difference[3] - difference[1]) ** 2) / 2
+        cos_angle = (difference[0] + difference[4] + difference[8] - 1) / 2
+        if atan2(sin_angle, cos_angle) >= self.rotation_threshold:
+            return None
+        return np.array(angles)
+
+    def _solve_single_spherical_wrist(self, floats: dict, motion_rotation: tuple, motion_translation: tuple, seed: list) -> Tuple[list, bool]:
+        # float version of _solve_spherical_wrist for the branch of the seed, also tells whether all subproblems had an exact solution
+        axes, points, crosses, crosses_squared = floats["axes"], floats["points"], floats["crosses"], floats["crosses_squared"]
+        wrist_center = floats["wrist"]
+        lower, upper = floats["lower"], floats["upper"]
+        wrist_target = _add(_mat_vec(motion_rotation, wrist_center), motion_translation)
+
+        angles_1, exact_1 = _subproblem_4_float(axes[0], _sub(wrist_target, points[0]), axes[1], _dot(axes[1], _sub(wrist_center, points[0])))
+        theta_1 = _closest([-angle for angle in angles_1], seed[0], lower[0], upper[0])
+        rotation_1 = _rodrigues(crosses[0], crosses_squared[0], theta_1)
+        local_target = _add(_mat_t_vec(rotation_1, _sub(wrist_target, points[0])), points[0])
+
+        local_arm = _sub(local_target, points[1])
+        angles_3, exact_3 = _subproblem_3_float(axes[2], _sub(wrist_center, points[2]), _sub(points[1], points[2]), sqrt(_dot(local_arm, local_arm)))
+        theta_3 = _closest(angles_3, seed[2], lower[2], upper[2])
+        rotation_3 = _rodrigues(crosses[2], crosses_squared[2], theta_3)
+        moved_center = _add(_mat_vec(rotation_3, _sub(wrist_center, points[2])), points[2])
+        theta_2 = _subproblem_1_float(axes[1], _sub(moved_center, points[1]), local_arm)
+        rotation_2 = _rodrigues(crosses[1], crosses_squared[1], theta_2)
+
+        # what's left for the wrist: R4 R5 R6 = (R1 R2 R3)^T R_motion
+        wrist_rotation = _mat_t_mul(_mat_mul(_mat_mul(rotation_1, rotation_2), rotation_3), motion_rotation)
+        moved_axis = _mat_vec(wrist_rotation, axes[5])
+        angles_5, exact_5 = _subproblem_4_float(axes[4], axes[5], axes[3], _dot(moved_axis, axes[3]))
+        theta_5 = _closest(angles_5, seed[4], lower[4], upper[4])
+        rotation_5 = _rodrigues(crosses[4], crosses_squared[4], theta_5)
+        theta_4 = _subproblem_1_float(axes[3], _mat_vec(rotation_5, axes[5]), moved_axis)
+        rotation_4 = _rodrigues(crosses[3], crosses_squared[3], theta_4)
+        reference = floats["reference"]
+        theta_6 = _subproblem_1_float(axes[5], reference, _mat_t_vec(_mat_mul(rotation_4, rotation_5), _mat_vec(wrist_rotation, reference)))
+        return [theta_1, theta_2, theta_3, theta_4, theta_5, theta_6], exact_1 and exact_3 and exact_5
+
+    def _solve_single_parallel(self, floats: dict, motion_rotation: tuple, motion_translation: tuple, seed: list) -> Tuple[list, bool]:
+        # float version of _solve_parallel for the branch of the seed, see _solve_single_spherical_wrist
+        axes, points, crosses, crosses_squared = floats["axes"], floats["points"], floats["crosses"], floats["crosses_squared"]
+        wrist_point = floats["wrist"]
+        direction = axes[1]
+        signs = floats["signs"]
+        lower, upper = floats["lower"], floats["upper"]
+
+        moved_point = _add(_mat_vec(motion_rotation, wrist_point), motion_translation)
+        angles_1, exact_1 = _subproblem_4_float(axes[0], _sub(moved_point, points[0]), direction, _dot(direction, _sub(wrist_point, points[0])))
+        theta_1 = _closest([-angle for angle in angles_1], seed[0], lower[0], upper[0])
+        rotation_1 = _rodrigues(crosses[0], crosses_squared[0], theta_1)
+        remaining = _mat_t_mul(rotation_1, motion_rotation)
+
+        angles_5, exact_5 = _subproblem_4_float(axes[4], axes[5], direction, _dot(_mat_vec(remaining, axes[5]), direction))
+        theta_5 = _closest(angles_5, seed[4], lower[4], upper[4])
+        rotation_5 = _rodrigues(crosses[4], crosses_squared[4], theta_5)
+        theta_6 = _subproblem_1_float(axes[5], _mat_t_vec(remaining, direction), _mat_t_vec(rotation_5, direction))
+        rotation_6 = _rodrigues(crosses[5], crosses_squared[5], theta_6)
+        reference = floats["reference"]
+        theta_sum = _subproblem_1_float(direction, reference, _mat_vec(remaining, _mat_t_vec(rotation_6, _mat_t_vec(rotation_5, reference))))
+
+        # the point on axis 4, moved back through joints 5 and 6, the motion and joint 1 (rotations by minus the angle are the transposed ones)
+        target = _add(_mat_t_vec(rotation_5, _sub(points[3], points[4])), points[4])
+        target = _add(_mat_t_vec(rotation_6, _sub(target, points[5])), points[5])
+        target = _add(_mat_vec(motion_rotation, target), motion_translation)
+        target = _add(_mat_t_vec(rotation_1, _sub(target, points[0])), points[0])
+        arm = _sub(target, points[1])
+        angles_3, exact_3 = _subproblem_3_float(axes[2], _sub(points[3], points[2]), _sub(points[1], points[2]), sqrt(_dot(arm, arm)))
+        theta_3 = _closest(angles_3, seed[2], lower[2], upper[2])
+        moved_point = _add(_mat_vec(_rodrigues(crosses[2], crosses_squared[2], theta_3), _sub(points[3], points[2])), points[2])
+        theta_2 = _subproblem_1_float(axes[1], _sub(moved_point, points[1]), arm)
+        theta_4 = signs[2] * (theta_sum - signs[0] * theta_2 - signs[1] * theta_3)
+        return [theta_1, theta_2, theta_3, theta_4, theta_5, theta_6], exact_1 and exact_3 and exact_5
+
+    def _solve_spherical_wrist(self, geometry: dict, motions: np.ndarray) -> np.ndarray:
+        """
+        Returns (N, 8, 6) candidates. The wrist center only depends on the first three joints, the last three then take care of the orientation.
+        """
+        axes, points = geometry["axes"], geometry["points"]
+        wrist_center = geometry["wrist_center"]
+        num = len(motions)
+        # target position of the wrist center, the last three rotations don't move it
+        wrist_target = motions[:, :3, :3] @ wrist_center + motions[:, :3, 3]
+
+        # joint 1 has to rotate the wrist center into the plane in which joints 2 and 3 move it, which is perpendicular to their axes
+        theta_1 = -self._subproblem_4(axes[0], wrist_target - points[0], axes[1], axes[1] @ (wrist_center - points[0]))  # (N, 2)
+        wrist_target = np.repeat(wrist_target, 2, axis=0)
+        theta_1 = theta_1.reshape(-1)
+        rotations_1 = self._rotations(axes[0], theta_1)
+        local_target = np.einsum("nji,nj->ni", rotations_1, wrist_target - points[0]) + points[0]
+
+        # joint 3 sets the distance between joint 2 and the wrist center, joint 2 then rotates the wrist center into place
+        theta_3 = self._subproblem_3(axes[2], wrist_center - points[2], points[1] - points[2], np.linalg.norm(local_target - points[1], axis=-1)).reshape(-1)
+        theta_1, rotations_1, local_target = np.repeat(theta_1, 2), np.repeat(rotations_1, 2, axis=0), np.repeat(local_target, 2, axis=0)
+        rotations_3 = self._rotations(axes[2], theta_3)
+        moved_center = rotations_3 @ (wrist_center - points[2]) + points[2]
+        theta_2 = self._subproblem_1(axes[1], moved_center - points[1], local_target - points[1])
+        rotations_2 = self._rotations(axes[1], theta_2)
+
+        # what's left for the wrist: R4 R5 R6 = (R1 R2 R3)^T R_motion
+        wrist_rotations = np.swapaxes(rotations_1 @ rotations_2 @ rotations_3, -1, -2) @ np.repeat(motions[:, :3, :3], 4, axis=0)
+        theta_4, theta_5, theta_6 = self._solve_wrist(axes[3], axes[4], axes[5], wrist_rotations)
+        repeat = lambda values: np.repeat(values, 2)
+        return np.stack([repeat(theta_1), repeat(theta_2), repeat(theta_3), theta_4, theta_5, theta_6], axis=-1).reshape(num, 8, 6)
+
+    def _solve_parallel(self, geometry: dict, motions: np.ndarray) -> np.ndarray:
+        """
+        Returns (N, 8, 6) candidates. Rotations around the three parallel axes don't change anything along their direction,
+        which gives joint 1 from the position and joint 5 from the orientation, joint 6 and the sum of the parallel joints follow, then the planar part.
+        """
+        axes, points = geometry["axes"], geometry["points"]
+        wrist_point = geometry["wrist_point"]
+        num = len(motions)
+        direction = axes[1]
+        signs = np.sign(axes[1:4] @ direction)
+
+        # joint 1: the point where axes 5 and 6 meet must keep its component along the parallel axes
+        moved_point = motions[:, :3, :3] @ wrist_point + motions[:, :3, 3]
+        theta_1 = -self._subproblem_4(axes[0], moved_point - points[0], direction, direction @ (wrist_point - points[0])).reshape(-1)
+        motions = np.repeat(motions, 2, axis=0)
+        rotations_1 = self._rotations(axes[0], theta_1)
+        # R1^T R_motion = R2 R3 R4 R5 R6
+        remaining = np.swapaxes(rotations_1, -1, -2) @ motions[:, :3, :3]
+
+        # joint 5: axis 6 is moved by joint 5 only as far as the direction of the parallel axes is concerned
+        theta_5 = self._subproblem_4(axes[4], np.broadcast_to(axes[5], (len(remaining), 3)), direction, (remaining @ axes[5]) @ direction).reshape(-1)
+        theta_1, rotations_1, motions, remaining = np.repeat(theta_1, 2), np.repeat(rotations_1, 2, axis=0), np.repeat(motions, 2, axis=0), np.repeat(remaining, 2, axis=0)
+        rotations_5 = self._rotations(axes[4], theta_5)
+
+        # joint 6: R6 R_remaining^T d = R5^T d, as R2 R3 R4 keep d as it is
+        theta_6 = self._subproblem_1(axes[5], np.swapaxes(remaining, -1, -2) @ direction, np.swapaxes(rotations_5, -1, -2) @ direction)
+        rotations_6 = self._rotations(axes[5], theta_6)
+        # sum of the parallel joints
+        parallel_rotations = remaining @ np.swapaxes(rotations_6, -1, -2) @ np.swapaxes(rotations_5, -1, -2)
+        reference = self._perpendicular(direction)
+        theta_sum = self._subproblem_1(direction, np.broadcast_to(reference, (len(remaining), 3)), parallel_rotations @ reference)
+
+        # the rigid transform of joints 2 to 4 moves the point on axis 4 just like joints 2 and 3 do
+        transforms = self._screw_transforms(axes[0], points[0], -theta_1) @ motions @ self._screw_transforms(axes[5], points[5], -theta_6) @ self._screw_transforms(axes[4], points[4], -theta_5)
+        target = transforms[:, :3, :3] @ points[3] + transforms[:, :3, 3]
+        theta_3 = self._subproblem_3(axes[2], points[3] - points[2], points[1] - points[2], np.linalg.norm(target - points[1], axis=-1)).reshape(-1)
+        theta_1, theta_5, theta_6, theta_sum, target = np.repeat(theta_1, 2), np.repeat(theta_5, 2), np.repeat(theta_6, 2), np.repeat(theta_sum, 2), np.repeat(target, 2, axis=0)
+        moved_point = self._rotations(axes[2], theta_3) @ (points[3] - points[2]) + points[2]
+        theta_2 = self._subproblem_1(axes[1], moved_point - points[1], target - points[1])
+        theta_4 = signs[2] * (theta_sum - signs[0] * theta_2 - signs[1] * theta_3)
+        return np.stack([theta_1, theta_2, theta_3, theta_4, theta_5, theta_6], axis=-1).reshape(num, 8, 6)
+
+    def _solve_wrist(self, axis_4: np.ndarray, axis_5: np.ndarray, axis_6: np.ndarray, rotations: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # angles with R4 R5 R6 = rotations for three axes through one point, two solutions per rotation, flattened
+        moved_axis = rotations @ axis_6
+        theta_5 = self._subproblem_4(axis_5, np.broadcast_to(axis_6, (len(rotations), 3)), axis_4, moved_axis @ axis_4).reshape(-1)
+        rotations, moved_axis = np.repeat(rotations, 2, axis=0), np.repeat(moved_axis, 2, axis=0)
+        rotations_5 = self._rotations(axis_5, theta_5)
+        theta_4 = self._subproblem_1(axis_4, rotations_5 @ axis_6, moved_axis)
+        rotations_4 = self._rotations(axis_4, theta_4)
+        reference = self._perpendicular(axis_6)
+        theta_6 = self._subproblem_1(axis_6, np.broadcast_to(reference, (len(rotations), 3)), np.swapaxes(rotations_4 @ rotations_5, -1, -2) @ rotations @ reference)
+        return theta_4, theta_5, theta_6
+
+    # geometric subproblems (Paden-Kahan), all vectors are relative to a point on the rotation axis, in case of no exact solution they give the closest one
+
+    @staticmethod
+    def _subproblem_1(axis: np.ndarray, p: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # angle that rotates p onto q around axis, (N, 3) -> (N,)
+        p = p - (p @ axis)[..., None] * axis
+        q = q - (q @ axis)[..., None] * axis
+        return np.arctan2(np.cross(p, q) @ axis, np.sum(p * q, axis=-1))
+
+    @staticmethod
+    def _subproblem_3(axis: np.ndarray, p: np.ndarray, c: np.ndarray, distance: np.ndarray) -> np.ndarray:
+        # angles that rotate p around axis such that it has the given distance to c, (N, 3) -> (N, 2)
+        p = np.broadcast_to(p, distance.shape + (3,))
+        c = np.broadcast_to(c, distance.shape + (3,))
+        axial = (p - c) @ axis
+        p_plane = p - (p @ axis)[..., None] * axis
+        c_plane = c - (c @ axis)[..., None] * axis
+        base_angle = np.arctan2(np.cross(p_plane, c_plane) @ axis, np.sum(p_plane * c_plane, axis=-1))
+        p_norm, c_norm = np.linalg.norm(p_plane, axis=-1), np.linalg.norm(c_plane, axis=-1)
+        cos = (p_norm ** 2 + c_norm ** 2 - (distance ** 2 - axial ** 2)) / np.maximum(2 * p_norm * c_norm, 1e-12)
+        offset = np.arccos(np.clip(cos, -1, 1))
+        return np.stack([base_angle - offset, base_angle + offset], axis=-1)
+
+    @staticmethod
+    def _subproblem_4(axis: np.ndarray, p: np.ndarray, h: np.ndarray, d: np.ndarray) -> np.ndarray:
+        # angles that rotate p around axis such that its component along h is d, (N, 3) -> (N, 2)
+        a = (p - (p @ axis)[..., None] * axis) @ h
+        b = np.cross(axis, p) @ h
+        c = d - (p @ axis) * (axis @ h)
+        base_angle = np.arctan2(b, a)
+        offset = np.arccos(np.clip(c / np.maximum(np.hypot(a, b), 1e-12), -1, 1))
+        return np.stack([base_angle - offset, base_angle + offset], axis=-1)
+
+    @staticmethod
+    def _rotations(axis: np.ndarray, angles: np.ndarray) -> np.ndarray:
+        # rotation matrices around a unit axis for a batch of angles, Rodrigues' formula
+        cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+        return np.eye(3) + np.sin(angles)[:, None, None] * cross + (1 - np.cos(angles))[:, None, None] * (cross @ cross)
+
+    @classmethod
+    def _screw_transforms(cls, axis: np.ndarray, point: np.ndarray, angles: np.ndarray) -> np.ndarray:
+        # homogeneous transforms of rotations around an axis through point
+        transforms = np.broadcast_to(np.eye(4), (len(angles), 4, 4)).copy()
+        transforms[:, :3, :3] = cls._rotations(axis, angles)
+        transforms[:, :3, 3] = point - transforms[:, :3, :3] @ point
+        return transforms
+
+    @staticmethod
+    def _perpendicular(axis: np.ndarray) -> np.ndarray:
+        # some unit vector perpendicular to axis
+        other = np.eye(3)[np.argmin(np.abs(axis))]
+        perpendicular = np.cross(axis, other)
+        return perpendicular / np.linalg.norm(perpendicular)
+
+    @staticmethod
+    def _parallel(axis_a: np.ndarray, axis_b: np.ndarray) -> bool:
+        return np.linalg.norm(np.cross(axis_a, axis_b)) < 1e-6
+
+    @staticmethod
+    def _on_axis(point: np.ndarray, axis: np.ndarray, axis_point: np.ndarray) -> bool:
+        return np.linalg.norm(np.cross(point - axis_point, axis)) < 1e-6
+
+    @classmethod
+    def _intersection(cls, axis_a: np.ndarray, point_a: np.ndarray, axis_b: np.ndarray, point_b: np.ndarray) -> Union[np.ndarray, None]:
+        # point where two axes meet, None if they don't
+        if cls._parallel(axis_a, axis_b):
+            return point_a if cls._on_axis(point_a, axis_b, point_b) else None
+        # closest points of the two lines
+        offset = point_b - point_a
+        ab = axis_a @ axis_b
+        t_a = (offset @ axis_a - ab * (offset @ axis_b)) / (1 - ab ** 2)
+        t_b = (ab * (offset @ axis_a) - offset @ axis_b) / (1 - ab ** 2)
+        closest_a, closest_b = point_a + t_a * axis_a, point_b + t_b * axis_b
+        if np.linalg.norm(closest_a - closest_b) > 1e-6:
+            return None
+        return closest_a
@@ -0,0 +1,142 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+from typing import List, Tuple
+from modular_drl_env.util.quaternion_util import quaternions_to_matrices, matrices_to_quaternions
+
+__all__ = [
+    "ForwardKinematics"
+]
+
+def _origin_to_matrix(element) -> np.ndarray:
+    # homogeneous transform of an URDF origin tag, rpy are fixed axis rotations around x, y and z, in that order
+    matrix = np.eye(4)
+    if element is None:
+        return matrix
+    xyz = np.array([float(value) for value in element.get("xyz", "0 0 0").split()])
+    r, p, y = [float(value) for value in element.get("rpy", "0 0 0").split()]
+    rot_x = np.array([[1, 0, 0], [0, np.cos(r), -np.sin(r)], [0, np.sin(r), np.cos(r)]])
+    rot_y = np.array([[np.cos(p), 0, np.sin(p)], [0, 1, 0], [-np.sin(p), 0, np.cos(p)]])
+    rot_z = np.array([[np.cos(y), -np.sin(y), 0], [np.sin(y), np.cos(y), 0], [0, 0, 1]])
+    matrix[:3, :3] = rot_z @ rot_y @ rot_x
+    matrix[:3, 3] = xyz
+    return matrix
+
+class ForwardKinematics:
+    """
+    Forward kinematics of a robot computed with numpy from its URDF, without touching the simulation.
+    Computes the frames of all links for a whole batch of joint configurations in one go, which is a lot faster than moving the robot
+    in pybullet and asking for link states once many configurations have to be evaluated, e.g. when sampling targets or checking a robot's skeleton.
+    The link frames are the same as the ones pybullet reports as world link frames (what pyb_u.get_link_state returns).
+    Supports revolute, continuous, prismatic and fixed joints, which covers all predefined robots.
+    """
+
+    def __init__(self, urdf_path: str, joint_names: List[str], base_position: np.ndarray=np.zeros(3), base_orientation: np.ndarray=np.array([0, 0, 0, 1]), default_joints: dict={}, scale: float=1):
+        """
+        joint_names are the joints whose angles make up the input configurations, in that order.
+        All other movable joints stay at their angle in default_joints (joint name -> angle) or at 0.
+        """
+        root = ET.parse(urdf_path).getroot()
+        joints = root.findall("joint")
+        child_links = set(joint.find("child").get("link") for joint in joints)
+        root_links = [link.get("name") for link in root.findall("link") if link.get("name") not in child_links]
+        assert len(root_links) == 1, "[ForwardKinematics] URDF " + urdf_path + " must have exactly one root link"
+
+        self.joint_names = list(joint_names)
+        # the base link comes first, all others follow in an order in which every parent comes before its children
+        self.link_names = root_links
+        # per link: index of the parent link, fixed transform from the parent's frame to the joint frame, joint type, axis and column in the input
+        self.parents = [-1]
+        self.origins = [np.eye(4)]
+        self.joint_types = ["fixed"]
+        self.axes = [np.zeros(3)]
+        self.columns = [-1]
+        self.defaults = [0.]
+        remaining = list(joints)
+        while remaining:
+            added = False
+            for joint in list(remaining):
+                parent = joint.find("parent").get("link")
+                if parent not in self.link_names:
+                    continue
+                remaining.remove(joint)
+                added = True
+                name = joint.get("name")
+                origin = _origin_to_matrix(joint.find("origin"))
+                origin[:3, 3] *= scale
+                axis = joint.find("axis")
+                self.link_names.append(joint.find("child").get("link"))
+                self.parents.append(self.link_names.index(parent))
+                self.origins.append(origin)
+                self.joint_types.append(joint.get("type"))
+                self.axes.append(np.array([float(value) for value in axis.get("xyz").split()]) if axis is not None else np.array([1., 0, 0]))
+                self.columns.append(self.joint_names.index(name) if name in self.joint_names else -1)
+                self.defaults.append(default_joints[name] if name in default_joints else 0.)
+            assert added, "[ForwardKinematics] URDF " + urdf_path + " has joints that aren't connected to the root link"
+        for joint_type in self.joint_types:
+            assert joint_type in ["fixed", "revolute", "continuous", "prismatic"], "[ForwardKinematics] unsupported joint type " + joint_type
+        for name in self.joint_names:
+            assert name in [joint.get("name") for joint in joints], "[ForwardKinematics] unknown joint " + name
+        self.origins = np.array(self.origins)
+        self.axes = np.array([axis / np.linalg.norm(axis) if np.any(axis) else axis for axis in self.axes])
+        # everything link_frames needs to compute the motions of all joints at once:
+        # cross product matrices of the rotation axes (zero for all other joints) and their squares for Rodrigues' formula, translation axes of prismatic joints
+        revolute = np.array([joint_type in ["revolute", "continuous"] for joint_type in self.joint_types])
+        prismatic = np.array([joint_type == "prismatic" for joint_type in self.joint_types])
+        self._crosses = np.array([[[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]] for axis in self.axes]) * revolute[:, None, None]
+        self._crosses_squared = self._crosses @ self._crosses
+        self._translations = self.axes * prismatic[:, None]
+        # angles of the joints that are not part of the input, fixed joints stay at 0 and thus don't move
+        self._defaults = np.array([default if joint_type != "fixed" else 0. for default, joint_type in zip(self.defaults, self.joint_types)])
+        self._input_links = np.array([idx for idx, column in enumerate(self.columns) if column != -1], dtype=int)
+        self._input_columns = np.array([self.columns[idx] for idx in self._input_links], dtype=int)
+        self.link_ids = {name: idx for idx, name in enumerate(self.link_names)}
+
+        self.set_base(base_position, base_orientation)
+
+    def set_base(self, base_position: np.ndarray, base_orientation: np.ndarray):
+        """
+        Sets the pose of the base link in the world, e.g. after the robot was moved.
+        """
+        self.base = np.eye(4)
+        self.base[:3, :3] = quaternions_to_matrices(np.array(base_orientation, dtype=np.float64))
+        self.base[:3, 3] = base_position
+
+    def link_frames(self, joints: np.ndarray, links: List[str]=None) -> np.ndarray:
+        """
+        Returns the homogeneous world frames of the given links (all links in the order of self.link_names by default)
+        for a batch of configurations (N, len(joint_names)) as an (N, len(links), 4, 4) array.
+        A single configuration gives a (len(links), 4, 4) array.
+        """
+        joints = np.asarray(joints, dtype=np.float64)
+        single = joints.ndim == 1
+        joints = np.atleast_2d(joints)
+        num = len(joints)
+        # the motion of every joint and with it the transform from each link's parent to the link, for all links in one go
+        values = np.repeat(self._defaults[None], num, axis=0)
+        values[:, self._input_links] = joints[:, self._input_columns]
+        motions = np.zeros((num, len(self.link_names), 4, 4))
+        motions[..., :3, :3] = np.eye(3) + np.sin(values)[..., None, None] * self._crosses + (1 - np.cos(values))[..., None, None] * self._crosses_squared
+        motions[..., :3, 3] = values[..., None] * self._translations
+        motions[..., 3, 3] = 1
+        transforms = self.origins @ motions
+        # chain them up from the base, parents always come first
+        frames = np.empty((num, len(self.link_names), 4, 4))
+        frames[:, 0] = self.base
+        for idx in range(1, len(self.link_names)):
+            frames[:, idx] = frames[:, self.parents[idx]] @ transforms[:, idx]
+        if links is not None:
+            frames = frames[:, [self.link_ids[link] for link in links]]
+        return frames[0] if single else frames
+
+    def link_poses(self, joints: np.ndarray, links: List[str]=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as above, but returns positions (N, len(links), 3) and quaternions (N, len(links), 4) in x, y, z, w format.
+        """
+        frames = self.link_frames(joints, links)
+        return frames[..., :3, 3], matrices_to_quaternions(frames[..., :3, :3])
+
+    def link_positions(self, joints: np.ndarray, links: List[str]=None) -> np.ndarray:
+        """
+        Same as above, but only returns the positions.
+        """
+        return self.link_frames(joints, links)[..., :3, 3]
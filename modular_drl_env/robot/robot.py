@@ -1,10 +1,13 @@
 from abc import ABC, abstractmethod
 from typing import Union, List
+import os
 import numpy as np
 from modular_drl_env.world.world import World
 from modular_drl_env.util.quaternion_util import quaternion_to_rpy, rpy_to_quaternion
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb, JointGroup
+from modular_drl_env.robot.kinematics import ForwardKinematics
+from modular_drl_env.robot.robot_state import RobotState
 from time import process_time
 
 CONTROL_MODES = [
@@ -97,6 +100,8 @@ class Robot(ABC):
         # joint and position sensor (for end effector) are mandatory and thus treated separately
         self.joints_sensor = None
         self.position_rotation_sensor = None
+        # snapshot of the data of the two sensors above (and more) for the current step, gets created in build and filled by the env, see robot_state.py
+        self.state = None
 
         # in inverse kinmematics mode limits the maximum desired movement per step to this
         # note: independent of this, movements will still be limited by maximum joint velocities and joint position limits
@@ -123,6 +128,12 @@ class Robot(ABC):
         # joint angles for control mode 3, only ever gets set from the outside by other entities, e.g. a goal
         self.control_target = []
 
+        # numpy forward kinematics built from the URDF, see get_forward_kinematics
+        self._forward_kinematics = None
+
+        # solver for the inverse kinematics, pybullet's own solver is used if this is not set, see set_ik_solver
+        self.ik_solver = None
+
     def get_action_space_dims(self):
         """
         A simple method that should return a tuple containing as first entry the number action space
@@ -152,6 +163,11 @@ class Robot(ABC):
             if joint_id in self.controlled_joints_ids:
                 self.indices_controlled.append(idx)
         self.indices_controlled = np.array(self.indices_controlled)
+        # pre-resolved pybullet handles for the joint lists, these get used for all the movement below
+        self.controlled_joints_group = pyb_u.get_joint_group(self.object_id, self.controlled_joints_ids)
+        self.all_joints_group = pyb_u.get_joint_group(self.object_id, self.all_joints_ids)
+        # tuple of joint ids or handle -> (handle, limits and forces of these joints), for moveto_joints with explicit joints
+        self._joint_groups = dict()
 
         # handle the limit overwrite input
         self.joint_limits_overwrite = self.joint_limits_overwrite if type(self.joint_limits_overwrite) == list else [self.joint_limits_overwrite for _ in self.all_joints_ids]
@@ -189,6 +205,8 @@ class Robot(ABC):
 
         self.moveto_joints(self._resting_pose_angles, False, self.all_joints_ids)
 
+        self.state = RobotState(self)
+
     def set_joint_sensor(self, joints_sensor):
         """
         Simple setter method for the joint sensor of this robot.
@@ -207,6 +225,12 @@ class Robot(ABC):
         """
         self.goal = goal
 
+    def set_ik_solver(self, ik_solver):
+        """
+        Simple setter for the inverse kinematics solver of this robot, see inverse_kinematics.py.
+        """
+        self.ik_solver = ik_solver
+
     def process_action(self, action: np.ndarray):
         """
         This takes an action vector as given as the output of the NN actor and applies it to the robot.
@@ -299,7 +323,7 @@ class Robot(ABC):
         """
         pyb_u.set_joint_targets(
             robot_id=self.object_id,
-            joint_ids=self.controlled_joints_ids,
+            joint_ids=self.controlled_joints_group,
             velocity=desired_joints_velocities,
             forces=self.joints_max_forces)
 
@@ -311,21 +335,14 @@ class Robot(ABC):
         :param desired_joints_angles: Vector containing the desired new joint angles
         """
         if joints_ids is None:
-            joints_ids = self.controlled_joints_ids
+            joints_ids = self.controlled_joints_group
 
             # clip desired angles at max/min
-            upper_limit_mask = desired_joints_angles > self.joints_limits_upper
-            lower_limit_mask = desired_joints_angles < self.joints_limits_lower
-            desired_joints_angles[upper_limit_mask] = self.joints_limits_upper[upper_limit_mask]
-            desired_joints_angles[lower_limit_mask] = self.joints_limits_lower[lower_limit_mask]
+            np.clip(desired_joints_angles, self.joints_limits_lower, self.joints_limits_upper, out=desired_joints_angles)
             forces = self.joints_max_forces
         else:
-            indices = [self.all_joints_ids.index(i) for i in joints_ids]
-            upper_limit_mask = desired_joints_angles > self._joints_limits_upper[indices]
-            lower_limit_mask = desired_joints_angles < self._joints_limits_lower[indices]
-            desired_joints_angles[upper_limit_mask] = self._joints_limits_upper[indices][upper_limit_mask]
-            desired_joints_angles[lower_limit_mask] = self._joints_limits_lower[indices][lower_limit_mask]
-            forces = self._joints_max_forces[indices]
+            joints_ids, lower, upper, forces = self._get_joint_group(joints_ids)
+            np.clip(desired_joints_angles, lower, upper, out=desired_joints_angles)
 
         # apply movement
         if use_physics_sim:
@@ -342,6 +359,18 @@ class Robot(ABC):
                 position=desired_joints_angles
             )
 
+    def _get_joint_group(self, joints_ids):
+        """
+        Returns the pybullet handle for the given joints as well as their lower limits, upper limits and max forces, all of this is cached.
+        """
+        # handles are used as they are, lists get resolved
+        key = joints_ids if type(joints_ids) is JointGroup else tuple(joints_ids)
+        if key not in self._joint_groups:
+            indices = np.array([self.all_joints_ids.index(joint_id) for joint_id in joints_ids], dtype=int)
+            group = joints_ids if type(joints_ids) is JointGroup else pyb_u.get_joint_group(self.object_id, key)
+            self._joint_groups[key] = (group, self._joints_limits_lower[indices], self._joints_limits_upper[indices], self._joints_max_forces[indices])
+        return self._joint_groups[key]
+
     def moveto_xyzrpy(self, desired_xyz: np.ndarray, desired_rpy: np.ndarray, use_physics_sim: bool):
         """
         Moves the robot such that end effector is in the desired xyz position and rpy orientation.
@@ -382,6 +411,12 @@ class Robot(ABC):
         :param quat: Vector containing the desired rotation of the end effector.
         :return: Vector containing the joint angles required to reach the pose.
         """
+        if self.ik_solver is not None:
+            # the solvers only deal with the controlled joints, all others stay where they are
+            # the current angles of the controlled joints are the seeds, no need to ask for them again
+            joints = pyb_u.get_joint_states(self.object_id, self.all_joints_group)[0]
+            joints[self.indices_controlled] = self.ik_solver.solve(xyz, quat, joints[self.indices_controlled])
+            return joints
         return pyb_u.solve_inverse_kinematics(
             robot_id=self.object_id,
             link_id=self.end_effector_link_id,
@@ -400,6 +435,18 @@ class Robot(ABC):
         self.base_position = desired_base_position
         self.base_orientation = desired_base_orientation
         pyb_u.set_base_pos_and_ori(self.object_id, desired_base_position, desired_base_orientation)
+        if self._forward_kinematics is not None:
+            self._forward_kinematics.set_base(desired_base_position, desired_base_orientation)
+
+    def get_forward_kinematics(self) -> ForwardKinematics:
+        """
+        Returns the forward kinematics of this robot, which compute link poses for batches of controlled joint configurations without moving the robot in the simulation.
+        Joints that are not controlled are assumed to be at their resting angles. Gets built from the URDF on the first call.
+        """
+        if self._forward_kinematics is None:
+            urdf_path = self.urdf_path if os.path.isabs(self.urdf_path) else os.path.join(self.world.assets_path, self.urdf_path)
+            self._forward_kinematics = ForwardKinematics(urdf_path, self.controlled_joints_ids, self.base_position, self.base_orientation, dict(zip(self.all_joints_ids, self._resting_pose_angles)))
+        return self._forward_kinematics
 
     def sample_valid_configuration(self, only_controlled_joints=True):
         """
@@ -409,23 +456,16 @@ class Robot(ABC):
             l = self.joints_limits_lower
             u = self.joints_limits_upper
             d = len(self.controlled_joints_ids)
-            ids = self.controlled_joints_ids
+            ids = self.controlled_joints_group
         else:
             l = self._joints_limits_lower
             u = self._joints_limits_upper
             d = len(self.all_joints_ids)
-            ids = self.all_joints_ids
+            ids = self.all_joints_group
         while True:
             sample = np.random.uniform(low=l, high=u, size=(d,))
             self.moveto_joints(sample, False, ids)
-            pyb.performCollisionDetection()
-            contacts = pyb.getContactPoints(pyb_u.to_pb(self.object_id))
-            self_col = False
-            for contact in contacts:
-                if contact[1] == pyb_u.to_pb(self.object_id) and contact[2] == pyb_u.to_pb(self.object_id):
-                    self_col = True
-                    break
-            if not self_col:
+            if not self.world.collision_checker.in_self_collision(self):
                 break # if we reach this line, there were no self collisions
-        self.moveto_joints(self.resting_pose_angles, False, self.controlled_joints_ids)
+        self.moveto_joints(self.resting_pose_angles, False, self.controlled_joints_group)
         return sample
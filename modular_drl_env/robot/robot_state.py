@@ -0,0 +1,52 @@
+import numpy as np
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+
+__all__ = [
+    "RobotState"
+]
+
+class RobotState:
+    """
+    Snapshot of a robot's state at the current env step: angles and velocities of the controlled joints, pose of the end effector and world positions of all links.
+    The env fills it once per step after the sensors have been updated (and once per reset), goals and everything else that needs this data every step
+    should read it from here instead of going through the sensors or pyb_u again.
+    All arrays are allocated once and overwritten in place, copy them if you need a value for longer than the current step.
+    """
+
+    __slots__ = ("robot", "joints_angles", "joints_velocities", "ee_position", "ee_position_prev", "ee_rotation", "link_ids", "links_positions", "_link_group")
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.joints_angles = np.zeros(len(robot.controlled_joints_ids))
+        self.joints_velocities = np.zeros(len(robot.controlled_joints_ids))
+        self.ee_position = np.zeros(3)
+        # end effector position at the step before, equal to ee_position right after a reset
+        self.ee_position_prev = np.zeros(3)
+        # quaternion
+        self.ee_rotation = np.array([0., 0., 0., 1.])
+        # links in the order of the rows of links_positions
+        self.link_ids = pyb_u.get_link_ids(robot.object_id)
+        self._link_group = pyb_u.get_link_group(robot.object_id, self.link_ids)
+        self.links_positions = np.zeros((len(self.link_ids), 3))
+
+    def update(self):
+        """
+        Copies the current data of the robot's mandatory sensors and its link positions into the snapshot.
+        """
+        self.ee_position_prev[:] = self.ee_position
+        self._fill()
+
+    def reset(self):
+        """
+        Same as update, but at the start of an episode, such that there is no previous step.
+        """
+        self._fill()
+        self.ee_position_prev[:] = self.ee_position
+
+    def _fill(self):
+        self.joints_angles[:] = self.robot.joints_sensor.joints_angles
+        self.joints_velocities[:] = self.robot.joints_sensor.joints_velocities
+        self.ee_position[:] = self.robot.position_rotation_sensor.position
+        self.ee_rotation[:] = self.robot.position_rotation_sensor.rotation
+        # all links come from the same snapshot in pyb_u that the position sensor has fetched already, so this doesn't ask the engine again
+        pyb_u.get_link_positions(self.robot.object_id, self._link_group, out=self.links_positions)
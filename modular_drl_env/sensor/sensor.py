@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from time import time
+import numpy as np
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 
 class Sensor(ABC):
@@ -47,6 +48,9 @@ class Sensor(ABC):
         self.aux_visual_objects = []  # for spheres, cubes etc.
         self.aux_lines = []  # specifically for lines
 
+        # pose of the robot and state of the rest of the scene at the last update, see _scene_unchanged
+        self._scene_key = None
+
     @abstractmethod
     def update(self, step) -> dict:
         """
@@ -74,12 +78,34 @@ class Sensor(ABC):
         """
         pass
 
+    def write_observation(self, views: dict):
+        """
+        Writes the data currently stored into the pre-allocated arrays of the env's observation buffer, keys are the same as in get_observation().
+        Per default this copies the output of get_observation(), overwrite this to write into the arrays directly without temporary arrays.
+        """
+        for key, value in self.get_observation().items():
+            views[key][...] = value
+
     def _normalize(self) -> dict:
         """
         Returns the sensor data in normalized format.
         """
         pass
 
+    def _scene_unchanged(self) -> bool:
+        """
+        Dirty flag for robot bound sensors whose data only depends on the pose of their robot and on the rest of the scene, e.g. because they cast rays or measure distances.
+        Returns True if neither changed since the last call, in which case the sensor can keep its data instead of asking the engine again.
+        The scene part is the world's scene key, which changes with any obstacle that moves, also with those that aren't among the active objects.
+        Sensors using this should set self._scene_key to None in their reset, such that the first update afterwards always does the work.
+        """
+        scene_key = (pyb_u.get_joint_states(self.robot.object_id, self.robot.all_joints_group)[0].tobytes(),
+                     np.asarray(self.robot.base_position, dtype=np.float64).tobytes(),
+                     self.robot.world.get_scene_key(self.robot))
+        unchanged = scene_key == self._scene_key
+        self._scene_key = scene_key
+        return unchanged
+
     @abstractmethod
     def get_observation_space_element(self) -> dict:
         """
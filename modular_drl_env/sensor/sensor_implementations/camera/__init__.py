@@ -1,5 +1,5 @@
 from __future__ import annotations
-from .camera import CameraBase
+from .camera import CameraBase, CameraRenderScheduler
 from .camera_implementations.static_cameras import *
 from .camera_implementations.on_robot_cameras import *
 from .camera_implementations.buddy_robot_cameras import *
@@ -1,5 +1,5 @@
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from gym import spaces
 from typing import List, Dict
 from modular_drl_env.sensor.sensor import Sensor
@@ -8,10 +8,19 @@ from time import time
 from abc import abstractmethod
 from .camera_utils import *
 
+__all__ = [
+    'CameraBase',
+    'CameraRenderScheduler'
+]
+
+# the projection matrix only depends on the intrinsics, so all cameras with the same ones can share it
+_projection_matrix_cache = dict()
 
 class CameraBase(Sensor):
     """
     This class implements a camera that can be used as any combination of [R,G,B,D] including grayscale.
+    Alternatively, the depth image can be turned into a world frame point cloud, which is reported either as a voxel occupancy grid ("voxels")
+    or as the points closest to a center point ("points"), see _convert_depth.
 
 
     param: debug: dict with debug parameters
@@ -46,8 +55,26 @@ class CameraBase(Sensor):
         } if debug is None else debug
         self._add_debug_params()
 
+        # view matrix and the camera pose it was computed for, such that it only gets recomputed if the camera moved
+        self.view_matrix = None
+        self.view_key = None
+        self.projection_matrix = None
+
         self.camera = self._set_camera()
 
+        # images get written into these buffers instead of allocating new ones on every render
+        # raw_image always holds the uint8 image, image_buffer the (normalized) observation, which is the same array if normalize is off
+        if self.camera_args['type'] in ['voxels', 'points']:
+            self.raw_image = None
+            self.image_buffer = np.zeros(self._get_observation_shape(), dtype=np.float32)
+            self._setup_point_cloud()
+        else:
+            self.raw_image = np.zeros(self._get_observation_shape(), dtype=np.uint8)
+            self.image_buffer = np.zeros(self.raw_image.shape, dtype=np.float32) if self.normalize else self.raw_image
+
+        # set if the rendering of this camera is handled by a CameraRenderScheduler
+        self.render_scheduler = None
+
         self.current_image = None
 
     def _parse_camera_args(self, camera_args : dict):
@@ -60,6 +87,11 @@ class CameraBase(Sensor):
             'aspect' : 1,
             'near_val' : 0.05,
             'far_val' : 5,
+            # only used by the point cloud types
+            'grid_bounds' : [-1.0, 1.0, -1.0, 1.0, 0.0, 1.5],
+            'voxel_size' : 0.05,
+            'num_points' : 256,
+            'points_center' : [0.0, 0.0, 0.0],
         }
         self.camera_args = default_camera_args
         if type(camera_args) is dict:
@@ -105,53 +137,163 @@ class CameraBase(Sensor):
             # self.debug_lines['left'] = p.addUserDebugLine(self.pos, add_list(self.pos, left_vector), [0, 255, 0])
             # self.debug_lines['up'] = p.addUserDebugLine(self.pos, add_list(self.pos, up_vector), [0,0,255])
 
+    def _get_projection_matrix(self):
+        key = (self.camera_args['fov'], self.camera_args['aspect'], self.camera_args['near_val'], self.camera_args['far_val'])
+        if key not in _projection_matrix_cache:
+            _projection_matrix_cache[key] = pyb.computeProjectionMatrixFOV(
+                fov= self.camera_args['fov'],
+                aspect=self.camera_args['aspect'],
+                nearVal= self.camera_args['near_val'],
+                farVal= self.camera_args['far_val'],
+                )
+        return _projection_matrix_cache[key]
+
+    def _get_view_matrix(self):
+        key = (tuple(self.pos), tuple(self.target), tuple(self.camera_args['up_vector']))
+        if key != self.view_key:
+            self.view_matrix = pyb.computeViewMatrix(
+                cameraTargetPosition=self.target,
+                cameraEyePosition= self.pos,
+                cameraUpVector= self.camera_args['up_vector'],
+                )
+            self.view_key = key
+        return self.view_matrix
+
     def _set_camera(self):
         if self.debug.get('position', False) or self.debug.get('orientation', False) or self.debug.get('target', False) or self.debug.get('lines', False):
             self._use_debug_params()
 
-        viewMatrix = pyb.computeViewMatrix(
-            cameraTargetPosition=self.target,
-            cameraEyePosition= self.pos,
-            cameraUpVector= self.camera_args['up_vector'],
-            )
-
-        projectionMatrix = pyb.computeProjectionMatrixFOV(
-            fov= self.camera_args['fov'],
-            aspect=self.camera_args['aspect'],
-            nearVal= self.camera_args['near_val'],
-            farVal= self.camera_args['far_val'],
-            )
-
-
-        def _set_camera_inner(): # TODO           
-            _, _, rgba, depth, _ = pyb.getCameraImage(
-                width= self.camera_args['width'],
-                height= self.camera_args['height'],
-                viewMatrix= viewMatrix,
-                projectionMatrix= projectionMatrix,
-            )
-            rgba, depth = np.array(rgba), np.array(depth) # for compatibility with older python versions
-            if self.camera_args['type'] == 'grayscale':
-                r, g, b, a = rgba[:,:,0], rgba[:,:,1], rgba[:,:,2], rgba[:,:,3]/255
-                image = (0.2989 * r + 0.5870 * g + 0.1140 * b)*a
-                image = image[None]
-            if self.camera_args['type'] in ['rgb']:
-                image = rgba[:, :, :3]
-            if self.camera_args['type'] == 'rgbd':
-                image = rgba
-                image[:, :, 3] = depth
-
-
-            return image
+        self.view_matrix = self._get_view_matrix()
+        self.projection_matrix = self._get_projection_matrix()
 
         self.camera_ready = True
-        return _set_camera_inner
+        return self._render
+
+    def _get_render_key(self) -> tuple:
+        """
+        Cameras with the same key get the exact same image from pybullet.
+        """
+        return (self.camera_args['width'], self.camera_args['height'], self.view_matrix, self.projection_matrix)
+
+    def _get_camera_image(self):
+        """
+        Renders the current view, returns the rgba image with shape (height, width, 4) and the depth buffer with shape (height, width).
+        """
+        _, _, rgba, depth, _ = pyb.getCameraImage(
+            width= self.camera_args['width'],
+            height= self.camera_args['height'],
+            viewMatrix= self.view_matrix,
+            projectionMatrix= self.projection_matrix,
+            flags= pyb.ER_NO_SEGMENTATION_MASK,  # we don't use it and it's costly
+        )
+        return camera_image_to_arrays(self.camera_args['width'], self.camera_args['height'], rgba, depth)
+
+    def _convert_image(self, rgba, depth):
+        """
+        Converts the output of _get_camera_image into the observation of this camera, which is written into the image buffer.
+        """
+        if self.raw_image is None:
+            return self._convert_depth(depth)
+        if self.camera_args['type'] == 'grayscale':
+            gray = np.dot(rgba[:, :, :3], [0.2989, 0.5870, 0.1140])
+            gray *= rgba[:, :, 3] / 255
+            self.raw_image[:, :, 0] = gray
+        if self.camera_args['type'] in ['rgb']:
+            self.raw_image[:] = rgba[:, :, :3]
+        if self.camera_args['type'] == 'rgbd':
+            self.raw_image[:, :, :3] = rgba[:, :, :3]
+            # depth buffer values are between 0 and 1, scaled to the range of the other channels
+            np.multiply(depth, 255, out=self.raw_image[:, :, 3], casting='unsafe')
+        if self.normalize:
+            np.multiply(self.raw_image, 1 / 255, out=self.image_buffer)
+        return self.image_buffer
+
+    def _setup_point_cloud(self):
+        # normalized device coordinates of all pixels, the depth buffer only adds the z coordinate
+        # rows go from the top of the image to the bottom, hence the flipped y axis
+        # pybullet's tiny renderer samples each pixel at its lower left corner, not its center, found out by testing against ray casts
+        width, height = self.camera_args['width'], self.camera_args['height']
+        x_ndc, y_ndc = np.meshgrid(2 * np.arange(width) / width - 1, 1 - 2 * (np.arange(height) + 1) / height)
+        self.pixels_ndc = np.stack([x_ndc.ravel(), y_ndc.ravel(), np.zeros(width * height), np.ones(width * height)], axis=-1)
+
+        grid_bounds = np.array(self.camera_args['grid_bounds'])
+        self.grid_lower = grid_bounds[0::2]
+        self.grid_upper = grid_bounds[1::2]
+        self.grid_shape = self._get_grid_shape()
+
+        # inverse of projection x view and the view matrix it was computed for
+        self.inverse_matrix = None
+        self.inverse_key = None
+        self.points = np.zeros((0, 3))
+
+    def _get_grid_shape(self) -> tuple:
+        # grid_bounds are in the same format as workspace boundaries: xmin, xmax, ymin, ymax, zmin, zmax
+        grid_bounds = np.array(self.camera_args['grid_bounds'])
+        # the small epsilon prevents an extra voxel if the bounds are a multiple of the voxel size
+        return tuple(int(n) for n in np.ceil((grid_bounds[1::2] - grid_bounds[0::2]) / self.camera_args['voxel_size'] - 1e-9))
+
+    def _get_inverse_matrix(self) -> np.ndarray:
+        """
+        Returns the transposed inverse of projection x view, which maps (row) vectors in normalized device coordinates to the world frame.
+        """
+        key = (self.view_matrix, self.projection_matrix)
+        if key != self.inverse_key:
+            # pybullet's matrices are flat and column major
+            view = np.array(self.view_matrix).reshape(4, 4, order='F')
+            projection = np.array(self.projection_matrix).reshape(4, 4, order='F')
+            self.inverse_matrix = np.linalg.inv(projection @ view).T
+            self.inverse_key = key
+        return self.inverse_matrix
+
+    def _depth_to_points(self, depth) -> np.ndarray:
+        """
+        Unprojects the depth buffer into world frame points, pixels that didn't see anything and points outside of the grid bounds are dropped.
+        """
+        depth = depth.ravel()
+        seen = depth < 1 - 1e-6  # the far plane
+        pixels = self.pixels_ndc[seen]
+        pixels[:, 2] = 2 * depth[seen] - 1
+        points = pixels @ self._get_inverse_matrix()
+        points = points[:, :3] / points[:, 3:]
+        inside = np.all((points >= self.grid_lower) & (points < self.grid_upper), axis=1)
+        return points[inside]
+
+    def _convert_depth(self, depth):
+        """
+        Converts the depth buffer into the point cloud based observation, which is written into the image buffer.
+        """
+        self.points = self._depth_to_points(depth)
+        if self.camera_args['type'] == 'voxels':
+            # every voxel with at least one point in it is occupied
+            voxels = ((self.points - self.grid_lower) / self.camera_args['voxel_size']).astype(int)
+            voxels = np.minimum(voxels, np.array(self.grid_shape) - 1)  # float errors right at the upper bounds
+            self.image_buffer[:] = 0
+            self.image_buffer[voxels[:, 0], voxels[:, 1], voxels[:, 2]] = 1
+        else:
+            # the num_points points closest to the center, relative to it and sorted by distance
+            num_points = self.camera_args['num_points']
+            offsets = self.points - np.array(self.camera_args['points_center'])
+            distances = np.einsum('ij,ij->i', offsets, offsets)
+            if len(offsets) > num_points:
+                closest = np.argpartition(distances, num_points - 1)[:num_points]
+                offsets, distances = offsets[closest], distances[closest]
+            offsets = offsets[np.argsort(distances)]
+            self.image_buffer[:len(offsets)] = offsets
+            # missing points are filled up with the farthest one found, or with the far value if there are none at all
+            self.image_buffer[len(offsets):] = offsets[-1] if len(offsets) else self.camera_args['far_val']
+            np.clip(self.image_buffer, -self.camera_args['far_val'], self.camera_args['far_val'], out=self.image_buffer)
+            if self.normalize:
+                self.image_buffer /= self.camera_args['far_val']
+        return self.image_buffer
+
+    def _render(self):
+        return self._convert_image(*self._get_camera_image())
 
     def _get_image(self):
         if not self.camera_ready:
             self.camera = self._set_camera()
         self.image = self.camera()
-        return self.image/255 if self.normalize else self.image 
+        return self.image
 
     def _move(self, position = None, orientation = None, target = None):
         self.pos = self.pos if position is None else position 
@@ -170,21 +312,37 @@ class CameraBase(Sensor):
                 self.camera_args[key] = new_arg
         return copy.copy(self.camera_args)
 
-    def get_observation_space_element(self) -> Dict:
+    def _get_observation_shape(self) -> tuple:
+        if self.camera_args['type'] == 'voxels':
+            return self._get_grid_shape()
+        if self.camera_args['type'] == 'points':
+            return (self.camera_args['num_points'], 3)
         nr_channels = {
             'grayscale' : 1,
             'rgb' : 3,
             'rgbd': 4,
         }
+        return (self.camera_args['height'], self.camera_args['width'], nr_channels[self.camera_args['type']])
+
+    def get_observation_space_element(self) -> Dict:
+        if self.camera_args['type'] == 'voxels':
+            return {self.output_name : spaces.Box(low=0, high=1, shape=self._get_observation_shape(), dtype=np.float32),}
+        if self.camera_args['type'] == 'points':
+            high = 1 if self.normalize else self.camera_args['far_val']
+            return {self.output_name : spaces.Box(low=-high, high=high, shape=self._get_observation_shape(), dtype=np.float32),}
         low = 0
         high = 1 if self.normalize else 255
-        return {self.output_name : spaces.Box(low=low, high= high, shape=(128,128,nr_channels[self.camera_args['type']],), dtype=np.uint8),}
-        
+        dtype = np.float32 if self.normalize else np.uint8
+        return {self.output_name : spaces.Box(low=low, high= high, shape=self._get_observation_shape(), dtype=dtype),}
+
 
     def get_observation(self):
         return {self.output_name : self.current_image}
 
     def update(self, step):
+        if self.render_scheduler is not None:
+            # the image (and the cpu time) was already taken care of by the scheduler
+            return self.get_observation()
         self.cpu_epoch = time()
         if step % self.update_steps == 0:
             self._adapt_to_environment()
@@ -194,8 +352,11 @@ class CameraBase(Sensor):
         return self.get_observation()
 
     def reset(self):
+        if self.render_scheduler is not None:
+            return
         self.cpu_epoch = time()
         self._adapt_to_environment()
+        self.current_image = self._get_image()
         self.cpu_time = time() - self.cpu_epoch
 
     def _normalize(self):
@@ -224,3 +385,33 @@ class CameraBase(Sensor):
         """
         self.camera = self._set_camera()
 
+class CameraRenderScheduler:
+    """
+    Renders all cameras of an env in one go, once per env step before the sensors get updated.
+    Only cameras whose update_steps are due get moved and rendered and cameras that would see the exact same image
+    (same resolution, pose and intrinsics) share a single pybullet render.
+    The cameras themselves then only hand out their latest image.
+    """
+
+    def __init__(self, cameras: List[CameraBase]):
+        self.cameras = cameras
+        for camera in self.cameras:
+            camera.render_scheduler = self
+
+    def render(self, step: int=None):
+        """
+        Renders all cameras that are due at the given step, all of them if step is None (e.g. after a reset).
+        """
+        renders = dict()
+        for camera in self.cameras:
+            if step is not None and step % camera.update_steps != 0:
+                continue
+            camera.cpu_epoch = time()
+            camera._adapt_to_environment()
+            if not camera.camera_ready:
+                camera.camera = camera._set_camera()
+            key = camera._get_render_key()
+            if key not in renders:
+                renders[key] = camera._get_camera_image()
+            camera.current_image = camera._convert_image(*renders[key])
+            camera.cpu_time = time() - camera.cpu_epoch
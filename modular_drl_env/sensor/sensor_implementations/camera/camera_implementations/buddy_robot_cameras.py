@@ -5,7 +5,7 @@ from ..camera_utils import directionalVectorsFromQuaternion
 from typing import Union, List, Dict
 
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 
 __all__ = ['BuddyRobotCamera']
 
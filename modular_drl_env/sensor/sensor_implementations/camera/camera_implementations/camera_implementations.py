@@ -1,4 +1,4 @@
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from typing import List
 from modular_drl_env.robot.robot_implementations.ur5 import UR5
 from ..camera_utils import *
@@ -119,6 +119,19 @@ class CameraRailRobotCircle:
 
 
 
+def camera_image_to_arrays(width: int, height: int, rgba, depth):
+    """
+    Turns the rgba and depth buffers returned by pybullet's getCameraImage into arrays of shape (height, width, 4) (uint8) and (height, width) (float32).
+    If pybullet was built with numpy support, the buffers are already arrays and get reused without a copy.
+    """
+    if isinstance(rgba, np.ndarray):
+        rgba = np.frombuffer(rgba, dtype=np.uint8)
+        depth = np.frombuffer(depth, dtype=np.float32)
+    else:
+        rgba = np.fromiter(rgba, dtype=np.uint8, count=width * height * 4)
+        depth = np.fromiter(depth, dtype=np.float32, count=width * height)
+    return rgba.reshape(height, width, 4), depth.reshape(height, width)
+
 def add_list(a: List, b: List, factor: int = 1) -> List:
     """
     adds lists "a" and "b" as vectors, "factor" is multiplied by b
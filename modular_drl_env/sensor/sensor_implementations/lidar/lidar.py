@@ -1,5 +1,9 @@
 from modular_drl_env.sensor.sensor import Sensor
 from modular_drl_env.robot.robot import Robot
+from modular_drl_env.util.pybullet_util import pyb
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.util.quaternion_util import quaternions_to_matrices
+import numpy as np
 from time import time
 from abc import abstractmethod
 
@@ -41,7 +45,8 @@ class LidarSensor(Sensor):
     def update(self, step):
 
         self.cpu_epoch = time()
-        if step % self.update_steps == 0:
+        # the rays only need to be cast again if the robot or anything they could hit moved
+        if step % self.update_steps == 0 and not self._scene_unchanged():
             lidar_data_raw = self._get_lidar_data()
             self.lidar_indicator, self.lidar_distances = self._process_raw_lidar(lidar_data_raw)    
         self.cpu_time = time() - self.cpu_epoch
@@ -50,6 +55,7 @@ class LidarSensor(Sensor):
 
     def reset(self):
         self.cpu_epoch = time()
+        self._scene_key = None
         lidar_data_raw = self._get_lidar_data()
         self.lidar_indicator, self.lidar_distances = self._process_raw_lidar(lidar_data_raw)
         self.cpu_time = time() - self.cpu_epoch
@@ -75,6 +81,94 @@ class LidarSensor(Sensor):
 
         return logging_dict
 
+    ###################
+    # link ray groups #
+    ###################
+
+    # the methods below can be used by subclasses whose rays are fixed relative to some robot links and get merged into one output value per direction
+
+    @staticmethod
+    def _ray_grid(shape: tuple, x, y, z) -> np.ndarray:
+        """
+        Stacks the given local coordinates, which may be scalars or arrays broadcastable to shape, into an array of the shape shape + (3,).
+        """
+        return np.stack([np.broadcast_to(np.asarray(coordinate, dtype=float), shape) for coordinate in (x, y, z)], axis=-1)
+
+    def _setup_ray_groups(self, ray_groups: list):
+        """
+        Precomputes the rays of all groups.
+        ray_groups is a list of (link name, local ray starts, local ray ends) in the order of the output,
+        the local rays are given in the frame of the link and have the shape (num of directions, rays per direction, 3).
+        Every direction becomes one output value, namely the minimum hit fraction of its rays.
+        """
+        links = []
+        self.ray_group_slices = []
+        self.ray_group_link_index = []
+        self.ray_group_starts_local = []
+        self.ray_group_ends_local = []
+        direction_sizes = []
+        num_rays = 0
+        for link, starts, ends in ray_groups:
+            assert starts.shape == ends.shape, "Ray starts and ends of link " + link + " don't match!"
+            if link not in links:
+                links.append(link)
+            self.ray_group_link_index.append(links.index(link))
+            # homogeneous coordinates, such that the rays of a group can be moved into the world frame with a single matmul
+            group_size = starts.shape[0] * starts.shape[1]
+            self.ray_group_starts_local.append(np.hstack([starts.reshape(group_size, 3), np.ones((group_size, 1))]))
+            self.ray_group_ends_local.append(np.hstack([ends.reshape(group_size, 3), np.ones((group_size, 1))]))
+            self.ray_group_slices.append(slice(num_rays, num_rays + group_size))
+            direction_sizes += [starts.shape[1]] * starts.shape[0]
+            num_rays += group_size
+        self.ray_links_group = pyb_u.get_link_group(self.robot.object_id, links)
+
+        # index of the first ray of every direction, the rays of a direction are contiguous
+        self.ray_direction_offsets = np.concatenate([[0], np.cumsum(direction_sizes)[:-1]]).astype(int)
+
+        # indicator value for each bucket, see _raw_to_indicator
+        # the round is thrown in there to prevent weird numeric appendages that came up in testing, e.g. 0.200000000004, -0.199999999999 or the like
+        self.indicator_labels = np.round(np.arange(self.indicator_buckets) * (2 / self.indicator_buckets) - 1, 5)
+
+        # data storage, gets overwritten on every update
+        self.rays_starts = np.zeros((num_rays, 3))
+        self.rays_ends = np.zeros((num_rays, 3))
+        self.results = []
+
+    def _cast_ray_groups(self) -> np.ndarray:
+        """
+        Moves all rays to the current link poses, casts them and returns the minimum hit fraction of every direction.
+        """
+        link_positions, link_orientations, _, _ = pyb_u.get_link_states(self.robot.object_id, self.ray_links_group)
+        # transposed homogeneous frames without the last column, i.e. (local rays) x (frame^T) gives the rays in the world frame
+        frames = np.zeros((len(link_positions), 4, 3))
+        frames[:, :3, :] = np.swapaxes(quaternions_to_matrices(link_orientations), 1, 2)
+        frames[:, 3, :] = link_positions
+        for group_slice, link_idx, starts, ends in zip(self.ray_group_slices, self.ray_group_link_index, self.ray_group_starts_local, self.ray_group_ends_local):
+            np.matmul(starts, frames[link_idx], out=self.rays_starts[group_slice])
+            np.matmul(ends, frames[link_idx], out=self.rays_ends[group_slice])
+
+        # pybullet can only cast a limited number of rays per call, a batch of exactly the maximum size already gets rejected
+        batch_size = pyb.MAX_RAY_INTERSECTION_BATCH_SIZE - 1
+        if len(self.rays_starts) <= batch_size:
+            self.results = pyb.rayTestBatch(self.rays_starts, self.rays_ends)
+        else:
+            self.results = []
+            for idx in range(0, len(self.rays_starts), batch_size):
+                self.results += pyb.rayTestBatch(self.rays_starts[idx:idx + batch_size], self.rays_ends[idx:idx + batch_size])
+
+        hit_fractions = np.fromiter((result[2] for result in self.results), dtype=float, count=len(self.results))
+        return np.minimum.reduceat(hit_fractions, self.ray_direction_offsets)
+
+    def _raw_to_indicator(self, raw_lidar_data: np.ndarray) -> np.ndarray:
+        """
+        Takes values between 0 and 1, assigns each a bucket in that range and returns the corresponding buckets in the range of -1 and 1.
+        Values from 0.99 on count as nothing hit.
+        """
+        buckets = np.maximum(np.ceil(raw_lidar_data * self.indicator_buckets) - 1, 0).astype(int)
+        indicator = self.indicator_labels[np.minimum(buckets, self.indicator_buckets - 1)]
+        indicator[raw_lidar_data >= 0.99] = 1
+        return indicator
+
     @abstractmethod
     def _get_lidar_data(self):
         """
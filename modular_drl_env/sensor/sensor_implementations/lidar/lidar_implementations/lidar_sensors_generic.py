@@ -1,15 +1,18 @@
 from modular_drl_env.robot.robot import Robot
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from gym.spaces import Box
 from ..lidar import LidarSensor
 from modular_drl_env.util.misc import regular_equidistant_sphere_points, fibonacci_sphere
+from modular_drl_env.util.quaternion_util import quaternions_to_matrices
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 from time import time
 
 class LidarSensorGeneric(LidarSensor):
     """
-    Implements a generic lidar setup that will send 
+    Implements a generic lidar setup that will send rays in a sphere around each of the given links.
+    All rays are precomputed as templates relative to their link, such that an update only needs to move (and optionally rotate) them
+    with the current link poses in one go, cast them in one batch and convert the results with a few array operations.
     """
 
     def __init__(self, 
@@ -23,6 +26,7 @@ class LidarSensorGeneric(LidarSensor):
                  indicator: bool=True,
                  ignore_self: bool=True,
                  report_points: bool=False,
+                 rotate_rays: bool=False,
                  normalize: bool=False,
                  add_to_observation_space: bool=True, 
                  add_to_logging: bool=False, 
@@ -38,16 +42,18 @@ class LidarSensorGeneric(LidarSensor):
         self.ray_end = ray_end
 
         # indicator conversion setup
-        raw_bucket_size = 1 / indicator_buckets  # 1 is the range of pybullet lidar data (from 0 to 1)
+        self.raw_bucket_size = 1 / indicator_buckets  # 1 is the range of pybullet lidar data (from 0 to 1)
         indicator_label_diff = 2 / indicator_buckets  # 2 is the range of the indicator data (from -1 to 1)
-        # lambda function to convert to indicator based on bucket size
-        self.raw_to_indicator = lambda x : 1 if x >= 0.99 else round((np.max([(np.ceil(x/raw_bucket_size)-1),0]) * indicator_label_diff - 1),5)
-        # short explanation: takes a number between 0 and 1, assigns it a bucket in the range, and returns the corresponding bucket in the range of -1 and 1
+        # indicator value for each bucket, a raw value between 0 and 1 gets assigned a bucket, which corresponds to a value in the range of -1 and 1
         # the round is thrown in there to prevent weird numeric appendages that came up in testing, e.g. 0.200000000004, -0.199999999999 or the like
+        self.indicator_labels = np.round(np.arange(indicator_buckets) * indicator_label_diff - 1, 5)
+
+        # whether the rays turn with their link, if not they keep their directions in the world frame
+        self.rotate_rays = rotate_rays
 
         # determine shape of out output and the direction of rays
-        # INFO: because we won't rotate the rays in this class, we can already calculate every single ray right here and then later on just add the offset
-        # of the world frame location that the respective link is at
+        # INFO: we can calculate every single ray relative to its link right here and then later on just add the offset
+        # of the world frame location that the respective link is at (and rotate them, if wanted)
         # this also allows us to calculate the shape of the output, because sometimes our circle point algorithm won't be able to return the exact number of points
         # the user specified as the amount of the rays at the start (usually it's at most 2 off)
         self.lidar_indicator_shape = 0
@@ -60,9 +66,16 @@ class LidarSensorGeneric(LidarSensor):
             self.rays_ends_base[link] = sampled_sphere_points
             self.rays_starts_base[link] = (sampled_sphere_points * self.ray_start / self.ray_end) # == the points where our rays are supposed to start
 
-        # data storage for later
-        self.rays_starts = []
-        self.rays_ends = []
+        # all rays stacked into one array and the index of the link each one belongs to
+        self.ray_links = list(self.ray_setup.keys())
+        self.ray_links_group = pyb_u.get_link_group(self.robot.object_id, self.ray_links)
+        self.rays_starts_template = np.vstack([self.rays_starts_base[link] for link in self.ray_links])
+        self.rays_ends_template = np.vstack([self.rays_ends_base[link] for link in self.ray_links])
+        self.rays_link_index = np.concatenate([np.full(len(self.rays_ends_base[link]), idx) for idx, link in enumerate(self.ray_links)])
+
+        # data storage for later, the ray buffers get overwritten on every update
+        self.rays_starts = np.zeros((self.lidar_indicator_shape, 3))
+        self.rays_ends = np.zeros((self.lidar_indicator_shape, 3))
         self.results = []
 
         # bool for whether self hits get reported or treated as nothing hit
@@ -78,39 +91,43 @@ class LidarSensorGeneric(LidarSensor):
         return {self.output_name: Box(low=-1, high=1, shape=(self.lidar_indicator_shape * (1 if not self.report_points else 3),), dtype=np.float32)}
     
     def _get_lidar_data(self):
-        self.rays_starts = np.empty((0,3))
-        self.rays_ends = np.empty((0,3))
-
-        for link in self.ray_setup:
-            pos, _, _, _ = pyb_u.get_link_state(self.robot.object_id, link)
-            self.rays_starts = np.vstack([self.rays_starts, self.rays_starts_base[link] + pos])
-            self.rays_ends = np.vstack([self.rays_ends, self.rays_ends_base[link] + pos])
+        # world frame poses of all links with rays
+        link_positions, link_orientations, _, _ = pyb_u.get_link_states(self.robot.object_id, self.ray_links_group)
+
+        if self.rotate_rays:
+            # rotate every ray template by the orientation of its link, all in one batched matmul
+            rotations = quaternions_to_matrices(link_orientations)[self.rays_link_index]
+            np.matmul(rotations, self.rays_starts_template[:, :, None], out=self.rays_starts[:, :, None])
+            np.matmul(rotations, self.rays_ends_template[:, :, None], out=self.rays_ends[:, :, None])
+            self.rays_starts += link_positions[self.rays_link_index]
+            self.rays_ends += link_positions[self.rays_link_index]
+        else:
+            np.add(self.rays_starts_template, link_positions[self.rays_link_index], out=self.rays_starts)
+            np.add(self.rays_ends_template, link_positions[self.rays_link_index], out=self.rays_ends)
 
         self.results = pyb.rayTestBatch(self.rays_starts, self.rays_ends)
-        
-        processed_results = np.array(self.results, dtype=object)
+
+        hit_fractions = np.fromiter((result[2] for result in self.results), dtype=float, count=self.lidar_indicator_shape)
         if self.ignore_self:
             # set the hit fraction to 1 for all rays that hit the robot itself
-            self_mask = processed_results[:, 0] == pyb_u.to_pb(self.robot.object_id)
-            processed_results[self_mask][:, 2] = 1
+            hit_ids = np.fromiter((result[0] for result in self.results), dtype=int, count=self.lidar_indicator_shape)
+            hit_fractions[hit_ids == self.ray_links_group.pyb_object_id] = 1
 
-        return processed_results[:,2]
+        return hit_fractions
 
     def _process_raw_lidar(self, raw_lidar_data):
+        # bucket of every ray, values from 0.99 on count as nothing hit
+        buckets = np.maximum(np.ceil(raw_lidar_data / self.raw_bucket_size) - 1, 0).astype(int)
+        indicator = self.indicator_labels[np.minimum(buckets, len(self.indicator_labels) - 1)]
+        indicator[raw_lidar_data >= 0.99] = 1
+
+        distances = raw_lidar_data * (self.ray_end - self.ray_start) + self.ray_start
 
-        indicator = np.zeros(self.lidar_indicator_shape)
-        distances = np.zeros(self.lidar_indicator_shape)
         if self.report_points:
-            endpoints = np.zeros((self.lidar_indicator_shape, 3))
+            endpoints = self.rays_starts + raw_lidar_data[:, None] * (self.rays_ends - self.rays_starts)
         else:
             endpoints = None
 
-        for idx, data_point in enumerate(raw_lidar_data):
-            indicator[idx] = self.raw_to_indicator(data_point)
-            distances[idx] = data_point * (self.ray_end - self.ray_start) + self.ray_start
-            if self.report_points:
-                endpoints[idx] = self.rays_starts[idx] + data_point * (self.rays_ends[idx] - self.rays_starts[idx])
-
         return indicator, distances, endpoints
 
     def build_visual_aux(self):
@@ -126,7 +143,8 @@ class LidarSensorGeneric(LidarSensor):
     def update(self, step):
 
         self.cpu_epoch = time()
-        if step % self.update_steps == 0:
+        # the rays only need to be cast again if the robot or anything they could hit moved
+        if step % self.update_steps == 0 and not self._scene_unchanged():
             lidar_data_raw = self._get_lidar_data()
             self.lidar_indicator, self.lidar_distances, self.endpoints = self._process_raw_lidar(lidar_data_raw)    
         self.cpu_time = time() - self.cpu_epoch
@@ -135,6 +153,7 @@ class LidarSensorGeneric(LidarSensor):
 
     def reset(self):
         self.cpu_epoch = time()
+        self._scene_key = None
         lidar_data_raw = self._get_lidar_data()
         self.lidar_indicator, self.lidar_distances, self.endpoints = self._process_raw_lidar(lidar_data_raw)
         self.cpu_time = time() - self.cpu_epoch
@@ -142,7 +161,7 @@ class LidarSensorGeneric(LidarSensor):
 
     def get_observation(self) -> dict:
         if self.report_points:
-            return {self.output_name: np.concatenate(self.endpoints, axis=0)}
+            return {self.output_name: self.endpoints.reshape(-1)}
         if self.indicator:
             return {self.output_name: self.lidar_indicator}
         else:
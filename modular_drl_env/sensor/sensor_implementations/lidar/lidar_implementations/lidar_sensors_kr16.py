@@ -1,9 +1,8 @@
 from modular_drl_env.robot.robot import Robot
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from gym.spaces import Box
 from ..lidar import LidarSensor
-from modular_drl_env.util.quaternion_util import quaternion_to_matrix
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 
 __all__ = [
@@ -39,14 +38,6 @@ class LidarSensorKR16(LidarSensor):
         self.ray_start = ray_start  # offset of the ray start from the mesh center
         self.ray_end = ray_end  # end of the ray, meaning ray length = ray_end - ray_start
 
-        # indicator conversion setup
-        raw_bucket_size = 1 / indicator_buckets  # 1 is the range of pybullet lidar data (from 0 to 1)
-        indicator_label_diff = 2 / indicator_buckets  # 2 is the range of the indicator data (from -1 to 1)
-        # lambda function to convert to indicator based on bucket size
-        self.raw_to_indicator = lambda x : 1 if x >= 0.99 else round((np.max([(np.ceil(x/raw_bucket_size)-1),0]) * indicator_label_diff - 1),5)
-        # short explanation: takes a number between 0 and 1, assigns it a bucket in the range, and returns the corresponding bucket in the range of -1 and 1
-        # the round is thrown in there to prevent weird numeric appendages that came up in testing, e.g. 0.200000000004, -0.199999999999 or the like
-
         # determine shape out output
         self.lidar_indicator_shape = 0
         for key in self.ray_setup:
@@ -61,104 +52,58 @@ class LidarSensorKR16(LidarSensor):
         # and then keep only those that were activated by the user, this way we can process the results from the PyBullet call in the right order
         self.output_order = [ele for ele in self.output_order if ele in self.ray_setup]
 
-        # data storage
-        self.rays_starts = []
-        self.rays_ends = []
-        self.results = []
-
+        # define all rays once in the frames of their links, every update then only has to move them into the world frame
+        ray_groups = []
+        for key in self.output_order:
+            n_directions, n_rays_p_direction = self.ray_setup[key]
+            shape = (n_directions, n_rays_p_direction)
+            # angles along the first axis, ray rows along the second
+            i = np.arange(n_rays_p_direction)[None, :]
+            # end effector forwards ray
+            if key == "ee_forward":
+                ray_groups.append(("ee_link", self._ray_grid(shape, 0, 0, self.ray_start), self._ray_grid(shape, 0, 0, self.ray_end)))
+            # cone rays from end effector
+            elif key == "ee_cone":
+                angle = np.linspace(230 * (np.pi / 180), 270 * (np.pi/180), n_directions)[:, None]
+                z = -self.ray_end * np.sin(angle)
+                l = self.ray_end * np.cos(angle)
+                x_end = l * np.cos(2 * np.pi * i / n_rays_p_direction)
+                y_end = l * np.sin(2 * np.pi * i / n_rays_p_direction)
+                ray_groups.append(("ee_link", self._ray_grid(shape, 0, 0, self.ray_start), self._ray_grid(shape, x_end, y_end, z)))
+            # around head circle rays
+            elif key == "ee_side_circle":
+                angle = np.linspace(0, 2 * np.pi - 2 * np.pi/n_directions, n_directions)[:, None]
+                interval = -0.005
+                z = i * interval - 0.1
+                ray_groups.append(("ee_link", self._ray_grid(shape, self.ray_start * np.cos(angle), self.ray_start * np.sin(angle), z),
+                                              self._ray_grid(shape, self.ray_end * np.cos(angle), self.ray_end * np.sin(angle), z)))
+            # rays from the back of the end effector
+            elif key == "ee_back_cone":
+                angle = np.linspace(230 * (np.pi / 180), 290 * (np.pi/180), n_directions)[:, None]
+                l = self.ray_end * np.cos(angle)
+                z_end = self.ray_end * np.sin(angle)
+                x_end = l * np.cos(np.pi * i / n_rays_p_direction - np.pi / 2)
+                y_end = l * np.sin(np.pi * i / n_rays_p_direction - np.pi / 2)
+                ray_groups.append(("ee_link", self._ray_grid(shape, 0, 0, self.ray_start - 0.25), self._ray_grid(shape, x_end, y_end, z_end - 0.25)))
+            # rays around the upper arm of the end effector
+            else:
+                angle = np.linspace(0, 2 * np.pi - 2 * np.pi/n_directions, n_directions)[:, None]
+                interval = -0.48 / n_rays_p_direction  # evenly space rays along entire length, arm length of 0.48 found out by testing and does not account for potential urdf mesh scaling
+                extra_offset = 0.095
+                ray_groups.append(("link_3", self._ray_grid(shape, i * interval + 0.5, (self.ray_start + extra_offset) * np.sin(angle), (-self.ray_start - extra_offset) * np.cos(angle) - 0.05),
+                                             self._ray_grid(shape, i * interval + 0.5, self.ray_end * np.sin(angle), -self.ray_end * np.cos(angle) - 0.05)))
+        self._setup_ray_groups(ray_groups)
 
     def get_observation_space_element(self) -> dict:
         return {self.output_name: Box(low=-1, high=1, shape=(self.lidar_indicator_shape,), dtype=np.float32)}
 
     def _get_lidar_data(self):
-        
-        self.rays_starts = []
-        self.rays_ends = []
-
-        
-        pos_ee, or_ee, _, _ = pyb_u.get_link_state(self.robot.object_id, "ee_link")
-        frame_ee = np.eye(4)
-        frame_ee[:3, :3] = quaternion_to_matrix(or_ee)
-        frame_ee[0:3, 3] = pos_ee
-
-        # deal with all activated links
-        # end effector forwards ray:
-        if "ee_forward" in self.ray_setup:
-            self.rays_starts.append(np.matmul(frame_ee, np.array([0, 0, self.ray_start, 1]).T)[0:3].tolist())
-            self.rays_ends.append(np.matmul(frame_ee, np.array([0, 0, self.ray_end, 1]).T)[0:3].tolist())
-
-        interval = -0.005
-        # cone rays from end effector
-        if "ee_cone" in self.ray_setup:
-            for angle in np.linspace(230 * (np.pi / 180), 270 * (np.pi/180), self.ray_setup["ee_cone"][0]):
-                for i in range(self.ray_setup["ee_cone"][1]):
-                    z = -self.ray_end * np.sin(angle)
-                    l = self.ray_end * np.cos(angle)
-                    x_end = l * np.cos(2 * np.pi * i / self.ray_setup["ee_cone"][1])
-                    y_end = l * np.sin(2 * np.pi * i / self.ray_setup["ee_cone"][1])
-                    self.rays_starts.append(np.matmul(frame_ee, np.array([0, 0, self.ray_start, 1]).T)[0:3].tolist())
-                    self.rays_ends.append(np.matmul(frame_ee, np.array([x_end, y_end, z, 1]).T)[0:3].tolist())
-        
-        # around head circle rays
-        if "ee_side_circle" in self.ray_setup:
-            for angle in np.linspace(0, 2 * np.pi - 2 * np.pi/self.ray_setup["ee_side_circle"][0], self.ray_setup["ee_side_circle"][0]):
-                for i in range(self.ray_setup["ee_side_circle"][1]):
-                    z_start = i * interval - 0.1
-                    x_start = self.ray_start * np.cos(angle)
-                    y_start = self.ray_start * np.sin(angle)
-                    z_end = i * interval - 0.1
-                    x_end = self.ray_end * np.cos(angle)
-                    y_end = self.ray_end * np.sin(angle)
-                    self.rays_starts.append(np.matmul(frame_ee, np.array([x_start, y_start, z_start, 1]).T)[0:3].tolist())
-                    self.rays_ends.append(np.matmul(frame_ee, np.array([x_end, y_end, z_end, 1]).T)[0:3].tolist())
-
-        # rays from the back of the end effector
-        if "ee_back_cone" in self.ray_setup:
-            for angle in np.linspace(230 * (np.pi / 180), 290 * (np.pi/180), self.ray_setup["ee_back_cone"][0]):
-                for i in range(self.ray_setup["ee_back_cone"][1]):
-                    l = self.ray_end * np.cos(angle)
-                    z_end = self.ray_end * np.sin(angle)
-                    x_end = l * np.cos(np.pi * i / self.ray_setup["ee_back_cone"][1] - np.pi / 2)
-                    y_end = l * np.sin(np.pi * i / self.ray_setup["ee_back_cone"][1] - np.pi / 2)
-                    self.rays_starts.append(np.matmul(frame_ee, np.array([0, 0, self.ray_start - 0.25, 1]).T)[0:3].tolist())
-                    self.rays_ends.append(np.matmul(frame_ee, np.array([x_end, y_end, z_end - 0.25, 1]).T)[0:3].tolist())
-
-        # rays around the upper arm of the end effector
-        if "upper_arm" in self.ray_setup: 
-            interval = -0.48 / self.ray_setup["upper_arm"][1]  # evenly space rays along entire length, arm length of 0.48 found out by testing and does not account for potential urdf mesh scaling
-            pos_ar, or_ar, _, _ = pyb_u.get_link_state(self.robot.object_id, 'link_3')
-            frame_arm = np.eye(4)
-            frame_arm[:3, :3] = quaternion_to_matrix(or_ar)
-            frame_arm[0:3, 3] = pos_ar
-            extra_offset = 0.095
-            for angle in np.linspace(0, 2 * np.pi - 2 * np.pi/self.ray_setup["upper_arm"][0], self.ray_setup["upper_arm"][0]):
-                for i in range(self.ray_setup["upper_arm"][1]):
-                    self.rays_starts.append(np.matmul(frame_arm, np.array([i * interval + 0.5, (self.ray_start + extra_offset) * np.sin(angle), (-self.ray_start - extra_offset) * np.cos(angle) - 0.05, 1]).T)[0:3].tolist())
-                    self.rays_ends.append(np.matmul(frame_arm, np.array([i * interval + 0.5, self.ray_end * np.sin(angle), -self.ray_end * np.cos(angle) - 0.05, 1]).T)[0:3].tolist())
-
-        self.results = pyb.rayTestBatch(self.rays_starts, self.rays_ends)
-        
-        return np.array(self.results, dtype=object)[:,2]  # keeps only the distance information
+        # minimum hit fraction of every direction, already in the order of the output
+        return self._cast_ray_groups()
 
     def _process_raw_lidar(self, raw_lidar_data):
-
-        indicator = np.zeros(self.lidar_indicator_shape)
-        distances = np.zeros(self.lidar_indicator_shape)
-
-        # conversion
-        # the list slicing here is messy but basically just follows the way the rays were put into the source array following the _get_lidar_data method
-        raw_data_offset = 0
-        indicator_offset = 0
-        for j in range(len(self.output_order)): 
-            # get nums for this link
-            n_rays_p_direction = self.ray_setup[self.output_order[j]][1]
-            for i in range(self.ray_setup[self.output_order[j]][0]):
-                lidar_min = raw_lidar_data[raw_data_offset + i * n_rays_p_direction : raw_data_offset + (i + 1) * n_rays_p_direction].min()
-                indicator[indicator_offset + i] = self.raw_to_indicator(lidar_min)
-                distances[indicator_offset + i] = lidar_min * (self.ray_end - self.ray_start) + self.ray_start
-            raw_data_offset += n_rays_p_direction * self.ray_setup[self.output_order[j]][0]
-            indicator_offset += self.ray_setup[self.output_order[j]][0]
-    
+        indicator = self._raw_to_indicator(raw_lidar_data)
+        distances = raw_lidar_data * (self.ray_end - self.ray_start) + self.ray_start
         return indicator, distances
 
     def build_visual_aux(self):
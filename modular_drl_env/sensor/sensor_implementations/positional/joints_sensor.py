@@ -51,14 +51,14 @@ class JointsSensor(Sensor):
     def update(self, step) -> dict:
         self.cpu_epoch = process_time()
         if step % self.update_steps == 0:
-            self.joints_angles, self.joints_velocities = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_ids)
+            self.joints_angles, self.joints_velocities = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_group)
         self.cpu_time = process_time() - self.cpu_epoch
 
         return self.get_observation()
 
     def reset(self):
         self.cpu_epoch = process_time()
-        self.joints_angles, _ = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_ids)
+        self.joints_angles, _ = pyb_u.get_joint_states(self.robot.object_id, self.robot.controlled_joints_group)
         self.joints_velocities = np.zeros(self.joints_dims)
         self.cpu_time = process_time() - self.cpu_epoch
 
@@ -71,6 +71,19 @@ class JointsSensor(Sensor):
                 ret_dict[self.output_name_vels] = self.joints_velocities
             return ret_dict
 
+    def write_observation(self, views: dict):
+        if self.normalize:
+            # a * x + b, computed right in the buffer
+            np.multiply(self.normalizing_constant_a, self.joints_angles, out=views[self.output_name])
+            views[self.output_name] += self.normalizing_constant_b
+            if self.add_joint_velocities:
+                np.multiply(self.normalizing_constant_a_vels, self.joints_velocities, out=views[self.output_name_vels])
+                views[self.output_name_vels] += self.normalizing_constant_b_vels
+        else:
+            views[self.output_name][:] = self.joints_angles
+            if self.add_joint_velocities:
+                views[self.output_name_vels][:] = self.joints_velocities
+
     def _normalize(self) -> dict:
         ret_dict = {self.output_name: np.multiply(self.normalizing_constant_a, self.joints_angles) + self.normalizing_constant_b}
         if self.add_joint_velocities:
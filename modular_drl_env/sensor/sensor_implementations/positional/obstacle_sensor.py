@@ -1,4 +1,4 @@
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from gym.spaces import Box
 import numpy as np
 from modular_drl_env.sensor.sensor import Sensor
@@ -69,7 +69,8 @@ class ObstacleSensor(Sensor):
 
         # probe object
         self.default_position = np.array([0, 0, -10])
-        self.probe = pyb_u.create_sphere(self.default_position, 0, 0.001, color = [0.5, 0.5, 0.5, 0.0001], collision=True)  
+        self.probe_radius = 0.001
+        self.probe = pyb_u.create_sphere(self.default_position, 0, self.probe_radius, color = [0.5, 0.5, 0.5, 0.0001], collision=True)  
 
         # extra points via linear interpolation between selected links
         self.extra_points_link_pairs = extra_points_link_pairs
@@ -78,12 +79,20 @@ class ObstacleSensor(Sensor):
         self.num_extra = sum([tup[2] for tup in self.extra_points_link_pairs])
         self.extra_points_coordinates = np.zeros((self.num_extra, 3))
 
+        # all links whose positions we need each update, the reference links first
+        self.query_link_ids = list(self.reference_link_ids)
+        for link1, link2, _ in self.extra_points_link_pairs:
+            for link in [link1, link2]:
+                if link not in self.query_link_ids:
+                    self.query_link_ids.append(link)
+        self.query_link_group = pyb_u.get_link_group(self.robot.object_id, self.query_link_ids)
+
         # init data storage
         self.output_vector = np.tile(self.default_observation, (len(self.reference_link_ids) + self.num_extra, 1))
         self.output_vector_vels = np.tile(self.default_observation_vels, (len(self.reference_link_ids) + self.num_extra, 1))
         self.output_vector_distances = np.tile(self.default_observation_distances, (len(self.reference_link_ids) + self.num_extra, 1))
         self.output_vector_points = np.tile(self.default_observation_points, (len(self.reference_link_ids) + self.num_extra, 1))
-        self.data_raw = [None for _ in range(len(self.reference_link_ids) + self.num_extra)]
+        self.data_raw = [np.zeros((0, 7)) for _ in range(len(self.reference_link_ids) + self.num_extra)]
 
         # attributes for outside access
         self.min_dist = np.inf
@@ -107,85 +116,29 @@ class ObstacleSensor(Sensor):
 
     def update(self, step) -> dict:
         self.cpu_epoch = process_time()
-        if step % self.update_steps == 0:
-            self.min_dist = np.inf
-            # do the locations associated with a URDF link first
-            for idx, link in enumerate(self.reference_link_ids):
-                link_position, _, link_velocity, _ = pyb_u.get_link_state(self.robot.object_id, link)
-                self.link_positions[link] = link_position
-                self.link_velocities[link] = link_velocity
-                pyb_u.set_base_pos_and_ori(self.probe, link_position, np.array([0, 0, 0, 1]))
-
-                self.output_vector[idx] = self.default_observation
-                self.output_vector_vels[idx] = self.default_observation_vels
-                self.output_vector_points[idx] = self.default_observation_points
-                self.output_vector_distances[idx] = self.default_observation_distances
-                self.data_raw[idx] = self._run_obstacle_detection()
-                new_data, new_vels, new_points, new_distances = self._process(self.data_raw[idx])
-                self.output_vector[idx][:len(new_data)] = new_data
-                if self.report_velocities:
-                    self.output_vector_vels[idx][:len(new_vels)] = new_vels
-                if self.report_distances:
-                    self.output_vector_distances[idx][:len(new_distances)] = new_distances
-                if self.report_points:
-                    self.output_vector_points[idx][:len(new_points)] = new_points
-                if self.sphere_coordinates:
-                    self.min_dist = min(self.min_dist, self.output_vector[idx][0])
-                else:
-                    self.min_dist = min(self.min_dist, np.linalg.norm(self.output_vector[idx][:3]))
-            # now go trough the linear interpolation extra points if the user desires so
-            for tup in self.extra_points_link_pairs:
-                idx += 1
-                link1, link2, num = tup
-                # in case we don't track the links but still want to have extra points, check and get the position if needed
-                if link1 in self.link_positions:
-                    pos1 = self.link_positions[link1]
-                else:
-                    pos1, _, _, _ = pyb_u.get_link_state(self.robot.object_id, link1)
-                if link2 in self.link_positions:
-                    pos2 = self.link_positions[link2]
-                else:
-                    pos2, _, _, _ = pyb_u.get_link_state(self.robot.object_id, link2)
-                extra_positions = interpolate_3d(pos1, pos2, num)
-                for extra_position in extra_positions:
-                    pyb_u.set_base_pos_and_ori(self.probe, extra_position, np.array([0, 0, 0, 1]))
-                    self.output_vector[idx] = self.default_observation
-                    self.output_vector_vels[idx] = self.default_observation_vels
-                    self.output_vector_points[idx] = self.default_observation_points
-                    self.output_vector_distances[idx] = self.default_observation_distances
-                    self.data_raw[idx] = self._run_obstacle_detection()
-                    new_data, new_vels, new_points, new_distances = self._process(self.data_raw[idx])
-                    self.output_vector[idx][:len(new_data)] = new_data
-                    if self.report_velocities:
-                        self.output_vector_vels[idx][:len(new_vels)] = new_vels
-                    if self.report_distances:
-                        self.output_vector_distances[idx][:len(new_distances)] = new_distances
-                    if self.report_points:
-                        self.output_vector_points[idx][:len(new_points)] = new_points
-                    if self.sphere_coordinates:
-                        self.min_dist = min(self.min_dist, self.output_vector[idx][0])
-                    else:
-                        self.min_dist = min(self.min_dist, np.linalg.norm(self.output_vector[idx][:3]))
-            pyb_u.set_base_pos_and_ori(self.probe, self.default_position, np.array([0, 0, 0, 1]))
+        # nothing to measure if neither the robot nor anything around it moved
+        if step % self.update_steps == 0 and not self._scene_unchanged():
+            self._update_outputs()
         self.cpu_time = process_time() - self.cpu_epoch
 
         return self.get_observation()
 
     def reset(self):
         self.cpu_epoch = process_time()
+        self._scene_key = None
+        self._update_outputs()
+        self.cpu_time = process_time() - self.cpu_epoch
+        self.aux_visual_objects = []
 
+    def _update_outputs(self):
         self.min_dist = np.inf
-        for idx, link in enumerate(self.reference_link_ids):
-            link_position, _, link_velocity, _ = pyb_u.get_link_state(self.robot.object_id, link)
-            self.link_positions[link] = link_position
-            self.link_velocities[link] = link_velocity
-            pyb_u.set_base_pos_and_ori(self.probe, link_position, np.array([0, 0, 0, 1]))
-
+        probe_positions = self._get_probe_positions()
+        self.data_raw = self._run_obstacle_detection(probe_positions)
+        for idx in range(len(probe_positions)):
             self.output_vector[idx] = self.default_observation
             self.output_vector_vels[idx] = self.default_observation_vels
             self.output_vector_points[idx] = self.default_observation_points
             self.output_vector_distances[idx] = self.default_observation_distances
-            self.data_raw[idx] = self._run_obstacle_detection()
             new_data, new_vels, new_points, new_distances = self._process(self.data_raw[idx])
             self.output_vector[idx][:len(new_data)] = new_data
             if self.report_velocities:
@@ -198,41 +151,23 @@ class ObstacleSensor(Sensor):
                 self.min_dist = min(self.min_dist, self.output_vector[idx][0])
             else:
                 self.min_dist = min(self.min_dist, np.linalg.norm(self.output_vector[idx][:3]))
-        for tup in self.extra_points_link_pairs:
-            link1, link2, num = tup
-            # in case we don't track the links but still want to have extra points, check and get the position if needed
-            if link1 in self.link_positions:
-                pos1 = self.link_positions[link1]
-            else:
-                pos1, _, _, _ = pyb_u.get_link_state(self.robot.object_id, link1)
-            if link2 in self.link_positions:
-                pos2 = self.link_positions[link2]
-            else:
-                pos2, _, _, _ = pyb_u.get_link_state(self.robot.object_id, link2)
-            extra_positions = interpolate_3d(pos1, pos2, num)
-            for extra_position in extra_positions:
-                idx += 1
-                pyb_u.set_base_pos_and_ori(self.probe, extra_position, np.array([0, 0, 0, 1]))
-                self.output_vector[idx] = self.default_observation
-                self.output_vector_vels[idx] = self.default_observation_vels
-                self.output_vector_points[idx] = self.default_observation_points
-                self.output_vector_distances[idx] = self.default_observation_distances
-                self.data_raw[idx] = self._run_obstacle_detection()
-                new_data, new_vels, new_points, new_distances = self._process(self.data_raw[idx])
-                self.output_vector[idx][:len(new_data)] = new_data
-                if self.report_velocities:
-                    self.output_vector_vels[idx][:len(new_vels)] = new_vels
-                if self.report_distances:
-                    self.output_vector_distances[idx][:len(new_distances)] = new_distances
-                if self.report_points:
-                    self.output_vector_points[idx][:len(new_points)] = new_points
-                if self.sphere_coordinates:
-                    self.min_dist = min(self.min_dist, self.output_vector[idx][0])
-                else:
-                    self.min_dist = min(self.min_dist, np.linalg.norm(self.output_vector[idx][:3]))
-        pyb_u.set_base_pos_and_ori(self.probe, self.default_position, np.array([0, 0, 0, 1]))
-        self.cpu_time = process_time() - self.cpu_epoch
-        self.aux_visual_objects = []
+
+    def _get_probe_positions(self) -> np.ndarray:
+        """
+        Returns the positions of all the points the sensor measures from, first the reference links, then the extra points.
+        """
+        # one engine call for all the links we need
+        link_positions, _, link_velocities, _ = pyb_u.get_link_states(self.robot.object_id, self.query_link_group)
+        for link, link_position, link_velocity in zip(self.query_link_ids, link_positions, link_velocities):
+            self.link_positions[link] = link_position
+            self.link_velocities[link] = link_velocity
+        probe_positions = [link_positions[:len(self.reference_link_ids)]]
+        # now the linear interpolation extra points if the user desires so
+        for link1, link2, num in self.extra_points_link_pairs:
+            probe_positions.append(interpolate_3d(self.link_positions[link1], self.link_positions[link2], num).reshape(-1, 3))
+        probe_positions = np.vstack(probe_positions)
+        self.extra_points_coordinates = probe_positions[len(self.reference_link_ids):]
+        return probe_positions
 
     def get_observation(self) -> dict:
         if self.normalize:
@@ -308,49 +243,85 @@ class ObstacleSensor(Sensor):
         else:
             return {}
 
-    def _run_obstacle_detection(self):
-
-        res = []
-        # get nearest robots
-        for object in self.robot.world.active_objects:
-            if not object.seen_by_obstacle_sensor:
-                continue
-            closestPoints = pyb.getClosestPoints(pyb_u.to_pb(self.probe), pyb_u.to_pb(object.object_id), self.max_distance)
-            if not closestPoints:
+    def _run_obstacle_detection(self, probe_positions: np.ndarray) -> List[np.ndarray]:
+        """
+        Returns the raw data for the nearest obstacles for all probe positions at once.
+        Obstacles with simple geometry are handled analytically in one vectorized go,
+        everything else (e.g. meshes) is measured with the probe sphere via the engine.
+        """
+        num_probes = len(probe_positions)
+        # broad phase: only obstacles in the vicinity of the probes can be within max distance
+        margin = self.max_distance + self.probe_radius
+        nearby_objects = self.robot.world.get_active_objects_near(np.min(probe_positions, axis=0) - margin, np.max(probe_positions, axis=0) + margin)
+        seen_objects = [object for object in nearby_objects if object.seen_by_obstacle_sensor]
+        # shapes: (obstacles, probes, ...)
+        starts = np.zeros((len(seen_objects), num_probes, 3))
+        ends = np.zeros((len(seen_objects), num_probes, 3))
+        distances = np.full((len(seen_objects), num_probes), np.inf)
+
+        # group obstacles by their class such that all obstacles of one shape can be dealt with in one go
+        groups = dict()
+        for idx, object in enumerate(seen_objects):
+            groups.setdefault(type(object), []).append(idx)
+        probe_moved = False
+        # the probe ends up where it was, so moving it doesn't count as a change of the scene
+        move_counter = pyb_u.move_counter
+        for obstacle_class, idxs in groups.items():
+            analytic = obstacle_class.closest_points([seen_objects[idx] for idx in idxs], probe_positions)
+            if analytic is not None:
+                closest, normals, dists = analytic
+                # pybullet measures from the surface of the probe sphere, so we do the same to get consistent results
+                starts[idxs] = probe_positions[None, :, :] - self.probe_radius * normals
+                ends[idxs] = closest
+                distances[idxs] = dists - self.probe_radius
                 continue
-            min_val = min(closestPoints, key=lambda x: x[8])  # index 8 is the distance in the object returned by pybullet
+            # no analytic solution, use the probe sphere and the engine
+            for probe_idx, probe_position in enumerate(probe_positions):
+                pyb_u.set_base_pos_and_ori(self.probe, probe_position, np.array([0, 0, 0, 1]))
+                probe_moved = True
+                for idx in idxs:
+                    closestPoints = pyb.getClosestPoints(pyb_u.to_pb(self.probe), pyb_u.to_pb(seen_objects[idx].object_id), self.max_distance)
+                    if not closestPoints:
+                        continue
+                    min_val = min(closestPoints, key=lambda x: x[8])  # index 8 is the distance in the object returned by pybullet
+                    starts[idx, probe_idx] = min_val[5]
+                    ends[idx, probe_idx] = min_val[6]
+                    distances[idx, probe_idx] = min_val[8]
+        if probe_moved:
+            pyb_u.set_base_pos_and_ori(self.probe, self.default_position, np.array([0, 0, 0, 1]))
+            pyb_u.move_counter = move_counter
+
+        width = 10 if self.report_velocities else 7
+        velocities = np.array([object.velocity for object in seen_objects]).reshape(-1, 3)
+        distances[distances > self.max_distance] = np.inf
+        # sort per probe, stable to keep the order of the active objects on ties
+        order = np.argsort(distances, axis=0, kind="stable")[:self.num_obstacles]
+
+        ret = []
+        for probe_idx in range(num_probes):
+            obst_idx = order[:, probe_idx]
+            obst_idx = obst_idx[distances[obst_idx, probe_idx] != np.inf]
+            data = np.empty((len(obst_idx), width))
+            data[:, 0:3] = starts[obst_idx, probe_idx]  # start
+            data[:, 3:6] = ends[obst_idx, probe_idx]  # end
+            data[:, 6] = distances[obst_idx, probe_idx]  # distance
             if self.report_velocities:
-                res.append(np.hstack([np.array(min_val[5]), np.array(min_val[6]), min_val[8], object.velocity]))  # start, end, distance, velocity
-            else:
-                res.append(np.hstack([np.array(min_val[5]), np.array(min_val[6]), min_val[8]]))
+                data[:, 7:10] = velocities[obst_idx]  # velocity
+            ret.append(data)
 
-        # sort
-        res.sort(key=lambda x: x[6])
-        # extract n closest ones
-        smallest_n = res[:self.num_obstacles]
-
-        return np.array(smallest_n)
+        return ret
 
     def _process(self, data_raw):
-        data_processed = []
-        vels_processed = []
-        points_processed = []
-        distances_processed = []
-        for i in range(len(data_raw)):
-            vector = data_raw[i][3:6] -  data_raw[i][0:3]
-            if self.sphere_coordinates:
-                r = np.linalg.norm(vector)
-                theta = np.arccos(vector[2]/r)
-                phi = np.arctan2(vector[1], vector[0])
-                vector = np.array([r, theta, phi])
-            data_processed.append(vector)
-            if self.report_velocities:
-                vels_processed.append(data_raw[i][7:10])
-            if self.report_points:
-                points_processed.append(data_raw[i][3:6])
-            if self.report_distances:
-                distances_processed.append(np.linalg.norm(vector))
-        return np.array(data_processed).flatten(), np.array(vels_processed).flatten(), np.array(points_processed).flatten(), np.array(distances_processed).flatten()
+        vectors = data_raw[:, 3:6] - data_raw[:, 0:3]
+        if self.sphere_coordinates:
+            r = np.linalg.norm(vectors, axis=1)
+            theta = np.arccos(vectors[:, 2] / r)
+            phi = np.arctan2(vectors[:, 1], vectors[:, 0])
+            vectors = np.stack([r, theta, phi], axis=1)
+        vels_processed = data_raw[:, 7:10].flatten() if self.report_velocities else np.array([])
+        points_processed = data_raw[:, 3:6].flatten() if self.report_points else np.array([])
+        distances_processed = np.linalg.norm(vectors, axis=1) if self.report_distances else np.array([])
+        return vectors.flatten(), vels_processed, points_processed, distances_processed
 
     def get_data_for_logging(self) -> dict:
         if not self.add_to_logging:
@@ -443,23 +414,38 @@ class ObstacleAbsoluteSensor(Sensor):
             ret["obstacle_velocities"] = self.velocities
             ret["obstacle_distances"] = self.distances
         return ret
+
+    def write_observation(self, views: dict):
+        if self.normalize:
+            np.multiply(self.normalizing_constant_a_pos, self.positions, out=views["obstacle_positions"])
+            views["obstacle_positions"] += self.normalizing_constant_b_pos
+            np.multiply(self.normalizing_constant_a_vel, self.velocities, out=views["obstacle_velocities"])
+            views["obstacle_velocities"] += self.normalizing_constant_b_vel
+            np.divide(self.distances, self.max_distance, out=views["obstacle_distances"])
+        else:
+            views["obstacle_positions"][:] = self.positions
+            views["obstacle_velocities"][:] = self.velocities
+            views["obstacle_distances"][:] = self.distances
     
     def update(self, step) -> dict:
         cpu_epoch = process_time()
-        if step % self.update_steps == 0:
+        if step % self.update_steps == 0 and not self._scene_unchanged():
             self._get_data()
         self.cpu_time = process_time() - cpu_epoch
         return self.get_observation()
 
     def reset(self):
         cpu_epoch = process_time()
+        self._scene_key = None
         self._get_data()
         self.cpu_time = process_time() - cpu_epoch
     
     def _get_data(self):
         # check the distances of all active obstacles
         candidates = []
-        for obstacle in self.robot.world.active_objects:
+        # broad phase: only obstacles in the vicinity of the robot can be within max distance
+        low, high = pyb_u.get_aabb(self.robot.object_id)
+        for obstacle in self.robot.world.get_active_objects_near(low - self.max_distance, high + self.max_distance):
             if not obstacle.seen_by_obstacle_sensor:
                 continue
             pyb_data = pyb.getClosestPoints(pyb_u.to_pb(self.robot.object_id), pyb_u.to_pb(obstacle.object_id), self.max_distance)
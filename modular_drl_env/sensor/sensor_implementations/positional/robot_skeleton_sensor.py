@@ -64,6 +64,9 @@ class RobotSkeletonSensor(Sensor):
         self.normalizing_constant_a_vel = 2 / (np.ones(3) * 50)  # arbitrary max of 25 m/s, we don't really know the max speed of robot end effectors in general
         self.normalizing_constant_b_vel = np.ones(3) - np.multiply(self.normalizing_constant_b_pos, np.ones(3) * 25)
 
+        # pre-resolved pybullet handle for the reference links
+        self.reference_link_group = pyb_u.get_link_group(self.robot.object_id, self.reference_link_ids)
+
         # data storage
         self.positions = {}
         self.velocities = {}
@@ -118,7 +121,7 @@ class RobotSkeletonSensor(Sensor):
     def update(self, step) -> dict:
         self.cpu_epoch = process_time()
         if step % self.update_steps == 0:
-            pos, _, vel, _ = pyb_u.get_link_states(self.robot.object_id, self.reference_link_ids)
+            pos, _, vel, _ = pyb_u.get_link_states(self.robot.object_id, self.reference_link_group)
             for idx, link in enumerate(self.reference_link_ids):
                 self.positions[link] = pos[idx]
                 self.velocities[link] = vel[idx]
@@ -144,7 +147,7 @@ class RobotSkeletonSensor(Sensor):
         pass
 
     def reset(self):
-        pos, _, vel, _ = pyb_u.get_link_states(self.robot.object_id, self.reference_link_ids)
+        pos, _, vel, _ = pyb_u.get_link_states(self.robot.object_id, self.reference_link_group)
         for idx, link in enumerate(self.reference_link_ids):
             self.positions[link] = pos[idx]
             self.velocities[link] = vel[idx]
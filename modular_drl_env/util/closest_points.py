@@ -0,0 +1,111 @@
+import numpy as np
+from typing import Tuple
+from modular_drl_env.util.quaternion_util import quaternions_to_matrices
+
+# analytic, vectorized closest point queries between a batch of M obstacles of the same primitive shape and a batch of N points
+# the results mirror what pybullet's getClosestPoints reports for the same shapes, this includes the small collision margin
+# pybullet puts around boxes and cylinders (i.e. their edges and corners are rounded off by that margin)
+# spheres and boxes agree with pybullet up to floating point noise, for cylinders see the bounds in closest_points_cylinders
+# all methods return three arrays:
+#   - closest points on the obstacles' surfaces, (M, N, 3)
+#   - contact normals on the obstacles pointing towards the query points, (M, N, 3)
+#   - signed distances between points and surfaces, negative if a point is inside an obstacle, (M, N)
+
+# collision margin pybullet uses for its box and cylinder shapes
+PYBULLET_COLLISION_MARGIN = 0.001
+
+def _rotations(orientations: np.ndarray) -> np.ndarray:
+    # pybullet normalizes quaternions on its end, so we have to do the same
+    return quaternions_to_matrices(orientations / np.linalg.norm(orientations, axis=1)[:, None])
+
+def _safe_normalize(vectors: np.ndarray, default: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # normalizes along the last axis, zero length vectors get an arbitrary but fixed default direction
+    norms = np.linalg.norm(vectors, axis=-1)
+    nonzero = norms > 0
+    normalized = np.where(nonzero[..., None], vectors / np.where(nonzero, norms, 1)[..., None], default)
+    return normalized, norms
+
+def closest_points_spheres(points: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closest points on the surfaces of spheres for a batch of points.
+    """
+    normals, norms = _safe_normalize(points[None, :, :] - centers[:, None, :], np.array([0., 0., 1.]))
+    return centers[:, None, :] + radii[:, None, None] * normals, normals, norms - radii[:, None]
+
+def closest_points_boxes(points: np.ndarray, centers: np.ndarray, orientations: np.ndarray, half_extents: np.ndarray, margin: float=PYBULLET_COLLISION_MARGIN) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closest points on the surfaces of oriented boxes for a batch of points.
+    """
+    rots = _rotations(orientations)
+    # transform into the box frames, row vectors times rot equals rot.T times column vectors
+    local = (points[None, :, :] - centers[:, None, :]) @ rots
+    local_abs = np.abs(local)
+    signs = np.where(local >= 0, 1., -1.)
+    half_extents = half_extents[:, None, :]
+    core = half_extents - margin
+    excess = local_abs - core
+    outside = np.any(excess > 0, axis=-1)
+
+    # outside of the (margin-shrunken) core box: closest point on the core plus the margin in normal direction
+    closest_core = signs * np.minimum(local_abs, core)
+    normals_out, norms = _safe_normalize(local - closest_core, np.array([0., 0., 1.]))
+    closest_out = closest_core + margin * normals_out
+    distances_out = norms - margin
+
+    # inside: push out through the nearest face
+    axis = np.argmax(excess, axis=-1)[..., None]
+    face = np.arange(3) == axis
+    normals_in = face * signs
+    closest_in = np.where(face, signs * half_extents, local)
+    distances_in = np.take_along_axis(local_abs - half_extents, axis, axis=-1)[..., 0]
+
+    closest = np.where(outside[..., None], closest_out, closest_in)
+    normals = np.where(outside[..., None], normals_out, normals_in)
+    distances = np.where(outside, distances_out, distances_in)
+
+    rots_t = rots.transpose(0, 2, 1)
+    return centers[:, None, :] + closest @ rots_t, normals @ rots_t, distances
+
+def closest_points_cylinders(points: np.ndarray, centers: np.ndarray, orientations: np.ndarray, radii: np.ndarray, heights: np.ndarray, margin: float=PYBULLET_COLLISION_MARGIN) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closest points on the surfaces of oriented cylinders (axis along their local z) for a batch of points.
+    These are exact for the margin-rounded cylinder, pybullet only approximates them (GJK and EPA on a curved shape). Compared to getClosestPoints
+    on random points around and in cylinders of 2 to 30 cm radius: near the caps and rims the end points agree within 1e-6 m,
+    next to the mantle pybullet's end points are off by up to about 1.2 mm (its points are always the farther ones, the distances agree within 3e-5 m),
+    for points inside distances differ by up to 6e-5 m and close to the axis the end points can lie anywhere on the mantle.
+    Therefore the Cylinder obstacle doesn't use this and leaves cylinders to the engine.
+    """
+    rots = _rotations(orientations)
+    local = (points[None, :, :] - centers[:, None, :]) @ rots
+    radial, rho = _safe_normalize(local[..., :2], np.array([1., 0.]))
+    z = local[..., 2]
+    z_signs = np.where(z >= 0, 1., -1.)
+    radii = radii[:, None]
+    half_heights = heights[:, None] / 2
+    core_radii = radii - margin
+    core_half_heights = half_heights - margin
+    excess_radial = rho - core_radii
+    excess_axial = np.abs(z) - core_half_heights
+    outside = (excess_radial > 0) | (excess_axial > 0)
+
+    # outside of the core cylinder: closest point on the core plus the margin in normal direction
+    closest_core = np.concatenate([radial * np.minimum(rho, core_radii)[..., None], np.clip(z, -core_half_heights, core_half_heights)[..., None]], axis=-1)
+    normals_out, norms = _safe_normalize(local - closest_core, np.array([0., 0., 1.]))
+    closest_out = closest_core + margin * normals_out
+    distances_out = norms - margin
+
+    # inside: push out through the mantle or the caps, whichever is closer
+    through_mantle = (excess_radial >= excess_axial)[..., None]
+    zeros = np.zeros_like(z)[..., None]
+    normals_in = np.where(through_mantle, np.concatenate([radial, zeros], axis=-1), np.concatenate([zeros, zeros, z_signs[..., None]], axis=-1))
+    closest_in = np.where(through_mantle,
+                          np.concatenate([radial * radii[..., None], z[..., None]], axis=-1),
+                          np.concatenate([local[..., :2], (z_signs * half_heights)[..., None]], axis=-1))
+    distances_in = np.where(through_mantle[..., 0], rho - radii, np.abs(z) - half_heights)
+
+    closest = np.where(outside[..., None], closest_out, closest_in)
+    normals = np.where(outside[..., None], normals_out, normals_in)
+    distances = np.where(outside, distances_out, distances_in)
+
+    rots_t = rots.transpose(0, 2, 1)
+    return centers[:, None, :] + closest @ rots_t, normals @ rots_t, distances
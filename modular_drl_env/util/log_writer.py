@@ -0,0 +1,91 @@
+import atexit
+import queue
+import threading
+import pandas as pd
+
+__all__ = [
+    "EpisodeLogWriter"
+]
+
+class EpisodeLogWriter:
+    """
+    Writes the per step logs of an env into csv files from a background thread, such that the simulation never has to wait for the disk.
+    Rows are queued as they come in and get appended to their file in chunks, at the latest when the file is flushed (e.g. at the end of an episode).
+    The queue is bounded, if the disk can't keep up adding rows blocks until there is space again.
+    The csv files look the same as if the rows had been written at once via pandas.
+    """
+
+    def __init__(self, max_queue_size: int=10000, chunk_size: int=512):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        # number of rows collected for a file before they get appended to it
+        self.chunk_size = chunk_size
+        # path -> (columns, number of rows written so far)
+        self.files = dict()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        # make sure everything ends up on disk, even if the env is never closed (e.g. exit() after the last episode)
+        atexit.register(self.close)
+
+    def append(self, path: str, row: dict):
+        """
+        Queues a row for the given file. The row must not be changed afterwards.
+        """
+        self.queue.put((path, row))
+
+    def flush(self, path: str):
+        """
+        Writes all rows queued for the given file so far.
+        """
+        self.queue.put((path, None))
+
+    def close(self):
+        """
+        Writes all remaining rows and stops the background thread.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        # path -> rows not yet written
+        pending = dict()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, row = item
+            if row is None:
+                self._write(path, pending.pop(path, []))
+                continue
+            rows = pending.setdefault(path, [])
+            rows.append(row)
+            if len(rows) >= self.chunk_size:
+                self._write(path, rows)
+                pending[path] = []
+        for path, rows in pending.items():
+            self._write(path, rows)
+
+    def _write(self, path: str, rows: list):
+        if not rows:
+            return
+        try:
+            columns, num_rows = self.files.get(path, (None, 0))
+            # continue the index of the rows already in the file
+            frame = pd.DataFrame(rows, index=range(num_rows, num_rows + len(rows)))
+            if columns is None:
+                # first chunk, (over)writes the file
+                frame.to_csv(path)
+                columns = list(frame.columns)
+            elif any(column not in columns for column in frame.columns):
+                # the header can't be changed in place, so the file has to be written anew, this only happens if new columns appear mid file
+                frame = pd.concat([pd.read_csv(path, index_col=0, float_precision="round_trip"), frame])
+                frame.to_csv(path)
+                columns = list(frame.columns)
+            else:
+                frame.reindex(columns=columns).to_csv(path, mode="a", header=False)
+            self.files[path] = (columns, num_rows + len(rows))
+        except Exception as e:
+            print("[WARNING] Could not write log file " + path + ": " + str(e))
@@ -0,0 +1,48 @@
+from collections import deque
+from time import perf_counter
+import numpy as np
+
+__all__ = [
+    "StepProfiler"
+]
+
+class StepProfiler:
+    """
+    Collects wall clock timings for the components of an env step (world update, sensors, reward etc.).
+    Usage: take a timestamp via now() before a component runs and hand it to record() afterwards, which returns the next timestamp,
+    such that consecutive components can be chained without extra clock calls.
+    The timings are kept per component until they get fetched via pop_timings, e.g. by the MoreLoggingCustomCallback at the end of a rollout.
+    If disabled, nothing gets stored and the cost is a clock call per component.
+    """
+
+    def __init__(self, enabled: bool=True, max_samples: int=100000):
+        self.enabled = enabled
+        # upper bound for the samples kept per component, such that memory can't grow forever if nobody fetches the timings
+        self.max_samples = max_samples
+        # component name -> deque of timings in seconds
+        self.timings = dict()
+
+    @staticmethod
+    def now() -> float:
+        return perf_counter()
+
+    def record(self, name: str, start: float) -> float:
+        """
+        Stores the time passed since start for the given component and returns the current time.
+        """
+        end = perf_counter()
+        if self.enabled:
+            samples = self.timings.get(name)
+            if samples is None:
+                samples = self.timings[name] = deque(maxlen=self.max_samples)
+            samples.append(end - start)
+        return end
+
+    def pop_timings(self) -> dict:
+        """
+        Returns all timings collected so far as a dict of component name -> numpy array of seconds and clears them.
+        """
+        ret = {name: np.array(samples) for name, samples in self.timings.items() if samples}
+        for samples in self.timings.values():
+            samples.clear()
+        return ret
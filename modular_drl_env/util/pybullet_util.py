@@ -1,12 +1,86 @@
-import pybullet as pyb
+import pybullet
 import numpy as np
-from typing import List, Tuple
+import inspect
+from functools import partial
+from contextlib import contextmanager
+from typing import List, Tuple, Dict, Union
 
 # this is a small library to abstract away a few things w.r.t. pybullet behind a nicer interface for our use
 # what this mainly means that we can use easily understood strings as handles for objects instead of opaque ints
 # in other cases the wrapper methods do nothing other than build in conversion of pybullet outputs to numpy arrays
 
+class _ClientBoundPybullet:
+    """
+    Stand-in for the pybullet module that sends every call to the physics client of the currently active env.
+    Import this as pyb (from modular_drl_env.util.pybullet_util import pyb) instead of importing pybullet directly,
+    that way multiple envs with their own physics clients can live in the same process.
+    """
+
+    def __init__(self):
+        # physics client id -> dict of pybullet functions with that client id already filled in
+        self._bound_functions = dict()
+        self.physics_client_id = 0
+
+    def bind(self, physics_client_id: int) -> None:
+        if physics_client_id not in self._bound_functions:
+            # client 0 is pybullet's default anyway, so the single env case can use the raw functions without any overhead
+            self._bound_functions[physics_client_id] = {name: partial(attribute, physicsClientId=physics_client_id) if physics_client_id != 0 else attribute
+                                                        for name, attribute in vars(pybullet).items() if inspect.isbuiltin(attribute) and name != "connect"}
+        # putting the functions into the instance dict makes them as fast to access as regular attributes
+        self.__dict__.update(self._bound_functions[physics_client_id])
+        self.physics_client_id = physics_client_id
+
+    def __getattr__(self, name):
+        # constants and anything not bound yet come straight from pybullet
+        return getattr(pybullet, name)
+
+pyb = _ClientBoundPybullet()
+
+class JointGroup:
+    """
+    Handle for a fixed list of joints of one object with the pybullet int ids already resolved.
+    The state and control wrappers below accept it in place of a list of str joint ids, which saves the id lookups on every call.
+    Iterating over it yields the str joint ids, so it can still be used like the list it was made from.
+    Get one via pybullet_util.get_joint_group.
+    """
+
+    def __init__(self, object_id: str, joint_ids: List[str], pyb_object_id: int, pyb_joint_ids: List[int]):
+        self.object_id = object_id
+        self.joint_ids = list(joint_ids)
+        self.pyb_object_id = pyb_object_id
+        self.pyb_joint_ids = list(pyb_joint_ids)
+        # the same ids as numpy array, indexing the state snapshots with it is faster than with the list
+        self.pyb_joint_index = np.array(self.pyb_joint_ids, dtype=int)
+        # resetJointStatesMultiDof wants one list per joint
+        self.zero_velocities = [[0.] for _ in self.pyb_joint_ids]
+
+    def __len__(self) -> int:
+        return len(self.joint_ids)
+
+    def __iter__(self):
+        return iter(self.joint_ids)
+
+class LinkGroup:
+    """
+    Same as JointGroup, just for links. Get one via pybullet_util.get_link_group.
+    """
+
+    def __init__(self, object_id: str, link_ids: List[str], pyb_object_id: int, pyb_link_ids: List[int]):
+        self.object_id = object_id
+        self.link_ids = list(link_ids)
+        self.pyb_object_id = pyb_object_id
+        self.pyb_link_ids = list(pyb_link_ids)
+        self.pyb_link_index = np.array(self.pyb_link_ids, dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.link_ids)
+
+    def __iter__(self):
+        return iter(self.link_ids)
+
 class pybullet_util:
+    # pybullet client of the currently active env
+    physics_client_id = 0
     # these dicts will map pybullet's int ids to strings
     pybullet_object_ids = {}
     gym_env_str_names = {}
@@ -18,15 +92,28 @@ class pybullet_util:
     gym_env_str_joints_names = {}
     # current collision state
     collision = False  # bool for whether there is a collision at all involving a robot
-    collisions: List[Tuple[str, str]] = []  # list of tuples of colliding objects
+    robot_collisions: Dict[str, bool] = {}  # robot str id -> whether that robot collides with anything
+    # only computed when asked for, see get_collision_pairs
+    _collision_pairs: List[Tuple[str, str]] = None  # list of tuples of colliding objects
     # counter to keep our numbered ids safely unique even if we delete something
     spawn_counter = 0
-    # list of pybullet ids for all objects that are robots for convenient access
-    robot_pyb_ids = []
-    # list of planner times per robot
+    # counts every time a body gets teleported or an obstacle moves, allows others to notice that the scene changed (e.g. cached collision results)
+    # in contrast to the version of a world's spatial index this also covers obstacles that aren't among the active objects
+    move_counter = 0
+    # set of pybullet ids for all objects that are robots for convenient access
+    robot_pyb_ids = set()
+    # planner times per robot str id
     # info: this is a somewhat hacky solution to log planning times for the global planners like RRT, PRM etc.
     # a planner will write its time for planning into this variable from where it can be accesed by the environment and logged
-    planner_times = []
+    planner_times = {}
+    # per pybullet object id: the states of all its links and joints and its AABB, fetched on first access and shared by everyone asking afterwards
+    # everything below that changes the simulation throws these away, see invalidate_states
+    # they are not part of the context: switching the active env drops them, such that nothing fetched inside of one env call is ever served outside of it
+    _link_snapshots = {}
+    _joint_snapshots = {}
+    _aabb_snapshots = {}
+    # per pybullet object id: all its link and joint ids, i.e. 0 to number of joints - 1
+    _all_link_ids = {}
 
     ##########
     # basics #
@@ -36,15 +123,69 @@ class pybullet_util:
     def to_pb(cls, object_id: str) -> int:
         return cls.pybullet_object_ids[object_id]
 
-    @staticmethod
-    def init(assets_path: str, display_mode: bool, sim_step: float, gravity: List) -> None:
-        pyb.connect(pyb.DIRECT if not display_mode else pyb.GUI)
+    @classmethod
+    def init(cls, assets_path: str, display_mode: bool, sim_step: float, gravity: List) -> int:
+        """
+        Connects to a new physics client and makes it the active one, with a fresh set of handles.
+        Returns the physics client id.
+        """
+        cls.set_context(cls.new_context())
+        cls.physics_client_id = pybullet.connect(pybullet.DIRECT if not display_mode else pybullet.GUI)
+        pyb.bind(cls.physics_client_id)
         if display_mode:
             pyb.configureDebugVisualizer(pyb.COV_ENABLE_GUI, 0)
             pyb.configureDebugVisualizer(pyb.COV_ENABLE_SHADOWS, 1)
         pyb.setTimeStep(sim_step)
         pyb.setGravity(*gravity)
         pyb.setAdditionalSearchPath(assets_path)
+        return cls.physics_client_id
+
+    # state that belongs to one env and its physics client
+    _context_attributes = ["physics_client_id", "pybullet_object_ids", "gym_env_str_names", "pybullet_link_ids", "gym_env_str_link_names",
+                           "pybullet_joints_ids", "gym_env_str_joints_names", "collision", "robot_collisions", "_collision_pairs",
+                           "spawn_counter", "move_counter", "robot_pyb_ids", "planner_times", "_all_link_ids"]
+
+    @staticmethod
+    def new_context() -> dict:
+        """
+        Returns the state of a freshly initialized pybullet util.
+        """
+        return {"physics_client_id": 0, "pybullet_object_ids": {}, "gym_env_str_names": {}, "pybullet_link_ids": {}, "gym_env_str_link_names": {},
+                "pybullet_joints_ids": {}, "gym_env_str_joints_names": {}, "collision": False, "robot_collisions": {}, "_collision_pairs": None,
+                "spawn_counter": 0, "move_counter": 0, "robot_pyb_ids": set(), "planner_times": {}, "_all_link_ids": {}}
+
+    @classmethod
+    def get_context(cls) -> dict:
+        """
+        Returns the current state, i.e. the physics client and all the handles of the active env.
+        """
+        return {name: getattr(cls, name) for name in cls._context_attributes}
+
+    @classmethod
+    def set_context(cls, context: dict) -> None:
+        """
+        Makes the env with the given state the active one.
+        """
+        for name, value in context.items():
+            setattr(cls, name, value)
+        pyb.bind(cls.physics_client_id)
+        # the snapshots might stem from another client or be outdated by calls made while another env was active
+        cls.invalidate_states()
+
+    @classmethod
+    @contextmanager
+    def activate(cls, context: dict):
+        """
+        Context manager that makes the given state the active one and writes any changes back into it on exit.
+        The previously active state is restored afterwards. This is how multiple envs share this class within one process.
+        """
+        previous = cls.get_context()
+        cls.set_context(context)
+        try:
+            yield
+        finally:
+            context.update(cls.get_context())
+            cls.set_context(previous)
 
     @classmethod
     def reset(cls) -> None:
@@ -55,36 +196,67 @@ class pybullet_util:
         cls.pybullet_joints_ids = {}
         cls.gym_env_str_joints_names = {}
         cls.spawn_counter = 0
-        cls.robot_pyb_ids = []
+        # not reset, such that a scene rebuilt afterwards never has the same key as the one before
+        cls.move_counter += 1
+        cls.robot_pyb_ids = set()
+        cls.collision = False
+        cls.robot_collisions = {}
+        cls._collision_pairs = None
+        cls._all_link_ids = {}
+        cls.invalidate_states()
         pyb.resetSimulation()
 
     @staticmethod
     def close() -> None:
         pyb.disconnect()
 
-    @staticmethod
-    def physics_step() -> None:
+    @classmethod
+    def physics_step(cls) -> None:
         pyb.stepSimulation()
+        cls.invalidate_states()
 
-    @staticmethod
-    def perform_collision_check() -> None:
+    @classmethod
+    def perform_collision_check(cls) -> None:
         pyb.performCollisionDetection()
+        # the engine updates its bounding boxes here
+        cls._aabb_snapshots = {}
 
     @classmethod
-    def get_collisions(cls) -> List[Tuple[str, str]]:
-        pyb_cols = pyb.getContactPoints()
-        ret = []
-        for tup in pyb_cols:
-            if tup[8] <= 0:  # sometimes pybullet has spurious contacts with separation distances greater than zero
-                ret.append((cls.gym_env_str_names[tup[1]], cls.gym_env_str_names[tup[2]]))
-        cls.collisions = ret
-        # check if there is a collision involving robots
-        cls.collision = False
-        for tup in pyb_cols:
+    def get_collisions(cls) -> bool:
+        """
+        Updates the collision state from the contacts of the last collision detection and returns whether there is a collision involving robots.
+        Only the contacts of the robots are looked at and for each robot we stop at its first real one, which gives the per robot flags as well,
+        the list of all colliding objects is only computed if asked for via get_collision_pairs.
+        """
+        cls._collision_pairs = None
+        cls.robot_collisions = {cls.gym_env_str_names[pyb_id]: cls._in_contact(pyb_id) for pyb_id in cls.robot_pyb_ids}
+        cls.collision = any(cls.robot_collisions.values())
+        return cls.collision
+
+    @classmethod
+    def robot_in_collision(cls, robot_id: str) -> bool:
+        """
+        Returns whether the given robot is part of a collision, w.r.t. the last get_collisions call.
+        """
+        return cls.robot_collisions.get(robot_id, False)
+
+    @classmethod
+    def get_collision_pairs(cls) -> List[Tuple[str, str]]:
+        """
+        Returns a list of tuples of the str ids of all colliding objects, including those that don't involve robots.
+        """
+        if cls._collision_pairs is None:
+            # sometimes pybullet has spurious contacts with separation distances greater than zero
+            cls._collision_pairs = [(cls.gym_env_str_names[tup[1]], cls.gym_env_str_names[tup[2]]) for tup in pyb.getContactPoints() if tup[8] <= 0]
+        return cls._collision_pairs
+
+    @staticmethod
+    def _in_contact(pyb_id: int) -> bool:
+        # contacts of one body, regardless of whether it's body A or B in the contact
+        for tup in pyb.getContactPoints(bodyA=pyb_id):
             if tup[8] <= 0:
-                if tup[1] in cls.robot_pyb_ids or tup[2] in cls.robot_pyb_ids:
-                    cls.collision = True
-                    break
+                return True
+        return False
     
     ############
     # geometry #
@@ -111,7 +283,7 @@ class pybullet_util:
             else:
                 pyb_id = pyb.loadURDF(urdf_path, basePosition=position.tolist(), baseOrientation=orientation.tolist(), useFixedBase=fixed_base, globalScaling=scale)
             name = "robot_" + str(cls.spawn_counter) 
-            cls.planner_times.append(0)
+            cls.planner_times[name] = 0
             joints_info = [pyb.getJointInfo(pyb_id, i) for i in range(pyb.getNumJoints(pyb_id))]
             for joint_info in joints_info:
                 link_name, link_pyb_id = joint_info[12].decode('UTF-8'), joint_info[0]
@@ -120,7 +292,7 @@ class pybullet_util:
                 cls.gym_env_str_link_names[(pyb_id, link_pyb_id)] = link_name
                 cls.pybullet_joints_ids[(name, joint_name)] = joint_pyb_id
                 cls.gym_env_str_joints_names[(pyb_id, joint_pyb_id)] = joint_name
-            cls.robot_pyb_ids.append(pyb_id)
+            cls.robot_pyb_ids.add(pyb_id)
         else:
             pyb_id = pyb.loadURDF(urdf_path, basePosition=position.tolist(), baseOrientation=orientation.tolist(), useFixedBase=fixed_base, globalScaling=scale)
             name = "mesh_" + str(cls.spawn_counter)
@@ -178,6 +350,21 @@ class pybullet_util:
         cls.spawn_counter += 1
         return name
     
+    @classmethod
+    def create_collision_body(cls, position: np.ndarray, orientation: np.ndarray, collision_shape: int) -> str:
+        """
+        Creates a static body without visuals from an existing collision shape (e.g. a compound one from createCollisionShapeArray) and returns its string id.
+        """
+        name = "body_" + str(cls.spawn_counter)
+        pyb_id = pyb.createMultiBody(baseMass=0,
+                                     baseCollisionShapeIndex=collision_shape,
+                                     basePosition=np.asarray(position).tolist(),
+                                     baseOrientation=np.asarray(orientation).tolist())
+        cls.pybullet_object_ids[name] = pyb_id
+        cls.gym_env_str_names[pyb_id] = name
+        cls.spawn_counter += 1
+        return name
+
     @classmethod
     def remove_object(cls, object_id: str) -> None:
         """
@@ -187,8 +374,22 @@ class pybullet_util:
         pyb.removeBody(pyb_id)
         del cls.pybullet_object_ids[object_id]
         del cls.gym_env_str_names[pyb_id]
-        if pyb_id in cls.robot_pyb_ids:
-            cls.robot_pyb_ids.remove(pyb_id)
+        cls.robot_pyb_ids.discard(pyb_id)
+        # pybullet reuses the ids of removed objects
+        cls._all_link_ids.pop(pyb_id, None)
+        cls._invalidate_object_states(pyb_id)
+
+    @classmethod
+    def get_aabb(cls, object_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns lower and upper corner of the axis aligned bounding box around all links of the input object.
+        """
+        pyb_id = cls.pybullet_object_ids[object_id]
+        aabb = cls._aabb_snapshots.get(pyb_id)
+        if aabb is None:
+            aabbs = np.array([pyb.getAABB(pyb_id, link) for link in range(-1, pyb.getNumJoints(pyb_id))])
+            aabb = cls._aabb_snapshots[pyb_id] = (np.min(aabbs[:, 0], axis=0), np.max(aabbs[:, 1], axis=0))
+        return aabb[0].copy(), aabb[1].copy()
 
     @staticmethod
     def draw_lines(starts: List[List[float]], ends: List[List[float]], colors: List[List[float]]) -> List[int]:
@@ -207,6 +408,56 @@ class pybullet_util:
     # states and control #
     ######################
 
+    @classmethod
+    def invalidate_states(cls) -> None:
+        """
+        Throws away the link and joint states fetched since the last change of the simulation.
+        All methods of this class that change the simulation call this on their own,
+        code that moves things with direct pybullet calls has to call it afterwards (e.g. obstacles do so via their _moved method).
+        """
+        if cls._link_snapshots or cls._joint_snapshots or cls._aabb_snapshots:
+            cls._link_snapshots = {}
+            cls._joint_snapshots = {}
+            cls._aabb_snapshots = {}
+
+    @classmethod
+    def _invalidate_object_states(cls, pyb_id: int) -> None:
+        # for changes that only affect a single object, e.g. teleporting it or resetting its joints
+        cls._link_snapshots.pop(pyb_id, None)
+        cls._joint_snapshots.pop(pyb_id, None)
+        cls._aabb_snapshots.pop(pyb_id, None)
+
+    @classmethod
+    def _get_all_link_ids(cls, pyb_id: int) -> List[int]:
+        all_link_ids = cls._all_link_ids.get(pyb_id)
+        if all_link_ids is None:
+            all_link_ids = cls._all_link_ids[pyb_id] = list(range(pyb.getNumJoints(pyb_id)))
+        return all_link_ids
+
+    @classmethod
+    def _get_link_snapshot(cls, pyb_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Positions, orientations, velocities and angular velocities of all links of an object, indexed by the pybullet link id.
+        Sensors, goals and robots all ask for (mostly the same) links every step, this way the engine only gets asked once per object and step.
+        """
+        snapshot = cls._link_snapshots.get(pyb_id)
+        if snapshot is None:
+            link_states_pyb = pyb.getLinkStates(pyb_id, cls._get_all_link_ids(pyb_id), 1, 1)
+            states = np.array([ele[4] + ele[5] + ele[6] + ele[7] for ele in link_states_pyb]).reshape(-1, 13)
+            snapshot = cls._link_snapshots[pyb_id] = (states[:, 0:3], states[:, 3:7], states[:, 7:10], states[:, 10:13])
+        return snapshot
+
+    @classmethod
+    def _get_joint_snapshot(cls, pyb_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as above for the positions and velocities of all joints of an object.
+        """
+        snapshot = cls._joint_snapshots.get(pyb_id)
+        if snapshot is None:
+            states = np.array([ele[:2] for ele in pyb.getJointStates(pyb_id, cls._get_all_link_ids(pyb_id))]).reshape(-1, 2)
+            snapshot = cls._joint_snapshots[pyb_id] = (states[:, 0], states[:, 1])
+        return snapshot
+
     @classmethod
     def get_controllable_joint_ids(cls, robot_id: str) -> List[Tuple[str, int]]:
         """
@@ -221,6 +472,28 @@ class pybullet_util:
                 ret.append((cls.gym_env_str_joints_names[pyb_id, joint_info[0]], joint_info[2]))
         return ret
 
+    @classmethod
+    def get_link_ids(cls, robot_id: str) -> List[str]:
+        """
+        Returns the string names of all links of the input robot (without the base) in the order of their pybullet ids.
+        """
+        pyb_id = cls.pybullet_object_ids[robot_id]
+        return [cls.gym_env_str_link_names[pyb_id, link_pyb_id] for link_pyb_id in cls._get_all_link_ids(pyb_id)]
+
+    @classmethod
+    def get_joint_group(cls, robot_id: str, joint_ids: List[str]) -> JointGroup:
+        """
+        Resolves the given joints of an object once, see JointGroup.
+        """
+        return JointGroup(robot_id, joint_ids, cls.pybullet_object_ids[robot_id], [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids])
+
+    @classmethod
+    def get_link_group(cls, robot_id: str, link_ids: List[str]) -> LinkGroup:
+        """
+        Resolves the given links of an object once, see LinkGroup.
+        """
+        return LinkGroup(robot_id, link_ids, cls.pybullet_object_ids[robot_id], [cls.pybullet_link_ids[robot_id, link_id] for link_id in link_ids])
+
     @classmethod
     def get_base_pos_and_ori(cls, object_id) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -234,6 +507,8 @@ class pybullet_util:
         pyb_id = cls.pybullet_object_ids[object_id]
         assert pyb_id is not None, "Unknown object id"
         pyb.resetBasePositionAndOrientation(pyb_id, position.tolist(), orientation.tolist())
+        cls._invalidate_object_states(pyb_id)
+        cls.move_counter += 1
 
     @classmethod
     def get_base_vel(cls, object_id) -> Tuple[np.ndarray, np.ndarray]:
@@ -248,50 +523,61 @@ class pybullet_util:
         pyb_id = cls.pybullet_object_ids[object_id]
         assert pyb_id is not None, "Unknown object id"
         pyb.resetBaseVelocity(pyb_id, vel, ang_vel)
+        cls._invalidate_object_states(pyb_id)
 
     @classmethod
     def get_joint_state(cls, robot_id: str, joint_id: str) -> Tuple[float, float]:
         """
         Returns position and velocity of input joint.
         """
-        pyb_robot_id = cls.pybullet_object_ids[robot_id]
+        positions, velocities = cls._get_joint_snapshot(cls.pybullet_object_ids[robot_id])
         pyb_joint_id = cls.pybullet_joints_ids[robot_id, joint_id]
-        pos, vel, _, _ = pyb.getJointState(pyb_robot_id, pyb_joint_id)
-        return pos, vel
+        return positions[pyb_joint_id], velocities[pyb_joint_id]
     
     @classmethod
-    def get_joint_states(cls, robot_id: str, joint_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    def get_joint_states(cls, robot_id: str, joint_ids: Union[List[str], JointGroup]) -> Tuple[np.ndarray, np.ndarray]:
         """
         Returns two lists in the order input joint ids: joint positions and velocities.
         """
-        pyb_robot_id = cls.pybullet_object_ids[robot_id]
-        pyb_joint_ids = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
-        pyb_ret = pyb.getJointStates(pyb_robot_id, pyb_joint_ids)
-        return np.array([ele[0] for ele in pyb_ret]), np.array([ele[1] for ele in pyb_ret])
+        if type(joint_ids) is JointGroup:
+            pyb_robot_id, pyb_joint_ids = joint_ids.pyb_object_id, joint_ids.pyb_joint_index
+        else:
+            pyb_robot_id = cls.pybullet_object_ids[robot_id]
+            pyb_joint_ids = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
+        positions, velocities = cls._get_joint_snapshot(pyb_robot_id)
+        return positions[pyb_joint_ids], velocities[pyb_joint_ids]
     
     @classmethod
     def set_joint_state(cls, robot_id: str, joint_id: str, position: float, velocity: float=0) -> None:
         pyb_robot_id = cls.pybullet_object_ids[robot_id]
         pyb_joint_id = cls.pybullet_joints_ids[robot_id, joint_id]
         pyb.resetJointState(pyb_robot_id, pyb_joint_id, position, velocity)
+        cls._invalidate_object_states(pyb_robot_id)
 
     @classmethod
-    def set_joint_states(cls, robot_id: str, joint_ids: str, position: np.ndarray[float], velocity: np.ndarray[float]=None) -> None:
-        pyb_robot_id = cls.pybullet_object_ids[robot_id]
-        pyb_joint_ids = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
+    def set_joint_states(cls, robot_id: str, joint_ids: Union[List[str], JointGroup], position: np.ndarray[float], velocity: np.ndarray[float]=None) -> None:
+        if type(joint_ids) is JointGroup:
+            pyb_robot_id, pyb_joint_ids = joint_ids.pyb_object_id, joint_ids.pyb_joint_ids
+        else:
+            pyb_robot_id = cls.pybullet_object_ids[robot_id]
+            pyb_joint_ids = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
 
-        pybullet_argument_formating = [[value] for value in position]
+        # pybullet wants one list per joint, letting numpy build those is about twice as fast as a list comprehension
+        pybullet_argument_formating = np.asarray(position, dtype=np.float64).reshape(-1, 1).tolist()
         if velocity is not None:
-            pybullet_argument_formating_vel = [[value] for value in velocity]
+            pybullet_argument_formating_vel = np.asarray(velocity, dtype=np.float64).reshape(-1, 1).tolist()
+        elif type(joint_ids) is JointGroup:
+            pybullet_argument_formating_vel = joint_ids.zero_velocities
         else:
-            pybullet_argument_formating_vel = [[0] for _ in position]
+            pybullet_argument_formating_vel = [[0.] for _ in pyb_joint_ids]
 
         pyb.resetJointStatesMultiDof(pyb_robot_id, pyb_joint_ids, pybullet_argument_formating, pybullet_argument_formating_vel)
+        cls._invalidate_object_states(pyb_robot_id)
 
     @classmethod
     def set_joint_targets(cls, 
                           robot_id: str, 
-                          joint_ids: str, 
+                          joint_ids: Union[List[str], JointGroup], 
                           position: np.ndarray[float]=None, 
                           velocity: np.ndarray[float]=None,
                           forces: np.ndarray[float]=None) -> None:   
@@ -301,8 +587,12 @@ class pybullet_util:
         """     
     
         pyb_kwargs = {}
-        pyb_kwargs["jointIndices"] = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
-        pyb_kwargs["bodyUniqueId"] = cls.pybullet_object_ids[robot_id]
+        if type(joint_ids) is JointGroup:
+            pyb_kwargs["jointIndices"] = joint_ids.pyb_joint_ids
+            pyb_kwargs["bodyUniqueId"] = joint_ids.pyb_object_id
+        else:
+            pyb_kwargs["jointIndices"] = [cls.pybullet_joints_ids[robot_id, joint_id] for joint_id in joint_ids]
+            pyb_kwargs["bodyUniqueId"] = cls.pybullet_object_ids[robot_id]
         if velocity is not None:
             pyb_kwargs["targetVelocities"] = velocity
             pyb_kwargs["controlMode"] = pyb.VELOCITY_CONTROL
@@ -319,20 +609,30 @@ class pybullet_util:
         """
         Reports position, orientation, velocity and angular velocity of given link.
         """
-        pyb_robot_id = cls.pybullet_object_ids[robot_id]
+        positions, orientations, velocities, angular_velocities = cls._get_link_snapshot(cls.pybullet_object_ids[robot_id])
         pyb_link_id = cls.pybullet_link_ids[robot_id, link_id]
-        link_state_pyb = pyb.getLinkState(pyb_robot_id, pyb_link_id, 1, 1)
-        return np.array(link_state_pyb[4]), np.array(link_state_pyb[5]), np.array(link_state_pyb[6]), np.array(link_state_pyb[7])
+        return positions[pyb_link_id].copy(), orientations[pyb_link_id].copy(), velocities[pyb_link_id].copy(), angular_velocities[pyb_link_id].copy()
     
     @classmethod
-    def get_link_states(cls, robot_id: str, link_ids: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    def get_link_states(cls, robot_id: str, link_ids: Union[List[str], LinkGroup]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
         Reports positions, orientations, velocities and angular velocities of given links.
         """
-        pyb_robot_id = cls.pybullet_object_ids[robot_id]
-        pyb_link_ids = [cls.pybullet_link_ids[robot_id, link_id] for link_id in link_ids]
-        link_states_pyb = pyb.getLinkStates(pyb_robot_id, pyb_link_ids, 1, 1)
-        return np.array([ele[4] for ele in link_states_pyb]), np.array([ele[5] for ele in link_states_pyb]), np.array([ele[6] for ele in link_states_pyb]), np.array([ele[7] for ele in link_states_pyb])
+        if type(link_ids) is LinkGroup:
+            pyb_robot_id, pyb_link_ids = link_ids.pyb_object_id, link_ids.pyb_link_index
+        else:
+            pyb_robot_id = cls.pybullet_object_ids[robot_id]
+            pyb_link_ids = [cls.pybullet_link_ids[robot_id, link_id] for link_id in link_ids]
+        positions, orientations, velocities, angular_velocities = cls._get_link_snapshot(pyb_robot_id)
+        return positions[pyb_link_ids], orientations[pyb_link_ids], velocities[pyb_link_ids], angular_velocities[pyb_link_ids]
+
+    @classmethod
+    def get_link_positions(cls, robot_id: str, link_ids: LinkGroup, out: np.ndarray=None) -> np.ndarray:
+        """
+        Same as above, but only reports the positions, optionally written into the given array.
+        """
+        positions = cls._get_link_snapshot(link_ids.pyb_object_id)[0]
+        return np.take(positions, link_ids.pyb_link_index, axis=0, out=out)
     
     @classmethod
     def solve_inverse_kinematics(cls, robot_id: str, link_id: str, target_position: np.ndarray, target_orientation: np.ndarray=None, max_iterations: int=100, threshold: float=1e-2) -> np.ndarray:
@@ -370,15 +670,11 @@ class pybullet_util:
 
     @classmethod
     def log_planner_time(cls, robot_id: str, time: float) -> None:
-        pybullet_id = cls.pybullet_object_ids[robot_id]
-        idx = cls.robot_pyb_ids.index(pybullet_id)
-        cls.planner_times[idx] = time
+        cls.planner_times[robot_id] = time
 
     @classmethod
     def get_planner_time(cls, robot_id) -> float:
-        pybullet_id = cls.pybullet_object_ids[robot_id]
-        idx = cls.robot_pyb_ids.index(pybullet_id)
-        return cls.planner_times[idx]
+        return cls.planner_times.get(robot_id, 0)
     
     @staticmethod
     def toggle_rendering(toggle) -> None:
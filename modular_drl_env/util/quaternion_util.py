@@ -90,6 +90,50 @@ def quaternion_to_matrix(quat):
 
     return matrix
 
+def quaternions_to_matrices(quats):
+    """
+    Same as quaternion_to_matrix, but for an array of quaternions (one per row) at once.
+    """
+    quats = np.asarray(quats)
+    x, y, z, w = quats[..., 0], quats[..., 1], quats[..., 2], quats[..., 3]
+
+    matrices = np.empty(quats.shape[:-1] + (3, 3))
+    matrices[..., 0, 0] = 1 - 2 * y**2 - 2 * z**2
+    matrices[..., 0, 1] = 2 * x * y - 2 * z * w
+    matrices[..., 0, 2] = 2 * x * z + 2 * y * w
+    matrices[..., 1, 0] = 2 * x * y + 2 * z * w
+    matrices[..., 1, 1] = 1 - 2 * x**2 - 2 * z**2
+    matrices[..., 1, 2] = 2 * y * z - 2 * x * w
+    matrices[..., 2, 0] = 2 * x * z - 2 * y * w
+    matrices[..., 2, 1] = 2 * y * z + 2 * x * w
+    matrices[..., 2, 2] = 1 - 2 * x**2 - 2 * y**2
+
+    return matrices
+
+def matrices_to_quaternions(matrices):
+    """
+    Converts an array of rotation matrices (..., 3, 3) into quaternions (..., 4).
+    Unlike matrix_to_quaternion, this stays accurate for rotations close to 180 degrees by picking the largest component first.
+    """
+    matrices = np.asarray(matrices)
+    m00, m11, m22 = matrices[..., 0, 0], matrices[..., 1, 1], matrices[..., 2, 2]
+    # four times the square of each component
+    squares = np.stack([1 + m00 - m11 - m22, 1 - m00 + m11 - m22, 1 - m00 - m11 + m22, 1 + m00 + m11 + m22], axis=-1)
+    largest = np.argmax(squares, axis=-1)
+    scale = 0.5 / np.sqrt(np.maximum(np.take_along_axis(squares, largest[..., None], axis=-1)[..., 0], 1e-12))
+    # every component computed from the largest one, see e.g. Shepperd's method
+    candidates = np.empty(matrices.shape[:-2] + (4, 4))
+    x_from = [squares[..., 0], matrices[..., 0, 1] + matrices[..., 1, 0], matrices[..., 0, 2] + matrices[..., 2, 0], matrices[..., 2, 1] - matrices[..., 1, 2]]
+    y_from = [matrices[..., 0, 1] + matrices[..., 1, 0], squares[..., 1], matrices[..., 1, 2] + matrices[..., 2, 1], matrices[..., 0, 2] - matrices[..., 2, 0]]
+    z_from = [matrices[..., 0, 2] + matrices[..., 2, 0], matrices[..., 1, 2] + matrices[..., 2, 1], squares[..., 2], matrices[..., 1, 0] - matrices[..., 0, 1]]
+    w_from = [matrices[..., 2, 1] - matrices[..., 1, 2], matrices[..., 0, 2] - matrices[..., 2, 0], matrices[..., 1, 0] - matrices[..., 0, 1], squares[..., 3]]
+    for idx in range(4):
+        candidates[..., idx, :] = np.stack([x_from[idx], y_from[idx], z_from[idx], w_from[idx]], axis=-1)
+    quats = np.take_along_axis(candidates, largest[..., None, None], axis=-2)[..., 0, :] * scale[..., None]
+    # q and -q are the same rotation, we return the one with w >= 0
+    quats[quats[..., 3] < 0] *= -1
+    return quats
+
 def matrix_to_quaternion(mat):
 
     x = mat[2][1] - mat[1][2]
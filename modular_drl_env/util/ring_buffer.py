@@ -0,0 +1,61 @@
+import numpy as np
+
+__all__ = [
+    "RingBuffer"
+]
+
+class RingBuffer:
+    """
+    Fixed size history of scalars or arrays of one shape, backed by a single array that gets allocated once.
+    Appending overwrites the oldest entry once the buffer is full, which replaces the usual list.append + list.pop(0) pattern without shuffling or allocating anything.
+    Indexing is chronological, i.e. buffer[0] is the oldest and buffer[-1] the newest entry.
+    """
+
+    __slots__ = ("data", "capacity", "size", "_start")
+
+    def __init__(self, capacity: int, shape: tuple=(), dtype=np.float64):
+        assert capacity > 0, "[RingBuffer] capacity must be positive"
+        self.data = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.capacity = capacity
+        self.size = 0
+        # index of the oldest entry in data
+        self._start = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, idx: int):
+        if idx < 0:
+            idx += self.size
+        if idx < 0 or idx >= self.size:
+            raise IndexError("[RingBuffer] index out of range")
+        return self.data[(self._start + idx) % self.capacity]
+
+    def append(self, value) -> None:
+        """
+        Copies the value into the buffer, dropping the oldest entry if it's full.
+        """
+        if self.size < self.capacity:
+            self.data[(self._start + self.size) % self.capacity] = value
+            self.size += 1
+        else:
+            self.data[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+
+    def clear(self) -> None:
+        self.size = 0
+        self._start = 0
+
+    def full(self) -> bool:
+        return self.size == self.capacity
+
+    def ordered(self, out: np.ndarray=None) -> np.ndarray:
+        """
+        Returns all entries in chronological order. Pass a pre-allocated array of the same shape as data to avoid the allocation.
+        """
+        if out is None:
+            out = np.empty_like(self.data)
+        tail = min(self.capacity - self._start, self.size)
+        out[:tail] = self.data[self._start:self._start + tail]
+        out[tail:self.size] = self.data[:self.size - tail]
+        return out[:self.size]
@@ -0,0 +1,217 @@
+from modular_drl_env.util.pybullet_util import pyb
+import numpy as np
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+
+class CollisionChecker:
+    """
+    Collision checks for single robots that don't need the engine's collision detection over the whole scene.
+    Instead of calling performCollisionDetection and walking all contacts of the simulation, this asks the engine only
+    for those geometry pairs that can actually collide:
+        - self collisions: link pairs that pybullet would check itself (i.e. no parent-child pairs), precomputed once per robot
+          and only tested if their bounding boxes overlap
+        - the world's active objects near the robot, found via the world's broad phase
+        - other robots whose bounding boxes overlap with the robot
+        - static bodies that are not part of the active objects (e.g. a ground plane added directly via pybullet util),
+          their bounding boxes are cached until the simulation or the active objects change or something gets moved
+    Among the static bodies, those that belong to the world's obstacles (obstacle_objects and the scenario objects) are called pooled here:
+    worlds park them out of sight and move them in and out between episodes, so they are left out wherever results are kept across episodes (see in_static_collision).
+    The robot is expected to already be in the configuration that should be checked, use check_configurations to go through several configurations in one call.
+    """
+
+    def __init__(self, world):
+        self.world = world
+
+        # pybullet robot id -> (link ids, (link a, link b) index arrays into the link ids)
+        self.self_collision_pairs = dict()
+
+        # static bodies and their AABBs, see _get_static_bodies
+        self._static_key = None
+        self._static_moves = None
+        self._static_pyb_ids = []
+        self._static_lows = np.zeros((0, 3))
+        self._static_highs = np.zeros((0, 3))
+        # True for the static bodies that are one of the world's obstacles
+        self._static_pooled = np.zeros(0, dtype=bool)
+
+    def in_collision(self, robot, margin: float=0, obstacles: list=None, check_self: bool=True, check_robots: bool=True) -> bool:
+        """
+        Returns whether the robot in its current configuration collides with anything.
+        Margin is a safety distance, anything closer than that counts as collision.
+        If a list of obstacles is given, only these are checked instead of all active objects and static bodies.
+        """
+        robot_pyb_id = pyb_u.to_pb(robot.object_id)
+        link_ids, pairs = self._get_link_pairs(robot)
+        link_aabbs = np.array([pyb.getAABB(robot_pyb_id, link) for link in link_ids])
+        low, high = np.min(link_aabbs[:, 0], axis=0) - margin, np.max(link_aabbs[:, 1], axis=0) + margin
+
+        # self collisions
+        if check_self and self._check_link_pairs(robot_pyb_id, link_ids, pairs, link_aabbs, margin):
+            return True
+
+        # other robots
+        if check_robots:
+            for other in self.world.robots:
+                if other.object_id == robot.object_id:
+                    continue
+                other_pyb_id = pyb_u.to_pb(other.object_id)
+                other_low, other_high = pyb_u.get_aabb(other.object_id)
+                if np.all(other_low <= high) and np.all(other_high >= low):
+                    if pyb.getClosestPoints(robot_pyb_id, other_pyb_id, margin):
+                        return True
+
+        # obstacles
+        if obstacles is not None:
+            obstacles_set = set(obstacles)
+            candidates = [obstacle for obstacle in self.world.get_active_objects_near(low, high) if obstacle in obstacles_set]
+        else:
+            candidates = self.world.get_active_objects_near(low, high)
+        for obstacle in candidates:
+            if pyb.getClosestPoints(robot_pyb_id, pyb_u.to_pb(obstacle.object_id), margin):
+                return True
+
+        # static bodies outside of the active objects
+        if obstacles is None and self._check_static_bodies(robot_pyb_id, low, high, margin):
+            return True
+
+        return False
+
+    def in_static_collision(self, robot, margin: float=0) -> bool:
+        """
+        Returns whether the robot in its current configuration collides with itself or with bodies that are neither part of the active objects
+        nor one of the world's obstacles (e.g. a ground plane). None of these change between episodes, so the results can be kept for longer (see the PRM planner's roadmap).
+        """
+        robot_pyb_id = pyb_u.to_pb(robot.object_id)
+        link_ids, pairs = self._get_link_pairs(robot)
+        link_aabbs = np.array([pyb.getAABB(robot_pyb_id, link) for link in link_ids])
+        if len(pairs) and self._check_link_pairs(robot_pyb_id, link_ids, pairs, link_aabbs, margin):
+            return True
+        low, high = np.min(link_aabbs[:, 0], axis=0) - margin, np.max(link_aabbs[:, 1], axis=0) + margin
+        return self._check_static_bodies(robot_pyb_id, low, high, margin, pooled=False)
+
+    def in_pooled_collision(self, robot, margin: float=0) -> bool:
+        """
+        Returns whether the robot in its current configuration collides with one of the world's obstacles that is not part of the active objects,
+        i.e. the static bodies left out by in_static_collision. Most of these are parked out of sight and get rejected by their bounding boxes right away.
+        """
+        robot_pyb_id = pyb_u.to_pb(robot.object_id)
+        low, high = pyb_u.get_aabb(robot.object_id)
+        return self._check_static_bodies(robot_pyb_id, low - margin, high + margin, margin, pooled=True)
+
+    def get_static_bodies_key(self) -> bytes:
+        """
+        Returns the rounded AABBs of the bodies checked by in_static_collision (sorted, pybullet ids can differ between runs).
+        If these stay the same so do the results.
+        """
+        _, static_lows, static_highs = self._get_static_bodies()
+        fixed = ~self._static_pooled
+        aabbs = np.round(np.hstack([static_lows[fixed], static_highs[fixed]]), 4)
+        return aabbs[np.lexsort(aabbs.T[::-1])].tobytes()
+
+    def in_self_collision(self, robot) -> bool:
+        """
+        Returns whether the robot in its current configuration collides with itself.
+        """
+        robot_pyb_id = pyb_u.to_pb(robot.object_id)
+        link_ids, pairs = self._get_link_pairs(robot)
+        if not len(pairs):
+            return False
+        link_aabbs = np.array([pyb.getAABB(robot_pyb_id, link) for link in link_ids])
+        return self._check_link_pairs(robot_pyb_id, link_ids, pairs, link_aabbs, 0)
+
+    def check_configurations(self, robot, configurations: np.ndarray, joints_ids: list=None, margin: float=0, obstacles: list=None, self_only: bool=False,
+                             collision_fn=None, first_only: bool=False) -> np.ndarray:
+        """
+        Checks several configurations (one per row) for the given joints in one call, defaults to the robot's controlled joints.
+        The configurations are still checked one after the other, the robot is moved into each of them in turn.
+        Returns a boolean array that is True for every configuration that is in collision.
+        A custom collision_fn (called without arguments once the robot is in a configuration) replaces the checks given by margin, obstacles and self_only.
+        With first_only the checks stop at the first collision, the configurations after it are left unchecked and False.
+        The robot is moved back to its original configuration afterwards.
+        """
+        if joints_ids is None:
+            joints_ids = robot.controlled_joints_group
+        configurations = np.atleast_2d(np.asarray(configurations, dtype=np.float64))
+        q_orig, _ = pyb_u.get_joint_states(robot.object_id, joints_ids)
+        collisions = np.zeros(len(configurations), dtype=bool)
+        for idx, q in enumerate(configurations):
+            robot.moveto_joints(q.copy(), False, joints_ids)
+            if collision_fn is not None:
+                collisions[idx] = collision_fn()
+            elif self_only:
+                collisions[idx] = self.in_self_collision(robot)
+            else:
+                collisions[idx] = self.in_collision(robot, margin, obstacles)
+            if first_only and collisions[idx]:
+                break
+        robot.moveto_joints(q_orig, False, joints_ids)
+        return collisions
+
+    def _check_link_pairs(self, robot_pyb_id: int, link_ids: list, pairs: np.ndarray, link_aabbs: np.ndarray, margin: float) -> bool:
+        # only link pairs whose AABBs overlap need an exact check
+        a, b = pairs[:, 0], pairs[:, 1]
+        overlap = np.all(link_aabbs[a, 0] - margin <= link_aabbs[b, 1], axis=1) & np.all(link_aabbs[b, 0] - margin <= link_aabbs[a, 1], axis=1)
+        for idx_a, idx_b in pairs[overlap]:
+            if pyb.getClosestPoints(robot_pyb_id, robot_pyb_id, margin, linkIndexA=link_ids[idx_a], linkIndexB=link_ids[idx_b]):
+                return True
+        return False
+
+    def _check_static_bodies(self, robot_pyb_id: int, low: np.ndarray, high: np.ndarray, margin: float, pooled: bool=None) -> bool:
+        # pooled None checks all static bodies, True or False only the pooled or the other ones
+        static_pyb_ids, static_lows, static_highs = self._get_static_bodies()
+        overlap = np.all(static_lows <= high, axis=1) & np.all(static_highs >= low, axis=1)
+        if pooled is not None:
+            overlap &= self._static_pooled == pooled
+        for idx in np.flatnonzero(overlap):
+            if pyb.getClosestPoints(robot_pyb_id, static_pyb_ids[idx], margin):
+                return True
+        return False
+
+    def _get_link_pairs(self, robot):
+        robot_pyb_id = pyb_u.to_pb(robot.object_id)
+        if robot_pyb_id not in self.self_collision_pairs:
+            num_joints = pyb.getNumJoints(robot_pyb_id)
+            # only links with collision geometry matter
+            link_ids = [link for link in range(-1, num_joints) if pyb.getCollisionShapeData(robot_pyb_id, link)]
+            pairs = []
+            if robot.self_collision:
+                # pybullet skips collisions between parent and child links, so we do the same
+                parents = {joint: pyb.getJointInfo(robot_pyb_id, joint)[16] for joint in range(num_joints)}
+                for idx_a, link_a in enumerate(link_ids):
+                    for idx_b in range(idx_a + 1, len(link_ids)):
+                        link_b = link_ids[idx_b]
+                        if parents.get(link_b) != link_a and parents.get(link_a) != link_b:
+                            pairs.append((idx_a, idx_b))
+            self.self_collision_pairs[robot_pyb_id] = (link_ids, np.array(pairs, dtype=int).reshape(-1, 2))
+        return self.self_collision_pairs[robot_pyb_id]
+
+    def _get_static_bodies(self):
+        # the cache is valid as long as no bodies get added or removed and the active objects stay the same
+        key = (pyb_u.spawn_counter, len(pyb_u.pybullet_object_ids), id(self.world.active_objects), len(self.world.active_objects))
+        if key != self._static_key:
+            excluded = set(pyb_u.robot_pyb_ids)
+            excluded.update(pyb_u.to_pb(obstacle.object_id) for obstacle in self.world.active_objects)
+            pooled_ids = set(pyb_u.to_pb(obstacle.object_id) for obstacle in self.world.obstacle_objects + list(self.world.get_scenario_objects()) if obstacle.object_id in pyb_u.pybullet_object_ids)
+            self._static_pyb_ids = []
+            lows, highs, pooled = [], [], []
+            for object_id, pyb_id in pyb_u.pybullet_object_ids.items():
+                if pyb_id in excluded:
+                    continue
+                # purely visual bodies can't collide
+                if not any(pyb.getCollisionShapeData(pyb_id, link) for link in range(-1, pyb.getNumJoints(pyb_id))):
+                    continue
+                low, high = pyb_u.get_aabb(object_id)
+                self._static_pyb_ids.append(pyb_id)
+                lows.append(low)
+                highs.append(high)
+                pooled.append(pyb_id in pooled_ids)
+            self._static_lows = np.array(lows).reshape(-1, 3)
+            self._static_highs = np.array(highs).reshape(-1, 3)
+            self._static_pooled = np.array(pooled, dtype=bool)
+            self._static_key = key
+            self._static_moves = pyb_u.move_counter
+        elif pyb_u.move_counter != self._static_moves:
+            # same bodies, but some of them might have been moved (e.g. obstacles the world parks outside of the active objects)
+            for idx, pyb_id in enumerate(self._static_pyb_ids):
+                self._static_lows[idx], self._static_highs[idx] = pyb_u.get_aabb(pyb_u.gym_env_str_names[pyb_id])
+            self._static_moves = pyb_u.move_counter
+        return self._static_pyb_ids, self._static_lows, self._static_highs
@@ -1,5 +1,5 @@
 from modular_drl_env.world.obstacles.obstacle import Obstacle
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
 import numpy as np 
 from typing import Union
@@ -32,7 +32,7 @@ class Human(Obstacle):
         self.closeness_threshold = thresh
 
     def build(self) -> int:
-        self.human = Man(0, partitioned=False, timestep=self.sim_step, scaling=self.scale, static=(len(self.trajectory)==0))
+        self.human = Man(pyb_u.physics_client_id, partitioned=False, timestep=self.sim_step, scaling=self.scale, static=(len(self.trajectory)==0))
         #self.human.resetGlobalTransformation(self.position_orig, pyb.getEulerFromQuaternion(self.rotation_orig.tolist()))
         self.human.advance(self.position_orig, self.orientation_orig.tolist())
         self.internal_id = self.human.body_id
@@ -43,6 +43,11 @@ class Human(Obstacle):
         self.object_id = name
         return name
 
+    def _moved(self):
+        # the human library moves the body with direct pybullet calls, so we have to let the pybullet util know that the states it fetched are outdated
+        pyb_u.invalidate_states()
+        super()._moved()
+
     def move_traj(self):
         if not self.trajectory:
             pass  # empty trajectory, do nothing
@@ -77,6 +82,7 @@ class Human(Obstacle):
             # then, it performs a slice of forward movement a sim_step long
             # this is why we need to use last target here
             self.human.advance(last_target, quat)
+            self._moved()
 
 
     def raise_hands(self):
@@ -85,6 +91,7 @@ class Human(Obstacle):
         pyb.resetJointState(self.human.body_id, 10, -0.5 * (d * self.hand_raise_iterator))
         applyMMMRotationToURDFJoint(self.human.body_id, 9, 0.8 * (d * self.hand_raise_iterator), 0.5 * (d * self.hand_raise_iterator), 0)
         pyb.resetJointState(self.human.body_id, 11, -0.5 * (d * self.hand_raise_iterator))
+        self._moved()
         if self.hand_raise_direction:
             self.hand_raise_iterator = min(self.hand_raise_iterator + 1, self.hand_raise_iter_max)
             if self.hand_raise_iterator == self.hand_raise_iter_max:
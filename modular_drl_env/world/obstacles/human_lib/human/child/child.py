@@ -1,6 +1,6 @@
 import os
 
-import pybullet as p
+from modular_drl_env.util.pybullet_util import pyb as p
 
 from .. import Human
 
@@ -1,7 +1,7 @@
 import os
 import math
 
-import pybullet as p
+from modular_drl_env.util.pybullet_util import pyb as p
 import numpy as np
 
 
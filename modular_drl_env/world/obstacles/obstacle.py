@@ -34,6 +34,9 @@ class Obstacle(ABC):
         # useful in some scenarios, where a sensor is too close to a large unmoving obstacle like the ground plate
         self.seen_by_obstacle_sensor = seen_by_obstacle_sensor
 
+        # broad phase index this obstacle is currently part of, gets set by the index itself
+        self.spatial_index = None
+
     @abstractmethod
     def build(self) -> int:
         """
@@ -43,6 +46,30 @@ class Obstacle(ABC):
         """
         return 0
 
+    def get_aabb(self):
+        """
+        Returns the lower and upper corner of the axis aligned bounding box of the obstacle.
+        Can be overwritten by obstacles with simple geometry to avoid asking the physics engine.
+        """
+        return pyb_u.get_aabb(self.object_id)
+
+    def _moved(self):
+        # lets everyone caching something about the scene know that it changed, also for obstacles that aren't active (see world.get_scene_key)
+        pyb_u.move_counter += 1
+        # lets the broad phase know that it has to update this obstacle
+        if self.spatial_index is not None:
+            self.spatial_index.mark_dirty(self)
+
+    @classmethod
+    def closest_points(cls, obstacles: list, points: np.ndarray):
+        """
+        Can be overwritten by obstacles with simple geometry to compute the closest points on the surfaces of
+        several obstacles of that class for a batch of (N, 3) points analytically in one go,
+        see util/closest_points.py for the expected return values.
+        Returns None by default, which means that the distances have to be queried from the physics engine.
+        """
+        return None
+
     def move_traj(self):
         """
         Moves the obstacle along the trajectory with constant velocity.
@@ -62,6 +89,7 @@ class Obstacle(ABC):
                 self.velocity = step / (self.sim_step * self.sim_steps_per_env_step)
                 self.position = self.position + step
                 pyb_u.set_base_pos_and_ori(object_id=self.object_id, position=self.position, orientation=self.orientation)
+                self._moved()
         else:  # looping trajectory
             goal = self.trajectory[self.trajectory_idx + 1] + self.position_orig
             diff = goal - self.position
@@ -77,6 +105,7 @@ class Obstacle(ABC):
                 self.velocity = step / (self.sim_step * self.sim_steps_per_env_step) 
                 self.position = self.position + step
                 pyb_u.set_base_pos_and_ori(object_id=self.object_id, position=self.position, orientation=self.orientation)
+                self._moved()
 
     def move_base(self, new_base_position, new_base_rotation=None):
         if new_base_rotation is None:
@@ -88,3 +117,4 @@ class Obstacle(ABC):
         self.orientation_orig = new_base_rotation
         self.velocity = np.zeros(3)
         self.trajectory_idx = -1
+        self._moved()
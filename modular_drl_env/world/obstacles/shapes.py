@@ -2,6 +2,13 @@ from modular_drl_env.world.obstacles.obstacle import Obstacle
 import numpy as np
 from typing import Union
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.util.closest_points import closest_points_spheres, closest_points_boxes, PYBULLET_COLLISION_MARGIN
+from modular_drl_env.util.quaternion_util import quaternion_to_matrix
+
+def _oriented_extent(orientation: np.ndarray, half_extents: np.ndarray) -> np.ndarray:
+    # half extents of the axis aligned box around a rotated box
+    quat = np.asarray(orientation, dtype=np.float64)
+    return np.abs(quaternion_to_matrix(quat / np.linalg.norm(quat))) @ half_extents + PYBULLET_COLLISION_MARGIN
 
 class Sphere(Obstacle):
 
@@ -26,6 +33,16 @@ class Sphere(Obstacle):
                                              color=self.color)
         return self.object_id
 
+    def get_aabb(self):
+        position = np.asarray(self.position, dtype=np.float64)
+        return position - self.radius, position + self.radius
+
+    @classmethod
+    def closest_points(cls, obstacles: list, points: np.ndarray):
+        centers = np.array([obstacle.position for obstacle in obstacles], dtype=np.float64)
+        radii = np.array([obstacle.radius for obstacle in obstacles], dtype=np.float64)
+        return closest_points_spheres(points, centers, radii)
+
 class Box(Obstacle):
 
     def __init__(self, 
@@ -43,6 +60,10 @@ class Box(Obstacle):
         self.color = color
         self.halfExtents = halfExtents
 
+        # cache for the bounding box extent
+        self._aabb_orientation = None
+        self._aabb_extent = None
+
     def build(self) -> int:
         self.object_id = pyb_u.create_box(position=self.position_orig,
                                           orientation=self.orientation_orig,
@@ -51,6 +72,20 @@ class Box(Obstacle):
                                           color=self.color)
         return self.object_id
 
+    def get_aabb(self):
+        # the extent only changes with the orientation, which for most boxes never happens
+        if self._aabb_orientation is not self.orientation:
+            self._aabb_orientation = self.orientation
+            self._aabb_extent = _oriented_extent(self.orientation, np.asarray(self.halfExtents, dtype=np.float64))
+        return self.position - self._aabb_extent, self.position + self._aabb_extent
+
+    @classmethod
+    def closest_points(cls, obstacles: list, points: np.ndarray):
+        centers = np.array([obstacle.position for obstacle in obstacles], dtype=np.float64)
+        orientations = np.array([obstacle.orientation for obstacle in obstacles], dtype=np.float64)
+        half_extents = np.array([obstacle.halfExtents for obstacle in obstacles], dtype=np.float64)
+        return closest_points_boxes(points, centers, orientations, half_extents)
+
 class Cylinder(Obstacle):
 
     def __init__(self, 
@@ -70,6 +105,10 @@ class Cylinder(Obstacle):
         self.color = color
         self.height = height
 
+        # cache for the bounding box extent
+        self._aabb_orientation = None
+        self._aabb_extent = None
+
     def build(self) -> int:
         self.object_id = pyb_u.create_cylinder(position=self.position_orig,
                                                orientation=self.orientation_orig,
@@ -77,4 +116,14 @@ class Cylinder(Obstacle):
                                                radius=self.radius,
                                                height=self.height,
                                                color=self.color)
-        return self.object_id
\ No newline at end of file
+        return self.object_id
+
+    def get_aabb(self):
+        # same as for the box
+        if self._aabb_orientation is not self.orientation:
+            self._aabb_orientation = self.orientation
+            self._aabb_extent = _oriented_extent(self.orientation, np.array([self.radius, self.radius, self.height / 2]))
+        return self.position - self._aabb_extent, self.position + self._aabb_extent
+
+    # no analytic closest points: pybullet's own results for cylinders are approximate (see closest_points_cylinders in util/closest_points.py),
+    # so the obstacle sensor asks the engine for these to report exactly what it did before
\ No newline at end of file
@@ -0,0 +1,311 @@
+import os
+import json
+import struct
+import random
+import zipfile
+import numpy as np
+import multiprocessing as mp
+
+__all__ = [
+    "ScenarioCache",
+    "ScenarioDataset",
+    "write_scenario_file",
+    "read_scenario_file"
+]
+
+class ScenarioCache:
+    """
+    Stores scenarios (active obstacles and their poses, robot starting points and targets, see World.get_scenario) in stacked numpy arrays,
+    such that env resets can draw a finished scenario instead of letting the world generate one, which for most worlds involves many tries and collision checks.
+    Until the cache holds size scenarios, the world generates scenarios as usual and every one of them is added to the cache.
+    Optionally, background workers help filling it up: these are forks of the env's process which therefore have their own copy of the simulation.
+    The scenarios are sorted into levels by the success rate they were generated with, draws prefer the level of the current success rate,
+    such that worlds that use the success rate for a curriculum still get harder scenarios as the agent gets better.
+    A full cache is written to a npz file, which gets loaded again on the next start, such that the generation only happens once per world config.
+    Note: the file only fits worlds whose set up creates the exact same obstacles, which is why the env seeds the world's set up when a cache file is used.
+    """
+
+    def __init__(self, world, size: int=1000, levels: int=5, path: str=None, seed: int=0, background_workers: int=0):
+        self.world = world
+        # number of scenarios to collect before draws start
+        self.size = size
+        # number of success rate intervals the scenarios are sorted into
+        self.levels = levels
+        self.path = path
+        # the seed of the world's set up, used to check if a file fits
+        self.seed = seed
+
+        # stacked scenarios, allocated with the first one
+        self.data = None
+        # level of each scenario
+        self.scenario_levels = np.zeros(size, dtype=np.int8)
+        self.count = 0
+        # indices of the scenarios in each level, built once the cache is full
+        self._level_ids = None
+        # success rate of the last draw and the index the next draw will return if it was peeked at
+        self.success_rate = 0
+        self._peeked = None
+
+        if self.path is not None and os.path.isfile(self.path):
+            self.load(self.path)
+
+        self.workers = []
+        self.remotes = []
+        self.num_background_workers = background_workers
+
+    def start_workers(self):
+        """
+        Forks the background workers, call this once the env is completely set up.
+        """
+        if self.num_background_workers <= 0 or self.count >= self.size:
+            return
+        if "fork" not in mp.get_all_start_methods():
+            print("[WARNING] scenario cache background workers need to fork the env's process, which is not possible on this platform, continuing without them")
+            return
+        ctx = mp.get_context("fork")
+        missing = self.size - self.count
+        for worker_idx in range(self.num_background_workers):
+            # split the missing scenarios evenly
+            num_scenarios = missing // self.num_background_workers + (1 if worker_idx < missing % self.num_background_workers else 0)
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_scenario_worker, args=(self.world, num_scenarios, self.levels, work_remote), daemon=True)
+            process.start()
+            work_remote.close()
+            self.workers.append(process)
+            self.remotes.append(remote)
+
+    def add(self, scenario: dict, success_rate: float):
+        """
+        Adds a scenario the world generated with the given success rate, does nothing once the cache is full.
+        """
+        self._add(scenario, self._get_level(success_rate))
+
+    def draw(self, success_rate: float):
+        """
+        Returns a scenario for the given success rate, which can be set up via World.set_scenario, or None if the cache isn't full yet.
+        """
+        self._receive()
+        self.success_rate = success_rate
+        if self.count < self.size:
+            return None
+        if self._peeked is not None:
+            idx = self._peeked
+            self._peeked = None
+        else:
+            idx = self._sample(success_rate)
+        return {key: array[idx] for key, array in self.data.items()}
+
+    def peek(self):
+        """
+        Returns the scenario the next draw will return or None if that isn't known yet.
+        As the next success rate isn't known yet, the one of the last draw is used.
+        """
+        self._receive()
+        if self.count < self.size:
+            return None
+        if self._peeked is None:
+            self._peeked = self._sample(self.success_rate)
+        return {key: array[self._peeked] for key, array in self.data.items()}
+
+    def save(self, path: str):
+        write_scenario_file(path, self.world, self.seed, self.levels, self.scenario_levels[:self.count], {key: array[:self.count] for key, array in self.data.items()})
+
+    def load(self, path: str):
+        meta, scenarios = read_scenario_file(path)
+        if int(meta["_seed"]) != self.seed or int(meta["_levels"]) != self.levels:
+            print("[WARNING] scenario cache file " + path + " was generated with a different seed or number of levels, ignoring it")
+            return
+        mismatch = _check_scenario_file(meta, scenarios, self.world)
+        if mismatch:
+            print("[WARNING] scenario cache file " + path + " doesn't fit this world (" + mismatch + "), ignoring it")
+            return
+        scenario_levels = meta["_scenario_levels"]
+        for idx in range(min(len(scenario_levels), self.size)):
+            self._add({key: array[idx] for key, array in scenarios.items()}, scenario_levels[idx], save=False)
+
+    def close(self):
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+        self.workers = []
+        self.remotes = []
+
+    def _add(self, scenario: dict, level: int, save: bool=True):
+        if self.count >= self.size:
+            return
+        if self.data is None:
+            self.data = {key: np.zeros((self.size,) + value.shape, dtype=value.dtype) for key, value in scenario.items()}
+        for key, value in scenario.items():
+            self.data[key][self.count] = value
+        self.scenario_levels[self.count] = level
+        self.count += 1
+        if self.count == self.size:
+            self._level_ids = [np.flatnonzero(self.scenario_levels == level) for level in range(self.levels)]
+            if save and self.path is not None:
+                self.save(self.path)
+
+    def _receive(self):
+        # collects the scenarios the background workers have sent so far without waiting for any
+        for remote in self.remotes:
+            try:
+                while remote.poll():
+                    level, scenario = remote.recv()
+                    self._add(scenario, level)
+            except EOFError:
+                pass
+
+    def _get_level(self, success_rate: float) -> int:
+        return min(max(int(success_rate * self.levels), 0), self.levels - 1)
+
+    def _sample(self, success_rate: float) -> int:
+        # draws from the level of the success rate or, if that one is empty, the closest one that isn't, preferring easier levels
+        level = self._get_level(success_rate)
+        for distance in range(self.levels):
+            for candidate in (level - distance, level + distance):
+                if 0 <= candidate < self.levels and len(self._level_ids[candidate]):
+                    return int(np.random.choice(self._level_ids[candidate]))
+
+class ScenarioDataset:
+    """
+    Replays the scenarios of a fixed file (see generate_scenarios.py) in their order, such that evaluation runs see the exact same episodes.
+    Has the same interface as the scenario cache, so the env and the world can use it in its place.
+    The scenario arrays are memory mapped, several envs reading the same file share its memory and only the scenarios that get used are read.
+    """
+
+    def __init__(self, world, path: str, loop: bool=True, start: int=0):
+        self.world = world
+        self.path = path
+        # whether to start over after the last scenario, otherwise the world generates scenarios as usual from then on
+        self.loop = loop
+        self.meta, self.data = read_scenario_file(path, mmap=True)
+        mismatch = _check_scenario_file(self.meta, self.data, self.world)
+        if mismatch:
+            raise Exception("Scenario dataset " + path + " doesn't fit this world: " + mismatch)
+        self.success_rates = self.meta["_success_rates"] if "_success_rates" in self.meta else None
+        self.count = len(self.meta["_scenario_levels"])
+        # index of the scenario the next draw returns
+        self.next_idx = start
+
+    @staticmethod
+    def read_seed(path: str) -> int:
+        """
+        Returns the seed the world's set up needs to reproduce the obstacles of the file.
+        """
+        with np.load(path) as infile:
+            return int(infile["_seed"])
+
+    def add(self, scenario: dict, success_rate: float):
+        # the dataset is fixed
+        pass
+
+    def draw(self, success_rate: float):
+        scenario = self.peek()
+        if scenario is not None:
+            self.next_idx += 1
+        return scenario
+
+    def peek(self):
+        if self.next_idx >= self.count:
+            if not self.loop or self.count == 0:
+                return None
+            self.next_idx = 0
+        return {key: np.array(array[self.next_idx]) for key, array in self.data.items()}
+
+    def close(self):
+        pass
+
+def write_scenario_file(path: str, world, seed: int, levels: int, scenario_levels: np.ndarray, scenarios: dict, **extra):
+    """
+    Writes stacked scenarios into a npz file. The file is not compressed, such that its arrays can be memory mapped, see read_scenario_file.
+    Entries of extra are stored as additional meta data, their names should start with an underscore.
+    """
+    meta = {"_world": np.array(type(world).__name__), "_seed": np.array(seed), "_levels": np.array(levels), 
+            "_obstacles": np.array(_describe_obstacles(world.get_scenario_objects())), "_scenario_levels": np.asarray(scenario_levels, dtype=np.int8)}
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # several envs can share a file, so it gets replaced in one go
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as outfile:
+        np.savez(outfile, **meta, **extra, **scenarios)
+    os.replace(tmp_path, path)
+
+def read_scenario_file(path: str, mmap: bool=False):
+    """
+    Reads a file written by the method above, returns the meta data and the stacked scenarios as two dicts.
+    With mmap, the scenarios are memory mapped read only instead of being read into memory.
+    """
+    with np.load(path) as infile:
+        meta = {key: infile[key] for key in infile.files if key.startswith("_")}
+        if not mmap:
+            return meta, {key: infile[key] for key in infile.files if not key.startswith("_")}
+    # np.load can't memory map arrays in a npz, but as it's not compressed, each array lies in the file as it would in a npy file
+    scenarios = dict()
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as infile:
+        for info in archive.infolist():
+            key = info.filename[:-len(".npy")]
+            if key.startswith("_"):
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise Exception("Can't memory map compressed scenario file " + path)
+            # the data begins after the zip entry's local header, whose name and extra field lengths are stored in its last 4 bytes
+            infile.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", infile.read(30)[26:])
+            infile.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(infile)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+            if 0 in shape:
+                scenarios[key] = np.zeros(shape, dtype=dtype)
+            else:
+                scenarios[key] = np.memmap(path, dtype=dtype, mode="r", offset=infile.tell(), shape=shape, order="F" if fortran_order else "C")
+    return meta, scenarios
+
+def _describe_obstacles(objects: list) -> str:
+    # shapes and trajectories of the obstacles, two worlds with the same description can share scenarios
+    description = []
+    for obstacle in objects:
+        entry = {"type": type(obstacle).__name__, "trajectory": [np.asarray(point, dtype=np.float64).tolist() for point in obstacle.trajectory],
+                 "move_step": np.asarray(obstacle.move_step, dtype=np.float64).ravel().tolist()}
+        for attribute in ["radius", "halfExtents", "height", "scale"]:
+            if hasattr(obstacle, attribute):
+                entry[attribute] = np.asarray(getattr(obstacle, attribute), dtype=np.float64).ravel().tolist()
+        if hasattr(obstacle, "urdf_path"):
+            # the asset location differs between machines
+            entry["urdf"] = os.path.basename(obstacle.urdf_path)
+        description.append(entry)
+    return json.dumps(description)
+
+def _check_scenario_file(meta: dict, scenarios: dict, world) -> str:
+    # returns what doesn't fit or an empty string
+    if str(meta["_world"]) != type(world).__name__:
+        return "generated for " + str(meta["_world"])
+    objects = world.get_scenario_objects()
+    if scenarios["active_order"].shape[1] != len(objects):
+        return "different number of obstacles"
+    if scenarios["start_joints"].shape[1] != len(world.robots):
+        return "different number of robots"
+    if "_obstacles" in meta and str(meta["_obstacles"]) != _describe_obstacles(objects):
+        return "different obstacle shapes or trajectories"
+    return ""
+
+def _scenario_worker(world, num_scenarios: int, levels: int, remote):
+    """
+    Runs in a fork of the env's process, generates scenarios evenly spread over the levels and sends them back.
+    """
+    # the fork has the same random state as the env, without new seeds all workers would generate the same scenarios
+    np.random.seed()
+    random.seed()
+    try:
+        for idx in range(num_scenarios):
+            level = idx % levels
+            success_rate = (level + np.random.random()) / levels
+            world.reset(success_rate)
+            remote.send((level, world.get_scenario()))
+    except (BrokenPipeError, EOFError):
+        pass
+    remote.close()
@@ -0,0 +1,121 @@
+import numpy as np
+from typing import List
+
+class SpatialIndex:
+    """
+    Broad phase for distance and collision queries against obstacles.
+    Sorts obstacles into a uniform grid by the center of their axis aligned bounding box (AABB), such that a query only has to look at
+    the obstacles in the grid cells around the queried box instead of at every single obstacle in the world.
+    Obstacles larger than a grid cell (e.g. the ground plate or tables) or without a valid AABB are kept aside and are checked on every query.
+    Moving obstacles only mark themselves as dirty, their AABBs and the grid are updated right before the next query.
+    All the bookkeeping is done with numpy arrays, this keeps updates cheap even when thousands of obstacles move every step.
+    """
+
+    # offset and size of the grid cell coordinates when packing them into one int64 key
+    _key_offset = 2**19
+    _key_size = 2**20
+
+    def __init__(self, cell_size: float=0.25):
+        # edge length of one grid cell, also the maximum half extent of obstacles that get sorted into the grid
+        self.cell_size = cell_size
+
+        # obstacle -> slot, the slot is the position in the list the index was built from
+        self.slots = dict()
+        self.obstacles = []
+        # AABBs, one row per slot
+        self.lows = np.zeros((0, 3))
+        self.highs = np.zeros((0, 3))
+        # slots of obstacles too large for the grid
+        self.large_slots = np.zeros(0, dtype=int)
+        # slots of obstacles in the grid sorted by their cell key and the sorted keys themselves
+        self.grid_slots = np.zeros(0, dtype=int)
+        self.grid_keys = np.zeros(0, dtype=np.int64)
+        # obstacles that moved since the last query
+        self.dirty = set()
+        # counts every change of the indexed obstacles, allows others to notice that the scene changed (e.g. cached collision results)
+        self.version = 0
+
+    def rebuild(self, obstacles: list) -> None:
+        """
+        Clears the index and inserts all given obstacles.
+        """
+        for obstacle in self.obstacles:
+            obstacle.spatial_index = None
+        self.slots = dict()
+        self.obstacles = []
+        for obstacle in obstacles:
+            if obstacle in self.slots:
+                continue
+            self.slots[obstacle] = len(self.obstacles)
+            self.obstacles.append(obstacle)
+            obstacle.spatial_index = self
+        self.lows = np.zeros((len(self.obstacles), 3))
+        self.highs = np.zeros((len(self.obstacles), 3))
+        self.dirty = set(self.obstacles)
+        self.version += 1
+        self._flush()
+
+    def mark_dirty(self, obstacle) -> None:
+        """
+        Gets called by obstacles whenever they move.
+        """
+        self.dirty.add(obstacle)
+        self.version += 1
+
+    def __len__(self) -> int:
+        return len(self.obstacles)
+
+    def query(self, low: np.ndarray, high: np.ndarray) -> List:
+        """
+        Returns all indexed obstacles whose AABB overlaps with the box given by its lower and upper corner.
+        The obstacles are returned in the same order they had in the list the index was built from.
+        """
+        self._flush()
+        low = np.asarray(low, dtype=np.float64)
+        high = np.asarray(high, dtype=np.float64)
+        # the center of any grid obstacle touching the query box is at most one cell size away from it
+        cell_low, cell_high = self._cells(low - self.cell_size), self._cells(high + self.cell_size)
+        num_cells = np.prod(cell_high - cell_low + 1)
+        if num_cells > len(self.grid_keys):
+            # query spans more cells than there are obstacles in the grid, simply check all of them
+            candidates = np.arange(len(self.obstacles))
+        else:
+            ranges = [np.arange(cell_low[axis], cell_high[axis] + 1) for axis in range(3)]
+            keys = self._keys(np.stack(np.meshgrid(*ranges, indexing="ij"), axis=-1).reshape(-1, 3))
+            starts = np.searchsorted(self.grid_keys, keys, side="left")
+            ends = np.searchsorted(self.grid_keys, keys, side="right")
+            hits = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends) if end > start] + [np.zeros(0, dtype=int)])
+            candidates = np.concatenate([self.large_slots, self.grid_slots[hits]])
+        # exact AABB overlap test, the grid cells are coarse
+        overlap = np.all(self.lows[candidates] <= high, axis=1) & np.all(self.highs[candidates] >= low, axis=1)
+        return [self.obstacles[slot] for slot in np.sort(candidates[overlap])]
+
+    def _cells(self, positions: np.ndarray) -> np.ndarray:
+        cells = np.floor(positions / self.cell_size).astype(np.int64)
+        return np.clip(cells, -self._key_offset, self._key_offset - 1)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        cells = cells + self._key_offset
+        return (cells[..., 0] * self._key_size + cells[..., 1]) * self._key_size + cells[..., 2]
+
+    def _flush(self) -> None:
+        if not self.dirty:
+            return
+        for obstacle in self.dirty:
+            slot = self.slots.get(obstacle)
+            if slot is None:
+                continue
+            self.lows[slot], self.highs[slot] = obstacle.get_aabb()
+        self.dirty = set()
+        # some bodies report NaN AABBs (e.g. the human), these get an infinite box, which keeps them with the large obstacles and in every query
+        unknown = ~(np.all(np.isfinite(self.lows), axis=1) & np.all(np.isfinite(self.highs), axis=1))
+        self.lows[unknown] = -np.inf
+        self.highs[unknown] = np.inf
+        # re-sort the grid, this is cheap compared to keeping per cell lists up to date
+        large = np.max(self.highs - self.lows, axis=1) / 2 > self.cell_size
+        self.large_slots = np.flatnonzero(large)
+        grid_slots = np.flatnonzero(~large)
+        keys = self._keys(self._cells((self.lows[grid_slots] + self.highs[grid_slots]) / 2))
+        order = np.argsort(keys, kind="stable")
+        self.grid_slots = grid_slots[order]
+        self.grid_keys = keys[order]
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 import numpy as np
 from modular_drl_env.world.obstacles.shapes import *
 from modular_drl_env.world.obstacles.urdf_object import URDFObject
+from modular_drl_env.world.spatial_index import SpatialIndex
+from modular_drl_env.world.collision_checker import CollisionChecker
 
 
 class World(ABC):
@@ -27,6 +29,14 @@ class World(ABC):
         # in other words, filling this with the right obstacles in each episode is MANDATORY, otherwise wrong behavior might affect your env
         self.active_objects = []
 
+        # broad phase over the active objects, use the get_active_objects_near method below instead of accessing this directly
+        self.spatial_index = SpatialIndex()
+        # copy of the active objects the index was last built from, if they differ in any way the index gets rebuilt
+        self._indexed_objects = None
+
+        # collision checks for single robots without running the engine's collision detection on the whole scene
+        self.collision_checker = CollisionChecker(self)
+
         # set sim step
         self.sim_step = sim_step
         self.sim_steps_per_env_step = sim_steps_per_env_step
@@ -52,6 +62,12 @@ class World(ABC):
         # list of robots, gets filled by register method down below
         self.robots = []  # all robots in world
 
+        # optional cache of pre-sampled scenarios the env draws its resets from, see scenario_cache.py
+        self.scenario_cache = None
+
+        # per robot and kind of sampling: configurations sampled in advance for creating starting points and targets, see _sample_configuration
+        self._configuration_pools = {}
+
     def register_robots(self, robots):
         """
         This method receives a list of robot objects from the outside and sorts the robots therein into a list that is important for other methods.
@@ -94,6 +110,125 @@ class World(ABC):
         """
         pass
 
+    def peek_next_scenario(self):
+        """
+        Worlds that know the next episode's scenario before their reset method runs (e.g. because they draw scenarios from a pre-sampled cache)
+        can return it here, which allows goals to prepare for the next episode in the background, e.g. by planning its trajectory ahead of time.
+        The scenario is a dict with:
+        - "active_objects": list of the obstacles that will be active
+        - "obstacle_poses": dict obstacle -> (position, orientation) of these obstacles at the start of the episode
+        - "robots_joints": dict robot -> controlled joints angles at the start of the episode
+        - "joints_targets": list of joints targets per robot, same as self.joints_targets
+        By default, this returns the scenario the scenario cache will hand out next, if there is one, and None otherwise, i.e. the next scenario is unknown.
+        """
+        if self.scenario_cache is None:
+            return None
+        scenario = self.scenario_cache.peek()
+        if scenario is None:
+            return None
+        objects = self.get_scenario_objects()
+        active_ids = self._get_active_ids(scenario["active_order"])
+        robots_joints = dict()
+        for idx, robot in enumerate(self.robots):
+            joints = self._from_row(scenario["start_joints"][idx])
+            if joints is not None:
+                robots_joints[robot] = joints
+        return {
+            "active_objects": [objects[idx] for idx in active_ids],
+            "obstacle_poses": {objects[idx]: (scenario["obstacle_positions"][idx], scenario["obstacle_orientations"][idx]) for idx in active_ids},
+            "robots_joints": robots_joints,
+            "joints_targets": [self._from_row(row) for row in scenario["joints_targets"]]
+        }
+
+    def get_scenario_objects(self) -> list:
+        """
+        Returns all obstacles that can be part of a scenario, see get_scenario.
+        The list has to be the same (in content and order) every time the world is set up with the same config.
+        By default, this is self.obstacle_objects, overwrite this if your world keeps some of its obstacles elsewhere.
+        """
+        return self.obstacle_objects
+
+    def get_scenario(self) -> dict:
+        """
+        Captures the scenario the last reset has set up: which obstacles are active and where all obstacles are, the robots' starting points and all targets.
+        The scenario is a dict of numpy arrays whose shapes are the same for every scenario of this world, such that many of them can be stacked and stored.
+        Entries that are None (e.g. for robots without a goal) are stored as rows of NaN.
+        Worlds with additional per episode state can add it by overwriting this method and set_scenario.
+        """
+        objects = self.get_scenario_objects()
+        object_idx = {obstacle: idx for idx, obstacle in enumerate(objects)}
+        # rank of each object within the active objects, -1 for inactive ones
+        active_order = np.full(len(objects), -1, dtype=np.int16)
+        for rank, obstacle in enumerate(self._get_scenario_active()):
+            active_order[object_idx[obstacle]] = rank
+        joints_dims = max([len(robot.joints_limits_lower) for robot in self.robots], default=0)
+        return {
+            "active_order": active_order,
+            "obstacle_positions": np.array([obstacle.position_orig for obstacle in objects], dtype=np.float64).reshape(-1, 3),
+            "obstacle_orientations": np.array([obstacle.orientation_orig for obstacle in objects], dtype=np.float64).reshape(-1, 4),
+            "start_positions": self._to_rows([point[0] for point in self.ee_starting_points], 3),
+            "start_rotations": self._to_rows([point[1] for point in self.ee_starting_points], 4),
+            "start_joints": self._to_rows([point[2] for point in self.ee_starting_points], joints_dims),
+            "position_targets": self._to_rows(self.position_targets, 3),
+            "rotation_targets": self._to_rows(self.rotation_targets, 4),
+            "joints_targets": self._to_rows(self.joints_targets, joints_dims)
+        }
+
+    def set_scenario(self, scenario: dict):
+        """
+        Sets up a scenario captured by get_scenario, this can replace the reset method.
+        Only obstacles that are active in the current or in the new episode get moved, all others stay wherever they are stored.
+        """
+        objects = self.get_scenario_objects()
+        object_idx = {obstacle: idx for idx, obstacle in enumerate(objects)}
+        active = [objects[idx] for idx in self._get_active_ids(scenario["active_order"])]
+        active_set = set(active)
+        for obstacle in [obstacle for obstacle in self._get_scenario_active() if obstacle not in active_set] + active:
+            idx = object_idx[obstacle]
+            obstacle.move_base(scenario["obstacle_positions"][idx].copy(), scenario["obstacle_orientations"][idx].copy())
+        self._set_scenario_active(active)
+        # samples left over from before must not carry over into the scenario, this keeps generated scenarios independent of each other
+        self._configuration_pools = {}
+
+        self.ee_starting_points = [(self._from_row(position), self._from_row(rotation), self._from_row(joints)) for position, rotation, joints in 
+                                   zip(scenario["start_positions"], scenario["start_rotations"], scenario["start_joints"])]
+        self.position_targets = [self._from_row(row) for row in scenario["position_targets"]]
+        self.rotation_targets = [self._from_row(row) for row in scenario["rotation_targets"]]
+        self.joints_targets = [self._from_row(row) for row in scenario["joints_targets"]]
+
+        # move robots to starting position
+        for robot, starting_point in zip(self.robots, self.ee_starting_points):
+            if starting_point[2] is not None:
+                robot.moveto_joints(starting_point[2].copy(), False, robot.controlled_joints_ids)
+
+    def _get_scenario_active(self) -> list:
+        # the obstacles of the current episode, overwrite this and the method below if your world doesn't keep them in self.active_objects
+        return self.active_objects
+
+    def _set_scenario_active(self, active: list):
+        self.active_objects = active
+
+    @staticmethod
+    def _get_active_ids(active_order: np.ndarray) -> np.ndarray:
+        # indices of the active objects sorted by their rank
+        active_ids = np.flatnonzero(active_order >= 0)
+        return active_ids[np.argsort(active_order[active_ids])]
+
+    @staticmethod
+    def _to_rows(entries: list, width: int) -> np.ndarray:
+        rows = np.full((len(entries), width), np.nan)
+        for idx, entry in enumerate(entries):
+            if entry is not None:
+                entry = np.asarray(entry, dtype=np.float64).ravel()
+                rows[idx, :len(entry)] = entry
+        return rows
+
+    @staticmethod
+    def _from_row(row: np.ndarray):
+        # inverse of the above, shorter entries were padded with NaN
+        values = row[~np.isnan(row)]
+        return values.copy() if len(values) else None
+
     def build_visual_aux(self):
         """
         This method should:
@@ -141,26 +276,78 @@ class World(ABC):
         """
         pass
 
+    def get_active_objects_near(self, low: np.ndarray, high: np.ndarray) -> list:
+        """
+        Returns all active objects whose axis aligned bounding box overlaps with the box given by its lower and upper corner.
+        Use this instead of scanning all active objects when you're only interested in obstacles in some region,
+        e.g. those within some distance of a robot. The order of the active objects list is kept.
+        """
+        self._update_spatial_index()
+        return self.spatial_index.query(low, high)
+
+    def get_active_objects_version(self) -> int:
+        """
+        Returns a number that changes whenever the active objects change or one of them moves.
+        Useful for caching anything that depends on the obstacles, e.g. collision checks.
+        """
+        self._update_spatial_index()
+        return self.spatial_index.version
+
+    def get_scene_key(self, robot=None) -> tuple:
+        """
+        Returns a key that changes whenever anything changes that the given robot doesn't control itself:
+        the active objects and their poses, any other obstacle or body that gets moved, objects getting spawned or removed and the poses of all other robots.
+        Useful for caching anything that depends on the rest of the scene, e.g. collision checks or the data of sensors.
+        """
+        other_robots = tuple(pyb_u.get_joint_states(other.object_id, other.all_joints_group)[0].tobytes() + np.asarray(other.base_position, dtype=np.float64).tobytes() for other in self.robots if other is not robot)
+        return (self.get_active_objects_version(), pyb_u.spawn_counter, pyb_u.move_counter, len(pyb_u.pybullet_object_ids), other_robots)
+
+    def _update_spatial_index(self):
+        # worlds replace, extend or overwrite entries of the active objects list during resets, so we check here if the index is still up to date
+        # obstacles compare by identity, so this is only a quick pass over the list
+        if self._indexed_objects != self.active_objects:
+            self.spatial_index.rebuild(self.active_objects)
+            self._indexed_objects = list(self.active_objects)
+
+    def _closest_distance(self, robot, link_id: str=None) -> float:
+        """
+        Returns the closest distance of a robot or one of its links to any of the active objects.
+        Uses the broad phase with a growing search radius, which is exact as no object outside the search box
+        can be closer than the search radius.
+        """
+        if link_id is None:
+            low, high = pyb_u.get_aabb(robot.object_id)
+            link_kwargs = {}
+        else:
+            link_pyb_id = pyb_u.pybullet_link_ids[robot.object_id, link_id]
+            low, high = pyb.getAABB(pyb_u.to_pb(robot.object_id), link_pyb_id)
+            link_kwargs = {"linkIndexA": link_pyb_id}
+        radius = 0.25
+        while True:
+            candidates = self.get_active_objects_near(np.array(low) - radius, np.array(high) + radius)
+            # once the search box contains everything, measure without cutoff
+            cutoff = radius if len(candidates) < len(self.spatial_index) else 99
+            min_dist = np.inf
+            for obstacle in candidates:
+                closestPoints = pyb.getClosestPoints(pyb_u.to_pb(robot.object_id), pyb_u.to_pb(obstacle.object_id), cutoff, **link_kwargs)
+                if closestPoints:
+                    min_dist = min(min_dist, min([value[8] for value in closestPoints]))
+            if min_dist <= radius or cutoff == 99:
+                break
+            radius *= 4
+        return min_dist
+
     def get_data_for_logging(self):
         """
         This method logs the position and sizes of all active geometry. Additionally, it will report the closest distance of all robots to the obstacles.
         """
         log_dict = dict()
+        # check distance of obstacles to all robots
         for robot in self.robots:
-            log_dict[robot.name + "_closestObstDistance_robot"] = np.inf
-            log_dict[robot.name + "_closestObstDistance_ee"] = np.inf
+            log_dict[robot.name + "_closestObstDistance_robot"] = self._closest_distance(robot)
+            log_dict[robot.name + "_closestObstDistance_ee"] = self._closest_distance(robot, robot.end_effector_link_id)
         obstacle_log_list = []
         for obstacle in self.active_objects:
-            # check distance of obstacle to all robots
-            for robot in self.robots:
-                obstacle_pyb_id = pyb_u.to_pb(obstacle.object_id)
-                robot_pyb_id = pyb_u.to_pb(robot.object_id)
-                closestDistances_robot = pyb.getClosestPoints(robot_pyb_id, obstacle_pyb_id, 99)
-                closestDistance_robot = min([value[8] for value in closestDistances_robot])
-                closestDistance_ee = pyb.getClosestPoints(robot_pyb_id, obstacle_pyb_id, 99, pyb_u.pybullet_link_ids[robot.object_id, robot.end_effector_link_id])[0][8]
-                log_dict[robot.name + "_closestObstDistance_robot"] = min(closestDistance_robot, log_dict[robot.name + "_closestObstDistance_robot"])
-                log_dict[robot.name + "_closestObstDistance_ee"] = min(closestDistance_ee, log_dict[robot.name + "_closestObstDistance_ee"])
-
             if type(obstacle) == Sphere:
                 obstacle_log_list.append(["Sphere", obstacle.radius, obstacle.position])
             elif type(obstacle) == Box:
@@ -191,15 +378,11 @@ class World(ABC):
             oob = False
             too_close_to_base = False
             for idx, robot in enumerate(robots):
-                joint_dim = len(robot.all_joints_ids)
-                if factor == -1:
-                    random_joints = robot.sample_valid_configuration()
-                else:
-                    random_joints = (1 - factor) * robot.resting_pose_angles + factor * robot.sample_valid_configuration()
-                    upper_limit_mask = random_joints > robot.joints_limits_upper
-                    lower_limit_mask = random_joints < robot.joints_limits_lower
-                    random_joints[upper_limit_mask] = robot.joints_limits_upper[upper_limit_mask]
-                    random_joints[lower_limit_mask] = robot.joints_limits_lower[lower_limit_mask]
+                # candidates that are obviously out of bounds are sorted out before the robot moves, see below
+                random_joints = self._sample_configuration(robot, factor=factor, base_dist=base_dist)
+                if random_joints is None:
+                    oob = True
+                    break
                 joints.append(random_joints)
                 robot.moveto_joints(random_joints, False, robot.controlled_joints_ids)
 
@@ -214,11 +397,8 @@ class World(ABC):
             # if out of bounds, start over
             if oob or too_close_to_base:
                 continue
-            # now check if there's a collision
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            # if so, start over
-            if pyb_u.collision:
+            # now check if there's a collision, if so, start over
+            if any(self.collision_checker.in_collision(robot) for robot in robots):
                 continue
             # if we reached this line, then everything works out
             val = True
@@ -248,9 +428,11 @@ class World(ABC):
             oob_or_too_close = False
             too_close_to_base = False
             for idx, robot in enumerate(robots):
-                random_joints = robot.sample_valid_configuration()
-                if True:  # replace by some condition that checks if a robot has an aliased joint range
-                    random_joints = (random_joints + np.pi) % (2 * np.pi) - np.pi
+                # replace wrap by some condition that checks if a robot has an aliased joint range
+                random_joints = self._sample_configuration(robot, wrap=True, reference=self.ee_starting_points[robot.mgt_id][0], min_dist=min_dist, base_dist=base_dist)
+                if random_joints is None:
+                    oob_or_too_close = True
+                    break
                 robot.moveto_joints(random_joints, False)
 
                 # check if robot is out of bounds directly
@@ -269,11 +451,8 @@ class World(ABC):
             # if out of bounds or too close, start over
             if oob_or_too_close or too_close_to_base:
                 continue
-            # now check if there's a collision
-            pyb_u.perform_collision_check()
-            pyb_u.get_collisions()
-            # if so, start over
-            if pyb_u.collision:
+            # now check if there's a collision, if so, start over
+            if any(self.collision_checker.in_collision(robot) for robot in robots):
                 continue
             # if we reached this line, then everything works out
             val = True
@@ -294,6 +473,52 @@ class World(ABC):
                     self.joints_targets.append(None)
         return val
 
+    def _sample_configuration(self, robot, factor: float=-1, wrap: bool=False, reference: np.ndarray=None, min_dist: float=0, base_dist: float=7.5e-2, batch_size: int=64):
+        """
+        Helper for the two methods above that samples random configurations for a robot and returns the first one
+        whose end effector is within the workspace, at least base_dist away from the robot's base and at least min_dist away from the reference position.
+        The end effector positions come from the robot's forward kinematics, such that the simulation only has to deal with (e.g. check collisions of)
+        configurations that are not obviously useless. The returned configuration is also free of self collisions, the robot is left in it.
+        For factor see _create_ee_starting_points, wrap maps the angles into [-pi, pi). Returns None if no configuration passes.
+        Configurations are sampled and run through the kinematics in batches, the ones not used yet are kept for the next calls.
+        """
+        lower, upper = robot.joints_limits_lower, robot.joints_limits_upper
+        forward_kinematics = robot.get_forward_kinematics()
+        workspace_low = np.array([self.x_min, self.y_min, self.z_min])
+        workspace_high = np.array([self.x_max, self.y_max, self.z_max])
+        # starting points and targets keep separate pools, which are only valid for the same factor and base pose
+        slot = (robot.mgt_id, wrap)
+        key = (factor, forward_kinematics.base.tobytes())
+        pool = self._configuration_pools.get(slot)
+        # whatever is left in the pool first, then one fresh batch at most, the callers retry anyway
+        for _ in range(2):
+            if pool is None or pool[0] != key or not len(pool[1]):
+                samples = np.random.uniform(low=lower, high=upper, size=(batch_size, len(lower)))
+                if factor != -1:
+                    samples = (1 - factor) * robot.resting_pose_angles + factor * samples
+                if wrap:
+                    samples = (samples + np.pi) % (2 * np.pi) - np.pi
+                # moving the robot clips at the limits as well
+                samples = np.clip(samples, lower, upper)
+                positions = forward_kinematics.link_positions(samples, [robot.end_effector_link_id])[:, 0]
+                pool = [key, samples, positions]
+                self._configuration_pools[slot] = pool
+            _, samples, positions = pool
+            valid = np.all((positions >= workspace_low) & (positions <= workspace_high), axis=1)
+            valid &= np.linalg.norm(positions - robot.base_position, axis=1) >= base_dist
+            if reference is not None:
+                valid &= np.linalg.norm(positions - reference, axis=1) >= min_dist
+            for hit in np.flatnonzero(valid):
+                # self collisions are the most common reason to reject a sample, checking them here is cheaper than the full collision check afterwards
+                robot.moveto_joints(samples[hit].copy(), False, robot.controlled_joints_ids)
+                if self.collision_checker.in_self_collision(robot):
+                    continue
+                # everything up to the returned configuration counts as used, just like when sampling one after the other
+                pool[1], pool[2] = samples[hit + 1:], positions[hit + 1:]
+                return samples[hit].copy()
+            pool[1], pool[2] = samples[:0], positions[:0]
+        return None
+
     def out_of_bounds(self, position: np.ndarray) -> bool:
         """
         Helper method that returns whether a given position is within the workspace bounds or not.
@@ -159,6 +159,9 @@ class PlateExperiment(World):
         self.joints_targets.append(joints_goal)
         self.robots[0].moveto_joints(joints_start, False)
 
+    def get_scenario_objects(self) -> list:
+        return [self.ground_plate] + self.obstacle_objects
+
     def update(self):
         for obst in self.active_objects:
             obst.move_traj()
@@ -198,6 +198,9 @@ class RandomObstacleWorld(World):
             else:
                 robot.moveto_joints(self.ee_starting_points[idx][2], False)
 
+    def get_scenario_objects(self) -> list:
+        return [self.ground_plate] + self.obstacle_objects
+
     def update(self):
 
         for obstacle in self.active_objects:
@@ -5,7 +5,7 @@ import numpy as np
 import pickle as pkl
 from random import choice, shuffle, sample
 from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 
 __all__ = [
     'S2RExperiment',
@@ -1,6 +1,6 @@
 from modular_drl_env.world.world import World
 import numpy as np
-import pybullet as pyb
+from modular_drl_env.util.pybullet_util import pyb
 from modular_drl_env.world.obstacles.human import Human
 from modular_drl_env.world.obstacles.shapes import Box
 from modular_drl_env.world.obstacles.ground_plate import GroundPlate
@@ -164,6 +164,12 @@ class TableExperiment(World):
             else:
                 robot.moveto_joints(self.ee_starting_points[idx][2], False, robot.controlled_joints_ids)
 
+    def _get_scenario_active(self) -> list:
+        return self.active_obstacles
+
+    def _set_scenario_active(self, active: list):
+        self.active_obstacles = active
+
     def update(self):
         for obstacle in self.active_obstacles:
             obstacle.move_traj()
\ No newline at end of file
@@ -96,6 +96,9 @@ class TestcasesWorld(World):
 
         self.robots[0].moveto_joints(self.robot_start_joint_angles[self.current_test_mode - 1], False)
 
+    def get_scenario_objects(self) -> list:
+        return [self.ground_plate] + self.obstacle_objects
+
     def update(self):
         for obstacle in self.active_objects:
             obstacle.move_traj()
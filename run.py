@@ -20,6 +20,7 @@ run_config, env_config = parse_config(args.configfile, args.train)
 # we import the rest here because this takes quite some time and we want the arg parsing to be fast and responsive
 from modular_drl_env.gym_env.environment import ModularDRLEnv
 from stable_baselines3.common.vec_env import SubprocVecEnv
+from modular_drl_env.gym_env.vec_env import ModularDRLVecEnv
 from stable_baselines3.common.callbacks import CallbackList, CheckpointCallback
 from stable_baselines3.common.noise import OrnsteinUhlenbeckActionNoise, NormalActionNoise
 from modular_drl_env.callbacks.callbacks import MoreLoggingCustomCallback
@@ -48,7 +49,8 @@ planner_map = {
     "RRT" : RRT,
     "BiRRT": BiRRT,
     "RRT*": RRTStar,
-    "PRM": PRM
+    "PRM": PRM,
+    "RRTConnect": RRTConnect
 }
 
 noise_map = {
@@ -72,7 +74,12 @@ if __name__ == "__main__":
                 return return_train_env_inner
             
             # create parallel envs
-            envs = SubprocVecEnv([return_train_env_outer(i) for i in range(run_config["num_envs"])])
+            if "num_processes" in run_config:
+                # our own vec env, runs many envs per process
+                envs = ModularDRLVecEnv([return_train_env_outer(i) for i in range(run_config["num_envs"])], num_processes=run_config["num_processes"])
+            else:
+                # one process per env
+                envs = SubprocVecEnv([return_train_env_outer(i) for i in range(run_config["num_envs"])])
 
             # callbacks
             checkpoint_callback = CheckpointCallback(save_freq=run_config["save_freq"], save_path=run_config["save_folder"] + "/" + run_config["algorithm"]["type"] + "_" + run_config["save_name"], name_prefix="model")
@@ -0,0 +1,27 @@
+"""
+Fixtures shared by the tests that need a whole env.
+"""
+import os
+import random
+
+import numpy as np
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def table_env():
+    # the table experiment keeps the obstacles of an episode outside of the world's active objects
+    # the env activates its pybullet context only within its own calls, tests have to do so via pyb_u.activate(env.pyb_context)
+    from modular_drl_env.util.configparser import parse_config
+    from modular_drl_env.gym_env.environment import ModularDRLEnv
+    _, config = parse_config(os.path.join(_ROOT, "configs", "tableexperiment_default_config.yaml"), True)
+    config["logging"] = 0
+    config["display"] = False
+    config["env_id"] = 0
+    np.random.seed(0)
+    random.seed(0)
+    env = ModularDRLEnv(config)
+    env.reset()
+    yield env
+    env.close()
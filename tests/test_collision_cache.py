@@ -0,0 +1,50 @@
+"""
+Checks that cached collision results get dropped once the scene changes, also if the change concerns obstacles outside of the world's active objects.
+"""
+import numpy as np
+
+from modular_drl_env.planner.collision_cache import CollisionCache
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.world.obstacles.shapes import Box
+
+def _parked_box(world):
+    # one of the boxes the table experiment keeps in storage
+    active = set(world.active_objects) | set(world.active_obstacles)
+    return next(obstacle for obstacle in world.obstacle_objects if isinstance(obstacle, Box) and obstacle not in active)
+
+def test_sync_keeps_results_of_unchanged_scene(table_env):
+    robot = table_env.robots[0]
+    with pyb_u.activate(table_env.pyb_context):
+        cache = CollisionCache(robot)
+        cache.sync()
+        q, _ = pyb_u.get_joint_states(robot.object_id, robot.controlled_joints_group)
+        cache.store(q, False)
+        cache.sync()
+        assert cache.lookup(q) is False
+
+def test_sync_clears_after_inactive_obstacle_moved(table_env):
+    robot = table_env.robots[0]
+    with pyb_u.activate(table_env.pyb_context):
+        box = _parked_box(robot.world)
+        cache = CollisionCache(robot)
+        cache.sync()
+        q, _ = pyb_u.get_joint_states(robot.object_id, robot.controlled_joints_group)
+        cache.store(q, False)
+        box.move_base(box.position + np.array([0.1, 0, 0]))
+        cache.sync()
+        assert cache.lookup(q) is None
+
+def test_collision_with_moved_inactive_obstacle(table_env):
+    robot = table_env.robots[0]
+    with pyb_u.activate(table_env.pyb_context):
+        box = _parked_box(robot.world)
+        position_orig, orientation_orig = box.position.copy(), box.orientation.copy()
+        checker = robot.world.collision_checker
+        in_collision = checker.in_collision(robot)
+        # right onto the end effector
+        box.move_base(pyb_u.get_link_state(robot.object_id, robot.end_effector_link_id)[0])
+        try:
+            assert checker.in_collision(robot)
+        finally:
+            box.move_base(position_orig, orientation_orig)
+        assert checker.in_collision(robot) == in_collision
@@ -0,0 +1,40 @@
+"""
+Checks that the planners only pad their paths with configurations they have checked for collisions.
+"""
+import numpy as np
+import pytest
+
+from modular_drl_env.planner.planner_implementations.prm import PRM
+from modular_drl_env.planner.planner_implementations.rrt_connect import RRTConnect
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+
+@pytest.mark.parametrize("planner_class, kwargs", [(RRTConnect, {}), (PRM, {"num_samples": 200, "num_neighbours": 8, "roadmap_dir": None})], ids=["RRTConnect", "PRM"])
+def test_padded_waypoints_are_checked(table_env, monkeypatch, planner_class, kwargs):
+    robot = table_env.robots[0]
+    world = robot.world
+    joints = robot.controlled_joints_group
+    with pyb_u.activate(table_env.pyb_context):
+        q_start, _ = pyb_u.get_joint_states(robot.object_id, joints)
+        np.random.seed(2)
+        planner = planner_class(robot, padding=True, collision_cache=False, **kwargs)
+        # every configuration the planner puts the robot into, which includes all it checks
+        visited = []
+        moveto_joints = robot.moveto_joints
+        def recording_moveto_joints(desired_joints_angles, use_physics_sim, joints_ids=None):
+            if joints_ids is joints:
+                visited.append(np.array(desired_joints_angles, dtype=np.float64))
+            return moveto_joints(desired_joints_angles, use_physics_sim, joints_ids)
+        monkeypatch.setattr(robot, "moveto_joints", recording_moveto_joints)
+        try:
+            for _ in range(100):
+                visited.clear()
+                path = planner.plan(np.random.uniform(robot.joints_limits_lower, robot.joints_limits_upper), world.active_objects)
+                if len(path) > 2:
+                    break
+        finally:
+            monkeypatch.undo()
+            robot.moveto_joints(q_start, False, joints)
+        assert len(path) > 2
+        visited = np.array(visited)
+        for q in path[1:]:
+            assert np.min(np.max(np.abs(visited - q), axis=1)) < 1e-9
@@ -0,0 +1,48 @@
+"""
+Checks that the lazy collision results of the PRM planner don't outlive the obstacle poses they were computed for.
+"""
+import numpy as np
+import pytest
+
+from modular_drl_env.planner.planner_implementations.prm import PRM
+from modular_drl_env.util.pybullet_util import pyb
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.world.obstacles.shapes import Box
+
+def _touches(robot, obstacle, q) -> bool:
+    robot.moveto_joints(q, False, robot.controlled_joints_group)
+    return len(pyb.getClosestPoints(pyb_u.to_pb(robot.object_id), pyb_u.to_pb(obstacle.object_id), 0)) > 0
+
+@pytest.mark.parametrize("collision_cache", [True, False])
+def test_requery_after_obstacle_moved(table_env, collision_cache):
+    robot = table_env.robots[0]
+    world = robot.world
+    joints = robot.controlled_joints_group
+    with pyb_u.activate(table_env.pyb_context):
+        active = set(world.active_objects) | set(world.active_obstacles)
+        box = max([obstacle for obstacle in world.obstacle_objects if isinstance(obstacle, Box) and obstacle not in active], key=lambda obstacle: np.prod(obstacle.halfExtents))
+        position_orig, orientation_orig = box.position.copy(), box.orientation.copy()
+        q_start, _ = pyb_u.get_joint_states(robot.object_id, joints)
+        np.random.seed(1)
+        planner = PRM(robot, num_samples=200, num_neighbours=8, padding=False, roadmap_dir=None, collision_cache=collision_cache)
+        # a goal the planner has to go through the roadmap for, such that the nodes and edges of the path get their lazy results
+        for _ in range(100):
+            q_goal = np.random.uniform(robot.joints_limits_lower, robot.joints_limits_upper)
+            path = planner.plan(q_goal, world.active_objects)
+            if len(path) > 2:
+                break
+        assert len(path) > 2
+        # block the path at one of its roadmap nodes
+        robot.moveto_joints(path[len(path) // 2], False, joints)
+        box.move_base(pyb_u.get_link_state(robot.object_id, robot.end_effector_link_id)[0], np.array([0, 0, 0, 1]))
+        robot.moveto_joints(q_start, False, joints)
+        try:
+            path = planner.plan(q_goal, world.active_objects)
+            # at the resolution the planner checks with
+            collides = any(_touches(robot, box, q) for q in path)
+            collides = collides or any(planner._edge_in_collision(q_a, q_b, lambda q: _touches(robot, box, q)) for q_a, q_b in zip(path[:-1], path[1:]))
+        finally:
+            robot.moveto_joints(q_start, False, joints)
+            box.move_base(position_orig, orientation_orig)
+        assert len(path) > 1
+        assert not collides
@@ -0,0 +1,474 @@
+"""
+Compares the reward kernels of the PositionCollision goals against the formulas the goals computed the rewards with before the kernels existed,
+once as plain python and once compiled with numba (skipped if numba is not installed).
+The kernel tests go through the kernels the same way the goal's reward method does,
+test_goal_reward runs the goals themselves on a stub robot against their old reward methods.
+"""
+import importlib
+import itertools
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from modular_drl_env.goal.goal_implementations import reward_kernels
+from modular_drl_env.goal.goal_implementations.position_collision import *
+from modular_drl_env.goal.goal_implementations.position_collision import _outcome_flags
+from modular_drl_env.sensor.sensor_implementations.positional.obstacle_sensor import ObstacleSensor
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.util.quaternion_util import quaternion_similarity
+
+# out of bounds, collided, reached, timed out
+_FLAGS = list(itertools.product([False, True], repeat=4))
+
+@pytest.fixture(params=["python", "numba"])
+def kernels(request):
+    if request.param == "numba":
+        pytest.importorskip("numba")
+        module = importlib.reload(reward_kernels)
+        assert module._NUMBA
+    else:
+        # a None entry makes the import of numba fail even if it's installed
+        numba = sys.modules.get("numba")
+        sys.modules["numba"] = None
+        try:
+            module = importlib.reload(reward_kernels)
+        finally:
+            if numba is None:
+                del sys.modules["numba"]
+            else:
+                sys.modules["numba"] = numba
+        assert not module._NUMBA
+    yield module
+    importlib.reload(reward_kernels)
+
+def _assert_same(kernels, new, old):
+    # plain python does the exact same operations as before, numba may differ in the last digits of exp and sqrt
+    if kernels._NUMBA:
+        assert new == pytest.approx(old, rel=1e-12, abs=1e-12)
+    else:
+        assert new == old
+
+def _old_terminal(out_of_bounds, collided, reached, timed_out, reward_out_of_bounds, reward_collision, reward_success, reward_timeout, reward_running, done_on_oob=True):
+    # the if/elif chain all goals had, returns reward, is_success and done
+    if out_of_bounds:
+        return reward_out_of_bounds, False, done_on_oob
+    elif collided:
+        return reward_collision, False, True
+    elif reached:
+        return reward_success, True, True
+    elif timed_out:
+        return reward_timeout, False, True
+    return reward_running, False, False
+
+def test_position_collision(kernels):
+    rng = np.random.default_rng(0)
+    reward_success, reward_collision, reward_distance_mult = 10, -10, -0.01
+    for (out_of_bounds, collided, reached, timed_out), done_on_oob in itertools.product(_FLAGS, [False, True]):
+        shaking, distance = int(rng.integers(0, 10)), rng.uniform(0, 2)
+        reward = 0
+        reward -= shaking * 0.005
+        old_reward, old_success, old_done = _old_terminal(out_of_bounds, collided, reached, timed_out, reward_collision, reward_collision, reward_success, reward_collision / 10,
+                                                          reward_distance_mult * distance, done_on_oob)
+        reward += old_reward
+
+        new_reward, outcome = kernels.terminal_reward(out_of_bounds, collided, reached, timed_out,
+                                                      reward_collision, reward_collision, reward_success, reward_collision / 10, reward_distance_mult * distance)
+        new_reward = -shaking * 0.005 + new_reward
+        _assert_same(kernels, new_reward, reward)
+        assert _outcome_flags(outcome, done_on_oob)[:2] == (old_success, old_done)
+
+def test_position_collision_better_smoothing(kernels):
+    rng = np.random.default_rng(1)
+    reward_success, reward_collision, reward_distance_mult, reward_smoothness_mult, decay = 10, -10, -0.01, -0.001, 0.9
+    for flags in _FLAGS:
+        distance = rng.uniform(0, 2)
+        current_velocity = rng.uniform(-1, 1, 6)
+        last_velocities = [rng.uniform(-1, 1, 6) for _ in range(int(rng.integers(0, 6)))]
+
+        shaking = 0
+        it_velocity = current_velocity
+        for idx in reversed(range(len(last_velocities))):
+            vel = last_velocities[idx]
+            diff_norm = np.linalg.norm(it_velocity - vel)
+            shaking += (decay ** idx) * diff_norm
+            it_velocity = vel
+        reward = 0
+        reward += shaking * reward_smoothness_mult
+        old_reward, old_success, old_done = _old_terminal(*flags, reward_collision / 2, reward_collision, reward_success, reward_collision / 2, reward_distance_mult * distance)
+        reward += old_reward
+
+        new_shaking = kernels.velocity_shaking(current_velocity, np.array(last_velocities).reshape(-1, 6), decay)
+        new_reward, outcome = kernels.terminal_reward(*flags, reward_collision / 2, reward_collision, reward_success, reward_collision / 2, reward_distance_mult * distance)
+        new_reward = new_shaking * reward_smoothness_mult + new_reward
+        _assert_same(kernels, new_shaking, shaking)
+        _assert_same(kernels, new_reward, reward)
+        assert _outcome_flags(outcome)[:2] == (old_success, old_done)
+
+def test_position_rotation_collision(kernels):
+    rng = np.random.default_rng(2)
+    reward_success, reward_collision, reward_distance_mult, reward_rotation_mult = 10, -10, -0.01, -0.001
+    distance_threshold, distance_threshold_end = 0.05, 0.01
+    for flags in _FLAGS:
+        shaking, position_distance, rotation_distance = int(rng.integers(0, 10)), rng.uniform(0, 0.2), rng.uniform(0, np.pi)
+        rot_score_threshold = max(10 * distance_threshold_end, 1.2 * distance_threshold)
+        reward = 0
+        reward -= shaking * 0.005
+        old_reward, old_success, old_done = _old_terminal(*flags, reward_collision / 2, reward_collision, reward_success, reward_collision / 2, reward_distance_mult * position_distance)
+        reward += old_reward
+        if not old_done and position_distance < rot_score_threshold:
+            reward += reward_rotation_mult * rotation_distance
+
+        new_reward, outcome = kernels.terminal_reward(*flags, reward_collision / 2, reward_collision, reward_success, reward_collision / 2, reward_distance_mult * position_distance)
+        new_reward = -shaking * 0.005 + new_reward
+        if outcome == kernels.RUNNING and position_distance < rot_score_threshold:
+            new_reward += reward_rotation_mult * rotation_distance
+        _assert_same(kernels, new_reward, reward)
+        assert _outcome_flags(outcome)[:2] == (old_success, old_done)
+
+def test_position_collision_no_shaking(kernels):
+    rng = np.random.default_rng(3)
+    reward_success, reward_collision, reward_distance_mult = 10, -10, -0.01
+    for flags in _FLAGS:
+        distance = rng.uniform(0, 2)
+        reward = 0
+        old_reward, old_success, old_done = _old_terminal(*flags, reward_collision, reward_collision, reward_success, reward_distance_mult * distance, reward_distance_mult * distance)
+        reward += old_reward
+
+        distance_reward = reward_distance_mult * distance
+        new_reward, outcome = kernels.terminal_reward(*flags, reward_collision, reward_collision, reward_success, distance_reward, distance_reward)
+        _assert_same(kernels, new_reward, reward)
+        assert _outcome_flags(outcome)[:2] == (old_success, old_done)
+
+def test_position_collision_no_shaking_proximity(kernels):
+    rng = np.random.default_rng(4)
+    reward_collision, d_min = -10, 0.05
+    lower, upper = -np.pi * np.ones(6), np.pi * np.ones(6)
+    proximity_a = ((reward_collision) - (0)) / (np.exp(d_min) - 1)
+    proximity_b = (0) - proximity_a
+    joint_limit_a = ((reward_collision) - (0)) / (np.exp(0.05) - 1)
+    joint_limit_b = (0) - joint_limit_a
+    proximity_reward = lambda x: proximity_a * np.exp(-(x - d_min)) + proximity_b
+    joint_limit_reward = lambda x: joint_limit_a * np.exp(-(x - 0.05)) + joint_limit_b
+    for _ in range(50):
+        # the part from PositionCollisionGoalNoShaking is covered above
+        base_reward = rng.uniform(-10, 10)
+        min_dist = rng.uniform(0, 2 * d_min)
+        joints = rng.uniform(lower, upper)
+        joints[int(rng.integers(0, 6))] = rng.choice([lower[0], upper[0]]) + rng.uniform(-0.1, 0.1)
+
+        reward = base_reward
+        if min_dist <= d_min:
+            reward += proximity_reward(min_dist)
+        dist_to_max = abs(upper - joints)
+        dist_to_min = abs(joints - lower)
+        dist_both = min(min(dist_to_max), min(dist_to_min))
+        if dist_both <= 0.05:
+            reward += joint_limit_reward(dist_both)
+
+        new_reward = base_reward
+        new_reward += kernels.exponential_penalty(min_dist, d_min, proximity_a, proximity_b)
+        new_dist_both = kernels.joint_limit_distance(joints, lower, upper)
+        new_reward += kernels.exponential_penalty(new_dist_both, 0.05, joint_limit_a, joint_limit_b)
+        _assert_same(kernels, new_dist_both, dist_both)
+        _assert_same(kernels, new_reward, reward)
+
+@pytest.mark.parametrize("normalize_rewards", [False, True])
+def test_position_collision_no_shaking_proximity_v2(kernels, normalize_rewards):
+    # V3 only changes the observations, its rewards are the ones of V2
+    rng = np.random.default_rng(5)
+    reward_success, reward_collision = 100, -100
+    d_min, k, dirac = 0.2, 6, 0.1
+    lambda_1, lambda_2, lambda_3, lambda_4 = 1000, 500, 10, 0.0
+    lower, upper = -np.pi * np.ones(6), np.pi * np.ones(6)
+    a = ((reward_collision) - (0)) / (np.exp(0.05) - 1)
+    b = (0) - a
+    dist_reward_fn = lambda x: (0.5 * (x**2)) if x < dirac else (dirac * (x - 0.5 * dirac))
+    obst_reward_fn = lambda x: (d_min / (x + d_min)) ** k
+    joint_limit_reward_fn = lambda x: (a * np.exp(-(x - 0.05)) + b) if x <= 0.05 else 0
+    for _, collided, reached, timed_out in _FLAGS:
+        distance, min_dist = rng.uniform(0, 0.3), rng.uniform(0, 0.5)
+        action = rng.uniform(-1, 1, 6)
+        joints = rng.uniform(lower, upper)
+
+        dist_reward = -dist_reward_fn(distance)
+        obst_reward = -obst_reward_fn(min_dist)
+        action_reward = -np.sum(np.square(action))
+        dist_to_max = abs(upper - joints)
+        dist_to_min = abs(joints - lower)
+        dist_both = min(min(dist_to_max), min(dist_to_min))
+        joint_limit_reward = joint_limit_reward_fn(dist_both)
+        if normalize_rewards:
+            running_reward = (lambda_1 * dist_reward + lambda_2 * obst_reward + lambda_3 * action_reward + lambda_4 * joint_limit_reward) / lambda_1
+        else:
+            running_reward = lambda_1 * dist_reward + lambda_2 * obst_reward + lambda_3 * action_reward + lambda_4 * joint_limit_reward
+        reward, old_success, old_done = _old_terminal(False, collided, reached, timed_out, 0., reward_collision, reward_success, reward_collision/2, running_reward)
+
+        new_dist_both = kernels.joint_limit_distance(joints, lower, upper)
+        new_running_reward = kernels.proximity_v2_reward(distance, min_dist, action, new_dist_both, dirac, d_min, k, a, b, lambda_1, lambda_2, lambda_3, lambda_4, normalize_rewards)
+        new_reward, outcome = kernels.terminal_reward(False, collided, reached, timed_out, 0., reward_collision, reward_success, reward_collision/2, new_running_reward)
+        _assert_same(kernels, new_reward, reward)
+        assert _outcome_flags(outcome)[:2] == (old_success, old_done)
+
+# the goals themselves, driven through get_observation and reward with a stub robot, against their reward bodies from before the kernels
+
+def _stub_robot(rng):
+    world = SimpleNamespace(x_min=-2, x_max=2, y_min=-2, y_max=2, z_min=0, z_max=2,
+                            position_targets=[rng.uniform(-1, 1, 3)], rotation_targets=[_random_quaternion(rng)], oob=False)
+    world.out_of_bounds = lambda position: world.oob
+    state = SimpleNamespace(ee_position=np.zeros(3), ee_rotation=np.array([0., 0., 0., 1.]), joints_velocities=np.zeros(6), joints_angles=np.zeros(6))
+    # the proximity goals look for their sensor by its exact type
+    obstacle_sensor = ObstacleSensor.__new__(ObstacleSensor)
+    obstacle_sensor.min_dist = 1.
+    return SimpleNamespace(name="stub", object_id="stub", mgt_id=0, world=world, state=state, sensors=[obstacle_sensor],
+                           controlled_joints_ids=list(range(6)), joints_limits_lower=-np.pi * np.ones(6), joints_limits_upper=np.pi * np.ones(6))
+
+def _random_quaternion(rng):
+    quaternion = rng.normal(size=4)
+    return quaternion / np.linalg.norm(quaternion)
+
+def _set_step(rng, robot, goal, flags, max_steps):
+    # puts the stub robot into a state with the given outcome flags, returns the step number and the action
+    out_of_bounds, collided, reached, timed_out = flags
+    robot.world.oob = out_of_bounds
+    pyb_u.robot_collisions["stub"] = collided
+    direction = _random_quaternion(rng)[:3]
+    direction /= np.linalg.norm(direction)
+    target = robot.world.position_targets[0]
+    if reached:
+        robot.state.ee_position = target + direction * goal.distance_threshold * rng.uniform(0, 0.9)
+        robot.state.ee_rotation = robot.world.rotation_targets[0].copy()
+    else:
+        robot.state.ee_position = target + direction * goal.distance_threshold * rng.uniform(1.1, 30)
+        robot.state.ee_rotation = _random_quaternion(rng)
+    robot.state.joints_velocities = rng.uniform(-1, 1, 6)
+    robot.state.joints_angles = rng.uniform(-np.pi, np.pi, 6)
+    if rng.uniform() < 0.3:
+        robot.state.joints_angles[int(rng.integers(0, 6))] = rng.choice([-np.pi, np.pi]) + rng.uniform(-0.1, 0.1)
+    robot.sensors[0].min_dist = rng.uniform(0, 0.4)
+    step = max_steps + 1 if timed_out else int(rng.integers(1, max_steps + 1))
+    return step, rng.uniform(-1, 1, 6)
+
+def _old_shaking(past_distances):
+    shaking = 0
+    if len(past_distances) >= 10:
+        arrow = []
+        for i in range(0,9):
+            arrow.append(0) if past_distances[i + 1] - past_distances[i] >= 0 else arrow.append(1)
+        for j in range(0,8):
+            if arrow[j] != arrow[j+1]:
+                shaking += 1
+    return shaking
+
+def _old_append(history, value, capacity):
+    history.append(value)
+    if len(history) > capacity:
+        history.pop(0)
+
+def _old_normalize(goal, reward):
+    if goal.normalize_rewards:
+        return goal.normalizing_constant_a_reward * reward + goal.normalizing_constant_b_reward
+    return reward
+
+def _old_position_collision(goal, old, step, action, out_of_bounds, collided):
+    reward = 0
+    reward -= _old_shaking(old.past_distances) * 0.005
+    is_success = False
+    if out_of_bounds:
+        done = True if goal.done_on_oob else False
+        reward += goal.reward_collision
+    elif collided:
+        done = True
+        reward += goal.reward_collision
+    elif old.distance < goal.distance_threshold:
+        done = True
+        is_success = True
+        reward += goal.reward_success
+    elif step > goal.max_steps:
+        done = True
+        old.timeout = True
+        reward += goal.reward_collision / 10
+    else:
+        done = False
+        reward += goal.reward_distance_mult * old.distance
+    return _old_normalize(goal, reward), is_success, done, old.timeout, out_of_bounds
+
+def _old_better_smoothing(goal, old, step, action, out_of_bounds, collided):
+    reward = 0
+    shaking = 0
+    current_velocity = old.velocities
+    it_velocity = current_velocity
+    for idx, vel in reversed(list(enumerate(old.last_velocities))):
+        diff_norm = np.linalg.norm(it_velocity - vel)
+        shaking += (goal.velocity_smoothness_importance_decay ** idx) * diff_norm
+        it_velocity = vel
+    reward += shaking * goal.reward_smoothness_mult
+    _old_append(old.last_velocities, current_velocity, 1)
+    is_success = False
+    if out_of_bounds:
+        done = True
+        reward += goal.reward_collision / 2
+    elif collided:
+        done = True
+        reward += goal.reward_collision
+    elif old.distance < goal.distance_threshold:
+        done = True
+        is_success = True
+        reward += goal.reward_success
+    elif step > goal.max_steps:
+        done = True
+        old.timeout = True
+        reward += goal.reward_collision / 2
+    else:
+        done = False
+        reward += goal.reward_distance_mult * old.distance
+    return _old_normalize(goal, reward), is_success, done, old.timeout, out_of_bounds
+
+def _old_position_rotation_collision(goal, old, step, action, out_of_bounds, collided):
+    reward = 0
+    reward -= _old_shaking(old.past_distances) * 0.005
+    is_success = False
+    if out_of_bounds:
+        done = True
+        reward += goal.reward_collision / 2
+    elif collided:
+        done = True
+        reward += goal.reward_collision
+    elif old.distance < goal.distance_threshold and old.rotation_distance < goal.rotation_threshold:
+        done = True
+        is_success = True
+        reward += goal.reward_success
+    elif step > goal.max_steps:
+        done = True
+        old.timeout = True
+        reward += goal.reward_collision / 2
+    else:
+        done = False
+        reward += goal.reward_distance_mult * old.distance
+        rot_score_threshold = max(10 * goal.distance_threshold_end, 1.2 * goal.distance_threshold)
+        if old.distance < rot_score_threshold:
+            reward += goal.reward_rotation_mult * old.rotation_distance
+    return _old_normalize(goal, reward), is_success, done, old.timeout, out_of_bounds
+
+def _old_no_shaking(goal, old, step, action, out_of_bounds, collided):
+    reward = 0
+    is_success = False
+    if out_of_bounds:
+        done = True
+        reward += goal.reward_collision
+    elif collided:
+        done = True
+        reward += goal.reward_collision
+    elif old.distance < goal.distance_threshold:
+        done = True
+        is_success = True
+        reward += goal.reward_success
+    elif step > goal.max_steps:
+        done = True
+        old.timeout = True
+        reward += goal.reward_distance_mult * old.distance
+    else:
+        done = False
+        reward += goal.reward_distance_mult * old.distance
+    return _old_normalize(goal, reward), is_success, done, old.timeout, out_of_bounds
+
+def _old_no_shaking_proximity(goal, old, step, action, out_of_bounds, collided):
+    reward, is_success, done, timeout, oob = _old_no_shaking(goal, old, step, action, out_of_bounds, collided)
+    a = ((goal.reward_collision) - (0)) / (np.exp(goal.d_min) - 1)
+    b = (0) - a
+    proximity_reward = lambda x: a * np.exp(-(x - goal.d_min)) + b
+    a = ((goal.reward_collision) - (0)) / (np.exp(0.05) - 1)
+    b = (0) - a
+    joint_limit_reward = lambda x: a * np.exp(-(x - 0.05)) + b
+    if old.min_dist <= goal.d_min:
+        reward += proximity_reward(old.min_dist)
+    dist_to_max = abs(goal.robot.joints_limits_upper - old.joints_angles)
+    dist_to_min = abs(old.joints_angles - goal.robot.joints_limits_lower)
+    dist_both = min(min(dist_to_max), min(dist_to_min))
+    if dist_both <= 0.05:
+        reward += joint_limit_reward(dist_both)
+    if step > goal.max_steps:
+        reward += goal.reward_collision
+    return reward, is_success, done, timeout, oob
+
+def _old_no_shaking_proximity_v2(goal, old, step, action, out_of_bounds, collided):
+    d_min, k, dirac = goal.d_min, goal.k, goal.dirac
+    dist_reward_fn = lambda x: (0.5 * (x**2)) if x < dirac else (dirac * (x - 0.5 * dirac))
+    obst_reward_fn = lambda x: (d_min / (x + d_min)) ** k
+    a = ((goal.reward_collision) - (0)) / (np.exp(0.05) - 1)
+    b = (0) - a
+    joint_limit_reward_fn = lambda x: (a * np.exp(-(x - 0.05)) + b) if x <= 0.05 else 0
+    reward = 0
+    dist_reward = -dist_reward_fn(old.distance)
+    obst_reward = -obst_reward_fn(old.min_dist)
+    action_reward = -np.sum(np.square(action))
+    dist_to_max = abs(goal.robot.joints_limits_upper - old.joints_angles)
+    dist_to_min = abs(old.joints_angles - goal.robot.joints_limits_lower)
+    dist_both = min(min(dist_to_max), min(dist_to_min))
+    joint_limit_reward = joint_limit_reward_fn(dist_both)
+    is_success = False
+    done = False
+    timeout = False
+    if collided:
+        done = True
+        reward += goal.reward_collision
+    elif old.distance < goal.distance_threshold:
+        done = True
+        is_success = True
+        reward += goal.reward_success
+    elif step > goal.max_steps:
+        done = True
+        timeout = True
+        reward += goal.reward_collision/2
+    else:
+        if goal.normalize_rewards:
+            reward = (goal.lambda_1 * dist_reward + goal.lambda_2 * obst_reward + goal.lambda_3 * action_reward + goal.lambda_4 * joint_limit_reward) / goal.lambda_1
+        else:
+            reward = goal.lambda_1 * dist_reward + goal.lambda_2 * obst_reward + goal.lambda_3 * action_reward + goal.lambda_4 * joint_limit_reward
+    return reward, is_success, done, timeout, False
+
+_GOALS = [
+    (PositionCollisionGoal, {"done_on_oob": True}, _old_position_collision),
+    (PositionCollisionGoal, {"done_on_oob": False}, _old_position_collision),
+    (PositionCollisionBetterSmoothingGoal, {}, _old_better_smoothing),
+    (PositionRotationCollisionGoal, {}, _old_position_rotation_collision),
+    (PositionCollisionGoalNoShaking, {}, _old_no_shaking),
+    (PositionCollisionGoalNoShakingProximity, {}, _old_no_shaking_proximity),
+    (PositionCollisionGoalNoShakingProximityV2, {}, _old_no_shaking_proximity_v2),
+    (PositionCollisionGoalNoShakingProximityV3, {}, _old_no_shaking_proximity_v2),
+]
+
+@pytest.mark.parametrize("normalize_rewards", [False, True])
+@pytest.mark.parametrize("goal_class, kwargs, old_reward", _GOALS, ids=lambda param: param.__name__ if isinstance(param, type) else None)
+def test_goal_reward(monkeypatch, goal_class, kwargs, old_reward, normalize_rewards):
+    rng = np.random.default_rng(6)
+    max_steps = 100
+    monkeypatch.setattr(pyb_u, "robot_collisions", {})
+    robot = _stub_robot(rng)
+    goal = goal_class(robot, normalize_rewards, False, False, False, max_steps, False, **kwargs)
+    goal.on_env_reset(0)
+    old = SimpleNamespace(past_distances=[], last_velocities=[], timeout=False)
+    # several passes over all flag combinations in random order, so that the histories fill up and run over
+    for step_flags in rng.permutation(_FLAGS * 4):
+        flags = tuple(bool(flag) for flag in step_flags)
+        step, action = _set_step(rng, robot, goal, flags, max_steps)
+        goal.get_observation()
+
+        old.distance = np.linalg.norm(robot.world.position_targets[0] - robot.state.ee_position)
+        # the position rotation goal used to drop its position history early, fixed together with the ring buffers
+        _old_append(old.past_distances, old.distance, 10)
+        old.rotation_distance = 1 - quaternion_similarity(robot.state.ee_rotation, robot.world.rotation_targets[0])
+        old.velocities = robot.state.joints_velocities.copy()
+        old.joints_angles = robot.state.joints_angles.copy()
+        old.min_dist = robot.sensors[0].min_dist
+        # V2 and V3 never check the bounds
+        out_of_bounds = flags[0] and goal_class not in (PositionCollisionGoalNoShakingProximityV2, PositionCollisionGoalNoShakingProximityV3)
+        expected = old_reward(goal, old, step, action, out_of_bounds, flags[1])
+
+        reward, is_success, done, timeout, oob = goal.reward(step, action)
+        if reward_kernels._NUMBA:
+            assert reward == pytest.approx(expected[0], rel=1e-12, abs=1e-12)
+        else:
+            assert reward == expected[0]
+        assert (is_success, done, timeout, oob) == expected[1:]
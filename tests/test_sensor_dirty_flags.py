@@ -0,0 +1,28 @@
+"""
+Checks that sensors keeping their data while the scene is unchanged notice obstacles moved outside of the world's active objects.
+"""
+import numpy as np
+
+from modular_drl_env.sensor.sensor_implementations.lidar.lidar import LidarSensor
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.world.obstacles.shapes import Box
+
+def test_lidar_sees_moved_inactive_obstacle(table_env):
+    robot = table_env.robots[0]
+    world = robot.world
+    lidar = next(sensor for sensor in robot.sensors if isinstance(sensor, LidarSensor))
+    with pyb_u.activate(table_env.pyb_context):
+        active = set(world.active_objects) | set(world.active_obstacles)
+        box = next(obstacle for obstacle in world.obstacle_objects if isinstance(obstacle, Box) and obstacle not in active)
+        position_orig, orientation_orig = box.position.copy(), box.orientation.copy()
+        before = lidar.update(0)[lidar.output_name].copy()
+        # right onto the end effector, the robot stays where it is
+        box.move_base(pyb_u.get_link_state(robot.object_id, robot.end_effector_link_id)[0], np.array([0, 0, 0, 1]))
+        try:
+            after = lidar.update(0)[lidar.output_name].copy()
+            indicator, distances = lidar._process_raw_lidar(lidar._get_lidar_data())
+        finally:
+            box.move_base(position_orig, orientation_orig)
+        fresh = indicator if lidar.indicator else distances
+        assert not np.array_equal(fresh, before)
+        assert np.array_equal(after, fresh)
@@ -0,0 +1,49 @@
+"""
+Checks that the broad phase of the worlds keeps up with changes of the active objects and copes with obstacles without a valid AABB.
+"""
+import numpy as np
+
+from modular_drl_env.util.pybullet_util import pybullet_util as pyb_u
+from modular_drl_env.world.spatial_index import SpatialIndex
+
+class _StubObstacle:
+    # the index only needs the AABB and a place to register itself
+    def __init__(self, low, high):
+        self.aabb = (np.array(low, dtype=np.float64), np.array(high, dtype=np.float64))
+        self.spatial_index = None
+
+    def get_aabb(self):
+        return self.aabb[0].copy(), self.aabb[1].copy()
+
+def test_query_finds_obstacles_near_box():
+    near = _StubObstacle([0, 0, 0], [0.1, 0.1, 0.1])
+    far = _StubObstacle([5, 5, 5], [5.1, 5.1, 5.1])
+    large = _StubObstacle([-10, -10, -0.1], [10, 10, 0.1])
+    index = SpatialIndex()
+    index.rebuild([near, far, large])
+    assert index.query(np.array([0.05, 0.05, 0.05]), np.array([0.2, 0.2, 0.2])) == [near, large]
+    assert index.query(np.array([5, 5, 5]), np.array([6, 6, 6])) == [far]
+
+def test_obstacle_without_valid_aabb_is_in_every_query():
+    near = _StubObstacle([0, 0, 0], [0.1, 0.1, 0.1])
+    unknown = _StubObstacle([np.nan] * 3, [np.nan] * 3)
+    index = SpatialIndex()
+    index.rebuild([near, unknown])
+    assert index.query(np.array([0, 0, 0]), np.array([0.2, 0.2, 0.2])) == [near, unknown]
+    assert index.query(np.array([5, 5, 5]), np.array([6, 6, 6])) == [unknown]
+
+def test_world_notices_replaced_active_object(table_env):
+    world = table_env.robots[0].world
+    with pyb_u.activate(table_env.pyb_context):
+        active_objects = world.active_objects
+        first, spare = world.obstacle_objects[:2]
+        low, high = spare.get_aabb()
+        world.active_objects = [first]
+        try:
+            assert spare not in world.get_active_objects_near(low, high)
+            # same list, same length, only the entry differs
+            world.active_objects[0] = spare
+            assert spare in world.get_active_objects_near(low, high)
+        finally:
+            world.active_objects = active_objects
+        assert spare not in world.get_active_objects_near(low, high)